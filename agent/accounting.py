@@ -0,0 +1,182 @@
+"""
+Учет времени и токенов по этапам анализа.
+
+AnalysisAccounting собирает во время выполнения анализа время извлечения
+текста каждого документа, размер запроса, попытки обращения к моделям,
+задержку API и расход токенов из usage ответа. Результат сохраняется в
+полях Analysis вместе с итоговым статусом, поэтому по каждому медленному
+анализу видно, на каком этапе ушло время, а по всем анализам строятся
+перцентили задержек по моделям и дням (latency_report).
+"""
+import time
+from datetime import timedelta
+
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import metrics
+from .models import Analysis
+
+USAGE_FIELDS = ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens')
+
+# Поля учета в модели Analysis (для API и админки)
+METRIC_FIELDS = (
+    'model_used', 'attempts', 'prompt_chars', 'prompt_tokens', 'extraction_ms', 'api_latency_ms',
+    'duration_ms', *USAGE_FIELDS, 'stop_reason', 'timings',
+)
+
+
+def _ms(seconds):
+    return round(seconds * 1000)
+
+
+class AnalysisAccounting:
+    """
+    Накопитель метрик одного анализа.
+
+    Использование:
+        ```python
+        accounting = AnalysisAccounting()
+        result = claude_service.compare_documents(documents, accounting=accounting)
+        analysis.set_status('completed', result=result, **accounting.fields())
+        ```
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.documents = []
+        self.prompt_chars = None
+        self.prompt_tokens = None
+        self.prompt_build_ms = None
+        self.attempts = []
+        self.model_used = None
+        self.api_latency_ms = None
+        self.usage = {}
+        self.stop_reason = None
+
+    def document_extracted(self, document, seconds, cached, chars):
+        """Запоминает извлечение текста документа (cached — текст взят из кэша)."""
+        self.documents.append({
+            'id': str(document.id),
+            'name': document.name,
+            'extraction_ms': _ms(seconds),
+            'cached': cached,
+            'chars': chars,
+        })
+
+    def prompt_built(self, system_message, prompt, tokens, seconds):
+        """Запоминает размер запроса и время его сборки (включая извлечение текста)."""
+        self.prompt_chars = len(system_message) + len(prompt)
+        self.prompt_tokens = tokens
+        self.prompt_build_ms = _ms(seconds)
+
+    def attempt(self, model, seconds, error=None):
+        """Запоминает попытку запроса к модели."""
+        self.attempts.append({'model': model, 'latency_ms': _ms(seconds), 'error': str(error)[:500] if error else None})
+        metrics.observe_claude_request(model, seconds, error)
+        if error is None:
+            self.model_used = model
+            self.api_latency_ms = _ms(seconds)
+
+    def response(self, message):
+        """Запоминает usage и stop_reason из ответа Messages API (объект Message)."""
+        self.model_used = getattr(message, 'model', None) or self.model_used
+        self.stop_reason = message.stop_reason
+        for field in USAGE_FIELDS:
+            self.usage[field] = getattr(message.usage, field, None)
+        metrics.observe_claude_usage(self.model_used, message.usage)
+
+    def fields(self):
+        """
+        Возвращает значения полей Analysis для set_status().
+
+        Возвращает:
+            dict: Поля учета с разбивкой по этапам в timings
+        """
+        extraction_ms = sum(document['extraction_ms'] for document in self.documents) if self.documents else None
+        return {
+            'model_used': self.model_used,
+            'attempts': len(self.attempts),
+            'prompt_chars': self.prompt_chars,
+            'prompt_tokens': self.prompt_tokens,
+            'extraction_ms': extraction_ms,
+            'api_latency_ms': self.api_latency_ms,
+            'duration_ms': _ms(time.perf_counter() - self.started),
+            'stop_reason': self.stop_reason,
+            **{field: self.usage.get(field) for field in USAGE_FIELDS},
+            'timings': {
+                'documents': self.documents,
+                'prompt_build_ms': self.prompt_build_ms,
+                'attempts': self.attempts,
+            },
+        }
+
+
+def percentile(values, fraction):
+    """
+    Перцентиль по ближайшему рангу; значения None не учитываются.
+
+    Параметры:
+        values (iterable): Значения
+        fraction (float): Доля, например 0.95 для p95
+
+    Возвращает:
+        Значение перцентиля или None, если значений нет
+
+    Примеры:
+        >>> percentile([120, 80, None, 300], 0.5)
+        120
+    """
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def latency_report(days=7):
+    """
+    Перцентили задержек завершенных анализов по моделям и дням.
+
+    Параметры:
+        days (int): За сколько последних дней строить отчет
+
+    Возвращает:
+        list: Строки {'day', 'model', 'count', 'api_p50_ms', 'api_p95_ms',
+              'duration_p50_ms', 'duration_p95_ms', 'input_tokens', 'output_tokens'},
+              отсортированные по дню (сначала новые) и модели
+
+    Примеры:
+        >>> latency_report(days=1)
+        [{'day': date(2025, 3, 1), 'model': 'claude-3-5-haiku-20241022', 'count': 42, 'api_p50_ms': 1830, ...}]
+    """
+    since = timezone.now() - timedelta(days=days)
+    rows = (
+        Analysis.objects.filter(status='completed', completed_at__gte=since)
+        .exclude(model_used=None)
+        .annotate(day=TruncDate('completed_at'))
+        .values_list('day', 'model_used', 'api_latency_ms', 'duration_ms', 'input_tokens', 'output_tokens')
+    )
+    groups = {}
+    for day, model, api_latency_ms, duration_ms, input_tokens, output_tokens in rows.iterator():
+        group = groups.setdefault((day, model), {'api': [], 'duration': [], 'input_tokens': 0, 'output_tokens': 0})
+        group['api'].append(api_latency_ms)
+        group['duration'].append(duration_ms)
+        group['input_tokens'] += input_tokens or 0
+        group['output_tokens'] += output_tokens or 0
+
+    report = [
+        {
+            'day': day,
+            'model': model,
+            'count': len(group['api']),
+            'api_p50_ms': percentile(group['api'], 0.5),
+            'api_p95_ms': percentile(group['api'], 0.95),
+            'duration_p50_ms': percentile(group['duration'], 0.5),
+            'duration_p95_ms': percentile(group['duration'], 0.95),
+            'input_tokens': group['input_tokens'],
+            'output_tokens': group['output_tokens'],
+        }
+        for (day, model), group in groups.items()
+    ]
+    report.sort(key=lambda row: (-row['day'].toordinal(), row['model']))
+    return report
@@ -3,10 +3,13 @@ from unfold.admin import ModelAdmin, TabularInline
 from unfold.forms import AdminPasswordChangeForm, UserChangeForm, UserCreationForm
 from django.urls import path
 from django.shortcuts import render
+from django.http import FileResponse, Http404
 from django.db.models import Count
 from django.utils import timezone
 from datetime import timedelta
-from .models import Document, Analysis
+from .models import Blob, Document, Analysis, AnalysisBatch, MessageBatchJob, ModelRouteDecision, WebhookEndpoint, WebhookDelivery, IdempotencyKey
+from . import profiling, scheduler, search
+from .accounting import METRIC_FIELDS, latency_report
 
 # Функция для создания дашборда
 def admin_dashboard(request):
@@ -44,6 +47,10 @@ def admin_dashboard(request):
         'document_types': document_types,
         'recent_documents': recent_documents,
         'recent_analyses': recent_analyses,
+        # Перцентили задержек по моделям и дням за неделю
+        'latency_report': latency_report(days=7),
+        # Ожидание в очереди планировщика по классам приоритета
+        'queue_wait_report': scheduler.queue_wait_report(days=7),
     })
 
 # Переопределение AdminSite для добавления дашборда
@@ -58,12 +65,28 @@ class ClaudeAdminSite(admin.AdminSite):
 # Создание экземпляра админ сайта
 admin_site = ClaudeAdminSite(name='claude_admin')
 
+class FullTextSearchMixin:
+    """
+    Заменяет LIKE-поиск админки на полнотекстовый поиск FTS5.
+    
+    Если полнотекстовый индекс недоступен (база не SQLite), используется
+    стандартный поиск по search_fields.
+    """
+    search_kind = None
+    
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or not search.is_available():
+            return super().get_search_results(request, queryset, search_term)
+        ids = search.matching_ids(self.search_kind, search_term)
+        return queryset.filter(pk__in=ids), False
+
 # Оставляем стандартную регистрацию для Django-admin
 @admin.register(Document)
-class DocumentAdmin(ModelAdmin):
+class DocumentAdmin(FullTextSearchMixin, ModelAdmin):
     list_display = ('name', 'file_type', 'uploaded_at')
     list_filter = ('file_type', 'uploaded_at')
     search_fields = ('name',)
+    search_kind = search.KIND_DOCUMENT
     date_hierarchy = 'uploaded_at'
     list_per_page = 15
     
@@ -74,30 +97,44 @@ class DocumentAdmin(ModelAdmin):
             'classes': ('grid-col-12', 'grid-col-6@md', 'grid-col-4@lg')
         }),
         ('Метаданные', {
-            'fields': ('uploaded_at',),
+            'fields': ('uploaded_at', 'extracted_at', 'extraction_error', 'blob'),
             'classes': ('grid-col-12', 'grid-col-6@md')
         }),
     )
     
-    readonly_fields = ('uploaded_at', 'file_type')
+    readonly_fields = ('uploaded_at', 'file_type', 'extracted_at', 'extraction_error', 'blob')
+    
+    def save_model(self, request, obj, form, change):
+        # При замене файла сбрасываем кэш извлеченного текста
+        if change and 'file' in form.changed_data:
+            obj.extracted_text = None
+            obj.extracted_at = None
+            obj.extraction_error = None
+        super().save_model(request, obj, form, change)
 
 class DocumentInline(TabularInline):
     model = Analysis.documents.through
     extra = 0
 
 @admin.register(Analysis)
-class AnalysisAdmin(ModelAdmin):
-    list_display = ('id', 'status', 'created_at', 'completed_at', 'document_count')
-    list_filter = ('status', 'created_at')
+class AnalysisAdmin(FullTextSearchMixin, ModelAdmin):
+    list_display = ('id', 'status', 'priority', 'execution_mode', 'created_at', 'queue_wait', 'completed_at', 'document_count', 'model_used', 'duration_ms')
+    list_filter = ('status', 'priority', 'execution_mode', 'model_used', 'created_at')
+    search_fields = ('custom_prompt',)
+    search_kind = search.KIND_ANALYSIS
     date_hierarchy = 'created_at'
-    readonly_fields = ('id', 'created_at', 'completed_at', 'result')
+    readonly_fields = ('id', 'created_at', 'queued_at', 'started_at', 'completed_at', 'client', 'result', 'message_batch') + METRIC_FIELDS
     exclude = ('documents',)
     list_per_page = 10
     inlines = [DocumentInline]
+    actions = ['cancel_analyses']
     
     fieldsets = (
         ('Основная информация', {
-            'fields': ('id', 'status', 'created_at', 'completed_at'),
+            'fields': (
+                'id', 'status', 'priority', 'client', 'execution_mode', 'message_batch',
+                'created_at', 'queued_at', 'started_at', 'deadline', 'completed_at',
+            ),
             'classes': ('grid-col-12',)
         }),
         ('Запрос', {
@@ -108,12 +145,182 @@ class AnalysisAdmin(ModelAdmin):
             'fields': ('result',),
             'classes': ('grid-col-12',)
         }),
+        ('Учет выполнения', {
+            'fields': METRIC_FIELDS,
+            'classes': ('grid-col-12', 'collapse')
+        }),
     )
     
     def document_count(self, obj):
         return obj.documents.count()
     document_count.short_description = 'Документов'
+    
+    def queue_wait(self, obj):
+        if obj.started_at is None:
+            return '—'
+        return f'{max((obj.started_at - obj.queued_at).total_seconds(), 0):.1f} с'
+    queue_wait.short_description = 'Ожидание в очереди'
+    
+    @admin.action(description='Отменить выбранные анализы')
+    def cancel_analyses(self, request, queryset):
+        cancelled = sum(analysis.cancel() for analysis in queryset.filter(status__in=['pending', 'processing']))
+        self.message_user(request, f'Отменено анализов: {cancelled}')
+    
+    def get_urls(self):
+        custom_urls = [
+            path('latency/', self.admin_site.admin_view(self.latency_view), name='agent_analysis_latency'),
+            path('profiles/', self.admin_site.admin_view(self.profiles_view), name='agent_analysis_profiles'),
+            path('profiles/<str:name>/', self.admin_site.admin_view(self.profile_view), name='agent_analysis_profile'),
+            path(
+                'profiles/<str:name>/download/', self.admin_site.admin_view(self.profile_download_view),
+                name='agent_analysis_profile_download'
+            ),
+        ]
+        return custom_urls + super().get_urls()
+    
+    def latency_view(self, request):
+        # Перцентили задержек по моделям и дням (p50/p95)
+        days = 7
+        return render(request, 'admin/agent/latency_report.html', {
+            **self.admin_site.each_context(request),
+            'days': days,
+            'latency_report': latency_report(days=days),
+            'queue_wait_report': scheduler.queue_wait_report(days=days),
+        })
+    
+    def profiles_view(self, request):
+        # Последние профили запросов (ProfilingMiddleware)
+        return render(request, 'admin/agent/profiles.html', {
+            **self.admin_site.each_context(request),
+            'profiles': profiling.recent_profiles(),
+        })
+    
+    def profile_view(self, request, name):
+        profile = profiling.load_profile(name)
+        if profile is None:
+            raise Http404
+        return render(request, 'admin/agent/profile_detail.html', {
+            **self.admin_site.each_context(request),
+            'profile': profile,
+        })
+    
+    def profile_download_view(self, request, name):
+        # Файл cProfile для snakeviz или pstats
+        path = profiling.profile_path(name, '.prof')
+        try:
+            return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{name}.prof')
+        except (TypeError, FileNotFoundError):
+            raise Http404
+
+class BatchAnalysisInline(TabularInline):
+    model = Analysis
+    fields = ('id', 'status', 'completed_at')
+    readonly_fields = ('id', 'status', 'completed_at')
+    extra = 0
+    can_delete = False
+    show_change_link = True
+
+@admin.register(AnalysisBatch)
+class AnalysisBatchAdmin(ModelAdmin):
+    list_display = ('id', 'created_at', 'completed_at', 'batch_progress')
+    date_hierarchy = 'created_at'
+    readonly_fields = ('id', 'created_at', 'completed_at', 'batch_progress')
+    list_per_page = 10
+    inlines = [BatchAnalysisInline]
+    
+    fieldsets = (
+        ('Основная информация', {
+            'fields': ('id', 'created_at', 'completed_at', 'batch_progress'),
+            'classes': ('grid-col-12',)
+        }),
+        ('Запрос', {
+            'fields': ('custom_prompt',),
+            'classes': ('grid-col-12',)
+        }),
+    )
+    
+    def batch_progress(self, obj):
+        progress = obj.progress()
+        return f"{progress['percent']}% ({progress['completed']} завершено, {progress['failed']} с ошибкой из {progress['total']})"
+    batch_progress.short_description = 'Прогресс'
+
+@admin.register(MessageBatchJob)
+class MessageBatchJobAdmin(ModelAdmin):
+    list_display = ('batch_id', 'model', 'processing_status', 'request_count', 'created_at', 'ended_at')
+    list_filter = ('processing_status', 'model')
+    readonly_fields = ('batch_id', 'model', 'processing_status', 'request_count', 'created_at', 'ended_at')
+    date_hierarchy = 'created_at'
+    list_per_page = 15
+
+@admin.register(Blob)
+class BlobAdmin(ModelAdmin):
+    list_display = ('sha256', 'extension', 'size', 'ref_count', 'created_at')
+    list_filter = ('extension',)
+    search_fields = ('sha256',)
+    readonly_fields = ('sha256', 'extension', 'file', 'size', 'ref_count', 'created_at')
+    date_hierarchy = 'created_at'
+    list_per_page = 15
+    
+    def has_add_permission(self, request):
+        # Записи создаются только при загрузке документов
+        return False
+
+@admin.register(ModelRouteDecision)
+class ModelRouteDecisionAdmin(ModelAdmin):
+    list_display = ('created_at', 'rule', 'task_type', 'prompt_tokens', 'chosen_model', 'model_used', 'success', 'latency_ms')
+    list_filter = ('rule', 'task_type', 'chosen_model', 'model_used', 'success')
+    readonly_fields = (
+        'created_at', 'analysis', 'rule', 'task_type', 'prompt_tokens',
+        'chosen_model', 'model_used', 'success', 'latency_ms', 'attempts',
+    )
+    date_hierarchy = 'created_at'
+    list_per_page = 25
+
+@admin.register(WebhookEndpoint)
+class WebhookEndpointAdmin(ModelAdmin):
+    list_display = ('url', 'client', 'all_analyses', 'is_active', 'created_at')
+    list_filter = ('all_analyses', 'is_active')
+    search_fields = ('url', 'client')
+    readonly_fields = ('id', 'client', 'secret', 'created_at')
+    list_per_page = 15
+
+@admin.register(WebhookDelivery)
+class WebhookDeliveryAdmin(ModelAdmin):
+    list_display = ('created_at', 'endpoint', 'analysis', 'event', 'status', 'attempts', 'next_attempt_at', 'delivered_at')
+    list_filter = ('status', 'event')
+    readonly_fields = (
+        'endpoint', 'analysis', 'event', 'status', 'attempts', 'next_attempt_at',
+        'last_error', 'created_at', 'delivered_at',
+    )
+    list_select_related = ('endpoint',)
+    date_hierarchy = 'created_at'
+    list_per_page = 25
+    
+    def has_add_permission(self, request):
+        # Записи создаются при завершении анализов
+        return False
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(ModelAdmin):
+    list_display = ('created_at', 'client', 'key', 'path', 'status_code')
+    list_filter = ('status_code',)
+    search_fields = ('key', 'client')
+    readonly_fields = ('client', 'key', 'path', 'fingerprint', 'status_code', 'content_type', 'created_at')
+    exclude = ('response',)
+    date_hierarchy = 'created_at'
+    list_per_page = 25
+    
+    def has_add_permission(self, request):
+        # Записи создаются запросами API с заголовком Idempotency-Key
+        return False
 
 # Регистрация модели в кастомном сайте
+admin_site.register(Blob, BlobAdmin)
 admin_site.register(Document, DocumentAdmin)
 admin_site.register(Analysis, AnalysisAdmin)
+admin_site.register(AnalysisBatch, AnalysisBatchAdmin)
+admin_site.register(MessageBatchJob, MessageBatchJobAdmin)
+admin_site.register(ModelRouteDecision, ModelRouteDecisionAdmin)
+admin_site.register(WebhookEndpoint, WebhookEndpointAdmin)
+admin_site.register(WebhookDelivery, WebhookDeliveryAdmin)
+admin_site.register(IdempotencyKey, IdempotencyKeyAdmin)
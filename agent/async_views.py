@@ -0,0 +1,191 @@
+"""
+Асинхронные представления анализа для запуска под ASGI (uvicorn).
+
+Синхронный DRF держит поток воркера gunicorn все время, пока Claude
+генерирует ответ (десятки секунд), поэтому число одновременных анализов
+равно числу воркеров. Эти представления ждут ответа через AsyncAnthropic,
+и один процесс обслуживает сотни одновременных анализов.
+
+Форматы запросов и ответов совпадают с /api/analyses/:
+
+- POST /api/async/analyses/             — создать и выполнить анализ
+  ("stream": true — вернуть ответ Claude потоком Server-Sent Events);
+- POST /api/async/analyses/{id}/retry/  — повторить анализ;
+- GET  /api/async/analyses/{id}/stream/ — выполнить ожидающий или неудачный
+  анализ с потоковой выдачей (для завершенного — отдать сохраненный результат).
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from . import cancellation, log, scheduler
+from .accounting import AnalysisAccounting
+from .models import Analysis
+from .serializers import AnalysisSerializer
+from .services import arun_analysis, get_async_claude_service
+
+
+def _serialize(analysis):
+    return AnalysisSerializer(analysis).data
+
+
+def _create(request, data):
+    """Проверяет данные и создает анализ вместе со связями с документами; (анализ, ошибки)."""
+    serializer = AnalysisSerializer(data=data, context={'request': request})
+    if not serializer.is_valid():
+        return None, serializer.errors
+    with transaction.atomic():
+        return serializer.save(status='pending', client=scheduler.client_id(request)), None
+
+
+def _event(name, payload):
+    return f"event: {name}\ndata: {json.dumps(payload, ensure_ascii=False, default=str)}\n\n"
+
+
+DISCONNECTED_MESSAGE = "Analysis failed: потоковая передача прервана клиентом"
+
+
+async def _stream_analysis(analysis):
+    """
+    Выполняет анализ и отдает события SSE: analysis (id и статус: 'pending',
+    пока анализ ждет в очереди, затем 'processing'), text (фрагменты ответа)
+    и done (итоговый статус) или error.
+
+    Как и arun_analysis(), поток сначала ждет слота в очереди agent.scheduler
+    (класс приоритета, справедливая доля клиента, ANALYSIS_CONCURRENCY).
+    Отмена (POST /api/analyses/{id}/cancel/) и deadline анализа прерывают
+    ожидание и поток между фрагментами ответа; событие done сообщает статус
+    'cancelled'.
+    """
+    with log.bind(analysis.id):
+        chunks = []
+        accounting = AnalysisAccounting()
+        # Базу опрашивает отдельная задача, а поток проверяет токен между фрагментами
+        cancel = cancellation.CancelToken(deadline=analysis.deadline)
+        watcher = asyncio.create_task(cancel.watch(analysis.pk))
+        claimed = False
+        try:
+            # Неудачный или отмененный анализ возвращается в очередь; переход
+            # атомарный, поэтому два одновременных потока анализ не выполняют
+            if analysis.status != 'pending' and not await analysis.aset_status(
+                'pending', ('failed', 'cancelled'), result=None, completed_at=None, message_batch=None,
+                queued_at=timezone.now(), started_at=None
+            ):
+                yield _event('error', {'error': 'Анализ уже выполняется'})
+                return
+            yield _event('analysis', {'id': analysis.id, 'status': analysis.status})
+            if not await scheduler.aacquire(analysis, cancel):
+                # Анализ отменили в очереди или его взял другой воркер
+                await analysis.arefresh_from_db(fields=['status', 'result', 'completed_at'])
+                if analysis.status == 'processing':
+                    yield _event('error', {'error': 'Анализ уже выполняется'})
+                else:
+                    yield _event('done', {'id': analysis.id, 'status': analysis.status})
+                return
+            claimed = True
+            cancel.check()
+            yield _event('analysis', {'id': analysis.id, 'status': analysis.status})
+            documents = [document async for document in analysis.documents.all()]
+            if not documents:
+                await analysis.aset_status('failed', result="No documents provided for analysis")
+            else:
+                async for text in get_async_claude_service().astream_documents(
+                    documents, analysis.custom_prompt, analysis=analysis, accounting=accounting, cancel=cancel
+                ):
+                    chunks.append(text)
+                    yield _event('text', {'text': text})
+                if not await analysis.aset_status(
+                    'completed', result=''.join(chunks), completed_at=timezone.now(), **accounting.fields()
+                ):
+                    # Анализ отменили, пока дописывался ответ: в done — настоящий статус
+                    await analysis.arefresh_from_db(fields=['status', 'result', 'completed_at'])
+        except cancellation.AnalysisCancelled as e:
+            await sync_to_async(cancellation.finish)(analysis, e, accounting.fields())
+        except (asyncio.CancelledError, GeneratorExit):
+            # Клиент отключился, пока анализ ждал в очереди: убираем его из
+            # очереди (взятый в работу анализ освобождает слот в finally)
+            if not claimed:
+                await analysis.aset_status('failed', ('pending',), result=DISCONNECTED_MESSAGE)
+            raise
+        except Exception as e:
+            if not await analysis.aset_status('failed', result=f"Analysis failed: {str(e)}", **accounting.fields()):
+                await analysis.arefresh_from_db(fields=['status', 'result', 'completed_at'])
+            yield _event('error', {'error': str(e)})
+        finally:
+            watcher.cancel()
+            # Слот планировщика занят, пока анализ в статусе 'processing': при
+            # любом выходе без итогового статуса (отключение клиента) освобождаем его
+            if claimed and analysis.status == 'processing':
+                await analysis.aset_status('failed', ('processing',), result=DISCONNECTED_MESSAGE, **accounting.fields())
+        yield _event('done', {'id': analysis.id, 'status': analysis.status})
+
+
+def _event_stream_response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Отключаем буферизацию ответа в nginx, иначе фрагменты придут одним блоком
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAnalysisCreateView(View):
+    """Создание и выполнение анализа без блокировки воркера."""
+
+    async def post(self, request):
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'error': 'Тело запроса должно быть JSON'}, status=400)
+        stream = bool(data.pop('stream', False))
+        # Проверка обращается к базе (документы, вебхук), поэтому выполняется в потоке
+        analysis, errors = await sync_to_async(_create)(request, data)
+        if errors:
+            return JsonResponse(errors, status=400)
+
+        if analysis.execution_mode == 'sync':
+            if stream:
+                return _event_stream_response(_stream_analysis(analysis))
+            await arun_analysis(analysis)
+        return JsonResponse(await sync_to_async(_serialize)(analysis), status=201)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAnalysisRetryView(View):
+    """Повторный запуск анализа без блокировки воркера."""
+
+    async def post(self, request, pk):
+        analysis = await aget_object_or_404(Analysis, pk=pk)
+        if not await analysis.aset_status(
+            'pending', result=None, completed_at=None, message_batch=None, queued_at=timezone.now(), started_at=None
+        ):
+            return JsonResponse({'error': 'Анализ уже выполняется'}, status=409)
+        if analysis.execution_mode == 'sync':
+            await arun_analysis(analysis)
+        return JsonResponse(await sync_to_async(_serialize)(analysis))
+
+
+class AsyncAnalysisStreamView(View):
+    """Потоковая выдача результата анализа (Server-Sent Events)."""
+
+    async def get(self, request, pk):
+        analysis = await aget_object_or_404(Analysis, pk=pk)
+        if analysis.status == 'processing':
+            return JsonResponse({'error': 'Анализ уже выполняется'}, status=409)
+        if analysis.execution_mode != 'sync':
+            return JsonResponse({'error': 'Анализ выполняется через Message Batches API'}, status=409)
+        if analysis.status == 'completed':
+            async def replay():
+                yield _event('analysis', {'id': analysis.id, 'status': analysis.status})
+                yield _event('text', {'text': analysis.result or ''})
+                yield _event('done', {'id': analysis.id, 'status': analysis.status})
+            return _event_stream_response(replay())
+        return _event_stream_response(_stream_analysis(analysis))
@@ -0,0 +1,190 @@
+"""
+Создание и выполнение пакетов анализов с общим пользовательским запросом.
+
+Пакеты в режиме 'sync' выполняет отдельный процесс — команда
+process_analysis_batches (run_pending()), а не поток веб-воркера: перезапуск
+gunicorn не оставляет анализы пакета в очереди навсегда. Анализ, который
+остался в статусе 'processing' после падения процесса дольше
+SCHEDULER_RUN_TIMEOUT, помечается неудачным, и пакет завершается.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import log
+from .models import Analysis, AnalysisBatch, Document
+from .services import ClaudeService, FileProcessor, run_analysis
+
+logger = log.get_logger(__name__)
+
+ABANDONED_MESSAGE = "Analysis failed: выполнение прервано (процесс завершился), повторите анализ"
+
+
+def create_batch(document_groups, custom_prompt=None, execution_mode='sync', client=''):
+    """
+    Создает пакет и по одному анализу на каждую группу документов.
+
+    Анализы и их связи с документами создаются через bulk_create в одной
+    транзакции, поэтому сотни анализов сохраняются за несколько запросов к базе.
+
+    Параметры:
+        document_groups (list): Список групп UUID документов
+        custom_prompt (str, optional): Общий запрос для всех анализов пакета
+        execution_mode (str): 'sync' или 'message_batch' (через Message Batches API)
+        client (str): Клиент, создавший пакет; анализы пакета получают приоритет 'bulk'
+
+    Возвращает:
+        AnalysisBatch: Созданный пакет
+    """
+    with transaction.atomic():
+        batch = AnalysisBatch.objects.create(custom_prompt=custom_prompt, execution_mode=execution_mode)
+        analyses = Analysis.objects.bulk_create([
+            Analysis(
+                batch=batch, custom_prompt=custom_prompt, status='pending', execution_mode=execution_mode,
+                priority='bulk', client=client
+            )
+            for _ in document_groups
+        ])
+        Through = Analysis.documents.through
+        Through.objects.bulk_create([
+            Through(analysis_id=analysis.id, document_id=document_id)
+            for analysis, group in zip(analyses, document_groups)
+            for document_id in dict.fromkeys(group)
+        ])
+    return batch
+
+
+class BatchRunner:
+    """
+    Выполняет анализы пакета с ограниченным параллелизмом.
+
+    Сначала текст каждого уникального документа пакета извлекается ровно один
+    раз (документ, общий для всех групп, например отчет головного офиса, не
+    разбирается заново для каждого анализа). Затем анализы выполняются в пуле
+    из BATCH_ANALYSIS_CONCURRENCY потоков с общим клиентом Claude.
+
+    Использование:
+        ```python
+        BatchRunner(batch).run()
+        ```
+    """
+
+    def __init__(self, batch, concurrency=None):
+        self.batch = batch
+        self.concurrency = concurrency or getattr(settings, 'BATCH_ANALYSIS_CONCURRENCY', 4)
+
+    def run(self):
+        try:
+            analyses = list(
+                self.batch.analyses.filter(status='pending').prefetch_related('documents')
+            )
+            if not analyses:
+                return
+            documents = {}
+            for analysis in analyses:
+                for document in analysis.documents.all():
+                    documents.setdefault(document.id, document)
+
+            logger.info(
+                "Пакет %s: %d анализов, %d уникальных документов", self.batch.id, len(analyses), len(documents),
+                extra={'batch_id': str(self.batch.id)}
+            )
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                list(executor.map(self._extract, documents.values()))
+
+            claude_service = ClaudeService()
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                list(executor.map(
+                    lambda analysis: self._run_one(analysis, documents, claude_service),
+                    analyses
+                ))
+        except Exception as e:
+            # Например, не задан API-ключ: помечаем оставшиеся анализы как неудачные.
+            # Через set_status — переход атомарный, поэтому анализ, который другой
+            # воркер успел завершить, не перезаписывается, а метрики и вебхуки
+            # обновляются так же, как при обычном завершении
+            logger.warning("Пакет %s завершился ошибкой: %s", self.batch.id, e, exc_info=True, extra={'batch_id': str(self.batch.id)})
+            now = timezone.now()
+            for analysis in self.batch.analyses.filter(status__in=['pending', 'processing']).only('id', 'webhook'):
+                analysis.set_status('failed', result=f"Analysis failed: {str(e)}", completed_at=now)
+        finally:
+            # Анализ, который еще числится выполняющимся (процесс упал), пакет не завершает:
+            # его доведет fail_abandoned()
+            if not self.batch.analyses.filter(status__in=['pending', 'processing']).exists():
+                AnalysisBatch.objects.filter(pk=self.batch.pk).update(completed_at=timezone.now())
+
+    @staticmethod
+    def _extract(document):
+        try:
+            FileProcessor.get_document_text(document)
+        except Exception as e:
+            logger.warning("Не удалось извлечь текст из %s: %s", document.name, e, extra={'document_id': str(document.id)})
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _run_one(analysis, documents, claude_service):
+        try:
+            run_analysis(
+                analysis,
+                documents=[documents[document.id] for document in analysis.documents.all()],
+                claude_service=claude_service
+            )
+        finally:
+            connection.close()
+
+
+def _unfinished_batches():
+    return AnalysisBatch.objects.filter(completed_at__isnull=True, execution_mode='sync')
+
+
+def fail_abandoned(now=None):
+    """
+    Помечает неудачными анализы пакетов, брошенные в статусе 'processing'.
+
+    Анализ считается брошенным, если начат дольше SCHEDULER_RUN_TIMEOUT назад
+    (как и в agent.scheduler): процесс, который его выполнял, завершился.
+
+    Возвращает:
+        int: Количество помеченных анализов
+    """
+    now = now or timezone.now()
+    abandoned = Analysis.objects.filter(
+        batch__in=_unfinished_batches(), status='processing',
+        started_at__lt=now - timedelta(seconds=settings.SCHEDULER_RUN_TIMEOUT),
+    ).only('id', 'webhook')
+    count = 0
+    for analysis in abandoned:
+        count += analysis.set_status('failed', ('processing',), result=ABANDONED_MESSAGE, completed_at=now)
+    if count:
+        logger.warning("Анализов пакетов, брошенных при выполнении: %d", count)
+    return count
+
+
+def run_pending():
+    """
+    Выполняет незавершенные пакеты в режиме 'sync' (команда process_analysis_batches).
+
+    Возвращает:
+        int: Количество обработанных пакетов
+
+    Примеры:
+        >>> while batches.run_pending():
+        ...     pass
+    """
+    fail_abandoned()
+    processed = 0
+    for batch in _unfinished_batches().order_by('created_at'):
+        BatchRunner(batch).run()
+        processed += 1
+    return processed
+
+
+def missing_document_ids(document_groups):
+    """Возвращает UUID из групп, для которых нет документов в базе."""
+    requested = {document_id for group in document_groups for document_id in group}
+    existing = set(Document.objects.filter(id__in=requested).values_list('id', flat=True))
+    return sorted(str(document_id) for document_id in requested - existing)
@@ -0,0 +1,56 @@
+"""
+Общие части нагрузочных тестов и бенчмарков (load_test, cancel_benchmark,
+scheduler_benchmark): команды запуска сервера приложения, эндпоинты создания
+анализа, поиск свободного порта и сводка перцентилей задержки.
+"""
+import socket
+
+from .accounting import percentile
+
+SERVERS = {
+    # Как в docker-compose.yml: gunicorn с синхронными воркерами (--threads > 1 — gthread)
+    'gunicorn': lambda port, options: [
+        'gunicorn', 'claude_agent.wsgi:application', '--timeout', '600', '--log-level', 'warning', '--bind', f'127.0.0.1:{port}',
+        '--workers', str(options['workers']), '--threads', str(options['threads']),
+    ],
+    'uvicorn': lambda port, options: [
+        'uvicorn', 'claude_agent.asgi:application', '--log-level', 'warning', '--backlog', '4096',
+        '--host', '127.0.0.1', '--port', str(port), '--workers', str(options['workers']),
+    ],
+}
+
+# Эндпоинт создания анализа по режиму; message_batch выполняется отдельным процессом
+ENDPOINTS = {
+    'sync': '/api/analyses/',
+    'async': '/api/async/analyses/',
+    'message_batch': '/api/analyses/',
+}
+
+
+def free_port():
+    """Свободный локальный порт для сервера приложения или имитации Claude."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def format_percentiles(values):
+    """
+    Сводка задержек для отчета.
+
+    Параметры:
+        values (list): Задержки в секундах
+
+    Возвращает:
+        str: p50, p90, p99 и максимум или '—', если значений нет
+
+    Примеры:
+        >>> format_percentiles([0.8, 1.2, 3.5])
+        'p50 1.20 с, p90 3.50 с, p99 3.50 с, max 3.50 с'
+    """
+    if not values:
+        return '—'
+    return (
+        f'p50 {percentile(values, 0.5):.2f} с, p90 {percentile(values, 0.9):.2f} с, '
+        f'p99 {percentile(values, 0.99):.2f} с, max {max(values):.2f} с'
+    )
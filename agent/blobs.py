@@ -0,0 +1,159 @@
+"""
+Хранение загруженных файлов по содержимому (content-addressed storage).
+
+Каждое уникальное содержимое хранится один раз — в файле
+blobs/<2 символа хеша>/<2 символа>/<sha256><расширение> — и описывается
+строкой Blob со счетчиком ссылок. Документы (Document.blob) ссылаются на
+Blob, поэтому один и тот же PDF, загруженный 30 раз, занимает место на
+диске один раз, а текст из него извлекается один раз (см.
+FileProcessor.get_document_text).
+
+- Хеш HTTP-загрузки считается по мере поступления данных обработчиками
+  загрузки из FILE_UPLOAD_HANDLERS, поэтому дубликат вообще не
+  записывается в хранилище; для прочих потоков (элементы ZIP) содержимое
+  копируется во временный файл с подсчетом хеша на лету.
+- Счетчик ссылок увеличивает store(), уменьшает release() (при удалении
+  документа, сигнал post_delete); Blob без ссылок удаляется вместе с файлом.
+
+Расширение входит в ключ: от него зависит способ извлечения текста.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.db import transaction
+from django.db.models import F
+
+from . import log, metrics
+from .models import Blob
+
+logger = log.get_logger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class HashingUploadMixin:
+    """Считает SHA-256 загружаемого файла по мере поступления блоков и записывает его в file.sha256."""
+
+    def new_file(self, *args, **kwargs):
+        # До вызова родителя: MemoryFileUploadHandler может прервать цепочку StopFutureHandlers
+        self.hasher = hashlib.sha256()
+        return super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.hasher.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def blob_path(sha256, extension):
+    return f'blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}'
+
+
+def _spool(stream):
+    """Копирует поток во временный файл, считая хеш на лету. Возвращает (файл, sha256, размер)."""
+    hasher = hashlib.sha256()
+    temp = tempfile.TemporaryFile()
+    size = 0
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+        hasher.update(chunk)
+        temp.write(chunk)
+        size += len(chunk)
+    temp.seek(0)
+    return temp, hasher.hexdigest(), size
+
+
+def store(content, file_name):
+    """
+    Сохраняет содержимое, если такого еще нет, и добавляет ссылку на него.
+
+    Параметры:
+        content: Загруженный файл (UploadedFile с атрибутом sha256 от
+            обработчика загрузки) или любой поток байтов
+        file_name (str): Исходное имя файла (нужно расширение)
+
+    Возвращает:
+        Blob: Запись о содержимом; ссылку нужно освободить release(), если
+            документ так и не будет создан
+
+    Примеры:
+        >>> blob = blobs.store(request.FILES['file'], 'report.pdf')
+        >>> Document.objects.create(file=blob.file.name, blob=blob, ...)
+    """
+    extension = os.path.splitext(file_name)[1].lower()[:16]
+    sha256 = getattr(content, 'sha256', None)
+    size = getattr(content, 'size', None)
+    temp = None
+    if sha256 is None:
+        temp, sha256, size = _spool(content)
+        content = temp
+
+    try:
+        if _acquire(sha256, extension):
+            blob = Blob.objects.get(sha256=sha256, extension=extension)
+            metrics.observe_upload(duplicate=True, size=blob.size)
+            logger.debug("Содержимое %s уже сохранено, файл не записывается", sha256)
+            return blob
+
+        # Файл пишется вне транзакции, чтобы не держать блокировку базы на время записи
+        path = blob_path(sha256, extension)
+        _write(path, content, file_name)
+        with transaction.atomic():
+            if _acquire(sha256, extension):
+                blob = Blob.objects.get(sha256=sha256, extension=extension)
+            else:
+                # release() мог удалить файл между записью и транзакцией
+                _write(path, content, file_name)
+                blob = Blob.objects.create(
+                    sha256=sha256, extension=extension, file=path, size=size or default_storage.size(path), ref_count=1
+                )
+        metrics.observe_upload(duplicate=False, size=blob.size)
+        return blob
+    finally:
+        if temp is not None:
+            temp.close()
+
+
+def _write(path, content, file_name):
+    if default_storage.exists(path):
+        return
+    saved = default_storage.save(path, File(content, name=file_name))
+    if saved != path:
+        # Тот же файл одновременно записал другой процесс: лишняя копия не нужна
+        default_storage.delete(saved)
+
+
+def _acquire(sha256, extension):
+    """Добавляет ссылку на существующий Blob; False, если его нет."""
+    return Blob.objects.filter(sha256=sha256, extension=extension).update(ref_count=F('ref_count') + 1) == 1
+
+
+def release(blob_id):
+    """
+    Освобождает ссылку на Blob; последняя ссылка удаляет запись и файл.
+    """
+    with transaction.atomic():
+        Blob.objects.filter(pk=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        blob = Blob.objects.filter(pk=blob_id, ref_count__lte=0).first()
+        if blob is None:
+            return
+        blob.delete()
+        # Внутри транзакции: store() не создаст новую запись, пока файл не удален
+        default_storage.delete(blob.file.name)
+    logger.debug("Содержимое %s больше не используется и удалено", blob.sha256)
@@ -0,0 +1,195 @@
+"""
+Отмена анализов и предельное время выполнения (deadline).
+
+Анализ отменяется запросом POST /api/analyses/{id}/cancel/ (Analysis.cancel)
+или по истечении Analysis.deadline и переходит в статус 'cancelled'. Чтобы
+отмена освобождала воркер сразу, а не после ответа всех моделей,
+выполнение анализа получает CancelToken и проверяет его:
+
+- между документами и во время ожидания пула извлечения текста (процесс
+  пула с зависшим разбором завершается, см. agent.sandbox);
+- перед каждой попыткой в цепочке резервных моделей;
+- во время ответа Claude: синхронный запрос выполняется потоково, и при
+  отмене соединение закрывается — API прекращает генерацию; таймаут
+  клиента и ожидание лимита частоты ограничены оставшимся временем.
+
+Отмена приходит из другого процесса через базу: токен с analysis_id
+перечитывает статус не чаще CANCEL_CHECK_INTERVAL. Под ASGI базу опрашивает
+отдельная задача (CancelToken.watch), которая отменяет задачу анализа, —
+ожидание ответа Claude прерывается сразу.
+"""
+import asyncio
+import contextlib
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import log
+
+logger = log.get_logger(__name__)
+
+ACTIVE_STATUSES = ('pending', 'processing')
+CANCELLED_MESSAGE = 'Analysis cancelled'
+DEADLINE_MESSAGE = 'Analysis cancelled: deadline exceeded'
+
+
+class AnalysisCancelled(Exception):
+    """Анализ отменен пользователем (reason='cancelled') или истек его deadline (reason='deadline')."""
+
+    def __init__(self, reason):
+        super().__init__(DEADLINE_MESSAGE if reason == 'deadline' else CANCELLED_MESSAGE)
+        self.reason = reason
+
+
+class CancelToken:
+    """
+    Признак отмены выполняющегося анализа.
+
+    Параметры:
+        analysis_id (UUID, optional): Анализ, статус которого проверяется в базе;
+            без него учитываются только deadline и cancel() в этом процессе
+        deadline (datetime, optional): Момент, после которого анализ прерывается
+
+    Использование:
+        ```python
+        token = CancelToken(analysis.id, analysis.deadline)
+        for document in documents:
+            token.check()
+            ...
+        ```
+    """
+
+    def __init__(self, analysis_id=None, deadline=None):
+        self.analysis_id = analysis_id
+        self.deadline = deadline
+        self.reason = None
+        self._checked_at = time.monotonic()
+
+    def cancel(self, reason='cancelled'):
+        """Отменяет анализ в этом процессе (проверки увидят отмену сразу, без запроса к базе)."""
+        if self.reason is None:
+            self.reason = reason
+
+    def remaining(self):
+        """Секунд до deadline или None, если он не задан."""
+        if self.deadline is None:
+            return None
+        return (self.deadline - timezone.now()).total_seconds()
+
+    def timeout(self, default):
+        """Таймаут операции: default, но не дольше оставшегося времени."""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return max(min(default, remaining), 0.001)
+
+    def _expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def check(self):
+        """
+        Прерывает выполнение, если анализ отменен или истек его deadline.
+
+        Исключения:
+            AnalysisCancelled: Анализ нужно прекратить
+        """
+        if self.reason is None and self._expired():
+            self.reason = 'deadline'
+        if self.reason is None and self.analysis_id is not None:
+            now = time.monotonic()
+            if now - self._checked_at >= settings.CANCEL_CHECK_INTERVAL:
+                self._checked_at = now
+                from .models import Analysis
+                if Analysis.objects.filter(pk=self.analysis_id, status='cancelled').exists():
+                    self.reason = 'cancelled'
+        if self.reason is not None:
+            raise AnalysisCancelled(self.reason)
+
+    async def watch(self, analysis_id, task=None):
+        """
+        Опрашивает базу и deadline и отменяет задачу анализа (для выполнения под ASGI).
+
+        Параметры:
+            analysis_id (UUID): Анализ
+            task (asyncio.Task, optional): Задача, выполняющая анализ; без нее
+                отмена только отмечается в токене, и ее замечает check()
+                (так прерывается потоковая выдача: генератор ответа SSE
+                выполняется в задаче сервера, отменять которую нельзя)
+        """
+        from .models import Analysis
+
+        while self.reason is None:
+            remaining = self.remaining()
+            await asyncio.sleep(
+                settings.CANCEL_CHECK_INTERVAL if remaining is None
+                else max(min(settings.CANCEL_CHECK_INTERVAL, remaining), 0)
+            )
+            if self._expired():
+                self.cancel('deadline')
+            elif await Analysis.objects.filter(pk=analysis_id, status='cancelled').aexists():
+                self.cancel('cancelled')
+        if task is not None:
+            task.cancel()
+
+
+# Токены анализов, выполняющихся в этом процессе: отмена через API в том же
+# процессе срабатывает сразу, без ожидания следующего опроса базы
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def register(token):
+    """Делает токен доступным для notify() на время выполнения анализа."""
+    with _tokens_lock:
+        _tokens[token.analysis_id] = token
+    try:
+        yield token
+    finally:
+        with _tokens_lock:
+            if _tokens.get(token.analysis_id) is token:
+                del _tokens[token.analysis_id]
+
+
+def notify(analysis_id):
+    """Сообщает об отмене анализу, если он выполняется в этом процессе."""
+    with _tokens_lock:
+        token = _tokens.get(analysis_id)
+    if token is not None:
+        token.cancel()
+
+
+def finish(analysis, error, fields):
+    """
+    Записывает итог прерванного анализа.
+
+    Параметры:
+        analysis (Analysis): Анализ
+        error (AnalysisCancelled): Причина прерывания
+        fields (dict): Учет выполнения (AnalysisAccounting.fields())
+    """
+    logger.info("Анализ %s прерван: %s", analysis.id, error, extra={'analysis_id': str(analysis.id), 'reason': error.reason})
+    if not analysis.set_status('cancelled', result=str(error), completed_at=timezone.now(), **fields):
+        # Статус уже 'cancelled' (отмена через API): дописываем только учет выполнения
+        type(analysis).objects.filter(pk=analysis.pk).update(**fields)
+        analysis.refresh_from_db(fields=['status', 'result', 'completed_at'])
+
+
+def expire_overdue():
+    """
+    Отменяет анализы в очереди или в работе, deadline которых истек.
+
+    Нужна для анализов, которые никто не выполняет в этот момент: ожидающих
+    отправки в Message Batch или уже отправленных.
+
+    Возвращает:
+        int: Количество отмененных анализов
+    """
+    from .models import Analysis
+
+    now = timezone.now()
+    overdue = Analysis.objects.filter(status__in=ACTIVE_STATUSES, deadline__lte=now).only('id', 'webhook')
+    return sum(analysis.set_status('cancelled', result=DEADLINE_MESSAGE, completed_at=now) for analysis in overdue)
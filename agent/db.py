@@ -0,0 +1,64 @@
+import functools
+import random
+import sqlite3
+import time
+
+from django.conf import settings
+from django.db import OperationalError
+
+LOCK_ERROR_MESSAGES = ('database is locked', 'database table is locked', 'database is busy')
+
+
+def is_lock_error(error):
+    """
+    Проверяет, что исключение вызвано конкурентной блокировкой SQLite.
+
+    Параметры:
+        error (Exception): Перехваченное исключение
+
+    Возвращает:
+        bool: True, если запрос можно безопасно повторить
+    """
+    if not isinstance(error, (OperationalError, sqlite3.OperationalError)):
+        return False
+    message = str(error).lower()
+    return any(text in message for text in LOCK_ERROR_MESSAGES)
+
+
+def retry_on_lock(func=None, *, retries=None, delay=None):
+    """
+    Декоратор, повторяющий функцию при ошибке "database is locked".
+
+    busy_timeout в настройках уже заставляет SQLite ждать снятия блокировки,
+    но при длинных очередях писателей ожидание может истечь. Тогда операция
+    повторяется с экспоненциальной задержкой и случайным разбросом, чтобы
+    воркеры не просыпались одновременно.
+
+    Параметры:
+        retries (int, optional): Количество повторов (по умолчанию SQLITE_LOCK_RETRIES)
+        delay (float, optional): Начальная задержка в секундах (по умолчанию SQLITE_LOCK_RETRY_DELAY)
+
+    Примеры:
+        >>> @retry_on_lock
+        ... def mark_done(pk):
+        ...     Analysis.objects.filter(pk=pk).update(status='completed')
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            max_retries = retries if retries is not None else getattr(settings, 'SQLITE_LOCK_RETRIES', 5)
+            base_delay = delay if delay is not None else getattr(settings, 'SQLITE_LOCK_RETRY_DELAY', 0.05)
+            attempt = 0
+            while True:
+                try:
+                    return func(*args, **kwargs)
+                except (OperationalError, sqlite3.OperationalError) as e:
+                    if not is_lock_error(e) or attempt >= max_retries:
+                        raise
+                    time.sleep(base_delay * (2 ** attempt) * (0.5 + random.random()))
+                    attempt += 1
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
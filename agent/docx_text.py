@@ -0,0 +1,109 @@
+"""
+Потоковое извлечение текста из DOCX.
+
+python-docx строит полную объектную модель документа, а Document.paragraphs
+не содержит таблиц, колонтитулов и сносок, где в договорах и отчетах
+находится большая часть цифр. Здесь XML-части пакета читаются
+последовательно (zipfile + iterparse): текст абзацев и строк таблиц
+выдается в порядке документа, а разобранные элементы сразу удаляются, так
+что память не растет с размером документа.
+
+Порядок частей: верхние колонтитулы, основной текст, сноски, концевые
+сноски, нижние колонтитулы. Строка таблицы выдается одной строкой, ячейки
+разделены ' | ' (как строки XLSX и CSV в FileProcessor).
+
+Использование:
+    >>> for line in iter_docx_text('/path/to/contract.docx'):
+    ...     print(line)
+"""
+import re
+import zipfile
+from xml.etree.ElementTree import iterparse
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+P, T, TAB, BR, CR = W + 'p', W + 't', W + 'tab', W + 'br', W + 'cr'
+TR, TC = W + 'tr', W + 'tc'
+
+_PART_ORDER = (
+    re.compile(r'^word/header\d*\.xml$'),
+    re.compile(r'^word/document\d*\.xml$'),
+    re.compile(r'^word/footnotes\.xml$'),
+    re.compile(r'^word/endnotes\.xml$'),
+    re.compile(r'^word/footer\d*\.xml$'),
+)
+
+
+def _parts(archive):
+    names = archive.namelist()
+    for pattern in _PART_ORDER:
+        yield from sorted(name for name in names if pattern.match(name))
+
+
+def _iter_part(stream):
+    """Строки одной XML-части: абзацы вне таблиц и строки таблиц."""
+    # Стеки для вложенных таблиц: ячейки текущей строки, абзацы текущей ячейки, фрагменты абзаца
+    rows = []
+    cells = []
+    runs = []
+    parents = []
+    for event, element in iterparse(stream, events=('start', 'end')):
+        tag = element.tag
+        if event == 'start':
+            parents.append(element)
+            if tag == TR:
+                rows.append([])
+            elif tag == TC:
+                cells.append([])
+            elif tag == P:
+                runs.append([])
+            continue
+
+        parents.pop()
+        if tag == T:
+            if runs:
+                runs[-1].append(element.text or '')
+        elif tag == TAB:
+            if runs:
+                runs[-1].append('\t')
+        elif tag in (BR, CR):
+            if runs:
+                runs[-1].append('\n')
+        elif tag == P:
+            text = ''.join(runs.pop())
+            if cells:
+                cells[-1].append(text)
+            elif text:
+                yield text
+        elif tag == TC:
+            cell = ' '.join(part for part in cells.pop() if part)
+            if rows:
+                rows[-1].append(cell)
+        elif tag == TR:
+            row = rows.pop()
+            line = ' | '.join(row)
+            if cells:
+                # Вложенная таблица: строка становится абзацем внешней ячейки
+                cells[-1].append(line)
+            elif any(row):
+                yield line
+
+        # Разобранный элемент больше не нужен: в дереве остается только путь до текущего
+        if parents:
+            parents[-1].remove(element)
+
+
+def iter_docx_text(file_path):
+    """
+    Выдает строки текста DOCX в порядке документа, не загружая его целиком.
+
+    Параметры:
+        file_path (str): Путь к файлу .docx
+
+    Возвращает:
+        generator: Строки — абзацы и строки таблиц (ячейки через ' | ')
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        for name in _parts(archive):
+            with archive.open(name) as stream:
+                yield from _iter_part(stream)
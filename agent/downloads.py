@@ -0,0 +1,188 @@
+"""
+Отдача файлов документов.
+
+Файл документа отдается одним из способов (настройка MEDIA_SERVE_MODE):
+
+- 'django' — файл читается и отправляется воркером приложения блоками
+  (FileResponse); поддерживаются запросы диапазона (Range, If-Range);
+- 'x-accel-redirect' — приложение только проверяет доступ и условные
+  заголовки, а файл отправляет nginx из internal-локации MEDIA_ACCEL_PREFIX
+  (пример — deploy/nginx.conf); nginx сам обрабатывает Range;
+- 'x-sendfile' — то же для Apache (mod_xsendfile) и lighttpd: в заголовке
+  X-Sendfile передается абсолютный путь к файлу.
+
+ETag — SHA-256 содержимого из Blob (сильный, одинаковый у всех копий файла),
+для документов без Blob — слабый по размеру и времени изменения. На
+If-None-Match с совпадающим ETag возвращается 304 без тела.
+"""
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils.http import content_disposition_header, parse_etags, quote_etag
+
+from . import metrics
+
+SERVE_MODES = ('django', 'x-accel-redirect', 'x-sendfile')
+CHUNK_SIZE = 256 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Разбирает заголовок Range для файла размером size.
+
+    Параметры:
+        header (str): Значение заголовка, например 'bytes=0-1023' или 'bytes=-500'
+        size (int): Размер файла в байтах
+
+    Возвращает:
+        tuple | None: (первый байт, последний байт) или None, если диапазон
+            не поддерживается (несколько диапазонов, другие единицы) и нужно
+            отдать файл целиком
+
+    Исключения:
+        RangeNotSatisfiable: Диапазон за пределами файла (ответ 416)
+    """
+    match = _RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Суффикс: последние N байт
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable
+        return max(size - length, 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first > last:
+        if first < size:
+            # Некорректный диапазон игнорируется (RFC 9110, 14.2)
+            return None
+        raise RangeNotSatisfiable
+    return first, last
+
+
+class _FileRange:
+    """Часть открытого файла для FileResponse: отдает length байт с текущей позиции."""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def _etag(document, path):
+    if document.blob_id:
+        return quote_etag(document.blob.sha256)
+    stat = os.stat(path)
+    return f'W/"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+
+
+def _download_name(document):
+    extension = os.path.splitext(document.file.name)[1]
+    name = document.name or 'document'
+    return name if name.lower().endswith(extension.lower()) else f'{name}{extension}'
+
+
+def serve_document(request, document):
+    """
+    Возвращает ответ с файлом документа с учетом MEDIA_SERVE_MODE, ETag и Range.
+
+    Параметры:
+        request (HttpRequest): Запрос (заголовки If-None-Match, Range, If-Range;
+            ?download=1 — отдать как вложение)
+        document (Document): Документ
+
+    Возвращает:
+        HttpResponseBase: 200, 206, 304 или 416
+
+    Примеры:
+        >>> return serve_document(request, get_object_or_404(Document, pk=pk))
+    """
+    if not document.file or not default_storage.exists(document.file.name):
+        raise Http404('Файл документа не найден')
+    path = default_storage.path(document.file.name)
+    size = default_storage.size(document.file.name)
+    etag = _etag(document, path)
+    mode = settings.MEDIA_SERVE_MODE
+    if mode not in SERVE_MODES:
+        raise ImproperlyConfigured(f'MEDIA_SERVE_MODE должен быть одним из {SERVE_MODES}, а не {mode!r}')
+
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        metrics.observe_download(mode, 304, 0)
+        return response
+
+    content_type = document.file_type or 'application/octet-stream'
+    disposition = content_disposition_header(request.GET.get('download') == '1', _download_name(document))
+
+    if mode == 'django':
+        response, sent = _file_response(request, path, size, etag, content_type)
+    else:
+        # Тело отправит фронтовой сервер, ответ приложения пустой
+        response, sent = HttpResponse(content_type=content_type), size
+        if mode == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + quote(document.file.name)
+        else:
+            response['X-Sendfile'] = path
+    response['Content-Disposition'] = disposition
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    # Кэшировать можно, но с проверкой ETag: файл документа могут заменить
+    response['Cache-Control'] = 'private, no-cache'
+    metrics.observe_download(mode, response.status_code, sent)
+    return response
+
+
+def _file_response(request, path, size, etag, content_type):
+    """Ответ с файлом или его диапазоном. Возвращает (ответ, байт тела)."""
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    # If-Range с другим ETag (или с датой) означает, что файл изменился: он отдается целиком.
+    # Слабый ETag для If-Range не годится (RFC 9110, 13.1.5)
+    if range_header and (if_range is None or (if_range == etag and not etag.startswith('W/'))) and size:
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response, 0
+
+    file = open(path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+        response.block_size = CHUNK_SIZE
+        return response, size
+
+    first, last = byte_range
+    length = last - first + 1
+    file.seek(first)
+    response = FileResponse(_FileRange(file, length), status=206, content_type=content_type)
+    response.block_size = CHUNK_SIZE
+    response['Content-Length'] = str(length)
+    response['Content-Range'] = f'bytes {first}-{last}/{size}'
+    return response, length
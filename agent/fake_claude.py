@@ -0,0 +1,436 @@
+"""
+Локальная имитация API Claude для тестирования без затрат на реальные запросы.
+
+Сервер реализует подмножество Anthropic API, которое использует сервис:
+- POST /v1/messages                              — ответ модели (в том числе потоковый, stream=true)
+- POST /v1/messages/batches                      — создание Message Batch
+- GET  /v1/messages/batches/{id}                 — статус пакета
+- GET  /v1/messages/batches/{id}/results         — результаты пакета (JSONL)
+- POST /v1/messages/batches/{id}/cancel          — отмена пакета
+
+Чтобы направить сервис на имитацию, запустите `python manage.py fake_claude_server`
+и задайте USE_FAKE_CLAUDE=True (или CLAUDE_API_BASE_URL=http://127.0.0.1:8765).
+
+Задержка ответа задается распределением (LatencyDistribution), доли ошибок 500
+и 529 (перегрузка) — error_rate и overload_rate, лимиты частоты — rate_limits.
+"""
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _isoformat(value):
+    return value.isoformat().replace('+00:00', 'Z') if value else None
+
+
+class LatencyDistribution:
+    """
+    Распределение времени ответа имитации.
+
+    Задается строкой вида 'вид:параметры' (все значения в секундах):
+
+    - '2' или 'const:2'         — всегда 2 с;
+    - 'uniform:1,3'             — равномерно от 1 до 3 с;
+    - 'normal:2,0.5'            — нормальное со средним 2 и отклонением 0.5 (не меньше 0);
+    - 'lognormal:2,0.6'         — логнормальное с медианой 2 и sigma 0.6: длинный хвост,
+                                  как у реального API;
+    - 'exp:2'                   — экспоненциальное со средним 2.
+
+    Примеры:
+        >>> LatencyDistribution.parse('lognormal:1.5,0.8').sample(random.Random(1))
+        4.203901028990369
+    """
+
+    KINDS = {
+        'const': lambda rnd, value: value,
+        'uniform': lambda rnd, low, high: rnd.uniform(low, high),
+        'normal': lambda rnd, mean, stddev: max(0.0, rnd.gauss(mean, stddev)),
+        'lognormal': lambda rnd, median, sigma: median * math.exp(rnd.gauss(0, sigma)),
+        'exp': lambda rnd, mean: rnd.expovariate(1 / mean) if mean else 0.0,
+    }
+
+    def __init__(self, kind='const', params=(0.0,)):
+        if kind not in self.KINDS:
+            raise ValueError(f'Неизвестное распределение задержки: {kind}')
+        self.kind = kind
+        self.params = tuple(float(value) for value in params)
+
+    @classmethod
+    def parse(cls, spec):
+        """Создает распределение из строки или числа (постоянная задержка)."""
+        if isinstance(spec, cls):
+            return spec
+        if isinstance(spec, (int, float)):
+            return cls('const', (spec,))
+        kind, _, params = str(spec).partition(':')
+        if not params:
+            return cls('const', (kind,))
+        return cls(kind, params.split(','))
+
+    def sample(self, rnd):
+        return self.KINDS[self.kind](rnd, *self.params)
+
+    def __str__(self):
+        return f"{self.kind}:{','.join(f'{value:g}' for value in self.params)}"
+
+
+def _estimate_tokens(text):
+    # Грубая оценка: около четырех символов на токен
+    return max(1, len(text) // 4)
+
+
+class FakeClaudeState:
+    """
+    Состояние имитации: настройки поведения и созданные пакеты сообщений.
+
+    Параметры:
+        batch_delay (float): Через сколько секунд после создания пакет завершается
+        error_rate (float): Доля запросов, завершающихся ошибкой 500 (0..1)
+        overload_rate (float): Доля запросов, отклоняемых ошибкой 529 overloaded_error (0..1)
+        seed (int, optional): Начальное значение генератора случайных чисел
+        rate_limits (dict, optional): Лимиты на модель за период: {'rpm': 50, 'itpm': 40000, 'otpm': 8000};
+            при превышении запрос отклоняется с ошибкой 429, как в настоящем API
+        rate_window (float): Период лимитов в секундах (60 для "в минуту")
+        latency (float | str | LatencyDistribution): Время "генерации" ответа в секундах
+            или его распределение, например 'lognormal:2,0.6'
+    """
+
+    def __init__(self, batch_delay=2.0, error_rate=0.0, seed=None, rate_limits=None, rate_window=60.0, latency=0.0,
+                 overload_rate=0.0):
+        self.batch_delay = batch_delay
+        self.latency = LatencyDistribution.parse(latency)
+        self.error_rate = error_rate
+        self.overload_rate = overload_rate
+        self.random = random.Random(seed)
+        self.rate_limits = rate_limits or {}
+        self.rate_window = rate_window
+        self.batches = {}
+        self.usage = {}
+        self.stats = {
+            'requests': 0, 'rate_limited': 0, 'errors': 0, 'overloaded': 0, 'in_flight': 0, 'peak_in_flight': 0,
+            # Потоковые ответы, прерванные клиентом (отмена анализа)
+            'disconnected': 0,
+        }
+        self.lock = threading.Lock()
+
+    def check_rate_limit(self, params):
+        """
+        Списывает запрос из корзин токенов модели.
+
+        Как и настоящий API, корзины пополняются непрерывно со скоростью
+        limit / rate_window, а выходные токены оцениваются по max_tokens.
+
+        Возвращает:
+            float | None: Рекомендуемую паузу (retry-after) при превышении лимита, иначе None
+        """
+        if not self.rate_limits:
+            return None
+        model = params.get('model')
+        amounts = {
+            'rpm': 1,
+            'itpm': _estimate_tokens(json.dumps(params.get('messages', []), ensure_ascii=False)),
+            'otpm': params.get('max_tokens', 0),
+        }
+        now = time.monotonic()
+        with self.lock:
+            buckets = self.usage.setdefault(model, {})
+            wait = 0.0
+            for dimension, limit in self.rate_limits.items():
+                if not limit:
+                    continue
+                tokens, updated_at = buckets.get(dimension, (limit, now))
+                tokens = min(limit, tokens + (now - updated_at) * limit / self.rate_window)
+                buckets[dimension] = (tokens, now)
+                if tokens < amounts[dimension]:
+                    wait = max(wait, (amounts[dimension] - tokens) * self.rate_window / limit)
+            if wait:
+                self.stats['rate_limited'] += 1
+                return wait
+            for dimension, (tokens, updated_at) in list(buckets.items()):
+                buckets[dimension] = (tokens - amounts[dimension], updated_at)
+        return None
+
+    def should_fail(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def should_overload(self):
+        with self.lock:
+            return self.random.random() < self.overload_rate
+
+    def sample_latency(self):
+        with self.lock:
+            return self.latency.sample(self.random)
+
+    def make_message(self, params):
+        prompt = ''.join(
+            message['content'] if isinstance(message['content'], str)
+            else ''.join(block.get('text', '') for block in message['content'])
+            for message in params.get('messages', [])
+        )
+        text = (
+            f"## Результат анализа (имитация)\n\n"
+            f"Получен запрос длиной {len(prompt)} символов для модели {params.get('model')}."
+        )
+        return {
+            'id': f'msg_{uuid.uuid4().hex[:24]}',
+            'type': 'message',
+            'role': 'assistant',
+            'model': params.get('model'),
+            'content': [{'type': 'text', 'text': text}],
+            'stop_reason': 'end_turn',
+            'stop_sequence': None,
+            'usage': {
+                'input_tokens': _estimate_tokens(prompt + (params.get('system') or '')),
+                'output_tokens': _estimate_tokens(text),
+            },
+        }
+
+    def create_batch(self, requests, base_url):
+        batch_id = f'msgbatch_{uuid.uuid4().hex[:24]}'
+        created_at = _now()
+        results = []
+        for request in requests:
+            if self.should_fail():
+                result = {'type': 'errored', 'error': {
+                    'type': 'error',
+                    'error': {'type': 'api_error', 'message': 'Имитация внутренней ошибки'},
+                }}
+            else:
+                result = {'type': 'succeeded', 'message': self.make_message(request['params'])}
+            results.append({'custom_id': request['custom_id'], 'result': result})
+        with self.lock:
+            self.batches[batch_id] = {
+                'created_at': created_at,
+                'ends_at': created_at + timedelta(seconds=self.batch_delay),
+                'results': results,
+                'base_url': base_url,
+            }
+        return self.describe_batch(batch_id)
+
+    def describe_batch(self, batch_id):
+        with self.lock:
+            batch = self.batches.get(batch_id)
+        if batch is None:
+            return None
+        ended = _now() >= batch['ends_at']
+        counts = {'processing': 0, 'succeeded': 0, 'errored': 0, 'canceled': 0, 'expired': 0}
+        if ended:
+            for item in batch['results']:
+                counts[item['result']['type']] += 1
+        else:
+            counts['processing'] = len(batch['results'])
+        return {
+            'id': batch_id,
+            'type': 'message_batch',
+            'processing_status': 'ended' if ended else 'in_progress',
+            'request_counts': counts,
+            'created_at': _isoformat(batch['created_at']),
+            'expires_at': _isoformat(batch['created_at'] + timedelta(hours=24)),
+            'ended_at': _isoformat(batch['ends_at']) if ended else None,
+            'archived_at': None,
+            'cancel_initiated_at': None,
+            'results_url': f"{batch['base_url']}/v1/messages/batches/{batch_id}/results" if ended else None,
+        }
+
+    def cancel_batch(self, batch_id):
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return None
+            if _now() < batch['ends_at']:
+                # Необработанные запросы отменяются, пакет завершается сразу
+                batch['ends_at'] = _now()
+                batch['results'] = [
+                    {'custom_id': item['custom_id'], 'result': {'type': 'canceled'}} for item in batch['results']
+                ]
+        return self.describe_batch(batch_id)
+
+    def batch_results(self, batch_id):
+        with self.lock:
+            batch = self.batches.get(batch_id)
+        if batch is None or _now() < batch['ends_at']:
+            return None
+        return batch['results']
+
+
+class FakeClaudeHandler(BaseHTTPRequestHandler):
+    """Обработчик HTTP-запросов имитации. Состояние берется из self.server.state."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('request-id', f'req_{uuid.uuid4().hex[:24]}')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, error_type, message, retry_after=None):
+        headers = {'retry-after': f'{retry_after:.0f}'} if retry_after is not None else None
+        self._send_json({'type': 'error', 'error': {'type': error_type, 'message': message}}, status, headers)
+
+    def _send_stream(self, message, latency, chunks=10):
+        """Отправляет сообщение потоком событий SSE, как Messages API при stream=true."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def event(name, data):
+            self.wfile.write(f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        text = message['content'][0]['text']
+        usage = message['usage']
+        event('message_start', {'type': 'message_start', 'message': {
+            **message, 'content': [], 'stop_reason': None, 'usage': {**usage, 'output_tokens': 1},
+        }})
+        event('content_block_start', {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}})
+        size = max(1, -(-len(text) // chunks))
+        for start in range(0, len(text), size):
+            time.sleep(latency / chunks)
+            event('content_block_delta', {
+                'type': 'content_block_delta', 'index': 0,
+                'delta': {'type': 'text_delta', 'text': text[start:start + size]},
+            })
+        event('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        event('message_delta', {
+            'type': 'message_delta',
+            'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+            'usage': {'output_tokens': usage['output_tokens']},
+        })
+        event('message_stop', {'type': 'message_stop'})
+
+    def do_POST(self):
+        state = self.server.state
+        path = self.path.split('?', 1)[0].rstrip('/')
+        payload = self._read_json()
+        if path == '/v1/messages':
+            with state.lock:
+                state.stats['requests'] += 1
+                state.stats['in_flight'] += 1
+                state.stats['peak_in_flight'] = max(state.stats['peak_in_flight'], state.stats['in_flight'])
+            try:
+                self._handle_message(state, payload)
+            finally:
+                with state.lock:
+                    state.stats['in_flight'] -= 1
+        elif path == '/v1/messages/batches':
+            self._send_json(state.create_batch(payload.get('requests', []), self.base_url))
+        elif path.startswith('/v1/messages/batches/') and path.endswith('/cancel'):
+            batch = state.cancel_batch(path.split('/')[4])
+            if batch is None:
+                self._send_error(404, 'not_found_error', 'Пакет не найден')
+            else:
+                self._send_json(batch)
+        else:
+            self._send_error(404, 'not_found_error', f'Неизвестный путь: {path}')
+
+    def _handle_message(self, state, payload):
+        retry_after = state.check_rate_limit(payload)
+        if retry_after is not None:
+            self._send_error(429, 'rate_limit_error', 'Имитация превышения лимита запросов', retry_after)
+            return
+        if state.should_overload():
+            with state.lock:
+                state.stats['overloaded'] += 1
+            self._send_error(529, 'overloaded_error', 'Имитация перегрузки API')
+            return
+        if state.should_fail():
+            with state.lock:
+                state.stats['errors'] += 1
+            self._send_error(500, 'api_error', 'Имитация внутренней ошибки')
+            return
+        message = state.make_message(payload)
+        latency = state.sample_latency()
+        if payload.get('stream'):
+            try:
+                self._send_stream(message, latency)
+            except (BrokenPipeError, ConnectionResetError):
+                # Клиент закрыл соединение: генерация прекращается, как в API
+                with state.lock:
+                    state.stats['disconnected'] += 1
+            return
+        time.sleep(latency)
+        self._send_json(message)
+
+    def do_GET(self):
+        state = self.server.state
+        path = self.path.split('?', 1)[0].rstrip('/')
+        parts = path.split('/')
+        if path.startswith('/v1/messages/batches/') and len(parts) == 5:
+            batch = state.describe_batch(parts[4])
+            if batch is None:
+                self._send_error(404, 'not_found_error', 'Пакет не найден')
+            else:
+                self._send_json(batch)
+        elif path.startswith('/v1/messages/batches/') and len(parts) == 6 and parts[5] == 'results':
+            results = state.batch_results(parts[4])
+            if results is None:
+                self._send_error(404, 'not_found_error', 'Результаты пакета еще не готовы')
+                return
+            body = ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in results).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/binary')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_error(404, 'not_found_error', f'Неизвестный путь: {path}')
+
+
+class FakeClaudeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Очередь соединений по умолчанию (5) мала для нагрузочных тестов с сотнями клиентов
+    request_queue_size = 1024
+
+
+def make_server(host='127.0.0.1', port=8765, state=None, verbose=False):
+    """
+    Создает HTTP-сервер имитации API Claude.
+
+    Параметры:
+        host (str): Адрес для прослушивания
+        port (int): Порт (0 — выбрать свободный)
+        state (FakeClaudeState, optional): Состояние и настройки поведения
+        verbose (bool): Печатать журнал запросов
+
+    Возвращает:
+        FakeClaudeServer: Сервер; адрес доступен в server.server_address
+
+    Примеры:
+        >>> server = make_server(port=0, state=FakeClaudeState(batch_delay=0))
+        >>> threading.Thread(target=server.serve_forever, daemon=True).start()
+    """
+    server = FakeClaudeServer((host, port), FakeClaudeHandler)
+    server.state = state or FakeClaudeState()
+    server.verbose = verbose
+    return server
@@ -0,0 +1,127 @@
+"""
+Поле модели со сжатием текста (CompressedTextField).
+
+Результаты анализов и извлеченный текст документов — самые объемные поля
+базы: markdown-ответ Claude и текст многостраничного договора хорошо
+сжимаются, а без сжатия раздувают файл SQLite, страничный кэш и резервные
+копии. CompressedTextField хранит значение в BLOB-столбце в виде:
+
+    1 байт формата + данные
+
+где формат 0x00 — UTF-8 без сжатия (короткие и несжимаемые значения),
+0x01 — UTF-8, сжатый zlib. В коде поле ведет себя как TextField: атрибут
+модели — str. Значение распаковывается при первом обращении к атрибуту,
+поэтому выборки, которым поле не нужно (списки, проверки статуса), не тратят
+время на распаковку.
+
+values() и values_list() возвращают значение в сжатом виде (CompressedText);
+распаковать его можно decompress_text(). Строки, записанные до перехода на
+сжатие (TEXT), читаются как есть.
+"""
+import zlib
+
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+FORMAT_PLAIN = b'\x00'
+FORMAT_ZLIB = b'\x01'
+COMPRESSION_LEVEL = 6
+# Короче этого значения хранятся без сжатия: выигрыш меньше заголовка zlib
+MIN_COMPRESS_SIZE = 256
+
+
+class CompressedText(bytes):
+    """Значение CompressedTextField, прочитанное из базы и еще не распакованное."""
+
+
+def compress_text(text):
+    """
+    Упаковывает строку в формат CompressedTextField.
+
+    Параметры:
+        text (str): Исходный текст
+
+    Возвращает:
+        bytes: Байт формата и данные
+    """
+    data = text.encode('utf-8')
+    if len(data) >= MIN_COMPRESS_SIZE:
+        compressed = zlib.compress(data, COMPRESSION_LEVEL)
+        if len(compressed) < len(data):
+            return FORMAT_ZLIB + compressed
+    return FORMAT_PLAIN + data
+
+
+def decompress_text(value):
+    """
+    Распаковывает значение CompressedTextField.
+
+    Параметры:
+        value (bytes | memoryview | str | None): Значение из базы
+
+    Возвращает:
+        str | None: Исходный текст
+    """
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if value[:1] == FORMAT_ZLIB:
+        return zlib.decompress(value[1:]).decode('utf-8')
+    if value[:1] == FORMAT_PLAIN:
+        return value[1:].decode('utf-8')
+    raise ValueError(f'Неизвестный формат сжатого текста: {value[:1]!r}')
+
+
+class CompressedTextAttribute(DeferredAttribute):
+    """Дескриптор поля: распаковывает значение при первом обращении и запоминает результат."""
+
+    def __get__(self, instance, cls=None):
+        value = super().__get__(instance, cls)
+        if isinstance(value, CompressedText):
+            value = decompress_text(value)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        # Дескриптор данных: иначе значение из instance.__dict__ читалось бы в обход __get__
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedTextField(models.TextField):
+    """
+    Текстовое поле, хранящееся в базе в сжатом виде.
+
+    Использование:
+        ```python
+        result = CompressedTextField(blank=True, null=True, verbose_name="Результат")
+        ```
+    """
+
+    descriptor_class = CompressedTextAttribute
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or isinstance(value, str):
+            return value
+        return CompressedText(value)
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return decompress_text(value)
+        return super().to_python(value)
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        if isinstance(value, CompressedText):
+            # Значение не менялось после чтения: повторно не сжимается
+            return bytes(value)
+        return compress_text(str(value))
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = super().get_db_prep_value(value, connection, prepared)
+        if value is not None:
+            return connection.Database.Binary(value)
+        return value
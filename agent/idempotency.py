@@ -0,0 +1,197 @@
+"""
+Идемпотентные POST-запросы API по заголовку Idempotency-Key.
+
+Клиент, повторяющий запрос после таймаута сети, передает тот же ключ, что и
+в первый раз (например, UUID), и получает сохраненный ответ первого запроса
+с заголовком Idempotent-Replayed: true — второй анализ и второй запрос к
+Claude не создаются. Заголовок обрабатывает IdempotencyMiddleware:
+
+- первый запрос с ключом создает запись IdempotencyKey; ключ уникален в
+  пределах владельца (agent.scheduler.owner_id: пользователь или, для
+  анонимных запросов, IP-адрес), поэтому из одновременных запросов с одним
+  ключом выполняется один, а одинаковые ключи разных пользователей не
+  пересекаются;
+- пока первый запрос выполняется, повтор получает 409 и Retry-After;
+- тот же ключ с другим методом, путем или телом запроса — 422;
+- ответы 5xx, исключения и потоковые ответы (SSE) не сохраняются: ключ
+  освобождается, и повтор выполнит запрос заново;
+- ключ хранится IDEMPOTENCY_KEY_TTL секунд; незавершенная запись старше
+  IDEMPOTENCY_LOCK_TIMEOUT считается брошенной (процесс воркера завершился
+  посреди запроса), и ключ можно занять снова.
+
+Использование:
+    ```
+    curl -X POST http://127.0.0.1:8000/api/analyses/ -H 'Idempotency-Key: 5f0c…' \\
+         -H 'Content-Type: application/json' -d '{"document_ids": ["…"]}'
+    ```
+"""
+import hashlib
+import re
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from . import log, metrics
+from .db import retry_on_lock
+from .models import IdempotencyKey
+
+logger = log.get_logger(__name__)
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+# Печатные символы ASCII без пробела: ключ попадает в журнал и в уникальный индекс
+_KEY_RE = re.compile(r'^[\x21-\x7e]{1,255}$')
+
+# Устаревшие ключи удаляются попутно, не чаще раза в минуту на процесс
+PURGE_INTERVAL = 60.0
+_purged_at = 0.0
+
+
+def _file_digest(upload):
+    # SHA-256 уже посчитал обработчик загрузки (agent.blobs); без него — по блокам
+    sha256 = getattr(upload, 'sha256', None)
+    if sha256 is None:
+        hasher = hashlib.sha256()
+        for chunk in upload.chunks():
+            hasher.update(chunk)
+        upload.seek(0)
+        sha256 = hasher.hexdigest()
+    return sha256
+
+
+def fingerprint(request):
+    """
+    Отпечаток запроса: SHA-256 метода, пути и тела.
+
+    Тело загрузки файла (multipart/form-data) не сравнивается побайтно:
+    граница частей (boundary) у каждой отправки своя, и повтор той же
+    загрузки отличался бы от первого запроса. Для него учитываются тип
+    содержимого без параметров, поля формы и имена и SHA-256 файлов.
+
+    Параметры:
+        request (HttpRequest): Запрос
+
+    Возвращает:
+        str: Шестнадцатеричный SHA-256
+    """
+    digest = hashlib.sha256(f'{request.method} {request.path}\n'.encode())
+    if request.content_type == 'multipart/form-data':
+        digest.update(f'{request.content_type}\n'.encode())
+        for name in sorted(request.POST):
+            for value in request.POST.getlist(name):
+                digest.update(f'{name}={value}\n'.encode())
+        for name in sorted(request.FILES):
+            for upload in request.FILES.getlist(name):
+                digest.update(f'{name}:{upload.name}:{_file_digest(upload)}\n'.encode())
+    else:
+        digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _purge(now):
+    global _purged_at
+    if time.monotonic() - _purged_at < PURGE_INTERVAL:
+        return
+    _purged_at = time.monotonic()
+    IdempotencyKey.objects.filter(created_at__lt=now - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)).delete()
+
+
+def _stale(record, now):
+    age = (now - record.created_at).total_seconds()
+    if record.status_code is None:
+        return age > settings.IDEMPOTENCY_LOCK_TIMEOUT
+    return age > settings.IDEMPOTENCY_KEY_TTL
+
+
+@retry_on_lock
+def _claim(client, key, path, digest):
+    """Занимает ключ клиента. Возвращает None или запись запроса, уже занявшего ключ."""
+    now = timezone.now()
+    _purge(now)
+    while True:
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(client=client, key=key, path=path, fingerprint=digest, created_at=now)
+            return None
+        except IntegrityError:
+            pass
+        record = IdempotencyKey.objects.filter(client=client, key=key).first()
+        if record is None:
+            # Запись удалили между INSERT и SELECT: пробуем занять ключ снова
+            continue
+        if not _stale(record, now):
+            return record
+        # Брошенную или устаревшую запись занимает только один из запросов
+        taken = IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).update(
+            path=path, fingerprint=digest, status_code=None, content_type='', response=None, created_at=now
+        )
+        if taken:
+            return None
+
+
+def start(request, client, key):
+    """
+    Начинает запрос с ключом идемпотентности.
+
+    Параметры:
+        request (HttpRequest): Запрос
+        client (str): Владелец запроса (agent.scheduler.owner_id)
+        key (str): Значение заголовка Idempotency-Key
+
+    Возвращает:
+        HttpResponse | None: Ответ вместо выполнения запроса (сохраненный ответ
+            или ошибка) либо None — ключ занят этим запросом, его нужно
+            выполнить и передать ответ в finish()
+    """
+    if not _KEY_RE.match(key):
+        return JsonResponse(
+            {'error': f'{HEADER} должен содержать от 1 до 255 печатных символов ASCII'}, status=400
+        )
+    digest = fingerprint(request)
+    record = _claim(client, key, request.path, digest)
+    if record is None:
+        metrics.observe_idempotency('executed')
+        return None
+
+    if record.fingerprint != digest:
+        metrics.observe_idempotency('mismatch')
+        return JsonResponse(
+            {'error': f'{HEADER} уже использован для другого запроса ({record.path})'}, status=422
+        )
+    if record.status_code is None:
+        metrics.observe_idempotency('in_progress')
+        response = JsonResponse({'error': f'Запрос с этим {HEADER} еще выполняется'}, status=409)
+        response['Retry-After'] = '1'
+        return response
+
+    metrics.observe_idempotency('replayed')
+    logger.info("Повтор запроса %s с %s: ответ %d из сохраненного", record.path, HEADER, record.status_code)
+    response = HttpResponse(bytes(record.response or b''), status=record.status_code, content_type=record.content_type)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+@retry_on_lock
+def finish(client, key, response):
+    """
+    Сохраняет ответ для повторов запроса или освобождает ключ.
+
+    Параметры:
+        client (str): Клиент, переданный в start()
+        key (str): Ключ, занятый start()
+        response (HttpResponse | None): Ответ представления; None — запрос
+            завершился исключением
+    """
+    pending = IdempotencyKey.objects.filter(client=client, key=key, status_code__isnull=True)
+    if response is None or response.streaming or response.status_code >= 500:
+        pending.delete()
+        return
+    pending.update(
+        status_code=response.status_code,
+        content_type=response.get('Content-Type', ''),
+        response=response.content,
+    )
@@ -0,0 +1,173 @@
+"""
+Пакетная загрузка документов: несколько файлов или ZIP-архивы за один запрос.
+"""
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import blobs, search
+from .models import Document
+from .services import FileProcessor, detect_file_type, EXTENSION_MIME_TYPES
+
+ZIP_MIME_TYPES = ('application/zip', 'application/x-zip-compressed')
+
+
+class BulkUploadError(Exception):
+    """Пакет нельзя обработать целиком (например, превышен лимит файлов)."""
+
+
+class BulkDocumentUpload:
+    """
+    Принимает пакет загруженных файлов и создает по документу на каждый файл.
+
+    ZIP-архивы распаковываются по одному элементу: каждый элемент копируется
+    в хранилище потоком, поэтому архив целиком в память не читается. Файлы
+    сохраняются по содержимому (agent.blobs): дубликаты не записываются. Строки
+    Document создаются одним bulk_create в одной транзакции, а для каждого
+    файла возвращается отдельный результат, так что ошибка в одном файле не
+    отменяет загрузку остальных.
+
+    Использование:
+        ```python
+        upload = BulkDocumentUpload(request.FILES.getlist('files'), extract=True)
+        results = upload.run()
+        ```
+    """
+
+    def __init__(self, files, extract=False):
+        """
+        Параметры:
+            files (list): Загруженные файлы (UploadedFile), в том числе ZIP-архивы
+            extract (bool): Сразу извлечь текст из созданных документов
+        """
+        self.files = files
+        self.extract = extract
+        self.max_files = getattr(settings, 'BULK_UPLOAD_MAX_FILES', 1000)
+        self.max_total_size = getattr(settings, 'BULK_UPLOAD_MAX_TOTAL_SIZE', 1024 ** 3)
+        self.results = []
+        self.total_size = 0
+        self.stored_blobs = []
+        self._documents_results = {}
+
+    def run(self):
+        """
+        Сохраняет файлы, создает документы и (опционально) извлекает текст.
+
+        Возвращает:
+            list: Результаты по каждому файлу: словари с ключами file, status
+                  ('created', 'skipped' или 'error') и id, file_type, extracted
+                  либо error
+        """
+        pending = []
+        try:
+            for uploaded in self.files:
+                if self._is_zip(uploaded):
+                    pending.extend(self._store_archive(uploaded))
+                else:
+                    pending.append(self._store(uploaded.name, uploaded, uploaded.size))
+            documents = self._create_documents(pending)
+        except Exception:
+            # Пакет отклонен целиком: освобождаем ссылки на уже записанное содержимое
+            for blob in self.stored_blobs:
+                blobs.release(blob.pk)
+            raise
+
+        if self.extract and documents:
+            self._extract(documents)
+        return self.results
+
+    def _is_zip(self, uploaded):
+        if uploaded.name.lower().endswith('.zip') or uploaded.content_type in ZIP_MIME_TYPES:
+            return zipfile.is_zipfile(uploaded)
+        return False
+
+    def _store_archive(self, uploaded):
+        stored = []
+        try:
+            archive = zipfile.ZipFile(uploaded)
+        except zipfile.BadZipFile as e:
+            self._result(uploaded.name, 'error', error=f'Поврежденный архив: {e}')
+            return stored
+
+        with archive:
+            for info in archive.infolist():
+                entry_name = f'{uploaded.name}/{info.filename}'
+                base_name = os.path.basename(info.filename)
+                if info.is_dir() or not base_name or base_name.startswith('.') or '__MACOSX' in info.filename:
+                    continue
+                if os.path.splitext(base_name)[1].lower() not in EXTENSION_MIME_TYPES:
+                    self._result(entry_name, 'skipped', error='Неподдерживаемый формат файла')
+                    continue
+                try:
+                    with archive.open(info) as stream:
+                        stored.append(self._store(base_name, stream, info.file_size, entry_name))
+                except (zipfile.BadZipFile, OSError, RuntimeError) as e:
+                    self._result(entry_name, 'error', error=f'Не удалось распаковать файл: {e}')
+        return stored
+
+    def _store(self, file_name, stream, size, display_name=None):
+        display_name = display_name or file_name
+        # Считаются только сохраненные файлы: пропущенные элементы архива и
+        # ошибки распаковки лимит не расходуют
+        if len(self.stored_blobs) >= self.max_files:
+            raise BulkUploadError(f'Превышен лимит файлов в одном запросе: {self.max_files}')
+        self.total_size += size or 0
+        if self.total_size > self.max_total_size:
+            raise BulkUploadError(f'Превышен допустимый общий размер пакета: {self.max_total_size} байт')
+
+        # Содержимое копируется блоками, не читая файл целиком; дубликат не записывается
+        blob = blobs.store(stream, file_name)
+        self.stored_blobs.append(blob)
+        result = self._result(display_name, 'created')
+        return {
+            'blob': blob,
+            'name': os.path.splitext(file_name)[0],
+            'file_type': detect_file_type(file_name, default='application/octet-stream'),
+            'result': result,
+        }
+
+    def _create_documents(self, pending):
+        documents = [
+            Document(file=item['blob'].file.name, blob=item['blob'], name=item['name'], file_type=item['file_type'])
+            for item in pending
+        ]
+        with transaction.atomic():
+            Document.objects.bulk_create(documents)
+            # bulk_create не отправляет post_save, поэтому индексируем названия явно
+            for document in documents:
+                search.index_document(document)
+
+        for item, document in zip(pending, documents):
+            item['result'].update(id=str(document.id), file_type=document.file_type, extracted=False)
+            self._documents_results[document.id] = item['result']
+        return documents
+
+    def _extract(self, documents):
+        workers = getattr(settings, 'BULK_EXTRACTION_WORKERS', os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for document, error in zip(documents, executor.map(self._extract_one, documents)):
+                result = self._documents_results[document.id]
+                result['extracted'] = error is None
+                if error:
+                    result['extraction_error'] = error
+
+    @staticmethod
+    def _extract_one(document):
+        try:
+            content = FileProcessor.get_document_text(document)
+            return content if FileProcessor.is_extraction_error(content) else None
+        except Exception as e:
+            return str(e)
+        finally:
+            # Каждый поток открывает собственное соединение с базой
+            connection.close()
+
+    def _result(self, file_name, status, error=None):
+        result = {'file': file_name, 'status': status}
+        if error:
+            result['error'] = error
+        self.results.append(result)
+        return result
@@ -0,0 +1,214 @@
+"""
+Структурированное журналирование с идентификатором корреляции.
+
+Вместо print() код агента пишет в логгеры get_logger(__name__):
+
+- каждая запись получает correlation_id — идентификатор HTTP-запроса
+  (CorrelationIdMiddleware, заголовок X-Request-ID) или выполняемого
+  анализа (bind() в run_analysis), поэтому все строки одного анализа
+  находятся одним фильтром;
+- DEBUG-записи выборочные: они пишутся для доли LOG_DEBUG_SAMPLE_RATE
+  запросов и анализов целиком, а не для случайных строк; для остальных
+  get_logger() отбрасывает вызов debug() до создания записи;
+- QueueLogHandler только кладет запись в очередь, а форматирует и пишет в
+  stdout отдельный поток, поэтому медленный сборщик логов не задерживает
+  обработку запроса. При переполнении очереди записи отбрасываются.
+
+Настройка — LOGGING в settings.py, формат вывода — LOG_FORMAT (json или text).
+"""
+import atexit
+import contextlib
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+_correlation_id = contextvars.ContextVar('correlation_id', default=None)
+# Решение выборки DEBUG для текущего запроса или анализа (None — решать по каждой записи)
+_debug_sampled = contextvars.ContextVar('debug_sampled', default=None)
+
+
+def _sample():
+    return random.random() < getattr(settings, 'LOG_DEBUG_SAMPLE_RATE', 0.0)
+
+
+def get_correlation_id():
+    return _correlation_id.get()
+
+
+@contextlib.contextmanager
+def bind(correlation_id):
+    """
+    Привязывает записи журнала в текущем потоке или задаче asyncio к идентификатору.
+
+    Параметры:
+        correlation_id: Идентификатор запроса или анализа (приводится к строке)
+
+    Примеры:
+        >>> with log.bind(analysis.id):
+        ...     logger.info("Анализ запущен")
+    """
+    id_token = _correlation_id.set(str(correlation_id))
+    sampled_token = _debug_sampled.set(_sample())
+    try:
+        yield
+    finally:
+        try:
+            _correlation_id.reset(id_token)
+            _debug_sampled.reset(sampled_token)
+        except ValueError:
+            # Асинхронный генератор закрыт из другого контекста: значения уже не действуют
+            pass
+
+
+def _debug_enabled():
+    sampled = _debug_sampled.get()
+    if sampled is None:
+        return _sample()
+    return sampled
+
+
+class SampledLogger(logging.LoggerAdapter):
+    """
+    Логгер, у которого debug() для невыбранных запросов ничего не стоит.
+
+    Уровень логгера 'agent' — DEBUG, если выборка включена; решение выборки
+    проверяется в isEnabledFor(), до создания записи (несколько микросекунд
+    на вызов), поэтому невыбранные debug() почти ничего не стоят.
+    """
+
+    def __init__(self, logger):
+        super().__init__(logger, None)
+
+    def isEnabledFor(self, level):
+        return (level > logging.DEBUG or _debug_enabled()) and self.logger.isEnabledFor(level)
+
+    def process(self, msg, kwargs):
+        return msg, kwargs
+
+
+def get_logger(name):
+    """
+    Возвращает логгер модуля с выборочной записью DEBUG.
+
+    Примеры:
+        >>> logger = log.get_logger(__name__)
+        >>> logger.debug("Документ %s: %d символов", doc.name, len(text))
+    """
+    return SampledLogger(logging.getLogger(name))
+
+
+class CorrelationFilter(logging.Filter):
+    """Добавляет в запись correlation_id текущего запроса или анализа."""
+
+    def filter(self, record):
+        record.correlation_id = _correlation_id.get()
+        return True
+
+
+# Стандартные атрибуты LogRecord; все остальные пришли из extra и выводятся как поля
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'correlation_id', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: time, level, logger, message, correlation_id и поля extra."""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'correlation_id': getattr(record, 'correlation_id', None),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                data[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Человекочитаемый вывод для разработки."""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s [%(correlation_id)s] %(message)s')
+
+
+FORMATTERS = {'json': JsonFormatter, 'text': TextFormatter}
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """
+    Неблокирующий обработчик: запись попадает в ограниченную очередь, а
+    форматирование и вывод в stdout выполняет фоновый поток QueueListener.
+
+    Параметры:
+        format (str): Формат вывода — 'json' или 'text'
+        maxsize (int): Размер очереди; при переполнении записи отбрасываются,
+            а их число выводится следующей записью
+    """
+
+    def __init__(self, format='json', maxsize=10000):
+        self.maxsize = maxsize
+        self.target = logging.StreamHandler(sys.stdout)
+        self.target.setFormatter(FORMATTERS[format]())
+        self.dropped = 0
+        super().__init__(queue.Queue(maxsize))
+        self._start()
+        # Поток не переживает fork (gunicorn --preload): в дочернем процессе создаем заново
+        os.register_at_fork(after_in_child=self._start)
+        atexit.register(self.close)
+
+    def _start(self):
+        self.queue = queue.Queue(self.maxsize)
+        self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+
+    def prepare(self, record):
+        # Сообщение и трассировка вычисляются здесь, пока аргументы и исключение
+        # еще актуальны; остальное форматирование выполняет поток вывода
+        message = record.getMessage()
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = self.target.formatter.formatException(record.exc_info)
+        record = copy.copy(record)
+        record.message = record.msg = message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = exc_text
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            notice = logging.LogRecord(
+                'agent.log', logging.WARNING, __file__, 0, 'Очередь журнала переполнена, пропущено записей: %d',
+                (dropped,), None
+            )
+            notice.correlation_id = None
+            try:
+                self.queue.put_nowait(self.prepare(notice))
+            except queue.Full:
+                self.dropped += dropped
+
+    def close(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+        super().close()
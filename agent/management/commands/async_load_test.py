@@ -0,0 +1,132 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+
+from agent.accounting import percentile
+from agent.benchmarking import free_port
+from agent.fake_claude import FakeClaudeState, make_server
+
+DEPLOYMENTS = {
+    # Текущая схема из docker-compose.yml: синхронные воркеры gunicorn и DRF
+    'gunicorn': {
+        'command': ['gunicorn', 'claude_agent.wsgi:application', '--timeout', '300'],
+        'workers_flag': '--workers',
+        'bind': lambda port: ['--bind', f'127.0.0.1:{port}'],
+        'endpoint': '/api/analyses/',
+    },
+    # ASGI: uvicorn и асинхронные представления с AsyncAnthropic
+    'uvicorn': {
+        'command': ['uvicorn', 'claude_agent.asgi:application', '--log-level', 'warning', '--backlog', '4096'],
+        'workers_flag': '--workers',
+        'bind': lambda port: ['--host', '127.0.0.1', '--port', str(port)],
+        'endpoint': '/api/async/analyses/',
+    },
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест анализа: сравнивает, сколько запросов к Claude одновременно '
+        'держит воркер gunicorn (синхронный DRF) и воркер uvicorn (асинхронные представления). '
+        'Claude заменяется локальной имитацией с заданной задержкой ответа.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--deployments', nargs='+', default=list(DEPLOYMENTS), choices=list(DEPLOYMENTS))
+        parser.add_argument('--workers', type=int, default=1, help='Процессов сервера приложения')
+        parser.add_argument('--concurrency', type=int, default=200, help='Одновременных клиентов')
+        parser.add_argument('--requests', type=int, default=400, help='Всего анализов')
+        parser.add_argument('--latency', type=float, default=2.0, help='Задержка ответа Claude, с')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in options['deployments']:
+                self._run_deployment(name, tmp, options)
+
+    def _run_deployment(self, name, tmp, options):
+        deployment = DEPLOYMENTS[name]
+        state = FakeClaudeState(latency=options['latency'])
+        fake = make_server(port=0, state=state)
+        threading.Thread(target=fake.serve_forever, daemon=True).start()
+
+        env = dict(
+            os.environ,
+            CLAUDE_API_KEY='fake',
+            CLAUDE_API_BASE_URL=f'http://127.0.0.1:{fake.server_address[1]}',
+            SQLITE_PATH=os.path.join(tmp, f'{name}.sqlite3'),
+            RATE_LIMIT_ENABLED='False',
+            DEBUG='False',
+        )
+        subprocess.run([sys.executable, 'manage.py', 'migrate', '-v', '0'], env=env, check=True)
+
+        port = free_port()
+        command = deployment['command'] + [deployment['workers_flag'], str(options['workers'])]
+        command += deployment['bind'](port)
+        try:
+            server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except FileNotFoundError:
+            raise CommandError(f'{command[0]} не установлен')
+        base_url = f'http://127.0.0.1:{port}'
+        try:
+            stats = asyncio.run(self._load(base_url, deployment['endpoint'], options))
+        finally:
+            server.terminate()
+            server.wait()
+            fake.shutdown()
+            fake.server_close()
+
+        p = lambda fraction: percentile(stats['latencies'], fraction) or 0
+        self.stdout.write(
+            f"{name} ({options['workers']} воркер.): {stats['ok']}/{options['requests']} анализов за "
+            f"{stats['elapsed']:.1f} с ({stats['ok'] / stats['elapsed']:.1f}/с), ошибок {stats['errors']}, "
+            f"p50 {p(0.5):.1f} с, p95 {p(0.95):.1f} с; одновременно у Claude до "
+            f"{state.stats['peak_in_flight']} запросов "
+            f"({state.stats['peak_in_flight'] / options['workers']:.0f} на воркер)"
+        )
+
+    async def _load(self, base_url, endpoint, options):
+        limits = httpx.Limits(max_connections=options['concurrency'], max_keepalive_connections=options['concurrency'])
+        async with httpx.AsyncClient(base_url=base_url, timeout=600, limits=limits) as client:
+            for _ in range(100):
+                try:
+                    await client.get('/api/')
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.2)
+            else:
+                raise CommandError(f'Сервер {base_url} не запустился')
+
+            files = {'file': ('report.txt', 'Выручка за квартал выросла на 12%. ' * 50, 'text/plain')}
+            document = (await client.post('/api/documents/', files=files)).json()
+
+            stats = {'ok': 0, 'errors': 0, 'latencies': []}
+            queue = asyncio.Queue()
+            for _ in range(options['requests']):
+                queue.put_nowait(None)
+
+            async def worker():
+                while not queue.empty():
+                    queue.get_nowait()
+                    started = time.perf_counter()
+                    try:
+                        response = await client.post(endpoint, json={
+                            'document_ids': [document['id']],
+                            'custom_prompt': 'Назови ключевые показатели',
+                        })
+                        ok = response.status_code == 201 and response.json()['status'] == 'completed'
+                    except httpx.HTTPError:
+                        ok = False
+                    stats['ok' if ok else 'errors'] += 1
+                    stats['latencies'].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(options['concurrency'])))
+            stats['elapsed'] = time.perf_counter() - started
+            return stats
@@ -0,0 +1,36 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from agent import blobs
+from agent.models import Document
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит файлы документов, загруженных до хранения по содержимому, '
+        'в blobs/: одинаковые файлы остаются на диске в одном экземпляре.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать документы без содержимого')
+
+    def handle(self, *args, **options):
+        documents = Document.objects.filter(blob__isnull=True).exclude(file='')
+        self.stdout.write(f'Документов без содержимого: {documents.count()}')
+        if options['dry_run']:
+            return
+
+        moved = missing = 0
+        for document in documents.iterator():
+            old_path = document.file.name
+            if not default_storage.exists(old_path):
+                missing += 1
+                continue
+            with default_storage.open(old_path, 'rb') as stream:
+                blob = blobs.store(stream, old_path)
+            # Только blob и file: save() документа не трогает остальные поля
+            Document.objects.filter(pk=document.pk).update(blob=blob, file=blob.file.name)
+            default_storage.delete(old_path)
+            moved += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Перенесено: {moved}, файл не найден: {missing}'))
@@ -0,0 +1,158 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from agent.benchmarking import ENDPOINTS, SERVERS, format_percentiles, free_port
+from agent.fake_claude import FakeClaudeState, make_server
+
+
+class Command(BaseCommand):
+    help = (
+        'Измеряет, как быстро отмена (POST /api/analyses/{id}/cancel/) и deadline освобождают '
+        'воркер: анализы с долгим ответом имитации Claude отменяются через заданное время, '
+        'а в отчете — задержка от отмены до ответа на создание анализа, итоговые статусы и '
+        'число прерванных ответов Claude. Работает на временной базе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=list(SERVERS), default='gunicorn')
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Процессов сервера приложения (по умолчанию --analyses + 2, чтобы запрос отмены не ждал свободного воркера)'
+        )
+        parser.add_argument('--threads', type=int, default=1, help='Потоков на воркер gunicorn')
+        parser.add_argument('--mode', choices=['sync', 'async'], default='sync', help='Эндпоинт создания анализа')
+        parser.add_argument('--analyses', type=int, default=4, help='Одновременных анализов в каждом сценарии')
+        parser.add_argument('--latency', type=float, default=30.0, help='Время ответа имитации Claude, с')
+        parser.add_argument('--cancel-after', type=float, default=3.0, help='Через сколько секунд отменять анализ')
+        parser.add_argument('--timeout', type=int, default=2, help='Поле timeout анализа в сценарии deadline, с')
+
+    def handle(self, *args, **options):
+        if options['cancel_after'] >= options['latency'] or options['timeout'] >= options['latency']:
+            raise CommandError('--cancel-after и --timeout должны быть меньше --latency')
+        options['workers'] = options['workers'] or options['analyses'] + 2
+        state = FakeClaudeState(latency=str(options['latency']))
+        fake = make_server(port=0, state=state)
+        threading.Thread(target=fake.serve_forever, daemon=True).start()
+        process = None
+        with tempfile.TemporaryDirectory() as tmp:
+            try:
+                base_url, process = self._start_server(fake, tmp, options)
+                report = asyncio.run(self._measure(base_url, options))
+                # Имитация замечает закрытое соединение при записи следующей части ответа
+                time.sleep(options['latency'] / 10 * 2)
+            finally:
+                if process:
+                    process.terminate()
+                    process.wait()
+                fake.shutdown()
+                fake.server_close()
+        self._report(report, state, options)
+
+    def _start_server(self, fake, tmp, options):
+        env = dict(
+            os.environ,
+            USE_FAKE_CLAUDE='True',
+            FAKE_CLAUDE_URL=f'http://127.0.0.1:{fake.server_address[1]}',
+            SQLITE_PATH=os.path.join(tmp, 'cancel.sqlite3'),
+            MEDIA_ROOT=os.path.join(tmp, 'media'),
+            RATE_LIMIT_ENABLED='False',
+            ALLOWED_HOSTS='127.0.0.1',
+            DEBUG='False',
+            LOG_DEBUG_SAMPLE_RATE='0',
+        )
+        manage = os.path.join(settings.BASE_DIR, 'manage.py')
+        subprocess.run([sys.executable, manage, 'migrate', '-v', '0'], env=env, check=True)
+        port = free_port()
+        command = SERVERS[options['server']](port, options)
+        try:
+            process = subprocess.Popen(command, env=env, cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL)
+        except FileNotFoundError:
+            raise CommandError(f'{command[0]} не установлен')
+        return f'http://127.0.0.1:{port}', process
+
+    async def _measure(self, base_url, options):
+        # Таймаут клиента с запасом: без отмены ответ пришел бы через --latency секунд
+        async with httpx.AsyncClient(base_url=base_url, timeout=options['latency'] * 3) as client:
+            for _ in range(150):
+                try:
+                    await client.get('/api/')
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.2)
+            else:
+                raise CommandError(f'Сервер {base_url} не запустился')
+
+            response = await client.post('/api/documents/', files={
+                'file': ('report.txt', 'Выручка за квартал выросла на 12%.'.encode('utf-8'), 'text/plain'),
+            })
+            response.raise_for_status()
+            document_id = response.json()['id']
+            endpoint = ENDPOINTS[options['mode']]
+
+            async def create(number, **fields):
+                started = time.perf_counter()
+                response = await client.post(endpoint, json={
+                    'document_ids': [document_id], 'custom_prompt': f'Сценарий {number}', **fields,
+                })
+                response.raise_for_status()
+                return time.perf_counter(), time.perf_counter() - started, response.json()
+
+            # Отмена: создание анализа (синхронный режим держит запрос до конца) и отмена из другого запроса
+            tasks = [asyncio.create_task(create(number)) for number in range(options['analyses'])]
+            await asyncio.sleep(options['cancel_after'])
+            response = await client.get('/api/analyses/')
+            response.raise_for_status()
+            cancelled_at = {}
+            for analysis in response.json()['results']:
+                if analysis['status'] in ('pending', 'processing'):
+                    cancelled_at[analysis['id']] = time.perf_counter()
+                    (await client.post(f"/api/analyses/{analysis['id']}/cancel/")).raise_for_status()
+            cancel_results = await asyncio.gather(*tasks)
+
+            deadline_results = await asyncio.gather(*(
+                create(number, timeout=options['timeout']) for number in range(options['analyses'])
+            ))
+
+        release = [
+            finished - cancelled_at[analysis['id']]
+            for finished, _, analysis in cancel_results if analysis['id'] in cancelled_at
+        ]
+        return {
+            'cancel': {
+                'release': release,
+                'durations': [duration for _, duration, _ in cancel_results],
+                'statuses': [analysis['status'] for _, _, analysis in cancel_results],
+            },
+            'deadline': {
+                'durations': [duration for _, duration, _ in deadline_results],
+                'statuses': [analysis['status'] for _, _, analysis in deadline_results],
+            },
+        }
+
+    def _report(self, report, state, options):
+        def statuses(values):
+            return {status: values.count(status) for status in sorted(set(values))}
+
+        self.stdout.write(
+            f"{options['server']} ×{options['workers']}, режим {options['mode']}, анализов {options['analyses']}, "
+            f"ответ Claude {options['latency']:g} с (без отмены запрос занимал бы воркер столько же)"
+        )
+        cancel = report['cancel']
+        self.stdout.write(f"Отмена через {options['cancel_after']:g} с: статусы {statuses(cancel['statuses'])}")
+        self.stdout.write(f"  от отмены до освобождения воркера: {format_percentiles(cancel['release'])}")
+        self.stdout.write(f"  длительность запроса создания:      {format_percentiles(cancel['durations'])}")
+        deadline = report['deadline']
+        self.stdout.write(f"Deadline (timeout={options['timeout']} с): статусы {statuses(deadline['statuses'])}")
+        self.stdout.write(f"  длительность запроса создания:      {format_percentiles(deadline['durations'])}")
+        self.stdout.write(
+            f"Имитация Claude: запросов {state.stats['requests']}, прервано клиентом {state.stats['disconnected']}"
+        )
@@ -0,0 +1,173 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from .extraction_benchmark import WORDS, _sentence
+
+
+def _markdown(rnd, size):
+    """Результат анализа в духе ответов Claude: заголовки, списки, таблицы сравнения."""
+    parts = []
+    length = 0
+    while length < size:
+        block = [f'## {_sentence(rnd, WORDS, 3).capitalize()}', _sentence(rnd, WORDS, rnd.randint(30, 80)) + '.']
+        block += [f'- **{rnd.choice(WORDS)}**: {_sentence(rnd, WORDS, 8)}' for _ in range(rnd.randint(2, 6))]
+        block.append('| показатель | документ 1 | документ 2 |\n|---|---|---|')
+        block += [
+            f'| {rnd.choice(WORDS)} | {rnd.uniform(0, 1e6):,.2f} | {rnd.uniform(0, 1e6):,.2f} |'
+            for _ in range(rnd.randint(3, 8))
+        ]
+        text = '\n'.join(block) + '\n\n'
+        parts.append(text)
+        length += len(text)
+    return ''.join(parts)
+
+
+def _document_text(rnd, size):
+    """Извлеченный текст отчета: абзацы и строки таблиц через ' | '."""
+    lines = []
+    length = 0
+    while length < size:
+        if rnd.random() < 0.3:
+            line = ' | '.join([str(rnd.randint(1, 99999)), rnd.choice(WORDS), f'{rnd.uniform(100, 1e6):.2f}'])
+        else:
+            line = _sentence(rnd, WORDS, rnd.randint(15, 40)).capitalize() + '.'
+        lines.append(line)
+        length += len(line) + 1
+    return '\n'.join(lines)
+
+
+class Command(BaseCommand):
+    help = (
+        'Измеряет сжатие CompressedTextField (Analysis.result, Document.extracted_text): '
+        'объем хранимых данных и файла базы, время записи и чтения по сравнению с '
+        'несжатым TEXT. Работает на временной базе.'
+    )
+
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyses', type=int, default=2000, help='Анализов с результатом')
+        parser.add_argument('--result-kb', type=int, default=6, help='Средний размер результата, КБ')
+        parser.add_argument('--documents', type=int, default=100, help='Документов с извлеченным текстом')
+        parser.add_argument('--text-kb', type=int, default=150, help='Средний размер извлеченного текста, КБ')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--child', action='store_true', help='Внутренний режим: замер в уже подготовленной среде')
+
+    def handle(self, *args, **options):
+        if options['child']:
+            self.stdout.write(json.dumps(self._measure(options)))
+            return
+
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                SQLITE_PATH=os.path.join(tmp, 'compression.sqlite3'),
+                MEDIA_ROOT=os.path.join(tmp, 'media'),
+                LOG_DEBUG_SAMPLE_RATE='0',
+            )
+            manage = os.path.join(settings.BASE_DIR, 'manage.py')
+            subprocess.run([sys.executable, manage, 'migrate', '-v', '0'], env=env, check=True)
+            command = [sys.executable, manage, 'compression_benchmark', '--child']
+            for name in ('analyses', 'result_kb', 'documents', 'text_kb', 'seed'):
+                command += [f"--{name.replace('_', '-')}", str(options[name])]
+            result = subprocess.run(command, env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise CommandError(result.stderr.strip())
+            report = json.loads(result.stdout.strip().splitlines()[-1])
+        self._report(report)
+
+    def _measure(self, options):
+        from django.db import connection, models
+        from django.db.models import Value
+
+        from agent.models import Analysis, Document
+
+        rnd = random.Random(options['seed'])
+        results = [
+            _markdown(rnd, int(rnd.lognormvariate(0, 0.6) * options['result_kb'] * 1024 / 1.2))
+            for _ in range(options['analyses'])
+        ]
+        texts = [
+            _document_text(rnd, int(rnd.lognormvariate(0, 0.6) * options['text_kb'] * 1024 / 1.2))
+            for _ in range(options['documents'])
+        ]
+        analyses = Analysis.objects.bulk_create([Analysis(status='completed') for _ in results])
+        documents = Document.objects.bulk_create([
+            Document(file=f'documents/report-{number}.txt', name=f'report-{number}.txt', file_type='text/plain')
+            for number in range(len(texts))
+        ])
+        targets = [
+            (Analysis, 'result', [analysis.pk for analysis in analyses], results),
+            (Document, 'extracted_text', [document.pk for document in documents], texts),
+        ]
+
+        def write(compressed):
+            started = time.perf_counter()
+            for model, field, pks, values in targets:
+                for pk, value in zip(pks, values):
+                    if not compressed:
+                        # Несжатый TEXT, как до CompressedTextField
+                        value = Value(value, output_field=models.TextField())
+                    model.objects.filter(pk=pk).update(**{field: value})
+            return time.perf_counter() - started
+
+        def read(access):
+            started = time.perf_counter()
+            for model, field, _, _ in targets:
+                for obj in model.objects.all():
+                    if access:
+                        getattr(obj, field)
+            return time.perf_counter() - started
+
+        def sizes():
+            stored = 0
+            with connection.cursor() as cursor:
+                for model, field, _, _ in targets:
+                    cursor.execute(f'SELECT SUM(LENGTH(CAST({field} AS BLOB))) FROM {model._meta.db_table}')
+                    stored += cursor.fetchone()[0] or 0
+                cursor.execute('VACUUM')
+            return stored, os.path.getsize(settings.DATABASES['default']['NAME'])
+
+        report = {'raw_bytes': sum(len(value.encode('utf-8')) for value in results + texts)}
+        for variant, compressed in (('plain', False), ('compressed', True)):
+            write_seconds = write(compressed)
+            stored, file_size = sizes()
+            read(True)  # прогрев страничного кэша
+            report[variant] = {
+                'write_seconds': write_seconds,
+                'stored_bytes': stored,
+                'file_bytes': file_size,
+                'read_seconds': min(read(True) for _ in range(3)),
+                'list_seconds': min(read(False) for _ in range(3)),
+            }
+        return report
+
+    def _report(self, report):
+        mb = 1024 * 1024
+        plain, compressed = report['plain'], report['compressed']
+        self.stdout.write(f"Текст без сжатия: {report['raw_bytes'] / mb:.1f} МБ")
+        self.stdout.write(
+            f"{'хранение':<10} {'данные, МБ':>10} {'файл БД, МБ':>12} {'запись, с':>10} "
+            f"{'чтение, с':>10} {'список, с':>10}"
+        )
+        for name, variant in (('TEXT', plain), ('сжатие', compressed)):
+            self.stdout.write(
+                f"{name:<10} {variant['stored_bytes'] / mb:>10.1f} {variant['file_bytes'] / mb:>12.1f} "
+                f"{variant['write_seconds']:>10.2f} {variant['read_seconds']:>10.2f} {variant['list_seconds']:>10.2f}"
+            )
+        self.stdout.write(
+            f"Степень сжатия {report['raw_bytes'] / compressed['stored_bytes']:.1f}x, "
+            f"файл базы меньше в {plain['file_bytes'] / compressed['file_bytes']:.1f} раза"
+        )
+        self.stdout.write(
+            '  чтение — загрузка всех строк с обращением к тексту, '
+            'список — без обращения (текст не распаковывается)'
+        )
@@ -0,0 +1,149 @@
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from agent.accounting import percentile
+
+
+def _corpus(unique, uploads, mean_kb, seed):
+    """
+    Набор загрузок с реалистичным повторением: популярность содержимого
+    распределена по закону Ципфа (несколько отчетов загружают многие,
+    большинство — по одному разу), размеры — логнормально.
+    """
+    rnd = random.Random(seed)
+    words = ['выручка', 'расходы', 'квартал', 'прибыль', 'филиал', 'отчет', 'рост', 'снижение', 'план', 'факт']
+    contents = []
+    for number in range(unique):
+        size = int(rnd.lognormvariate(0, 0.8) * mean_kb * 1024 / 1.38)
+        line = ' '.join(rnd.choice(words) for _ in range(12))
+        text = f'Документ {number}\n' + '\n'.join(f'{line} {row}' for row in range(size // (len(line) * 2 + 8) + 1))
+        contents.append(text.encode('utf-8'))
+    weights = [1 / (rank + 1) ** 1.1 for rank in range(unique)]
+    # Каждое содержимое загружается хотя бы раз, остальные загрузки — по популярности
+    order = list(range(unique)) + rnd.choices(range(unique), weights, k=max(uploads - unique, 0))
+    rnd.shuffle(order)
+    return contents, order
+
+
+class Command(BaseCommand):
+    help = (
+        'Измеряет выигрыш хранения по содержимому на наборе загрузок с повторами: '
+        'сколько места занимают файлы по сравнению с хранением каждой загрузки, '
+        'задержку загрузки нового содержимого и дубликата и число извлечений текста. '
+        'Работает на временной базе и временном MEDIA_ROOT.'
+    )
+
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--unique', type=int, default=60, help='Уникальных файлов')
+        parser.add_argument('--uploads', type=int, default=600, help='Всего загрузок')
+        parser.add_argument('--mean-kb', type=int, default=300, help='Средний размер файла, КБ')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--child', action='store_true', help='Внутренний режим: замер в уже подготовленной среде')
+
+    def handle(self, *args, **options):
+        if options['child']:
+            self.stdout.write(json.dumps(self._measure(options)))
+            return
+
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                SQLITE_PATH=os.path.join(tmp, 'dedup.sqlite3'),
+                MEDIA_ROOT=os.path.join(tmp, 'media'),
+                RATE_LIMIT_DB_PATH=os.path.join(tmp, 'ratelimit.sqlite3'),
+                LOG_DEBUG_SAMPLE_RATE='0',
+                ALLOWED_HOSTS='testserver',
+            )
+            manage = os.path.join(settings.BASE_DIR, 'manage.py')
+            subprocess.run([sys.executable, manage, 'migrate', '-v', '0'], env=env, check=True)
+            command = [
+                sys.executable, manage, 'dedup_benchmark', '--child',
+                '--unique', str(options['unique']), '--uploads', str(options['uploads']),
+                '--mean-kb', str(options['mean_kb']), '--seed', str(options['seed']),
+            ]
+            result = subprocess.run(command, env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise CommandError(result.stderr.strip())
+            report = json.loads(result.stdout.strip().splitlines()[-1])
+        self._report(report)
+
+    def _measure(self, options):
+        from django.test import Client
+
+        from agent.models import Document
+        from agent.services import FileProcessor
+
+        contents, order = _corpus(options['unique'], options['uploads'], options['mean_kb'], options['seed'])
+        client = Client()
+        seen = set()
+        latency = {'new': [], 'duplicate': []}
+        for number, index in enumerate(order):
+            upload = io.BytesIO(contents[index])
+            upload.name = f'report-{number}.txt'
+            started = time.perf_counter()
+            response = client.post('/api/documents/', {'file': upload})
+            elapsed = time.perf_counter() - started
+            if response.status_code != 201:
+                raise CommandError(f'Загрузка завершилась с кодом {response.status_code}: {response.content[:200]}')
+            latency['duplicate' if index in seen else 'new'].append(elapsed)
+            seen.add(index)
+
+        stored = 0
+        for root, _, files in os.walk(settings.MEDIA_ROOT):
+            stored += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+
+        # Извлечение текста для всех документов: файл разбирается только для первого документа каждого содержимого
+        extractions = 0
+        started = time.perf_counter()
+        for document in Document.objects.order_by('uploaded_at'):
+            reused = Document.objects.filter(blob_id=document.blob_id, extracted_text__isnull=False).exists()
+            FileProcessor.get_document_text(document)
+            extractions += not reused
+        extraction_seconds = time.perf_counter() - started
+
+        return {
+            'uploads': len(order),
+            'unique': len(contents),
+            'logical_bytes': sum(len(contents[index]) for index in order),
+            'stored_bytes': stored,
+            # Без повторов в наборе задержек загрузки дубликатов нет
+            'new_p50': percentile(latency['new'], 0.5) or 0.0,
+            'new_p95': percentile(latency['new'], 0.95) or 0.0,
+            'duplicate_p50': percentile(latency['duplicate'], 0.5) or 0.0,
+            'duplicate_p95': percentile(latency['duplicate'], 0.95) or 0.0,
+            'extractions': extractions,
+            'extraction_seconds': extraction_seconds,
+        }
+
+    def _report(self, report):
+        saved = 1 - report['stored_bytes'] / report['logical_bytes']
+        self.stdout.write(
+            f"Загрузок {report['uploads']}, уникального содержимого {report['unique']}"
+        )
+        self.stdout.write(
+            f"  на диске {report['stored_bytes'] / 1024 ** 2:.1f} МБ вместо "
+            f"{report['logical_bytes'] / 1024 ** 2:.1f} МБ (экономия {saved:.0%})"
+        )
+        self.stdout.write(
+            f"  загрузка нового содержимого: p50 {report['new_p50'] * 1000:.1f} мс, "
+            f"p95 {report['new_p95'] * 1000:.1f} мс"
+        )
+        self.stdout.write(
+            f"  загрузка дубликата:          p50 {report['duplicate_p50'] * 1000:.1f} мс, "
+            f"p95 {report['duplicate_p95'] * 1000:.1f} мс"
+        )
+        self.stdout.write(
+            f"  извлечений текста {report['extractions']} на {report['uploads']} документов "
+            f"({report['extraction_seconds']:.2f} с)"
+        )
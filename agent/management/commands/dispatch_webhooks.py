@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from agent import webhooks
+
+
+class Command(BaseCommand):
+    help = (
+        'Отправляет уведомления вебхуков о завершенных анализах: события одного адреса '
+        'объединяются в один запрос, неудачные доставки повторяются с экспоненциальной '
+        'задержкой. По умолчанию работает непрерывно.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Отправить все доставки, срок которых наступил, и выйти')
+        parser.add_argument('--interval', type=float, default=1.0, help='Пауза, когда отправлять нечего, с')
+
+    def handle(self, *args, **options):
+        while True:
+            sent = webhooks.dispatch()
+            if sent:
+                self.stdout.write(f'Обработано доставок: {sent}')
+                # Очередь не пуста — следующая порция сразу, без паузы
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,147 @@
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from .extraction_benchmark import WORDS, _max_rss_mb, _sentence
+
+# Примерно столько абзацев и строк таблиц помещается на страницу A4
+PARAGRAPHS_PER_PAGE = 8
+TABLE_EVERY_PAGES = 2
+TABLE_ROWS = 12
+TABLE_MARKER = 'ИТОГО-ТАБЛИЦА'
+
+METHODS = ('python-docx', 'streaming')
+
+
+def _write_document(path, pages, rnd):
+    """DOCX на pages страниц: разделы, абзацы, таблица каждые TABLE_EVERY_PAGES страниц, колонтитулы."""
+    import docx
+    document = docx.Document()
+    section = document.sections[0]
+    section.header.paragraphs[0].text = 'Договор поставки № 17/2024'
+    section.footer.paragraphs[0].text = 'Конфиденциально'
+    for page in range(pages):
+        if page % 10 == 0:
+            document.add_heading(f'Раздел {page // 10 + 1}', level=1)
+        for _ in range(PARAGRAPHS_PER_PAGE):
+            document.add_paragraph(_sentence(rnd, WORDS, rnd.randint(20, 40)))
+        if page % TABLE_EVERY_PAGES == 0:
+            table = document.add_table(rows=TABLE_ROWS, cols=4)
+            for number, row in enumerate(table.rows):
+                cells = row.cells
+                cells[0].text = f'{page}.{number}'
+                cells[1].text = rnd.choice(WORDS)
+                cells[2].text = f'{rnd.uniform(100, 1_000_000):.2f}'
+                cells[3].text = TABLE_MARKER if number == TABLE_ROWS - 1 else _sentence(rnd, WORDS, 3)
+    document.save(path)
+
+
+def _extractor(method):
+    """Функция извлечения текста способом method; библиотека импортируется при вызове."""
+    if method == 'python-docx':
+        import docx
+
+        def extract(path):
+            # Прежняя реализация FileProcessor
+            document = docx.Document(path)
+            return "\n".join([para.text for para in document.paragraphs])
+        return extract
+
+    from agent.docx_text import iter_docx_text
+    return lambda path: "\n".join(iter_docx_text(path))
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает потоковое извлечение текста DOCX (agent.docx_text) с python-docx на '
+        'сгенерированном документе (по умолчанию 500 страниц с таблицами и колонтитулами): '
+        'время, пиковый RSS, объем текста и попадание текста таблиц. '
+        'Каждый замер — отдельный процесс.'
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=500, help='Страниц в документе')
+        parser.add_argument('--repeat', type=int, default=3, help='Повторов каждого способа (берется медиана времени)')
+        parser.add_argument(
+            '--fixtures-dir', default=os.path.join(tempfile.gettempdir(), 'docx_benchmark'),
+            help='Каталог сгенерированных документов (переиспользуются между запусками)'
+        )
+        parser.add_argument('--child', nargs=2, metavar=('METHOD', 'PATH'), help='Внутренний режим: один замер')
+
+    def handle(self, *args, **options):
+        if options['child']:
+            method, path = options['child']
+            self._child(method, path)
+            return
+
+        path = self._fixture(options)
+        results = {}
+        for method in METHODS:
+            runs = [self._measure(method, path) for _ in range(options['repeat'])]
+            results[method] = {
+                'seconds': statistics.median(run['seconds'] for run in runs),
+                'rss_mb': max(run['extraction_rss_mb'] for run in runs),
+                'chars': runs[0]['chars'],
+                'tables': runs[0]['tables'],
+            }
+        self._report(path, options['pages'], results)
+
+    def _fixture(self, options):
+        os.makedirs(options['fixtures_dir'], exist_ok=True)
+        path = os.path.join(options['fixtures_dir'], f"contract-{options['pages']}.docx")
+        if not os.path.exists(path):
+            started = time.perf_counter()
+            _write_document(path + '.tmp', options['pages'], random.Random(options['pages']))
+            os.replace(path + '.tmp', path)
+            self.stdout.write(
+                f'Сгенерирован {os.path.basename(path)} ({os.path.getsize(path) / 1024 / 1024:.1f} МБ) '
+                f'за {time.perf_counter() - started:.1f} с'
+            )
+        return path
+
+    @staticmethod
+    def _measure(method, path):
+        command = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'docx_benchmark', '--child', method, path]
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode:
+            raise CommandError(completed.stderr.strip() or f'Замер {method} завершился с кодом {completed.returncode}')
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def _child(self, method, path):
+        # Библиотека импортируется до замера, чтобы RSS показывал только разбор документа
+        extract = _extractor(method)
+
+        baseline_rss = _max_rss_mb()
+        started = time.perf_counter()
+        text = extract(path)
+        seconds = time.perf_counter() - started
+        self.stdout.write(json.dumps({
+            'seconds': seconds,
+            'extraction_rss_mb': _max_rss_mb() - baseline_rss,
+            'chars': len(text),
+            'tables': text.count(TABLE_MARKER),
+        }))
+
+    def _report(self, path, pages, results):
+        expected_tables = (pages + TABLE_EVERY_PAGES - 1) // TABLE_EVERY_PAGES
+        self.stdout.write(f'{os.path.basename(path)}: {pages} страниц, {expected_tables} таблиц')
+        self.stdout.write(f"{'способ':<12} {'время, с':>9} {'+RSS, МБ':>9} {'символов':>11} {'таблиц':>7}")
+        for method, result in results.items():
+            self.stdout.write(
+                f"{method:<12} {result['seconds']:>9.2f} {result['rss_mb']:>9.0f} "
+                f"{result['chars']:>11,} {result['tables']:>4}/{expected_tables}"
+            )
+        baseline, streaming = results['python-docx'], results['streaming']
+        self.stdout.write(
+            f"Потоковое извлечение быстрее в {baseline['seconds'] / streaming['seconds']:.1f} раза, "
+            f"памяти на разбор: {streaming['rss_mb']:.0f} МБ против {baseline['rss_mb']:.0f} МБ"
+        )
@@ -0,0 +1,341 @@
+import csv
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+WORDS = (
+    'выручка прибыль расходы доходы квартал отчет баланс актив пассив капитал налог '
+    'договор поставка клиент продукт продажи маржа рентабельность инвестиции кредит '
+    'себестоимость амортизация дивиденды аудит бюджет план показатель рост снижение'
+).split()
+# Стандартные шрифты PDF без встраивания не содержат кириллицы
+LATIN_WORDS = (
+    'revenue profit margin forecast contract invoice supplier customer growth risk '
+    'quarter report balance asset liability equity tax delivery product sales budget'
+).split()
+
+# Размеры при --scale 1
+SIZES = {
+    'pdf': 300,       # страниц
+    'docx': 20000,    # абзацев
+    'xlsx': 100000,   # строк
+    'csv': 100000,    # строк
+    'json': 20000,    # записей (и вложенность JSON_DEPTH)
+    'txt': 200000,    # строк (~20 МБ)
+}
+JSON_DEPTH = 200
+# Меняется при изменении генераторов, чтобы не сравнивать замеры на разных файлах
+FIXTURES_VERSION = 1
+
+
+def _sentence(rnd, words, count):
+    return ' '.join(rnd.choice(words) for _ in range(count))
+
+
+def _write_pdf(path, pages, rnd):
+    """PDF с текстовым слоем: pages страниц по 50 строк, без внешних библиотек."""
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,  # дерево страниц, заполняется после создания страниц
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    kids = []
+    for page in range(pages):
+        lines = [f'Page {page + 1}. ' + _sentence(rnd, LATIN_WORDS, 12) for _ in range(50)]
+        stream = 'BT /F1 10 Tf 14 TL 40 800 Td ' + ' '.join(f'({line}) Tj T*' for line in lines) + ' ET'
+        stream = stream.encode('latin-1')
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+        content_number = len(objects)
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+            b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % content_number
+        )
+        kids.append(b'%d 0 R' % len(objects))
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(kids), pages)
+
+    with open(path, 'wb') as f:
+        f.write(b'%PDF-1.4\n')
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+        xref = f.tell()
+        f.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b'%010d 00000 n \n' % offset)
+        f.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+
+
+def _write_docx(path, paragraphs, rnd):
+    import docx
+    document = docx.Document()
+    for number in range(paragraphs):
+        if number % 50 == 0:
+            document.add_heading(f'Раздел {number // 50 + 1}', level=1)
+        document.add_paragraph(_sentence(rnd, WORDS, rnd.randint(20, 60)))
+    document.save(path)
+
+
+def _row(rnd, number):
+    return [
+        number,
+        f'Клиент {rnd.randint(1, 5000)}',
+        rnd.choice(WORDS),
+        round(rnd.uniform(100, 1_000_000), 2),
+        rnd.randint(1, 500),
+        f'2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}',
+        rnd.choice(['оплачен', 'ожидает', 'просрочен']),
+        _sentence(rnd, WORDS, 6),
+    ]
+
+
+HEADER = ['id', 'клиент', 'категория', 'сумма', 'количество', 'дата', 'статус', 'комментарий']
+
+
+def _write_xlsx(path, rows, rnd):
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Продажи')
+    sheet.append(HEADER)
+    for number in range(rows):
+        sheet.append(_row(rnd, number))
+    workbook.save(path)
+
+
+def _write_csv(path, rows, rnd):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        for number in range(rows):
+            writer.writerow(_row(rnd, number))
+
+
+def _write_json(path, records, rnd):
+    tree = {'value': 'leaf'}
+    for level in range(JSON_DEPTH):
+        tree = {'level': level, 'name': rnd.choice(WORDS), 'child': tree}
+    data = {
+        'records': [
+            {
+                'id': number,
+                'client': {'name': f'Клиент {rnd.randint(1, 5000)}', 'tags': rnd.sample(WORDS, 3)},
+                'lines': [{'product': rnd.choice(WORDS), 'amount': rnd.randint(1, 1000)} for _ in range(3)],
+                'comment': _sentence(rnd, WORDS, 10),
+            }
+            for number in range(records)
+        ],
+        'tree': tree,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def _write_txt(path, lines, rnd):
+    with open(path, 'w', encoding='utf-8') as f:
+        for _ in range(lines):
+            f.write(_sentence(rnd, WORDS, 8) + '\n')
+
+
+GENERATORS = {
+    'pdf': _write_pdf,
+    'docx': _write_docx,
+    'xlsx': _write_xlsx,
+    'csv': _write_csv,
+    'json': _write_json,
+    'txt': _write_txt,
+}
+
+
+def _max_rss_mb():
+    # ru_maxrss в Linux — в килобайтах, в macOS — в байтах
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+
+def _git_commit():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=settings.BASE_DIR, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f'{commit}-dirty' if dirty else commit
+
+
+class Command(BaseCommand):
+    help = (
+        'Бенчмарк извлечения текста FileProcessor на больших сгенерированных файлах всех '
+        'поддерживаемых форматов: пропускная способность, пиковый RSS и время до первого текста. '
+        'Результаты дописываются в историю с хешем коммита и сравниваются с предыдущим коммитом.'
+    )
+    # Проверки проекта загружают URL и представления и поднимают базовый RSS замера
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--formats', nargs='+', choices=list(GENERATORS), default=list(GENERATORS))
+        parser.add_argument('--scale', type=float, default=1.0, help='Множитель размеров файлов (0.1 — быстрый прогон)')
+        parser.add_argument('--repeat', type=int, default=3, help='Повторов извлечения (берется медиана времени)')
+        parser.add_argument(
+            '--fixtures-dir', default=os.path.join(tempfile.gettempdir(), 'extraction_benchmark'),
+            help='Каталог сгенерированных файлов (переиспользуются между запусками)'
+        )
+        parser.add_argument(
+            '--history', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'extraction.jsonl'),
+            help='Файл истории замеров (JSON Lines)'
+        )
+        parser.add_argument('--no-save', action='store_true', help='Не записывать замер в историю')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Допустимое ухудшение относительно прошлого коммита')
+        parser.add_argument('--fail-on-regression', action='store_true', help='Завершиться с ошибкой при регрессии')
+        parser.add_argument('--child', help='Внутренний режим: извлечь текст из файла и вывести замер')
+
+    def handle(self, *args, **options):
+        if options['child']:
+            self._child(options['child'])
+            return
+
+        os.makedirs(options['fixtures_dir'], exist_ok=True)
+        results = {}
+        for name in options['formats']:
+            path = self._fixture(name, options)
+            runs = [self._measure(path) for _ in range(options['repeat'])]
+            if any('error' in run for run in runs):
+                results[name] = {'error': next(run['error'] for run in runs if 'error' in run)}
+                continue
+            size = os.path.getsize(path)
+            seconds = statistics.median(run['seconds'] for run in runs)
+            results[name] = {
+                'size_mb': round(size / 1024 / 1024, 2),
+                'seconds': round(seconds, 4),
+                'mb_per_s': round(size / 1024 / 1024 / seconds, 2),
+                'chars_per_s': round(runs[0]['chars'] / seconds),
+                'first_text_s': round(statistics.median(run['first_text_seconds'] for run in runs), 4),
+                'peak_rss_mb': round(max(run['peak_rss_mb'] for run in runs), 1),
+                'extraction_rss_mb': round(max(run['extraction_rss_mb'] for run in runs), 1),
+            }
+
+        record = {
+            'commit': _git_commit(),
+            'date': timezone.now().isoformat(timespec='seconds'),
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'scale': options['scale'],
+            'fixtures_version': FIXTURES_VERSION,
+            'results': results,
+        }
+        previous = self._previous(options['history'], record)
+        regressions = self._report(results, previous, options['threshold'])
+
+        if not options['no_save']:
+            os.makedirs(os.path.dirname(options['history']), exist_ok=True)
+            with open(options['history'], 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        if regressions and options['fail_on_regression']:
+            raise CommandError('Регрессия извлечения: ' + ', '.join(regressions))
+
+    def _fixture(self, name, options):
+        size = max(1, int(SIZES[name] * options['scale']))
+        path = os.path.join(options['fixtures_dir'], f'v{FIXTURES_VERSION}-{name}-{size}.{name}')
+        if not os.path.exists(path):
+            started = time.perf_counter()
+            # Файл пишется под временным именем, чтобы прерванная генерация не оставила битый файл
+            GENERATORS[name](path + '.tmp', size, random.Random(f'{name}-{size}'))
+            os.replace(path + '.tmp', path)
+            self.stdout.write(
+                f'Сгенерирован {os.path.basename(path)} ({os.path.getsize(path) / 1024 / 1024:.1f} МБ) '
+                f'за {time.perf_counter() - started:.1f} с'
+            )
+        return path
+
+    @staticmethod
+    def _measure(path):
+        # Каждый замер — отдельный процесс, иначе пиковый RSS накапливается между форматами
+        command = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'extraction_benchmark', '--child', path]
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode:
+            return {'error': completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'ошибка'}
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def _child(self, path):
+        from agent.services import FileProcessor
+
+        baseline_rss = _max_rss_mb()
+        started = time.perf_counter()
+        first_text_seconds = None
+        if path.endswith('.docx'):
+            # DOCX разбирается потоково: время до первой строки меряется отдельным проходом
+            from agent.docx_text import iter_docx_text
+            next(iter_docx_text(path), None)
+            first_text_seconds = time.perf_counter() - started
+            started = time.perf_counter()
+        text = FileProcessor.extract_text_from_file(path)
+        seconds = time.perf_counter() - started
+        if FileProcessor.is_extraction_error(text):
+            raise CommandError(text[:200])
+        self.stdout.write(json.dumps({
+            'seconds': seconds,
+            # Остальные форматы не потоковые: первый текст появляется вместе со всем результатом
+            'first_text_seconds': seconds if first_text_seconds is None else first_text_seconds,
+            'chars': len(text),
+            'peak_rss_mb': _max_rss_mb(),
+            'extraction_rss_mb': _max_rss_mb() - baseline_rss,
+        }))
+
+    @staticmethod
+    def _previous(history, record):
+        """Последний замер другого коммита на той же машине и с теми же файлами."""
+        if not os.path.exists(history):
+            return None
+        previous = None
+        with open(history, encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if (
+                    entry.get('host') == record['host']
+                    and entry.get('scale') == record['scale']
+                    and entry.get('fixtures_version') == record['fixtures_version']
+                    and entry.get('commit') != record['commit']
+                ):
+                    previous = entry
+        return previous
+
+    def _report(self, results, previous, threshold):
+        if previous:
+            self.stdout.write(f"Сравнение с {previous['commit']} от {previous['date']}")
+        self.stdout.write(
+            f"{'формат':<6} {'МБ':>7} {'время, с':>9} {'МБ/с':>7} {'симв./с':>11} "
+            f"{'1-й текст, с':>12} {'RSS, МБ':>8} {'+RSS, МБ':>9}  изменение"
+        )
+        regressions = []
+        for name, result in results.items():
+            if 'error' in result:
+                self.stdout.write(f"{name:<6} ошибка: {result['error']}")
+                continue
+            change = ''
+            before = (previous or {}).get('results', {}).get(name)
+            if before and 'error' not in before:
+                time_change = result['seconds'] / before['seconds'] - 1
+                rss_change = result['peak_rss_mb'] / before['peak_rss_mb'] - 1
+                change = f'время {time_change:+.0%}, RSS {rss_change:+.0%}'
+                if time_change > threshold or rss_change > threshold:
+                    change += '  РЕГРЕССИЯ'
+                    regressions.append(name)
+            self.stdout.write(
+                f"{name:<6} {result['size_mb']:>7.1f} {result['seconds']:>9.2f} {result['mb_per_s']:>7.1f} "
+                f"{result['chars_per_s']:>11,} {result['first_text_s']:>12.2f} {result['peak_rss_mb']:>8.0f} "
+                f"{result['extraction_rss_mb']:>9.0f}  {change}"
+            )
+        return regressions
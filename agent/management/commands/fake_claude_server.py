@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from agent.fake_claude import FakeClaudeState, make_server
+
+
+class Command(BaseCommand):
+    help = (
+        'Запускает локальную имитацию API Claude (Messages и Message Batches). '
+        'Задайте USE_FAKE_CLAUDE=True (или CLAUDE_API_BASE_URL=http://HOST:PORT), чтобы сервис обращался к ней.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--batch-delay', type=float, default=2.0, help='Время обработки Message Batch, с')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Доля запросов с ошибкой 500 (0..1)')
+        parser.add_argument('--overload-rate', type=float, default=0.0, help='Доля запросов с ошибкой 529 (0..1)')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument(
+            '--latency', default='0',
+            help="Время генерации ответа, с, или распределение: 'uniform:1,3', 'normal:2,0.5', 'lognormal:2,0.6', 'exp:2'"
+        )
+        parser.add_argument('--rpm', type=int, default=0, help='Лимит запросов в минуту на модель (0 — без лимита)')
+        parser.add_argument('--itpm', type=int, default=0, help='Лимит входных токенов в минуту на модель')
+        parser.add_argument('--otpm', type=int, default=0, help='Лимит выходных токенов в минуту на модель')
+        parser.add_argument('--verbose', action='store_true', help='Печатать журнал запросов')
+
+    def handle(self, *args, **options):
+        state = FakeClaudeState(
+            batch_delay=options['batch_delay'],
+            error_rate=options['error_rate'],
+            overload_rate=options['overload_rate'],
+            seed=options['seed'],
+            latency=options['latency'],
+            rate_limits={'rpm': options['rpm'], 'itpm': options['itpm'], 'otpm': options['otpm']},
+        )
+        server = make_server(options['host'], options['port'], state, verbose=options['verbose'])
+        host, port = server.server_address[:2]
+        self.stdout.write(self.style.SUCCESS(f'Имитация API Claude запущена: http://{host}:{port} (задержка {state.latency})'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
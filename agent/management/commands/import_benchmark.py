@@ -0,0 +1,81 @@
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Что делает процесс до обработки первого запроса или команды
+SCENARIOS = {
+    # Воркер gunicorn: WSGI-приложение и URLconf (а через него представления и сервисы)
+    'worker': (
+        "from django.core.wsgi import get_wsgi_application; get_wsgi_application(); "
+        "from django.urls import get_resolver; get_resolver().url_patterns"
+    ),
+    # manage.py-команда: только настройка Django и загрузка приложений
+    'setup': "import django; django.setup()",
+}
+
+_IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def _child(code, settings_module):
+    """Запускает сценарий в новом интерпретаторе: время запуска и строки -X importtime."""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         f"import time; started = time.perf_counter(); {code}; print(time.perf_counter() - started)"],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise CommandError(result.stderr.strip().splitlines()[-1])
+    imports = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match and len(match.group(3)) == 1:
+            # Пакеты верхнего уровня: суммарное время вместе с вложенными импортами
+            imports[match.group(4)] = int(match.group(2)) / 1e6
+    return float(result.stdout.strip().splitlines()[-1]), imports
+
+
+class Command(BaseCommand):
+    help = (
+        'Время холодного запуска: сколько занимает подготовка воркера (WSGI-приложение и URLconf) '
+        'и manage.py-команды в новом интерпретаторе, и какие импорты (python -X importtime) '
+        'стоят дороже всего. С --target проверяет, что запуск воркера укладывается в цель.'
+    )
+
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Запусков каждого сценария (берется медиана)')
+        parser.add_argument('--top', type=int, default=10, help='Сколько самых дорогих импортов показать')
+        parser.add_argument('--target', type=float, default=0.5, help='Цель для запуска воркера, с')
+        parser.add_argument('--fail-over-target', action='store_true', help='Код ошибки, если цель не достигнута')
+
+    def handle(self, *args, **options):
+        worker_seconds = None
+        for name, code in SCENARIOS.items():
+            runs = [_child(code, settings.SETTINGS_MODULE) for _ in range(options['repeat'])]
+            seconds = statistics.median(run[0] for run in runs)
+            imports = {
+                module: statistics.median(run[1].get(module, 0) for run in runs)
+                for module in runs[0][1]
+            }
+            self.stdout.write(f'{name}: {seconds * 1000:.0f} мс (медиана из {options["repeat"]})')
+            for module, module_seconds in sorted(imports.items(), key=lambda item: -item[1])[:options['top']]:
+                self.stdout.write(f'  {module_seconds * 1000:8.1f} мс  {module}')
+            if name == 'worker':
+                worker_seconds = seconds
+
+        if worker_seconds > options['target']:
+            message = f"Запуск воркера {worker_seconds * 1000:.0f} мс превышает цель {options['target'] * 1000:.0f} мс"
+            if options['fail_over_target']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Запуск воркера {worker_seconds * 1000:.0f} мс в пределах цели {options['target'] * 1000:.0f} мс"
+            ))
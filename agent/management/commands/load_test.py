@@ -0,0 +1,278 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from agent.benchmarking import ENDPOINTS, SERVERS, format_percentiles, free_port
+from agent.fake_claude import FakeClaudeState, LatencyDistribution, make_server
+from agent.webhook_receiver import WebhookReceiverState, make_receiver
+
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+class Command(BaseCommand):
+    help = (
+        'Сквозной нагрузочный тест всего стека: виртуальные пользователи загружают документы, '
+        'создают анализы и опрашивают их до завершения (или ждут уведомления вебхука, --notify webhook). Claude заменяется локальной имитацией '
+        'с заданным распределением задержки, ошибками и лимитами; сервер приложения запускается '
+        'с заданной конфигурацией воркеров (или используется уже запущенный, --url).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='Адрес уже запущенного сервиса (имитацию Claude он должен настроить сам)')
+        parser.add_argument('--server', choices=list(SERVERS), default='gunicorn')
+        parser.add_argument('--workers', type=int, default=2, help='Процессов сервера приложения')
+        parser.add_argument('--threads', type=int, default=1, help='Потоков на воркер gunicorn')
+        parser.add_argument('--mode', choices=list(ENDPOINTS), default='sync', help='Режим выполнения анализов')
+        parser.add_argument('--users', type=int, default=20, help='Одновременных пользователей')
+        parser.add_argument('--analyses', type=int, default=200, help='Всего анализов')
+        parser.add_argument('--documents', type=int, default=2, help='Документов на анализ')
+        parser.add_argument('--document-kb', type=int, default=20, help='Размер документа, КБ')
+        parser.add_argument('--poll-interval', type=float, default=0.5, help='Пауза между опросами статуса, с')
+        parser.add_argument(
+            '--notify', choices=['poll', 'webhook'], default='poll',
+            help='Как узнавать о завершении: опрашивать статус или ждать уведомления вебхука и запросить анализ один раз'
+        )
+        parser.add_argument('--timeout', type=float, default=600, help='Предельное время одного анализа, с')
+        parser.add_argument('--latency', default='lognormal:2,0.6', help='Распределение задержки Claude (см. fake_claude)')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов Claude с ошибкой 500')
+        parser.add_argument('--overload-rate', type=float, default=0.0, help='Доля ответов Claude с ошибкой 529')
+        parser.add_argument('--rpm', type=int, default=0, help='Лимит имитации, запросов в минуту на модель')
+        parser.add_argument('--itpm', type=int, default=0, help='Лимит имитации, входных токенов в минуту')
+        parser.add_argument('--client-rate-limit', action='store_true', help='Включить RATE_LIMIT_ENABLED в сервисе')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        try:
+            LatencyDistribution.parse(options['latency'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        fake = None
+        state = None
+        receiver = None
+        processes = []
+        tmp = tempfile.TemporaryDirectory()
+        try:
+            if options['url']:
+                base_url = options['url'].rstrip('/')
+            else:
+                state = FakeClaudeState(
+                    latency=options['latency'],
+                    error_rate=options['error_rate'],
+                    overload_rate=options['overload_rate'],
+                    rate_limits={'rpm': options['rpm'], 'itpm': options['itpm']},
+                    batch_delay=1.0,
+                    seed=options['seed'],
+                )
+                fake = make_server(port=0, state=state)
+                threading.Thread(target=fake.serve_forever, daemon=True).start()
+                base_url, processes = self._start_stack(fake, tmp.name, options)
+
+            if options['notify'] == 'webhook':
+                receiver = make_receiver(port=0, state=WebhookReceiverState())
+                threading.Thread(target=receiver.serve_forever, daemon=True).start()
+
+            started = time.perf_counter()
+            stats = asyncio.run(self._load(base_url, receiver, options))
+            elapsed = time.perf_counter() - started
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+            for server in (fake, receiver):
+                if server:
+                    server.shutdown()
+                    server.server_close()
+            tmp.cleanup()
+
+        self._report(stats, elapsed, state, receiver, options)
+
+    def _start_stack(self, fake, tmp, options):
+        env = dict(
+            os.environ,
+            USE_FAKE_CLAUDE='True',
+            FAKE_CLAUDE_URL=f'http://127.0.0.1:{fake.server_address[1]}',
+            SQLITE_PATH=os.path.join(tmp, 'load.sqlite3'),
+            MEDIA_ROOT=os.path.join(tmp, 'media'),
+            RATE_LIMIT_ENABLED=str(options['client_rate_limit']),
+            RATE_LIMIT_DB_PATH=os.path.join(tmp, 'ratelimit.sqlite3'),
+            ALLOWED_HOSTS='127.0.0.1',
+            DEBUG='False',
+            LOG_DEBUG_SAMPLE_RATE='0',
+            # Получатель вебхуков слушает 127.0.0.1
+            WEBHOOK_ALLOW_PRIVATE_URLS='True',
+        )
+        manage = os.path.join(settings.BASE_DIR, 'manage.py')
+        subprocess.run([sys.executable, manage, 'migrate', '-v', '0'], env=env, check=True)
+
+        port = free_port()
+        command = SERVERS[options['server']](port, options)
+        processes = []
+        try:
+            processes.append(subprocess.Popen(command, env=env, cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL))
+        except FileNotFoundError:
+            raise CommandError(f'{command[0]} не установлен')
+        if options['mode'] == 'message_batch':
+            processes.append(subprocess.Popen(
+                [sys.executable, manage, 'process_message_batches', '--interval', '1'],
+                env=env, stdout=subprocess.DEVNULL
+            ))
+        if options['notify'] == 'webhook':
+            processes.append(subprocess.Popen(
+                [sys.executable, manage, 'dispatch_webhooks', '--interval', '0.2'],
+                env=env, stdout=subprocess.DEVNULL
+            ))
+        return f'http://127.0.0.1:{port}', processes
+
+    async def _load(self, base_url, receiver, options):
+        limits = httpx.Limits(max_connections=options['users'], max_keepalive_connections=options['users'])
+        async with httpx.AsyncClient(base_url=base_url, timeout=options['timeout'], limits=limits) as client:
+            for _ in range(150):
+                try:
+                    await client.get('/api/')
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.2)
+            else:
+                raise CommandError(f'Сервер {base_url} не запустился')
+
+            stats = {
+                'upload': [], 'create': [], 'end_to_end': [], 'statuses': {}, 'http_errors': 0, 'timeouts': 0,
+                'status_requests': 0,
+            }
+            waiters = None
+            if receiver:
+                waiters = self._subscribe(receiver)
+                host, port = receiver.server_address[:2]
+                response = await client.post('/api/webhooks/', json={'url': f'http://{host}:{port}/'})
+                response.raise_for_status()
+                receiver.state.secret = response.json()['secret']
+                # Вебхук указывается при создании каждого анализа (all_analyses — только для сотрудников)
+                options = dict(options, webhook=response.json()['id'])
+            content = ('Выручка за квартал выросла на 12%, расходы снизились на 3%. ' * 20).encode('utf-8')
+            content = (content * (options['document_kb'] * 1024 // len(content) + 1))[:options['document_kb'] * 1024]
+            queue = asyncio.Queue()
+            for number in range(options['analyses']):
+                queue.put_nowait(number)
+
+            async def user():
+                while not queue.empty():
+                    number = queue.get_nowait()
+                    try:
+                        await self._scenario(client, number, content, stats, waiters, options)
+                    except httpx.HTTPError:
+                        stats['http_errors'] += 1
+
+            await asyncio.gather(*(user() for _ in range(options['users'])))
+            return stats
+
+    @staticmethod
+    def _subscribe(receiver):
+        """Связывает события получателя с ожидающими пользователями; возвращает функцию ожидания."""
+        loop = asyncio.get_running_loop()
+        futures = {}
+
+        def future(analysis_id):
+            if analysis_id not in futures:
+                futures[analysis_id] = loop.create_future()
+            return futures[analysis_id]
+
+        def notified(event):
+            waiter = future(event['analysis']['id'])
+            if not waiter.done():
+                waiter.set_result(event)
+
+        # Получатель вызывает on_event из своего потока; futures меняются только в цикле событий
+        receiver.state.on_event = lambda event: loop.call_soon_threadsafe(notified, event)
+        return future
+
+    async def _scenario(self, client, number, content, stats, waiters, options):
+        """Один анализ: загрузка документов, создание анализа и опрос до конечного статуса."""
+        started = time.perf_counter()
+        document_ids = []
+        for index in range(options['documents']):
+            response = await client.post('/api/documents/', files={
+                'file': (f'report-{number}-{index}.txt', content, 'text/plain'),
+            })
+            response.raise_for_status()
+            document_ids.append(response.json()['id'])
+        uploaded = time.perf_counter()
+        stats['upload'].append(uploaded - started)
+
+        payload = {'document_ids': document_ids, 'custom_prompt': f'Назови ключевые показатели ({number})'}
+        if options['mode'] == 'message_batch':
+            payload['execution_mode'] = 'message_batch'
+        if options.get('webhook'):
+            payload['webhook'] = options['webhook']
+        response = await client.post(ENDPOINTS[options['mode']], json=payload)
+        response.raise_for_status()
+        analysis = response.json()
+        stats['create'].append(time.perf_counter() - uploaded)
+
+        deadline = started + options['timeout']
+        if waiters and analysis['status'] not in TERMINAL_STATUSES:
+            try:
+                await asyncio.wait_for(waiters(str(analysis['id'])), deadline - time.perf_counter())
+            except asyncio.TimeoutError:
+                stats['timeouts'] += 1
+                return
+            stats['status_requests'] += 1
+            response = await client.get(f"/api/analyses/{analysis['id']}/")
+            response.raise_for_status()
+            analysis = response.json()
+        while analysis['status'] not in TERMINAL_STATUSES:
+            if time.perf_counter() > deadline:
+                stats['timeouts'] += 1
+                return
+            await asyncio.sleep(options['poll_interval'])
+            stats['status_requests'] += 1
+            response = await client.get(f"/api/analyses/{analysis['id']}/")
+            response.raise_for_status()
+            analysis = response.json()
+
+        stats['end_to_end'].append(time.perf_counter() - started)
+        stats['statuses'][analysis['status']] = stats['statuses'].get(analysis['status'], 0) + 1
+
+    def _report(self, stats, elapsed, state, receiver, options):
+        completed = stats['statuses'].get('completed', 0)
+        if options['url']:
+            configuration = options['url']
+        else:
+            configuration = f"{options['server']} ×{options['workers']}"
+            if options['server'] == 'gunicorn':
+                configuration += f" (потоков {options['threads']})"
+        self.stdout.write(
+            f"{configuration}, режим {options['mode']}, пользователей {options['users']}, "
+            f"задержка Claude {options['latency']}, завершение: {options['notify']}"
+        )
+        self.stdout.write(
+            f"  анализов {options['analyses']} за {elapsed:.1f} с: завершено {completed} "
+            f"({completed / elapsed:.2f}/с), статусы {stats['statuses']}, "
+            f"HTTP-ошибок {stats['http_errors']}, превышено время {stats['timeouts']}"
+        )
+        self.stdout.write(f"  загрузка документов: {format_percentiles(stats['upload'])}")
+        self.stdout.write(f"  создание анализа:    {format_percentiles(stats['create'])}")
+        self.stdout.write(f"  до результата:       {format_percentiles(stats['end_to_end'])}")
+        self.stdout.write(
+            f"  запросов статуса: {stats['status_requests']} "
+            f"({stats['status_requests'] / max(options['analyses'], 1):.1f} на анализ)"
+        )
+        if receiver:
+            self.stdout.write(
+                f"  вебхуки: запросов {receiver.state.stats['requests']}, событий {receiver.state.stats['events']}, "
+                f"повторов {receiver.state.stats['duplicates']}, неверных подписей {receiver.state.stats['bad_signature']}"
+            )
+        if state:
+            self.stdout.write(
+                f"  имитация Claude: запросов {state.stats['requests']}, 429 — {state.stats['rate_limited']}, "
+                f"500 — {state.stats['errors']}, 529 — {state.stats['overloaded']}, "
+                f"одновременно до {state.stats['peak_in_flight']}"
+            )
@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from agent.accounting import percentile
+
+# Строки, которые раньше печатал print() при анализе одного документа
+PRINT_LINES = (
+    "Используется модель: claude-3-sonnet-20240229",
+    "Обработка документа: Отчет за квартал (тип: application/pdf)",
+    "Расширение файла: .pdf, определенный тип: application/pdf",
+    "Успешно извлечен текст из Отчет за квартал. Размер: 48213 символов",
+    "Маршрут 'default' (16071 токенов): модель claude-3-sonnet-20240229",
+    "Отправка запроса к Claude API с моделью claude-3-sonnet-20240229...",
+    "Ответ успешно получен!",
+)
+
+
+def _print_request(number):
+    for line in PRINT_LINES:
+        print(line)
+
+
+def _logging_request(number):
+    # Те же события через логгеры агента, как в services.run_analysis
+    from agent import log
+    services = log.get_logger('agent.services')
+    model = 'claude-3-sonnet-20240229'
+    with log.bind(f'analysis-{number}'):
+        services.debug("Модель по умолчанию: %s", model)
+        services.debug(
+            "Документ %s (%s): %d символов%s", 'Отчет за квартал', 'application/pdf', 48213, '',
+            extra={'document_id': 'a1b2', 'file_type': 'application/pdf', 'chars': 48213, 'cached': False}
+        )
+        services.info(
+            "Маршрут %s (%d токенов): модель %s", 'default', 16071, model,
+            extra={'rule': 'default', 'prompt_tokens': 16071, 'model': model}
+        )
+        services.debug("Отправка запроса к Claude API с моделью %s", model, extra={'model': model})
+        services.debug("Ответ модели %s получен", model, extra={'model': model})
+        services.info("Анализ %s выполнен", number, extra={'analysis_id': str(number), 'model': model})
+
+
+WORKLOADS = {'print': _print_request, 'logging': _logging_request}
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает журналирование через print() и через agent.log (очередь и фоновый поток): '
+        'потоки-«запросы» пишут строки одного анализа, вывод читает родительский процесс, '
+        'при необходимости с ограниченной скоростью, как медленный сборщик логов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Потоков, пишущих в журнал')
+        parser.add_argument('--requests', type=int, default=5000, help='Анализов на поток')
+        parser.add_argument('--reader-rate', type=int, default=0, help='Скорость чтения вывода, байт/с (0 — без ограничения)')
+        parser.add_argument('--sample-rate', type=float, default=0.01, help='LOG_DEBUG_SAMPLE_RATE для режима logging')
+        parser.add_argument('--child', choices=list(WORKLOADS), help='Внутренний режим: выполнить нагрузку')
+
+    def handle(self, *args, **options):
+        if options['child']:
+            self._child(options)
+            return
+        for mode in WORKLOADS:
+            stats, output_bytes = self._run(mode, options)
+            self.stdout.write(
+                f"{mode:<8} {stats['requests']} анализов за {stats['elapsed']:.2f} с "
+                f"({stats['requests'] / stats['elapsed']:.0f}/с), время записи на анализ "
+                f"p50 {stats['p50_us']:.0f} мкс, p99 {stats['p99_us']:.0f} мкс, max {stats['max_us'] / 1000:.1f} мс; "
+                f"вывод {output_bytes / 1024:.0f} КБ"
+            )
+
+    def _run(self, mode, options):
+        # Без буферизации stdout, как при PYTHONUNBUFFERED=1 в контейнере: иначе строки print()
+        # доходят до docker logs блоками по 8 КБ; StreamHandler и так сбрасывает буфер после записи
+        env = dict(
+            os.environ, PYTHONUNBUFFERED='1', LOG_DEBUG_SAMPLE_RATE=str(options['sample_rate']), LOG_FORMAT='json'
+        )
+        command = [
+            sys.executable, 'manage.py', 'log_benchmark', '--child', mode,
+            '--threads', str(options['threads']), '--requests', str(options['requests']),
+        ]
+        process = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output_bytes = 0
+        chunk_size = 4096
+        while True:
+            chunk = process.stdout.read1(chunk_size)
+            if not chunk:
+                break
+            output_bytes += len(chunk)
+            if options['reader_rate']:
+                time.sleep(len(chunk) / options['reader_rate'])
+        stderr = process.stderr.read().decode()
+        if process.wait():
+            raise CommandError(f'Замер {mode} завершился ошибкой:\n{stderr}')
+        # Результат замера — последняя строка stderr
+        return json.loads(stderr.strip().splitlines()[-1]), output_bytes
+
+    def _child(self, options):
+        workload = WORKLOADS[options['child']]
+        durations = []
+        lock = threading.Lock()
+
+        def worker(offset):
+            local = []
+            for number in range(offset, offset + options['requests']):
+                started = time.perf_counter()
+                workload(number)
+                local.append(time.perf_counter() - started)
+            with lock:
+                durations.extend(local)
+
+        started = time.perf_counter()
+        threads = [
+            threading.Thread(target=worker, args=(index * options['requests'],))
+            for index in range(options['threads'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        # Дожидаемся вывода очереди, чтобы чтение в родителе завершилось вместе с процессом
+        logging.shutdown()
+
+        sys.stderr.write(json.dumps({
+            'requests': len(durations),
+            'elapsed': elapsed,
+            'p50_us': percentile(durations, 0.5) * 1e6,
+            'p99_us': percentile(durations, 0.99) * 1e6,
+            'max_us': max(durations) * 1e6,
+        }) + '\n')
@@ -0,0 +1,96 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+
+from agent import metrics
+from agent.models import Analysis
+from agent.services import FileProcessor
+
+USAGE = SimpleNamespace(input_tokens=1200, output_tokens=300, cache_read_input_tokens=0, cache_creation_input_tokens=None)
+
+# Обновления метрик за один анализ одного документа без повторов
+CALLS = {
+    'observe_extraction_cache': lambda: metrics.observe_extraction_cache(hit=False),
+    'observe_extraction': lambda: metrics.observe_extraction('text/plain', 0.004),
+    'observe_claude_request': lambda: metrics.observe_claude_request('claude-3-5-haiku-20241022', 1.8),
+    'observe_claude_usage': lambda: metrics.observe_claude_usage('claude-3-5-haiku-20241022', USAGE),
+    'observe_attempts': lambda: metrics.observe_attempts(1),
+    'observe_status': lambda: metrics.observe_status('completed'),
+}
+
+
+def _per_call_ns(func, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations * 1e9
+
+
+class Command(BaseCommand):
+    help = (
+        'Микробенчмарк накладных расходов метрик Prometheus: время одного обновления '
+        'метрики в однопроцессном и многопроцессном (PROMETHEUS_MULTIPROC_DIR) режимах '
+        'в сравнении с самыми быстрыми операциями конвейера: извлечением текста из небольшого TXT '
+        'и сменой статуса анализа в базе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200000, help='Повторов каждого обновления')
+        parser.add_argument('--single-mode', action='store_true', help='Замерить только текущий режим')
+
+    def handle(self, *args, **options):
+        if options['single_mode']:
+            self._measure(options['iterations'])
+            return
+
+        env = {key: value for key, value in os.environ.items() if key != 'PROMETHEUS_MULTIPROC_DIR'}
+        self.stdout.write('Один процесс:')
+        self._run_child(env, options)
+        with tempfile.TemporaryDirectory() as directory:
+            self.stdout.write('Несколько процессов (PROMETHEUS_MULTIPROC_DIR):')
+            self._run_child(dict(env, PROMETHEUS_MULTIPROC_DIR=directory), options)
+
+    def _run_child(self, env, options):
+        # Режим prometheus_client выбирается при импорте, поэтому каждый замер — отдельный процесс
+        command = [sys.executable, 'manage.py', 'metrics_benchmark', '--single-mode', '--iterations', str(options['iterations'])]
+        self.stdout.write(subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout)
+
+    def _measure(self, iterations):
+        # Стоимость самого цикла и вызова lambda вычитается из замеров
+        loop_ns = _per_call_ns(lambda: None, iterations)
+        total_ns = 0
+        for name, func in CALLS.items():
+            func()  # создание дочерней метрики с метками не входит в замер
+            per_call = _per_call_ns(func, iterations) - loop_ns
+            total_ns += per_call
+            self.stdout.write(f'  {name:<26} {per_call:>8.0f} нс')
+
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as handle:
+            handle.write('Выручка за квартал выросла на 12%.\n' * 100)
+            path = handle.name
+        try:
+            extraction_ns = _per_call_ns(lambda: FileProcessor.extract_text_from_file(path), 2000)
+        finally:
+            os.unlink(path)
+
+        analysis = Analysis.objects.create(status='pending')
+        try:
+            update_ns = _per_call_ns(lambda: analysis.set_status('processing'), 200)
+        finally:
+            analysis.delete()
+
+        started = time.perf_counter()
+        body, _ = metrics.render_metrics()
+        scrape_ms = (time.perf_counter() - started) * 1000
+
+        self.stdout.write(
+            f'  все обновления за анализ: {total_ns / 1000:.1f} мкс; для сравнения извлечение TXT 3,5 КБ '
+            f'{extraction_ns / 1000:.1f} мкс, одна смена статуса в базе {update_ns / 1000:.0f} мкс '
+            f'(анализ делает не меньше двух), ответ Claude — секунды'
+        )
+        self.stdout.write(f'  /metrics: {scrape_ms:.1f} мс, {len(body)} байт')
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from agent import batches
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет пакеты анализов (POST /api/batches/ в режиме sync) и завершает анализы, '
+        'брошенные упавшим процессом. По умолчанию работает непрерывно.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Выполнить один цикл и выйти')
+        parser.add_argument('--interval', type=float, default=2.0, help='Пауза между циклами, с')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = batches.run_pending()
+            if processed:
+                self.stdout.write(self.style.SUCCESS(f'Обработано пакетов: {processed}'))
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from agent import message_batches
+from agent.services import ClaudeService
+
+
+class Command(BaseCommand):
+    help = (
+        'Отправляет анализы в режиме message_batch через Message Batches API '
+        'и записывает результаты завершенных пакетов. По умолчанию работает непрерывно.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Выполнить один цикл отправки и опроса и выйти')
+        parser.add_argument('--wait', action='store_true', help='С --once: дождаться завершения всех отправленных пакетов')
+        parser.add_argument('--interval', type=float, default=60.0, help='Пауза между циклами, с')
+
+    def handle(self, *args, **options):
+        claude_service = ClaudeService()
+        while True:
+            job = message_batches.submit_pending(claude_service)
+            if job:
+                self.stdout.write(f'Отправлен пакет {job.batch_id}: {job.request_count} запросов')
+            finished = message_batches.poll_jobs(claude_service)
+            if finished:
+                self.stdout.write(self.style.SUCCESS(f'Завершено пакетов: {finished}'))
+
+            if options['once']:
+                pending = message_batches.MessageBatchJob.objects.exclude(processing_status='ended').exists()
+                if not (options['wait'] and pending):
+                    break
+            time.sleep(options['interval'])
@@ -0,0 +1,109 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+import anthropic
+from django.core.management.base import BaseCommand
+
+from agent.fake_claude import FakeClaudeState, make_server
+from agent.ratelimit import RateLimiter, RateLimitTimeout, estimate_tokens
+
+MODEL = 'claude-3-7-sonnet-20250219'
+
+
+def _worker(url, limiter_args, requests, prompt_chars, max_tokens, results):
+    """Процесс-воркер: отправляет запросы к имитации, как воркер gunicorn."""
+    client = anthropic.Anthropic(api_key='fake', base_url=url, max_retries=0)
+    limiter = RateLimiter(**limiter_args) if limiter_args else None
+    prompt = 'x' * prompt_chars
+    counts = {'ok': 0, 'rate_limited': 0, 'timeouts': 0, 'errors': 0, 'waited': 0.0}
+    for _ in range(requests):
+        reservation = None
+        try:
+            if limiter:
+                reservation = limiter.acquire(MODEL, estimate_tokens(prompt), max_tokens)
+                counts['waited'] += reservation['waited']
+            response = client.messages.create(
+                model=MODEL, max_tokens=max_tokens, messages=[{'role': 'user', 'content': prompt}]
+            )
+            counts['ok'] += 1
+            if reservation:
+                limiter.settle(reservation, response.usage.input_tokens, response.usage.output_tokens)
+        except RateLimitTimeout:
+            counts['timeouts'] += 1
+        except anthropic.RateLimitError:
+            counts['rate_limited'] += 1
+            if reservation:
+                limiter.settle(reservation, output_tokens=0)
+        except anthropic.APIError:
+            counts['errors'] += 1
+    results.put(counts)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает поток запросов нескольких процессов к имитации API Claude с '
+        'лимитами без ограничителя и с межпроцессным ограничителем частоты.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Количество процессов')
+        parser.add_argument('--requests', type=int, default=40, help='Запросов на процесс')
+        parser.add_argument('--rpm', type=int, default=60, help='Лимит запросов за период')
+        parser.add_argument('--itpm', type=int, default=60000, help='Лимит входных токенов за период')
+        parser.add_argument('--otpm', type=int, default=0, help='Лимит выходных токенов за период')
+        parser.add_argument('--window', type=float, default=2.0, help='Период лимитов, с (в API — 60)')
+        parser.add_argument('--prompt-chars', type=int, default=2000, help='Длина запроса в символах')
+        parser.add_argument('--max-tokens', type=int, default=100)
+        parser.add_argument('--max-wait', type=float, default=30.0, help='Предел ожидания лимита, с')
+
+    def handle(self, *args, **options):
+        limits = {'rpm': options['rpm'], 'itpm': options['itpm'], 'otpm': options['otpm']}
+        for label, limited in (('без ограничителя', False), ('с ограничителем', True)):
+            state = FakeClaudeState(rate_limits=limits, rate_window=options['window'])
+            server = make_server(port=0, state=state)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            host, port = server.server_address[:2]
+            with tempfile.TemporaryDirectory() as tmp:
+                limiter_args = None
+                if limited:
+                    # Чуть ниже лимита сервера: оценка токенов клиента и сервера расходится
+                    limiter_args = {
+                        'path': os.path.join(tmp, 'ratelimit.sqlite3'),
+                        'limits': {MODEL: {key: int(value * 0.9) for key, value in limits.items()}},
+                        'period': options['window'],
+                        'max_wait': options['max_wait'],
+                    }
+                self._run(label, f'http://{host}:{port}', limiter_args, options)
+            server.shutdown()
+            server.server_close()
+
+    def _run(self, label, url, limiter_args, options):
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        processes = [
+            context.Process(target=_worker, args=(
+                url, limiter_args, options['requests'], options['prompt_chars'], options['max_tokens'], results
+            ))
+            for _ in range(options['workers'])
+        ]
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+        totals = {'ok': 0, 'rate_limited': 0, 'timeouts': 0, 'errors': 0, 'waited': 0.0}
+        for _ in processes:
+            for key, value in results.get().items():
+                totals[key] += value
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+
+        total = options['workers'] * options['requests']
+        self.stdout.write(
+            f"{label}: {total} запросов за {elapsed:.1f} с, успешно {totals['ok']} "
+            f"({totals['ok'] / elapsed:.1f}/с), 429: {totals['rate_limited']} "
+            f"({totals['rate_limited'] / total:.0%}), таймаутов ожидания: {totals['timeouts']}, "
+            f"прочих ошибок: {totals['errors']}, суммарное ожидание лимита {totals['waited']:.1f} с"
+        )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from agent import search
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый поисковый индекс документов и анализов.'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('Полнотекстовый поиск доступен только для SQLite')
+        documents, analyses = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано документов: {documents}, анализов: {analyses}'
+        ))
@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from agent.accounting import percentile
+from agent.models import ModelRouteDecision
+
+
+class Command(BaseCommand):
+    help = (
+        'Сводка журнала маршрутизатора моделей: по каждому правилу и ответившей '
+        'модели — количество запросов, доля успешных, p50/p95 задержки и средний размер запроса.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24, help='За какой период строить сводку')
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(hours=options['hours'])
+        rows = ModelRouteDecision.objects.filter(created_at__gte=since).values_list(
+            'rule', 'model_used', 'success', 'latency_ms', 'prompt_tokens', 'chosen_model'
+        )
+        groups = {}
+        for rule, model_used, success, latency_ms, prompt_tokens, chosen_model in rows.iterator():
+            group = groups.setdefault((rule, model_used or '—'), {
+                'latencies': [], 'success': 0, 'tokens': 0, 'fallback': 0,
+            })
+            group['latencies'].append(latency_ms)
+            group['success'] += success
+            group['tokens'] += prompt_tokens
+            group['fallback'] += model_used != chosen_model
+
+        if not groups:
+            self.stdout.write('Решений маршрутизатора за период нет')
+            return
+        self.stdout.write(
+            f"{'правило':<20} {'модель':<32} {'запросов':>8} {'успешно':>8} "
+            f"{'резерв':>7} {'p50, мс':>8} {'p95, мс':>8} {'токенов':>8}"
+        )
+        for (rule, model), group in sorted(groups.items()):
+            count = len(group['latencies'])
+            self.stdout.write(
+                f"{rule:<20} {model:<32} {count:>8} {group['success'] / count:>8.0%} "
+                f"{group['fallback']:>7} {percentile(group['latencies'], 0.5):>8} "
+                f"{percentile(group['latencies'], 0.95):>8} {group['tokens'] // count:>8}"
+            )
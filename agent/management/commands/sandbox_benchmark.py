@@ -0,0 +1,53 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from agent.sandbox import ExtractionPool
+from agent.services import FileProcessor
+
+
+class Command(BaseCommand):
+    help = (
+        'Пропускная способность извлечения текста в пуле процессов (agent.sandbox) при разном '
+        'числе процессов в сравнении с извлечением в потоках текущего процесса.'
+    )
+
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1], help='Размеры пула')
+        parser.add_argument('--files', type=int, default=64, help='Файлов на замер')
+        parser.add_argument('--rows', type=int, default=20000, help='Строк в CSV-файле')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'report.csv')
+            with open(path, 'w', encoding='utf-8') as f:
+                for row in range(options['rows']):
+                    f.write(f'{row},Филиал {row % 40},{row * 17 % 1000}.50,выручка за квартал\n')
+            files = [path] * options['files']
+
+            for size in sorted(set(options['sizes'])):
+                with ThreadPoolExecutor(max_workers=size) as executor:
+                    started = time.perf_counter()
+                    list(executor.map(FileProcessor.extract_text_from_file, files))
+                    threads = time.perf_counter() - started
+
+                pool = ExtractionPool(size=size, timeout=120, cpu_limit=60, memory_limit_mb=1024, max_jobs=1000)
+                try:
+                    # Прогрев: процессы пула запускаются и выполняют django.setup()
+                    with ThreadPoolExecutor(max_workers=size) as executor:
+                        list(executor.map(pool.extract, [path] * size))
+                        started = time.perf_counter()
+                        list(executor.map(pool.extract, files))
+                        processes = time.perf_counter() - started
+                finally:
+                    pool.close()
+
+                self.stdout.write(
+                    f'{size:3d} пот./проц.: потоки {len(files) / threads:6.1f} файлов/с, '
+                    f'пул процессов {len(files) / processes:6.1f} файлов/с'
+                )
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from agent.benchmarking import SERVERS, format_percentiles, free_port
+from agent.fake_claude import FakeClaudeState, make_server
+
+# Как сервер выполняет анализы: fifo — без планировщика, по одному анализу на
+# синхронный воркер (кто первым занял воркер, тот и выполняется); scheduler —
+# потоков с запасом, а одновременно выполняется ANALYSIS_CONCURRENCY анализов
+MODES = ('fifo', 'scheduler')
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает выполнение анализов без планировщика (fifo) и с ним (scheduler) при одинаковом '
+        'числе одновременных анализов: "тяжелый" клиент отправляет массовые анализы (bulk), затем '
+        'второй клиент — обычные (normal) через API, а пользователь — интерактивные через '
+        'веб-интерфейс. В отчете — время до результата по классам. Работает на временной базе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=MODES + ('both',), default='both')
+        parser.add_argument('--concurrency', type=int, default=4, help='Одновременных анализов (воркеров в режиме fifo)')
+        parser.add_argument('--bulk', type=int, default=40, help='Массовых анализов тяжелого клиента')
+        parser.add_argument('--normal', type=int, default=4, help='Обычных анализов второго клиента')
+        parser.add_argument('--interactive', type=int, default=2, help='Анализов из веб-интерфейса')
+        parser.add_argument('--latency', type=float, default=1.0, help='Время ответа имитации Claude, с')
+        parser.add_argument('--delay', type=float, default=0.5, help='Через сколько секунд после массовых приходят остальные')
+        parser.add_argument('--aging', type=float, default=60.0, help='SCHEDULER_AGING, с')
+
+    def handle(self, *args, **options):
+        modes = MODES if options['mode'] == 'both' else (options['mode'],)
+        state = FakeClaudeState(latency=str(options['latency']))
+        fake = make_server(port=0, state=state)
+        threading.Thread(target=fake.serve_forever, daemon=True).start()
+        try:
+            for mode in modes:
+                with tempfile.TemporaryDirectory() as tmp:
+                    process = None
+                    try:
+                        base_url, process = self._start_server(mode, fake, tmp, options)
+                        report = asyncio.run(self._measure(base_url, options))
+                    finally:
+                        if process:
+                            process.terminate()
+                            process.wait()
+                self._report(mode, report, options)
+        finally:
+            fake.shutdown()
+            fake.server_close()
+
+    def _start_server(self, mode, fake, tmp, options):
+        total = options['bulk'] + options['normal'] + options['interactive']
+        if mode == 'fifo':
+            server = {'workers': options['concurrency'], 'threads': 1}
+            concurrency = 0
+        else:
+            # Ожидающий запрос занимает поток, а воркер gthread может принять больше
+            # соединений, чем половину: потоков хватает на все запросы в каждом воркере
+            server = {'workers': 2, 'threads': total + 4}
+            concurrency = options['concurrency']
+        env = dict(
+            os.environ,
+            USE_FAKE_CLAUDE='True',
+            FAKE_CLAUDE_URL=f'http://127.0.0.1:{fake.server_address[1]}',
+            SQLITE_PATH=os.path.join(tmp, 'scheduler.sqlite3'),
+            MEDIA_ROOT=os.path.join(tmp, 'media'),
+            RATE_LIMIT_ENABLED='False',
+            ANALYSIS_CONCURRENCY=str(concurrency),
+            SCHEDULER_AGING=str(options['aging']),
+            ALLOWED_HOSTS='127.0.0.1',
+            DEBUG='False',
+            LOG_DEBUG_SAMPLE_RATE='0',
+        )
+        manage = os.path.join(settings.BASE_DIR, 'manage.py')
+        subprocess.run([sys.executable, manage, 'migrate', '-v', '0'], env=env, check=True)
+        port = free_port()
+        command = SERVERS['gunicorn'](port, server)
+        try:
+            process = subprocess.Popen(command, env=env, cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL)
+        except FileNotFoundError:
+            raise CommandError(f'{command[0]} не установлен')
+        return f'http://127.0.0.1:{port}', process
+
+    async def _measure(self, base_url, options):
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(base_url=base_url, timeout=600, limits=limits) as client:
+            for _ in range(150):
+                try:
+                    await client.get('/api/')
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.2)
+            else:
+                raise CommandError(f'Сервер {base_url} не запустился')
+
+            response = await client.post('/api/documents/', files={
+                'file': ('report.txt', 'Выручка за квартал выросла на 12%.'.encode('utf-8'), 'text/plain'),
+            })
+            response.raise_for_status()
+            document_id = response.json()['id']
+            # Веб-форма требует CSRF-токен из cookie
+            response = await client.get('/analyses/create/')
+            response.raise_for_status()
+            csrf_token = client.cookies['csrftoken']
+
+            async def api(priority, client_id, number):
+                started = time.perf_counter()
+                response = await client.post('/api/analyses/', headers={'X-Client-ID': client_id}, json={
+                    'document_ids': [document_id], 'custom_prompt': f'{priority} {number}', 'priority': priority,
+                })
+                response.raise_for_status()
+                return priority, time.perf_counter() - started
+
+            async def web(number):
+                started = time.perf_counter()
+                response = await client.post('/analyses/create/', data={
+                    'csrfmiddlewaretoken': csrf_token, 'documents': document_id, 'custom_prompt': f'web {number}',
+                }, headers={'Referer': base_url})
+                if response.status_code != 302:
+                    raise CommandError(f'Веб-форма вернула {response.status_code}')
+                return 'interactive', time.perf_counter() - started
+
+            tasks = [asyncio.create_task(api('bulk', 'heavy', number)) for number in range(options['bulk'])]
+            await asyncio.sleep(options['delay'])
+            tasks += [asyncio.create_task(api('normal', 'light', number)) for number in range(options['normal'])]
+            tasks += [asyncio.create_task(web(number)) for number in range(options['interactive'])]
+            results = await asyncio.gather(*tasks)
+
+            # Ожидание в очереди планировщика — по полям анализа (в режиме fifo анализ
+            # ждет свободного воркера еще до создания, и эта разница около нуля)
+            waits = {'interactive': [], 'normal': [], 'bulk': []}
+            url = '/api/analyses/'
+            while url:
+                response = await client.get(url)
+                response.raise_for_status()
+                page = response.json()
+                for analysis in page['results']:
+                    if analysis['started_at']:
+                        waits[analysis['priority']].append(
+                            (datetime.fromisoformat(analysis['started_at'])
+                             - datetime.fromisoformat(analysis['queued_at'])).total_seconds()
+                        )
+                url = page['next']
+
+        report = {priority: {'durations': [], 'waits': waits[priority]} for priority in waits}
+        for priority, duration in results:
+            report[priority]['durations'].append(duration)
+        return report
+
+    def _report(self, mode, report, options):
+        self.stdout.write(
+            f"{mode}: одновременно {options['concurrency']} анализа, ответ Claude {options['latency']:g} с; "
+            f"массовых {options['bulk']}, обычных {options['normal']}, интерактивных {options['interactive']}"
+        )
+        for priority in ('interactive', 'normal', 'bulk'):
+            self.stdout.write(f"  {priority:<12} до результата: {format_percentiles(report[priority]['durations'])}")
+            self.stdout.write(f"  {'':<12} в очереди:      {format_percentiles(report[priority]['waits'])}")
@@ -0,0 +1,84 @@
+import itertools
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from agent import search
+from agent.accounting import percentile
+
+WORDS = (
+    'выручка прибыль расходы доходы квартал отчет баланс актив пассив капитал налог '
+    'договор поставка клиент продукт продажи маржа рентабельность инвестиции кредит '
+    'дебиторская задолженность себестоимость амортизация дивиденды аудит бюджет план '
+    'revenue profit margin forecast contract invoice supplier customer growth risk'
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        'Измеряет скорость полнотекстового поиска на синтетическом корпусе: '
+        'строит индекс FTS5 во временной базе и выполняет серию ранжированных запросов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=100000, help='Размер корпуса')
+        parser.add_argument('--words', type=int, default=150, help='Количество слов в документе')
+        parser.add_argument('--vocabulary', type=int, default=50000, help='Размер словаря редких слов')
+        parser.add_argument('--queries', type=int, default=200, help='Количество поисковых запросов')
+        parser.add_argument('--limit', type=int, default=20, help='Количество результатов на запрос')
+
+    def handle(self, *args, **options):
+        rnd = random.Random(42)
+        # Словарь с распределением Ципфа: несколько частых слов и длинный хвост
+        # редких (номера договоров, названия компаний), как в реальных отчетах
+        vocabulary = WORDS + [f'{rnd.choice(WORDS)[:5]}{n}' for n in range(options['vocabulary'])]
+        cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = sqlite3.connect(os.path.join(tmp, 'search.sqlite3'))
+            for statement in search.SCHEMA_SQL:
+                conn.execute(statement)
+
+            started = time.perf_counter()
+            batch = []
+            for i in range(1, options['documents'] + 1):
+                body = ' '.join(rnd.choices(vocabulary, cum_weights=cum_weights, k=options['words']))
+                batch.append((i, f'Документ {i}', body, ''))
+                if len(batch) == 5000:
+                    self._insert(conn, batch)
+                    batch = []
+            self._insert(conn, batch)
+            conn.commit()
+            indexing = time.perf_counter() - started
+            self.stdout.write(
+                f"Проиндексировано {options['documents']} документов за {indexing:.1f} с "
+                f"({options['documents'] / indexing:.0f} док./с)"
+            )
+
+            sql = search.SEARCH_SQL.format(kind_filter='').replace('%s', '?')
+            timings = []
+            for _ in range(options['queries']):
+                query = ' '.join(rnd.choices(vocabulary, cum_weights=cum_weights, k=rnd.randint(1, 3)))
+                match = search.build_match_query(query)
+                started = time.perf_counter()
+                conn.execute(sql, (match, options['limit'], 0)).fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+            conn.close()
+
+        self.stdout.write(
+            f"Запросов: {len(timings)}, p50: {percentile(timings, 0.5):.1f} мс, "
+            f"p95: {percentile(timings, 0.95):.1f} мс, max: {max(timings):.1f} мс"
+        )
+
+    def _insert(self, conn, rows):
+        conn.executemany(
+            f"INSERT INTO {search.ENTRY_TABLE} (id, kind, object_id) VALUES (?, 'document', ?)",
+            [(row[0], f'{row[0]:032x}') for row in rows]
+        )
+        conn.executemany(
+            f"INSERT INTO {search.INDEX_TABLE} (rowid, title, body, prompt) VALUES (?, ?, ?, ?)",
+            rows
+        )
@@ -0,0 +1,162 @@
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from .compression_benchmark import _markdown
+
+ENCODINGS = ('identity', 'gzip', 'br')
+
+
+def _timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), result
+
+
+class Command(BaseCommand):
+    help = (
+        'Измеряет отдачу ответов и файлов: размер ответов API и HTML без сжатия, с gzip '
+        'и brotli (CompressionMiddleware) и время их формирования, пропускную способность '
+        'скачивания файла документа приложением, запросов Range и ответа X-Accel-Redirect. '
+        'Работает на временной базе и временном MEDIA_ROOT.'
+    )
+
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyses', type=int, default=20, help='Анализов с результатом')
+        parser.add_argument('--result-kb', type=int, default=8, help='Средний размер результата, КБ')
+        parser.add_argument('--file-mb', type=int, default=50, help='Размер скачиваемого файла, МБ')
+        parser.add_argument('--repeat', type=int, default=5, help='Повторов каждого запроса (берется медиана)')
+        parser.add_argument('--child', action='store_true', help='Внутренний режим: замер в уже подготовленной среде')
+
+    def handle(self, *args, **options):
+        if options['child']:
+            self.stdout.write(json.dumps(self._measure(options)))
+            return
+
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                SQLITE_PATH=os.path.join(tmp, 'serving.sqlite3'),
+                MEDIA_ROOT=os.path.join(tmp, 'media'),
+                RATE_LIMIT_DB_PATH=os.path.join(tmp, 'ratelimit.sqlite3'),
+                LOG_DEBUG_SAMPLE_RATE='0',
+                ALLOWED_HOSTS='testserver',
+                MEDIA_SERVE_MODE='django',
+            )
+            manage = os.path.join(settings.BASE_DIR, 'manage.py')
+            subprocess.run([sys.executable, manage, 'migrate', '-v', '0'], env=env, check=True)
+            command = [
+                sys.executable, manage, 'serving_benchmark', '--child',
+                '--analyses', str(options['analyses']), '--result-kb', str(options['result_kb']),
+                '--file-mb', str(options['file_mb']), '--repeat', str(options['repeat']),
+            ]
+            result = subprocess.run(command, env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise CommandError(result.stderr.strip())
+            report = json.loads(result.stdout.strip().splitlines()[-1])
+        self._report(report)
+
+    def _measure(self, options):
+        from django.test import Client, override_settings
+
+        from agent import middleware
+        from agent.models import Analysis
+
+        rnd = random.Random(1)
+        analyses = [
+            Analysis.objects.create(status='completed', result=_markdown(rnd, options['result_kb'] * 1024))
+            for _ in range(options['analyses'])
+        ]
+        client = Client()
+        size = options['file_mb'] * 1024 * 1024
+        upload = io.BytesIO(os.urandom(size))
+        upload.name = 'scan.pdf'
+        response = client.post('/api/documents/', {'file': upload})
+        if response.status_code != 201:
+            raise CommandError(f'Загрузка завершилась с кодом {response.status_code}: {response.content[:200]}')
+        document_id = response.json()['id']
+        repeat = options['repeat']
+
+        pages = {
+            'API: список анализов': '/api/analyses/',
+            'API: анализ': f'/api/analyses/{analyses[0].pk}/',
+            'API: список документов': '/api/documents/',
+            'HTML: анализ': f'/analyses/{analyses[0].pk}/',
+            'HTML: документы': '/documents/',
+        }
+        responses = {}
+        for name, url in pages.items():
+            responses[name] = {}
+            for encoding in ENCODINGS:
+                if encoding == 'br' and middleware.brotli is None:
+                    continue
+                seconds, response = _timed(lambda: client.get(url, HTTP_ACCEPT_ENCODING=encoding), repeat)
+                if response.status_code != 200:
+                    raise CommandError(f'{url}: код {response.status_code}')
+                responses[name][encoding] = {'bytes': len(response.content), 'seconds': seconds}
+
+        url = f'/api/documents/{document_id}/download/'
+
+        def download(**headers):
+            response = client.get(url, **headers)
+            return sum(len(chunk) for chunk in response.streaming_content)
+
+        full_seconds, sent = _timed(download, repeat)
+        if sent != size:
+            raise CommandError(f'Скачано {sent} байт вместо {size}')
+        range_seconds, _ = _timed(
+            lambda: download(HTTP_RANGE=f'bytes={size // 2}-{size // 2 + 1024 * 1024 - 1}'), repeat
+        )
+        with override_settings(MEDIA_SERVE_MODE='x-accel-redirect'):
+            accel_seconds, _ = _timed(lambda: client.get(url), repeat)
+        return {
+            'responses': responses,
+            'file_bytes': size,
+            'full_seconds': full_seconds,
+            'range_seconds': range_seconds,
+            'accel_seconds': accel_seconds,
+        }
+
+    def _report(self, report):
+        self.stdout.write(f"{'ответ':<24} {'без сжатия':>12} {'gzip':>16} {'brotli':>16}")
+        original = compressed = 0
+        for name, variants in report['responses'].items():
+            identity = variants['identity']
+            line = f"{name:<24} {identity['bytes'] / 1024:>7.1f} КБ {identity['seconds'] * 1000:>3.0f}мс"
+            for encoding in ('gzip', 'br'):
+                variant = variants.get(encoding)
+                if variant is None:
+                    line += f"{'нет пакета':>17}"
+                    continue
+                saved = 1 - variant['bytes'] / identity['bytes']
+                line += f" {variant['bytes'] / 1024:>6.1f} КБ {saved:>4.0%} {variant['seconds'] * 1000:>3.0f}мс"
+            self.stdout.write(line)
+            best = variants.get('br') or variants['gzip']
+            original += identity['bytes']
+            compressed += best['bytes']
+        self.stdout.write(f'Сжатие сокращает трафик этих ответов на {1 - compressed / original:.0%}')
+
+        mb = report['file_bytes'] / 1024 / 1024
+        self.stdout.write(f'Скачивание файла {mb:.0f} МБ (тестовый клиент, без сети — занятость воркера):')
+        self.stdout.write(
+            f"  приложением (FileResponse):  {report['full_seconds']:.2f} с, {mb / report['full_seconds']:.0f} МБ/с"
+        )
+        self.stdout.write(f"  диапазон 1 МБ (Range):       {report['range_seconds'] * 1000:.1f} мс")
+        self.stdout.write(
+            f"  X-Accel-Redirect:            {report['accel_seconds'] * 1000:.1f} мс ответа приложения, "
+            '0 байт через воркер (файл отдает nginx)'
+        )
@@ -0,0 +1,148 @@
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from agent.accounting import percentile
+from agent.db import is_lock_error, retry_on_lock
+
+STATUSES = ['pending', 'processing', 'completed', 'failed']
+
+
+def _connect(path, profile):
+    """Открывает соединение так же, как это делает Django для выбранного профиля."""
+    if profile['name'] == 'production':
+        conn = sqlite3.connect(path, timeout=profile['timeout'], isolation_level=None)
+        for pragma in profile['pragmas']:
+            conn.execute(pragma)
+    else:
+        # Настройки Django по умолчанию: timeout 5 секунд, DEFERRED-транзакции
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+    return conn
+
+
+def _worker(path, profile, ops, rows, seed):
+    """
+    Выполняет серию переходов статуса так, как это делает run_analysis:
+    чтение текущего статуса и запись нового внутри одной транзакции.
+    """
+    rnd = random.Random(seed)
+    begin = 'BEGIN IMMEDIATE' if profile['name'] == 'production' else 'BEGIN'
+    persistent = _connect(path, profile) if profile['name'] == 'production' else None
+    latencies = []
+    errors = 0
+
+    def transition(pk, status):
+        conn = persistent or _connect(path, profile)
+        try:
+            conn.execute(begin)
+            try:
+                conn.execute('SELECT status FROM analysis WHERE id = ?', (pk,)).fetchone()
+                conn.execute(
+                    'UPDATE analysis SET status = ?, result = ?, updated_at = ? WHERE id = ?',
+                    (status, 'x' * rnd.randint(100, 2000), time.time(), pk)
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            if conn is not persistent:
+                conn.close()
+
+    if profile['name'] == 'production':
+        transition = retry_on_lock(transition, retries=profile['retries'], delay=profile['retry_delay'])
+
+    for _ in range(ops):
+        started = time.perf_counter()
+        try:
+            transition(rnd.randint(1, rows), rnd.choice(STATUSES))
+            latencies.append(time.perf_counter() - started)
+        except sqlite3.OperationalError as e:
+            if not is_lock_error(e):
+                raise
+            errors += 1
+
+    if persistent is not None:
+        persistent.close()
+    return latencies, errors
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест конкурентной записи статусов анализа в SQLite: '
+        'сравнивает настройки по умолчанию с производственным профилем (WAL, busy timeout, повторы).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Количество параллельных процессов-писателей')
+        parser.add_argument('--ops', type=int, default=200, help='Количество переходов статуса на процесс')
+        parser.add_argument('--rows', type=int, default=50, help='Количество строк анализов в тестовой таблице')
+        parser.add_argument(
+            '--profile', choices=['default', 'production', 'both'], default='both',
+            help='Какой профиль SQLite тестировать'
+        )
+
+    def handle(self, *args, **options):
+        profiles = {
+            'default': {'name': 'default'},
+            'production': {
+                'name': 'production',
+                'timeout': settings.SQLITE_BUSY_TIMEOUT,
+                'pragmas': settings.SQLITE_PRAGMAS,
+                'retries': settings.SQLITE_LOCK_RETRIES,
+                'retry_delay': settings.SQLITE_LOCK_RETRY_DELAY,
+            },
+        }
+        names = ['default', 'production'] if options['profile'] == 'both' else [options['profile']]
+
+        self.stdout.write(
+            f"{'Профиль':<12} {'Операций':>9} {'Ошибок':>7} {'Ошибки, %':>10} "
+            f"{'Опер./с':>9} {'p50, мс':>8} {'p95, мс':>8}"
+        )
+        for name in names:
+            row = self._run_profile(profiles[name], options['workers'], options['ops'], options['rows'])
+            self.stdout.write(
+                f"{name:<12} {row['ops']:>9} {row['errors']:>7} {row['error_rate']:>10.2f} "
+                f"{row['throughput']:>9.1f} {row['p50']:>8.1f} {row['p95']:>8.1f}"
+            )
+
+    def _run_profile(self, profile, workers, ops, rows):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'stress.sqlite3')
+            conn = sqlite3.connect(path)
+            conn.execute(
+                'CREATE TABLE analysis (id INTEGER PRIMARY KEY, status TEXT, result TEXT, updated_at REAL)'
+            )
+            conn.executemany(
+                'INSERT INTO analysis (id, status, result, updated_at) VALUES (?, ?, ?, ?)',
+                [(i, 'pending', '', time.time()) for i in range(1, rows + 1)]
+            )
+            conn.commit()
+            conn.close()
+
+            started = time.perf_counter()
+            with multiprocessing.Pool(workers) as pool:
+                results = pool.starmap(
+                    _worker, [(path, profile, ops, rows, seed) for seed in range(workers)]
+                )
+            elapsed = time.perf_counter() - started
+
+        latencies = [latency for worker_latencies, _ in results for latency in worker_latencies]
+        errors = sum(worker_errors for _, worker_errors in results)
+        total = workers * ops
+        p50, p95 = ((percentile(latencies, fraction) or 0.0) * 1000 for fraction in (0.50, 0.95))
+
+        return {
+            'ops': total,
+            'errors': errors,
+            'error_rate': errors / total * 100 if total else 0.0,
+            'throughput': len(latencies) / elapsed if elapsed else 0.0,
+            'p50': p50,
+            'p95': p95,
+        }
@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from agent.webhook_receiver import WebhookReceiverState, make_receiver
+
+
+class Command(BaseCommand):
+    help = (
+        'Запускает локальный получатель вебхуков: проверяет подпись уведомлений и печатает '
+        'полученные события. Зарегистрируйте его адрес через POST /api/webhooks/.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8766)
+        parser.add_argument('--secret', help='Ключ вебхука (поле secret); без него подпись не проверяется')
+        parser.add_argument('--fail-rate', type=float, default=0.0, help='Доля запросов с ответом 503 (0..1)')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--verbose', action='store_true', help='Печатать журнал запросов')
+
+    def handle(self, *args, **options):
+        state = WebhookReceiverState(
+            secret=options['secret'],
+            fail_rate=options['fail_rate'],
+            seed=options['seed'],
+            on_event=lambda event: self.stdout.write(json.dumps(event, ensure_ascii=False)),
+        )
+        server = make_receiver(options['host'], options['port'], state, verbose=options['verbose'])
+        host, port = server.server_address[:2]
+        self.stdout.write(self.style.SUCCESS(f'Получатель вебхуков запущен: http://{host}:{port}/'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(
+                f"Запросов {state.stats['requests']}, событий {state.stats['events']}, "
+                f"повторов {state.stats['duplicates']}, ответов 503 — {state.stats['rejected']}, "
+                f"неверных подписей {state.stats['bad_signature']}"
+            )
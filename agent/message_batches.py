@@ -0,0 +1,158 @@
+"""
+Выполнение несрочных анализов через Message Batches API Anthropic.
+
+Анализы в режиме 'message_batch' не выполняются при создании, а остаются в
+статусе 'pending'. Команда process_message_batches периодически собирает их
+в пакет, отправляет его одним запросом, опрашивает статус и после завершения
+записывает результаты в соответствующие анализы. Пакетная обработка не
+расходует лимиты синхронных запросов и подходит для ночных массовых задач.
+
+Отмененные анализы и анализы с истекшим deadline в пакет не попадают, а их
+результаты не записываются; пакет, все анализы которого отменены,
+отменяется и на стороне Anthropic.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import cancellation, log
+from .accounting import AnalysisAccounting
+from .models import Analysis, AnalysisBatch, MessageBatchJob
+from .services import ClaudeService
+
+logger = log.get_logger(__name__)
+
+
+def submit_pending(claude_service=None, limit=None):
+    """
+    Отправляет накопленные анализы в режиме 'message_batch' одним пакетом.
+
+    Параметры:
+        claude_service (ClaudeService, optional): Сервис с настроенным клиентом
+        limit (int, optional): Максимум запросов в пакете (MESSAGE_BATCH_MAX_REQUESTS)
+
+    Возвращает:
+        MessageBatchJob | None: Отправленный пакет или None, если очередь пуста
+    """
+    limit = limit or getattr(settings, 'MESSAGE_BATCH_MAX_REQUESTS', 10000)
+    cancellation.expire_overdue()
+    analyses = list(
+        Analysis.objects.filter(execution_mode='message_batch', status='pending', message_batch__isnull=True)
+        .prefetch_related('documents')
+        .order_by('created_at')[:limit]
+    )
+    if not analyses:
+        return None
+
+    claude_service = claude_service or ClaudeService()
+    model = claude_service.default_model
+    requests = []
+    submitted = []
+    for analysis in analyses:
+        documents = analysis.documents.all()
+        if not documents:
+            analysis.set_status('failed', result="No documents provided for analysis")
+            continue
+        accounting = AnalysisAccounting()
+        try:
+            system_message, prompt = claude_service.build_request(documents, analysis.custom_prompt, accounting)
+        except Exception as e:
+            analysis.set_status('failed', result=f"Analysis failed: {str(e)}", **accounting.fields())
+            continue
+        requests.append({
+            'custom_id': analysis.id.hex,
+            'params': claude_service.request_params(model, system_message, prompt),
+        })
+        submitted.append((analysis, accounting))
+    if not requests:
+        return None
+
+    logger.info("Отправка Message Batch: %d запросов, модель %s", len(requests), model, extra={'model': model})
+    response = claude_service.client.messages.batches.create(requests=requests)
+    with transaction.atomic():
+        job = MessageBatchJob.objects.create(
+            batch_id=response.id,
+            model=model,
+            processing_status=response.processing_status,
+            request_count=len(requests),
+        )
+        for analysis, accounting in submitted:
+            # Время подготовки запроса; модель и токены запишутся при получении результатов
+            fields = accounting.fields()
+            fields['attempts'] = 1
+            fields['duration_ms'] = None
+            analysis.set_status('processing', message_batch=job, started_at=timezone.now(), **fields)
+    return job
+
+
+def poll_jobs(claude_service=None):
+    """
+    Проверяет статус незавершенных пакетов и сохраняет результаты завершенных.
+
+    Возвращает:
+        int: Количество пакетов, завершенных за этот вызов
+    """
+    # Пакет мог завершиться еще до первого опроса (processing_status='ended' при
+    # создании), поэтому признак необработанного пакета — пустой ended_at
+    jobs = list(MessageBatchJob.objects.filter(ended_at__isnull=True))
+    if not jobs:
+        return 0
+
+    cancellation.expire_overdue()
+    claude_service = claude_service or ClaudeService()
+    finished = 0
+    for job in jobs:
+        batch = claude_service.client.messages.batches.retrieve(job.batch_id)
+        if batch.processing_status == 'in_progress' and not job.analyses.filter(status='processing').exists():
+            # Все анализы пакета отменены: обработка остальных запросов только расходует токены
+            logger.info("Отмена Message Batch %s: анализы пакета отменены", job.batch_id)
+            batch = claude_service.client.messages.batches.cancel(job.batch_id)
+        if batch.processing_status != 'ended':
+            if batch.processing_status != job.processing_status:
+                MessageBatchJob.objects.filter(pk=job.pk).update(processing_status=batch.processing_status)
+            continue
+        apply_results(job, claude_service)
+        MessageBatchJob.objects.filter(pk=job.pk).update(
+            processing_status='ended', ended_at=batch.ended_at or timezone.now()
+        )
+        finished += 1
+    return finished
+
+
+def apply_results(job, claude_service):
+    """
+    Записывает результаты завершенного пакета в анализы.
+
+    Результаты приходят в произвольном порядке и сопоставляются с анализами
+    по custom_id. Анализы без результата (например, удаленные из пакета)
+    помечаются как неудачные.
+    """
+    analyses = {analysis.id.hex: analysis for analysis in job.analyses.filter(status='processing')}
+    for item in claude_service.client.messages.batches.results(job.batch_id):
+        analysis = analyses.pop(item.custom_id, None)
+        if analysis is None:
+            continue
+        result = item.result
+        if result.type == 'succeeded':
+            text = ''.join(block.text for block in result.message.content if block.type == 'text')
+            accounting = AnalysisAccounting()
+            accounting.response(result.message)
+            analysis.set_status(
+                'completed', result=text, completed_at=timezone.now(), model_used=accounting.model_used,
+                stop_reason=accounting.stop_reason, **accounting.usage
+            )
+        elif result.type == 'errored':
+            analysis.set_status('failed', result=f"Analysis failed: {result.error.error.message}")
+        else:
+            # canceled или expired (пакет не обработан за 24 часа)
+            analysis.set_status('failed', result=f"Analysis failed: запрос пакета {result.type}")
+
+    for analysis in analyses.values():
+        analysis.set_status('failed', result="Analysis failed: результат отсутствует в Message Batch")
+
+    # Пакеты анализов, все анализы которых завершены, отмечаем как завершенные
+    batch_ids = set(job.analyses.exclude(batch=None).values_list('batch_id', flat=True))
+    for batch in AnalysisBatch.objects.filter(pk__in=batch_ids, completed_at__isnull=True):
+        if not batch.analyses.filter(status__in=['pending', 'processing']).exists():
+            AnalysisBatch.objects.filter(pk=batch.pk).update(completed_at=timezone.now())
+
@@ -0,0 +1,222 @@
+"""
+Метрики конвейера анализа в формате Prometheus.
+
+Метрики обновляются в местах, через которые проходит каждый анализ
+(извлечение текста, попытки запросов к Claude, смена статуса анализа), и
+отдаются представлением metrics_view по адресу /metrics.
+
+Под gunicorn с несколькими воркерами у каждого процесса свой экземпляр
+метрик. Если задана переменная окружения PROMETHEUS_MULTIPROC_DIR,
+prometheus_client записывает значения в общие mmap-файлы этого каталога, а
+/metrics суммирует их по всем процессам (каталог должен существовать и
+очищаться перед запуском сервера, см. docker-compose.yml).
+
+Глубина очередей не накапливается в процессах, а считается запросом к базе
+в момент опроса, поэтому одинакова при любом числе воркеров.
+"""
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+# Границы корзин: от быстрых TXT до больших PDF и от быстрых моделей до долгой генерации
+EXTRACTION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CLAUDE_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+QUEUE_WAIT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+EXTRACTION_SECONDS = Histogram(
+    'agent_extraction_seconds', 'Время извлечения текста из файла', ['file_type'], buckets=EXTRACTION_BUCKETS
+)
+EXTRACTION_FAILURES = Counter(
+    'agent_extraction_failures_total', 'Прерванные извлечения текста по причинам (timeout, cpu, memory, crashed, error)', ['reason']
+)
+EXTRACTION_CACHE = Counter(
+    'agent_extraction_cache_total', 'Обращения к кэшу извлеченного текста (hit/miss)', ['result']
+)
+CLAUDE_REQUEST_SECONDS = Histogram(
+    'agent_claude_request_seconds', 'Задержка запроса к Claude', ['model', 'outcome'], buckets=CLAUDE_BUCKETS
+)
+CLAUDE_TOKENS = Counter(
+    'agent_claude_tokens_total', 'Токены Claude по видам (input, output, cache_read, cache_creation)', ['model', 'kind']
+)
+FALLBACK_ATTEMPTS = Histogram(
+    'agent_claude_attempts', 'Количество моделей, опрошенных для одного запроса', buckets=(1, 2, 3, 4, 5, 6, 8)
+)
+UPLOADS = Counter(
+    'agent_uploads_total', 'Загруженные файлы: новое содержимое (stored) или дубликат (deduplicated)', ['result']
+)
+DEDUPLICATED_BYTES = Counter(
+    'agent_upload_deduplicated_bytes_total', 'Байты, которые не пришлось записывать благодаря дедупликации'
+)
+ANALYSES_FINISHED = Counter(
+    'agent_analyses_finished_total', 'Анализы, перешедшие в конечный статус', ['status']
+)
+DOWNLOADS = Counter(
+    'agent_downloads_total', 'Запросы файлов документов по способу отдачи и коду ответа', ['mode', 'status']
+)
+DOWNLOAD_BYTES = Counter(
+    'agent_download_bytes_total', 'Байты файлов документов, отданные приложением (django) или фронтовым сервером', ['mode']
+)
+COMPRESSED_RESPONSES = Counter(
+    'agent_compressed_responses_total', 'Ответы, сжатые CompressionMiddleware', ['encoding']
+)
+COMPRESSION_SAVED_BYTES = Counter(
+    'agent_compression_saved_bytes_total', 'Байты, сэкономленные сжатием ответов', ['encoding']
+)
+WEBHOOK_DELIVERIES = Counter(
+    'agent_webhook_deliveries_total', 'Попытки доставки уведомлений вебхуков по результату', ['result']
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    'agent_queue_wait_seconds', 'Ожидание анализа в очереди планировщика по классам приоритета', ['priority'],
+    buckets=QUEUE_WAIT_BUCKETS
+)
+IDEMPOTENT_REQUESTS = Counter(
+    'agent_idempotent_requests_total',
+    'Запросы с заголовком Idempotency-Key по исходу: executed, replayed, in_progress, mismatch',
+    ['outcome']
+)
+
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+USAGE_KINDS = (
+    ('input', 'input_tokens'),
+    ('output', 'output_tokens'),
+    ('cache_read', 'cache_read_input_tokens'),
+    ('cache_creation', 'cache_creation_input_tokens'),
+)
+
+# labels() при каждом вызове берет блокировку и ищет дочернюю метрику,
+# что в несколько раз дороже самого обновления, поэтому дочерние метрики кэшируются
+_children = {}
+
+
+def _child(metric, *labels):
+    key = (metric, labels)
+    child = _children.get(key)
+    if child is None:
+        child = _children[key] = metric.labels(*labels)
+    return child
+
+
+def observe_extraction(file_type, seconds):
+    _child(EXTRACTION_SECONDS, file_type or 'unknown').observe(seconds)
+
+
+def observe_extraction_failure(reason):
+    _child(EXTRACTION_FAILURES, reason).inc()
+
+
+def observe_extraction_cache(hit):
+    _child(EXTRACTION_CACHE, 'hit' if hit else 'miss').inc()
+
+
+def observe_claude_request(model, seconds, error=None):
+    _child(CLAUDE_REQUEST_SECONDS, model, 'error' if error else 'success').observe(seconds)
+
+
+def observe_claude_usage(model, usage):
+    """Учитывает токены из usage ответа (пустые поля пропускаются)."""
+    for kind, field in USAGE_KINDS:
+        value = getattr(usage, field, None)
+        if value:
+            _child(CLAUDE_TOKENS, model or 'unknown', kind).inc(value)
+
+
+def observe_attempts(count):
+    if count:
+        FALLBACK_ATTEMPTS.observe(count)
+
+
+def observe_upload(duplicate, size):
+    _child(UPLOADS, 'deduplicated' if duplicate else 'stored').inc()
+    if duplicate and size:
+        DEDUPLICATED_BYTES.inc(size)
+
+
+def observe_download(mode, status, size):
+    _child(DOWNLOADS, mode, str(status)).inc()
+    if size:
+        _child(DOWNLOAD_BYTES, mode).inc(size)
+
+
+def observe_compression(encoding, original_size, compressed_size):
+    _child(COMPRESSED_RESPONSES, encoding).inc()
+    _child(COMPRESSION_SAVED_BYTES, encoding).inc(original_size - compressed_size)
+
+
+def observe_webhook_deliveries(result, count):
+    if count:
+        _child(WEBHOOK_DELIVERIES, result).inc(count)
+
+
+def observe_queue_wait(priority, seconds):
+    _child(QUEUE_WAIT_SECONDS, priority).observe(seconds)
+
+
+def observe_idempotency(outcome):
+    _child(IDEMPOTENT_REQUESTS, outcome).inc()
+
+
+def observe_status(status):
+    if status in TERMINAL_STATUSES:
+        _child(ANALYSES_FINISHED, status).inc()
+
+
+class QueueDepthCollector:
+    """Глубина очередей анализов на момент опроса (запрос к базе при каждом scrape)."""
+
+    def collect(self):
+        from django.db.models import Count
+        from .models import EXECUTION_MODES, Analysis, MessageBatchJob, WebhookDelivery
+
+        statuses = ('pending', 'processing')
+        # Нулевые значения тоже отдаются, чтобы правила оповещений не теряли ряды
+        depth = {(status, mode): 0 for status in statuses for mode, _ in EXECUTION_MODES}
+        rows = (
+            Analysis.objects.filter(status__in=statuses)
+            .values_list('status', 'execution_mode')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        for status, execution_mode, count in rows:
+            depth[(status, execution_mode)] = count
+
+        analyses = GaugeMetricFamily(
+            'agent_queue_depth', 'Анализы в очереди и в работе', labels=['status', 'execution_mode']
+        )
+        for (status, execution_mode), count in depth.items():
+            analyses.add_metric([status, execution_mode], count)
+        yield analyses
+
+        jobs = GaugeMetricFamily('agent_message_batches_in_progress', 'Незавершенные Message Batches')
+        jobs.add_metric([], MessageBatchJob.objects.filter(ended_at__isnull=True).count())
+        yield jobs
+
+        webhooks = GaugeMetricFamily('agent_webhook_deliveries_pending', 'Уведомления вебхуков, ожидающие отправки')
+        webhooks.add_metric([], WebhookDelivery.objects.filter(status='pending').count())
+        yield webhooks
+
+
+def render_metrics():
+    """
+    Возвращает метрики всех процессов в текстовом формате Prometheus.
+
+    Возвращает:
+        tuple: (тело ответа в байтах, Content-Type)
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = CollectorRegistry()
+        registry.register(_ProcessMetrics())
+    registry.register(QueueDepthCollector())
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class _ProcessMetrics:
+    """Метрики текущего процесса из глобального реестра (режим без PROMETHEUS_MULTIPROC_DIR)."""
+
+    def collect(self):
+        return REGISTRY.collect()
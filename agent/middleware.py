@@ -0,0 +1,298 @@
+import cProfile
+import re
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:  # пакет Brotli необязателен: без него ответы сжимаются gzip
+    brotli = None
+
+from . import idempotency, log, metrics
+from .profiling import QueryRecorder, save_profile
+from .scheduler import owner_id
+
+# Идентификатор из заголовка принимается, только если он не ломает формат журнала
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+# Маршруты, в kwargs или ответе которых есть идентификатор анализа
+_ANALYSIS_URL_RE = re.compile(r'^(async-)?analysis-|^agent_analysis_')
+# Типы содержимого, которые имеет смысл сжимать (PDF, DOCX, XLSX уже сжаты)
+_COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+# Кодировка с q=0 в Accept-Encoding клиентом отвергнута
+_REJECTED_RE = re.compile(r';\s*q=0(\.0*)?\s*$')
+
+
+class CorrelationIdMiddleware:
+    """
+    Привязывает записи журнала к HTTP-запросу.
+
+    Берет идентификатор из заголовка X-Request-ID (например, выданного nginx)
+    или создает новый и возвращает его в заголовке ответа X-Request-ID.
+    Работает и под WSGI, и под ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def _request_id(request):
+        request_id = request.headers.get('X-Request-ID', '')
+        return request_id if _REQUEST_ID_RE.match(request_id) else uuid.uuid4().hex
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_id = self._request_id(request)
+        with log.bind(request_id):
+            response = self.get_response(request)
+        response['X-Request-ID'] = request_id
+        return response
+
+    async def __acall__(self, request):
+        request_id = self._request_id(request)
+        with log.bind(request_id):
+            response = await self.get_response(request)
+        response['X-Request-ID'] = request_id
+        return response
+
+
+class IdempotencyMiddleware:
+    """
+    Выполняет POST-запрос с заголовком Idempotency-Key не больше одного раза:
+    повтор с тем же ключом получает сохраненный ответ первого запроса
+    (agent.idempotency).
+
+    Запросы без заголовка проходят без обращений к базе. Должно стоять
+    после CsrfViewMiddleware, чтобы отклоненный запрос не занимал ключ,
+    после AuthenticationMiddleware — ключи принадлежат владельцу
+    (agent.scheduler.owner_id: пользователю или IP-адресу), и после CompressionMiddleware —
+    сохраняется несжатый ответ.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def _key(request):
+        return request.headers.get(idempotency.HEADER) if request.method == 'POST' else None
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        key = self._key(request)
+        if key is None:
+            return self.get_response(request)
+        client = owner_id(request)
+        response = idempotency.start(request, client, key)
+        if response is not None:
+            return response
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            idempotency.finish(client, key, response)
+
+    async def __acall__(self, request):
+        key = self._key(request)
+        if key is None:
+            return await self.get_response(request)
+        client = await sync_to_async(owner_id)(request)
+        response = await sync_to_async(idempotency.start)(request, client, key)
+        if response is not None:
+            return response
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            await sync_to_async(idempotency.finish)(client, key, response)
+
+
+class ProfilingMiddleware:
+    """
+    Профилирует отдельный запрос сотрудника: cProfile и длительность SQL-запросов.
+
+    Профиль снимается, если запрос помечен заголовком X-Profile: 1 или
+    параметром ?profile=1 и пользователь — сотрудник (is_staff). Профиль
+    сохраняется в PROFILES_DIR (agent.profiling) вместе с идентификатором
+    анализа, его имя возвращается в заголовке X-Profile-Id, а список последних
+    профилей есть в админке (Анализы → Профили запросов).
+
+    Без пометки middleware только проверяет заголовок и строку запроса; при
+    PROFILING_ENABLED=False оно исключается из цепочки. Должно стоять после
+    AuthenticationMiddleware. Под ASGI профиль включает и другие задачи
+    цикла событий, а SQL из sync_to_async не записывается.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def _flagged(request):
+        if request.META.get('HTTP_X_PROFILE') == '1':
+            return True
+        return 'profile=' in request.META.get('QUERY_STRING', '') and request.GET.get('profile') == '1'
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not (self._flagged(request) and request.user.is_staff):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with recorder:
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        return self._save(request, response, profiler, recorder, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        if not self._flagged(request):
+            return await self.get_response(request)
+        user = await request.auser()
+        if not user.is_staff:
+            return await self.get_response(request)
+
+        profiler = cProfile.Profile()
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with recorder:
+            profiler.enable()
+            try:
+                response = await self.get_response(request)
+            finally:
+                profiler.disable()
+        return await sync_to_async(self._save)(request, response, profiler, recorder, time.perf_counter() - started)
+
+    @staticmethod
+    def _analysis_id(request, response):
+        match = request.resolver_match
+        if match is None or not _ANALYSIS_URL_RE.match(match.url_name or ''):
+            return None
+        analysis_id = match.kwargs.get('pk') or match.kwargs.get('object_id')
+        if analysis_id is None and isinstance(getattr(response, 'data', None), dict):
+            # Создание анализа: идентификатор есть только в ответе
+            analysis_id = response.data.get('id')
+        return str(analysis_id) if analysis_id is not None else None
+
+    def _save(self, request, response, profiler, recorder, duration):
+        name = save_profile(profiler, recorder.queries, {
+            'path': request.get_full_path(),
+            'method': request.method,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 1),
+            'user': request.user.get_username(),
+            'analysis_id': self._analysis_id(request, response),
+            'correlation_id': log.get_correlation_id() or uuid.uuid4().hex,
+        })
+        log.get_logger(__name__).info("Профиль запроса %s сохранен: %s", request.path, name)
+        response['X-Profile-Id'] = name
+        return response
+
+
+class CompressionMiddleware:
+    """
+    Сжимает ответы API и HTML-страницы: brotli, если он установлен и принимается
+    клиентом, иначе gzip. HTML всегда сжимается gzip (см. ниже).
+
+    Сжимаются только ответы с текстовым типом содержимого (HTML, JSON, CSS, JS)
+    не короче RESPONSE_COMPRESSION_MIN_SIZE байт. Потоковые ответы (SSE
+    /api/async/analyses/<id>/stream/, файлы документов) не сжимаются: сжатие
+    буферизует поток, а файлы PDF и DOCX уже сжаты. Для gzip, как в
+    GZipMiddleware Django, добавляются случайные байты против атаки BREACH.
+    HTML-страницы содержат CSRF-токен, а у brotli такой защиты нет, поэтому
+    они сжимаются только gzip.
+    Сильный ETag после сжатия становится слабым. Сэкономленные байты
+    учитываются в метрике agent_compression_saved_bytes_total.
+
+    Должно стоять в начале MIDDLEWARE, перед middleware, читающими или
+    изменяющими тело ответа.
+    """
+
+    sync_capable = True
+    async_capable = True
+    brotli_quality = 5
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = settings.RESPONSE_COMPRESSION_MIN_SIZE
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self._compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self._compress(request, await self.get_response(request))
+
+    @staticmethod
+    def _accepted(request):
+        header = request.headers.get('Accept-Encoding', '')
+        return {
+            part.split(';')[0].strip().lower()
+            for part in header.split(',')
+            if part.strip() and not _REJECTED_RE.search(part)
+        }
+
+    def _compress(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding') or response.status_code == 206:
+            return response
+        if not response.get('Content-Type', '').startswith(_COMPRESSIBLE_TYPES):
+            return response
+        content = response.content
+        if len(content) < self.min_size:
+            return response
+
+        # Ответ зависит от Accept-Encoding, даже если этот клиент сжатие не принимает
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accepted = self._accepted(request)
+        html = response['Content-Type'].startswith('text/html')
+        if brotli is not None and 'br' in accepted and not html:
+            encoding, compressed = 'br', brotli.compress(content, quality=self.brotli_quality)
+        elif 'gzip' in accepted:
+            encoding = 'gzip'
+            compressed = compress_string(content, max_random_bytes=GZipMiddleware.max_random_bytes)
+        else:
+            return response
+        if len(compressed) >= len(content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        metrics.observe_compression(encoding, len(content), len(compressed))
+        return response
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:27
+
+from django.db import migrations, models
+
+SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS agent_search_entry (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        object_id TEXT NOT NULL,
+        UNIQUE (kind, object_id)
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS agent_search_index USING fts5(
+        title, body, prompt,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for statement in SCHEMA_SQL:
+        schema_editor.execute(statement)
+
+    # Индексируем уже существующие документы и завершенные анализы
+    Document = apps.get_model("agent", "Document")
+    Analysis = apps.get_model("agent", "Analysis")
+    rows = [("document", doc.id.hex, doc.name, "", "") for doc in Document.objects.all()]
+    rows += [
+        ("analysis", analysis.id.hex, "", analysis.result or "", analysis.custom_prompt or "")
+        for analysis in Analysis.objects.filter(status="completed")
+    ]
+    with schema_editor.connection.cursor() as cursor:
+        for kind, object_id, title, body, prompt in rows:
+            cursor.execute(
+                "INSERT INTO agent_search_entry (kind, object_id) VALUES (%s, %s)",
+                [kind, object_id],
+            )
+            cursor.execute(
+                "INSERT INTO agent_search_index (rowid, title, body, prompt) "
+                "VALUES (last_insert_rowid(), %s, %s, %s)",
+                [title, body, prompt],
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS agent_search_index")
+    schema_editor.execute("DROP TABLE IF EXISTS agent_search_entry")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("agent", "0004_alter_analysis_options_alter_document_options"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="extracted_at",
+            field=models.DateTimeField(
+                blank=True, editable=False, null=True, verbose_name="Дата извлечения текста"
+            ),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="extracted_text",
+            field=models.TextField(
+                blank=True, editable=False, null=True, verbose_name="Извлеченный текст"
+            ),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
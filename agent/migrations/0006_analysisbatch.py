@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:31
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("agent", "0005_document_extracted_text_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AnalysisBatch",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="Идентификатор",
+                    ),
+                ),
+                (
+                    "custom_prompt",
+                    models.TextField(
+                        blank=True, null=True, verbose_name="Пользовательский запрос"
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Дата создания"
+                    ),
+                ),
+                (
+                    "completed_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Дата завершения"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Пакет анализов",
+                "verbose_name_plural": "Пакеты анализов",
+            },
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="batch",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="analyses",
+                to="agent.analysisbatch",
+                verbose_name="Пакет",
+            ),
+        ),
+    ]
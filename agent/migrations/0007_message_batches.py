@@ -0,0 +1,99 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:34
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("agent", "0006_analysisbatch"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MessageBatchJob",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="Идентификатор",
+                    ),
+                ),
+                (
+                    "batch_id",
+                    models.CharField(
+                        max_length=100, unique=True, verbose_name="ID пакета Anthropic"
+                    ),
+                ),
+                ("model", models.CharField(max_length=100, verbose_name="Модель")),
+                (
+                    "processing_status",
+                    models.CharField(
+                        default="in_progress",
+                        max_length=20,
+                        verbose_name="Статус обработки",
+                    ),
+                ),
+                (
+                    "request_count",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Количество запросов"
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Дата отправки"
+                    ),
+                ),
+                (
+                    "ended_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Дата завершения"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Message Batch",
+                "verbose_name_plural": "Message Batches",
+            },
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="execution_mode",
+            field=models.CharField(
+                choices=[("sync", "Сразу"), ("message_batch", "Message Batches API")],
+                default="sync",
+                max_length=20,
+                verbose_name="Режим выполнения",
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysisbatch",
+            name="execution_mode",
+            field=models.CharField(
+                choices=[("sync", "Сразу"), ("message_batch", "Message Batches API")],
+                default="sync",
+                max_length=20,
+                verbose_name="Режим выполнения",
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="message_batch",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="analyses",
+                to="agent.messagebatchjob",
+                verbose_name="Message Batch",
+            ),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("agent", "0007_message_batches"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ModelRouteDecision",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("rule", models.CharField(max_length=100, verbose_name="Правило")),
+                (
+                    "task_type",
+                    models.CharField(max_length=20, verbose_name="Тип задачи"),
+                ),
+                (
+                    "prompt_tokens",
+                    models.PositiveIntegerField(
+                        verbose_name="Токенов в запросе (оценка)"
+                    ),
+                ),
+                (
+                    "chosen_model",
+                    models.CharField(max_length=100, verbose_name="Выбранная модель"),
+                ),
+                (
+                    "model_used",
+                    models.CharField(
+                        blank=True,
+                        max_length=100,
+                        null=True,
+                        verbose_name="Ответившая модель",
+                    ),
+                ),
+                ("success", models.BooleanField(default=True, verbose_name="Успешно")),
+                (
+                    "latency_ms",
+                    models.PositiveIntegerField(verbose_name="Задержка, мс"),
+                ),
+                ("attempts", models.JSONField(default=list, verbose_name="Попытки")),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, db_index=True, verbose_name="Дата"
+                    ),
+                ),
+                (
+                    "analysis",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="route_decisions",
+                        to="agent.analysis",
+                        verbose_name="Анализ",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Решение маршрутизатора",
+                "verbose_name_plural": "Решения маршрутизатора",
+            },
+        ),
+    ]
@@ -0,0 +1,127 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("agent", "0008_model_route_decision"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="analysis",
+            name="api_latency_ms",
+            field=models.PositiveIntegerField(
+                blank=True, editable=False, null=True, verbose_name="Задержка API, мс"
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="attempts",
+            field=models.PositiveSmallIntegerField(
+                default=0, editable=False, verbose_name="Попыток запроса"
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="cache_creation_input_tokens",
+            field=models.PositiveIntegerField(
+                blank=True,
+                editable=False,
+                null=True,
+                verbose_name="Токенов записано в кэш",
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="cache_read_input_tokens",
+            field=models.PositiveIntegerField(
+                blank=True,
+                editable=False,
+                null=True,
+                verbose_name="Токенов прочитано из кэша",
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="duration_ms",
+            field=models.PositiveIntegerField(
+                blank=True, editable=False, null=True, verbose_name="Длительность, мс"
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="extraction_ms",
+            field=models.PositiveIntegerField(
+                blank=True,
+                editable=False,
+                null=True,
+                verbose_name="Извлечение текста, мс",
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="input_tokens",
+            field=models.PositiveIntegerField(
+                blank=True, editable=False, null=True, verbose_name="Входных токенов"
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="model_used",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                max_length=100,
+                null=True,
+                verbose_name="Ответившая модель",
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="output_tokens",
+            field=models.PositiveIntegerField(
+                blank=True, editable=False, null=True, verbose_name="Выходных токенов"
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="prompt_chars",
+            field=models.PositiveIntegerField(
+                blank=True, editable=False, null=True, verbose_name="Символов в запросе"
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="prompt_tokens",
+            field=models.PositiveIntegerField(
+                blank=True,
+                editable=False,
+                null=True,
+                verbose_name="Токенов в запросе (оценка)",
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="stop_reason",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                max_length=30,
+                null=True,
+                verbose_name="Причина остановки",
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="timings",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                editable=False,
+                verbose_name="Разбивка по этапам",
+            ),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("agent", "0009_analysis_accounting"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Blob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sha256", models.CharField(max_length=64, verbose_name="SHA-256")),
+                (
+                    "extension",
+                    models.CharField(
+                        blank=True, max_length=16, verbose_name="Расширение"
+                    ),
+                ),
+                ("file", models.FileField(upload_to="", verbose_name="Файл")),
+                ("size", models.BigIntegerField(verbose_name="Размер, байт")),
+                (
+                    "ref_count",
+                    models.PositiveIntegerField(default=0, verbose_name="Ссылок"),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Дата создания"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Содержимое файла",
+                "verbose_name_plural": "Содержимое файлов",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("sha256", "extension"), name="unique_blob_content"
+                    )
+                ],
+            },
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="blob",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="documents",
+                to="agent.blob",
+                verbose_name="Содержимое",
+            ),
+        ),
+    ]
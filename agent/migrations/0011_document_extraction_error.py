@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("agent", "0010_blob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="extraction_error",
+            field=models.TextField(
+                blank=True,
+                editable=False,
+                null=True,
+                verbose_name="Ошибка извлечения текста",
+            ),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:28
+
+import agent.fields
+from django.db import migrations, models
+from django.db.models import Value
+
+FIELDS = [("Analysis", "result"), ("Document", "extracted_text")]
+BATCH_SIZE = 500
+
+
+def _rows(model, field):
+    # Старые строки читаются как str (TEXT), уже сжатые — как CompressedText.
+    # Сначала только ключи: курсор не должен оставаться открытым во время UPDATE той же таблицы
+    pks = list(model.objects.filter(**{f"{field}__isnull": False}).values_list("pk", flat=True))
+    for start in range(0, len(pks), BATCH_SIZE):
+        yield from model.objects.filter(pk__in=pks[start:start + BATCH_SIZE]).values_list("pk", field)
+
+
+def compress_existing(apps, schema_editor):
+    for model_name, field in FIELDS:
+        model = apps.get_model("agent", model_name)
+        for pk, value in _rows(model, field):
+            if isinstance(value, str):
+                model.objects.filter(pk=pk).update(**{field: value})
+
+
+def decompress_existing(apps, schema_editor):
+    for model_name, field in FIELDS:
+        model = apps.get_model("agent", model_name)
+        for pk, value in _rows(model, field):
+            if not isinstance(value, str):
+                text = agent.fields.decompress_text(value)
+                model.objects.filter(pk=pk).update(**{field: Value(text, output_field=models.TextField())})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("agent", "0011_document_extraction_error"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="analysis",
+            name="result",
+            field=agent.fields.CompressedTextField(
+                blank=True, null=True, verbose_name="Результат"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="document",
+            name="extracted_text",
+            field=agent.fields.CompressedTextField(
+                blank=True, editable=False, null=True, verbose_name="Извлеченный текст"
+            ),
+        ),
+        migrations.RunPython(compress_existing, decompress_existing),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("agent", "0013_webhooks"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="analysis",
+            name="deadline",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Выполнить до"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="analysis",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "В ожидании"),
+                    ("processing", "В процессе"),
+                    ("completed", "Завершен"),
+                    ("failed", "Не удалось"),
+                    ("cancelled", "Отменен"),
+                ],
+                default="pending",
+                max_length=20,
+                verbose_name="Статус",
+            ),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:59
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def queue_existing(apps, schema_editor):
+    # Для уже созданных анализов время постановки в очередь — время создания
+    Analysis = apps.get_model("agent", "Analysis")
+    Analysis.objects.update(queued_at=F("created_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("agent", "0015_idempotency_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="analysis",
+            name="client",
+            field=models.CharField(
+                blank=True, default="", max_length=100, verbose_name="Клиент"
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="heartbeat_at",
+            field=models.DateTimeField(
+                blank=True,
+                editable=False,
+                null=True,
+                verbose_name="Ожидание подтверждено",
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="priority",
+            field=models.CharField(
+                choices=[
+                    ("interactive", "Интерактивный"),
+                    ("normal", "Обычный"),
+                    ("bulk", "Массовый"),
+                ],
+                default="normal",
+                max_length=20,
+                verbose_name="Приоритет",
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="queued_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now,
+                editable=False,
+                verbose_name="В очереди с",
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysis",
+            name="started_at",
+            field=models.DateTimeField(
+                blank=True, editable=False, null=True, verbose_name="Начат"
+            ),
+        ),
+        migrations.RunPython(queue_existing, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="analysis",
+            index=models.Index(
+                fields=["status", "execution_mode"], name="agent_analysis_queue_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 20:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("agent", "0016_analysis_priority"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="idempotencykey",
+            name="client",
+            field=models.CharField(
+                blank=True, default="", max_length=100, verbose_name="Клиент"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="idempotencykey",
+            name="key",
+            field=models.CharField(max_length=255, verbose_name="Ключ"),
+        ),
+        migrations.AddConstraint(
+            model_name="idempotencykey",
+            constraint=models.UniqueConstraint(
+                fields=("client", "key"), name="unique_idempotency_key"
+            ),
+        ),
+    ]
@@ -1,5 +1,36 @@
+from asgiref.sync import sync_to_async
 from django.db import models
+from django.utils import timezone
+import secrets
 import uuid
+from .db import retry_on_lock
+from .fields import CompressedTextField
+from . import metrics, search
+
+class Blob(models.Model):
+    """
+    Уникальное содержимое загруженного файла (agent.blobs).
+    
+    Файл хранится один раз по пути из SHA-256 содержимого; документы с
+    одинаковым содержимым ссылаются на одну запись, ref_count — число таких
+    ссылок. Запись и файл удаляются вместе с последней ссылкой.
+    """
+    sha256 = models.CharField(max_length=64, verbose_name="SHA-256")
+    extension = models.CharField(max_length=16, blank=True, verbose_name="Расширение")
+    file = models.FileField(verbose_name="Файл")
+    size = models.BigIntegerField(verbose_name="Размер, байт")
+    ref_count = models.PositiveIntegerField(default=0, verbose_name="Ссылок")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    
+    class Meta:
+        verbose_name = "Содержимое файла"
+        verbose_name_plural = "Содержимое файлов"
+        constraints = [
+            models.UniqueConstraint(fields=['sha256', 'extension'], name='unique_blob_content'),
+        ]
+    
+    def __str__(self):
+        return f"{self.sha256[:12]}{self.extension}"
 
 class Document(models.Model):
     """
@@ -12,12 +43,24 @@ class Document(models.Model):
     - file: Файл документа (PDF, DOCX, TXT и т.д.)
     - name: Название документа (если не указано, будет использовано имя файла)
     - file_type: Тип файла определяется автоматически при загрузке
+    
+    Выходные данные:
+    - extracted_text: Текст, извлеченный из файла при первом анализе (кэш для
+      повторных анализов и полнотекстового поиска; хранится сжатым, см. agent.fields)
+    - extraction_error: Причина, по которой текст извлечь не удалось (ошибка
+      разбора или превышение лимитов времени и памяти, см. agent.sandbox)
+    - blob: Содержимое файла; документы с одинаковым содержимым ссылаются на
+      один Blob, а файл хранится один раз
     """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, verbose_name="Идентификатор")
     file = models.FileField(upload_to='documents/', verbose_name="Файл")
     name = models.CharField(max_length=255, verbose_name="Название")
     file_type = models.CharField(max_length=50, verbose_name="Тип файла")
     uploaded_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата загрузки")
+    extracted_text = CompressedTextField(blank=True, null=True, editable=False, verbose_name="Извлеченный текст")
+    extracted_at = models.DateTimeField(null=True, blank=True, editable=False, verbose_name="Дата извлечения текста")
+    extraction_error = models.TextField(blank=True, null=True, editable=False, verbose_name="Ошибка извлечения текста")
+    blob = models.ForeignKey(Blob, null=True, blank=True, editable=False, on_delete=models.PROTECT, related_name='documents', verbose_name="Содержимое")
     
     class Meta:
         verbose_name = "Документ"
@@ -25,6 +68,99 @@ class Document(models.Model):
     
     def __str__(self):
         return self.name
+    
+    def save(self, *args, **kwargs):
+        """
+        Сохраняет документ; новый файл записывается в хранилище по содержимому.
+        
+        Если такое содержимое уже загружалось, файл не записывается повторно,
+        а документ ссылается на существующий Blob. При замене файла ссылка на
+        прежнее содержимое освобождается.
+        """
+        from . import blobs
+        
+        if not self.file or self.file._committed:
+            return super().save(*args, **kwargs)
+        
+        previous_blob_id = self.blob_id
+        self.blob = blobs.store(self.file.file, self.file.name)
+        self.file.name = self.blob.file.name
+        self.file._committed = True
+        try:
+            super().save(*args, **kwargs)
+        except Exception:
+            blobs.release(self.blob_id)
+            raise
+        if previous_blob_id:
+            blobs.release(previous_blob_id)
+
+# Режимы выполнения анализа: сразу при создании или через Message Batches API
+EXECUTION_MODES = [
+    ('sync', 'Сразу'),
+    ('message_batch', 'Message Batches API'),
+]
+
+# Классы приоритета выполнения (agent.scheduler) в порядке обслуживания
+PRIORITIES = [
+    ('interactive', 'Интерактивный'),
+    ('normal', 'Обычный'),
+    ('bulk', 'Массовый'),
+]
+
+# Из каких статусов анализ может перейти в статус-ключ (Analysis.set_status).
+# 'processing' — только из очереди: взять анализ в работу может один воркер;
+# 'pending' — повтор завершенного анализа, но не выполняющегося
+STATUS_TRANSITIONS = {
+    'pending': ('completed', 'failed', 'cancelled'),
+    'processing': ('pending',),
+    'completed': ('pending', 'processing'),
+    'failed': ('pending', 'processing'),
+    'cancelled': ('pending', 'processing'),
+}
+
+class AnalysisBatch(models.Model):
+    """
+    Пакет анализов: один пользовательский запрос, примененный к множеству
+    групп документов (например, отчет каждого филиала против отчета головного офиса).
+    
+    Входящие данные:
+    - custom_prompt: Общий запрос для всех анализов пакета (опционально)
+    
+    Выходные данные:
+    - analyses: Анализы пакета, по одному на каждую группу документов
+    - completed_at: Дата и время завершения последнего анализа пакета
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, verbose_name="Идентификатор")
+    custom_prompt = models.TextField(blank=True, null=True, verbose_name="Пользовательский запрос")
+    execution_mode = models.CharField(max_length=20, choices=EXECUTION_MODES, default='sync', verbose_name="Режим выполнения")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    completed_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата завершения")
+    
+    class Meta:
+        verbose_name = "Пакет анализов"
+        verbose_name_plural = "Пакеты анализов"
+    
+    def __str__(self):
+        return f"Пакет {self.id}"
+    
+    def progress(self):
+        """
+        Возвращает сводный прогресс пакета по статусам анализов.
+        
+        Возвращает:
+            dict: Количество анализов всего и в каждом статусе, а также
+                  долю завершенных (completed, failed или cancelled) в процентах
+        """
+        counts = dict(
+            self.analyses.values_list('status').annotate(count=models.Count('id')).order_by()
+        )
+        total = sum(counts.values())
+        progress = {'total': total}
+        for status, _ in Analysis._meta.get_field('status').choices:
+            progress[status] = counts.get(status, 0)
+        done = progress['completed'] + progress['failed'] + progress['cancelled']
+        progress['percent'] = round(done / total * 100, 1) if total else 100.0
+        return progress
 
 class Analysis(models.Model):
     """
@@ -37,17 +173,42 @@ class Analysis(models.Model):
     - documents: Связь со списком документов для анализа (минимум 1 документ)
     - custom_prompt: Пользовательский запрос для анализа (опционально)
     - status: Статус анализа устанавливается автоматически
+    - execution_mode: 'sync' — анализ выполняется сразу, 'message_batch' — ставится
+      в очередь и отправляется через Message Batches API командой process_message_batches
+    - webhook: Вебхук, которому сообщить о завершении анализа (опционально, см. agent.webhooks)
+    - deadline: Момент, после которого незавершенный анализ прерывается со
+      статусом 'cancelled' (опционально, см. agent.cancellation)
+    - priority: Класс приоритета: 'interactive' — из веб-интерфейса, 'normal' —
+      через API, 'bulk' — пакеты и массовые задачи (см. agent.scheduler)
+    - client: Клиент, создавший анализ; между клиентами слоты выполнения делятся поровну
     
     Выходные данные:
-    - result: Текстовый результат анализа от API Claude
+    - result: Текстовый результат анализа от API Claude (хранится сжатым, см. agent.fields)
     - completed_at: Дата и время завершения анализа (заполняется автоматически)
+    - queued_at, started_at: Постановка в очередь и начало выполнения; разница —
+      ожидание в очереди планировщика
+    - model_used, attempts, api_latency_ms, duration_ms, токены и stop_reason: учет
+      выполнения (agent.accounting); timings — разбивка по этапам, включая время
+      извлечения текста каждого документа
     """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, verbose_name="Идентификатор")
     documents = models.ManyToManyField(Document, related_name='analyses', verbose_name="Документы")
-    result = models.TextField(blank=True, null=True, verbose_name="Результат")
+    result = CompressedTextField(blank=True, null=True, verbose_name="Результат")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
     completed_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата завершения")
     custom_prompt = models.TextField(blank=True, null=True, help_text="Пользовательский запрос для анализа документов. Оставьте пустым для использования стандартного промпта.", verbose_name="Пользовательский запрос")
+    batch = models.ForeignKey(AnalysisBatch, null=True, blank=True, on_delete=models.SET_NULL, related_name='analyses', verbose_name="Пакет")
+    execution_mode = models.CharField(max_length=20, choices=EXECUTION_MODES, default='sync', verbose_name="Режим выполнения")
+    message_batch = models.ForeignKey('MessageBatchJob', null=True, blank=True, on_delete=models.SET_NULL, related_name='analyses', verbose_name="Message Batch")
+    deadline = models.DateTimeField(null=True, blank=True, verbose_name="Выполнить до")
+    priority = models.CharField(max_length=20, choices=PRIORITIES, default='normal', verbose_name="Приоритет")
+    client = models.CharField(max_length=100, blank=True, default='', verbose_name="Клиент")
+    queued_at = models.DateTimeField(default=timezone.now, editable=False, verbose_name="В очереди с")
+    started_at = models.DateTimeField(null=True, blank=True, editable=False, verbose_name="Начат")
+    # Воркер, ожидающий слот для анализа, периодически обновляет это поле;
+    # анализ без свежей отметки (воркер завершился) не занимает место в очереди
+    heartbeat_at = models.DateTimeField(null=True, blank=True, editable=False, verbose_name="Ожидание подтверждено")
+    webhook = models.ForeignKey('WebhookEndpoint', null=True, blank=True, on_delete=models.SET_NULL, related_name='analyses', verbose_name="Вебхук")
     status = models.CharField(
         max_length=20,
         choices=[
@@ -55,14 +216,260 @@ class Analysis(models.Model):
             ('processing', 'В процессе'),
             ('completed', 'Завершен'),
             ('failed', 'Не удалось'),
+            ('cancelled', 'Отменен'),
         ],
         default='pending',
         verbose_name="Статус"
     )
+    # Учет времени и токенов (заполняется при выполнении анализа)
+    model_used = models.CharField(max_length=100, blank=True, null=True, editable=False, verbose_name="Ответившая модель")
+    attempts = models.PositiveSmallIntegerField(default=0, editable=False, verbose_name="Попыток запроса")
+    prompt_chars = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name="Символов в запросе")
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name="Токенов в запросе (оценка)")
+    extraction_ms = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name="Извлечение текста, мс")
+    api_latency_ms = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name="Задержка API, мс")
+    duration_ms = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name="Длительность, мс")
+    input_tokens = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name="Входных токенов")
+    output_tokens = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name="Выходных токенов")
+    cache_creation_input_tokens = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name="Токенов записано в кэш")
+    cache_read_input_tokens = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name="Токенов прочитано из кэша")
+    stop_reason = models.CharField(max_length=30, blank=True, null=True, editable=False, verbose_name="Причина остановки")
+    timings = models.JSONField(default=dict, blank=True, editable=False, verbose_name="Разбивка по этапам")
     
     class Meta:
         verbose_name = "Анализ"
         verbose_name_plural = "Анализы"
+        indexes = [models.Index(fields=['status', 'execution_mode'], name='agent_analysis_queue_idx')]
     
     def __str__(self):
         return f"Анализ {self.id} - {self.status}"
+    
+    def set_status(self, status, expected=None, **fields):
+        """
+        Переводит анализ в новый статус одним UPDATE-запросом.
+        
+        В отличие от save(), не перезаписывает остальные поля строки и
+        повторяет запись при конкурентной блокировке SQLite, поэтому
+        несколько воркеров могут безопасно обновлять статусы одновременно.
+        
+        Переход атомарный: UPDATE выполняется, только если текущий статус в
+        базе допускает его (STATUS_TRANSITIONS). Поэтому из двух воркеров,
+        одновременно берущих анализ в работу ('processing') или повторяющих
+        его ('pending'), статус меняет только один, а второй получает False
+        и анализ не выполняет. Результат, пришедший после отмены, тоже не
+        перезаписывает статус 'cancelled'.
+        
+        Параметры:
+            status (str): Новый статус анализа
+            expected (tuple, optional): Допустимые текущие статусы вместо STATUS_TRANSITIONS
+            **fields: Дополнительные поля для обновления (result, completed_at и т.д.)
+            
+        Возвращает:
+            bool: False, если текущий статус не допускает перехода
+            
+        Примеры:
+            >>> analysis.set_status('completed', result=text, completed_at=timezone.now())
+            >>> if not analysis.set_status('processing'):
+            ...     return  # анализ уже выполняет другой воркер
+        """
+        fields['status'] = status
+        if not _update_analysis(self.pk, fields, expected or STATUS_TRANSITIONS[status]):
+            return False
+        for name, value in fields.items():
+            setattr(self, name, value)
+        metrics.observe_status(status)
+        if status == 'completed':
+            search.index_analysis(self)
+        if status in metrics.TERMINAL_STATUSES:
+            from . import webhooks
+            webhooks.enqueue([self], status)
+        return True
+    
+    async def aset_status(self, status, expected=None, **fields):
+        """Асинхронный вариант set_status() для кода под ASGI."""
+        return await sync_to_async(self.set_status)(status, expected, **fields)
+    
+    def cancel(self):
+        """
+        Отменяет анализ в очереди или в работе.
+        
+        Выполнение анализа (в этом или другом процессе) замечает отмену при
+        следующей проверке и прекращает извлечение текста и запросы к Claude.
+        
+        Возвращает:
+            bool: False, если анализ уже завершен
+        """
+        from . import cancellation
+        
+        if not self.set_status('cancelled', result=cancellation.CANCELLED_MESSAGE, completed_at=timezone.now()):
+            return False
+        cancellation.notify(self.pk)
+        return True
+
+
+class MessageBatchJob(models.Model):
+    """
+    Пакет запросов, отправленный в Message Batches API Anthropic.
+    
+    Создается командой process_message_batches при отправке накопленных
+    анализов в режиме 'message_batch'; команда же опрашивает статус пакета
+    и записывает результаты обратно в анализы.
+    
+    Выходные данные:
+    - batch_id: Идентификатор пакета на стороне Anthropic (msgbatch_...)
+    - processing_status: in_progress, canceling или ended
+    - ended_at: Дата и время завершения обработки пакета
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, verbose_name="Идентификатор")
+    batch_id = models.CharField(max_length=100, unique=True, verbose_name="ID пакета Anthropic")
+    model = models.CharField(max_length=100, verbose_name="Модель")
+    processing_status = models.CharField(max_length=20, default='in_progress', verbose_name="Статус обработки")
+    request_count = models.PositiveIntegerField(default=0, verbose_name="Количество запросов")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата отправки")
+    ended_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата завершения")
+    
+    class Meta:
+        verbose_name = "Message Batch"
+        verbose_name_plural = "Message Batches"
+    
+    def __str__(self):
+        return f"{self.batch_id} - {self.processing_status}"
+
+
+class ModelRouteDecision(models.Model):
+    """
+    Журнал решений маршрутизатора моделей (agent.routing).
+    
+    Каждая запись — один запрос к Claude: какое правило сработало, какая
+    модель была выбрана первой, какая в итоге ответила и сколько заняли
+    попытки. По журналу строится скользящая статистика задержек и ошибок
+    моделей и оценивается эффект маршрутизации.
+    
+    Выходные данные:
+    - attempts: Попытки в порядке выполнения: [{'model', 'latency_ms', 'error'}]
+    - latency_ms: Суммарное время всех попыток
+    """
+    analysis = models.ForeignKey(Analysis, null=True, blank=True, on_delete=models.SET_NULL, related_name='route_decisions', verbose_name="Анализ")
+    rule = models.CharField(max_length=100, verbose_name="Правило")
+    task_type = models.CharField(max_length=20, verbose_name="Тип задачи")
+    prompt_tokens = models.PositiveIntegerField(verbose_name="Токенов в запросе (оценка)")
+    chosen_model = models.CharField(max_length=100, verbose_name="Выбранная модель")
+    model_used = models.CharField(max_length=100, blank=True, null=True, verbose_name="Ответившая модель")
+    success = models.BooleanField(default=True, verbose_name="Успешно")
+    latency_ms = models.PositiveIntegerField(verbose_name="Задержка, мс")
+    attempts = models.JSONField(default=list, verbose_name="Попытки")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Дата")
+    
+    class Meta:
+        verbose_name = "Решение маршрутизатора"
+        verbose_name_plural = "Решения маршрутизатора"
+    
+    def __str__(self):
+        return f"{self.rule}: {self.chosen_model} ({self.latency_ms} мс)"
+
+
+def _webhook_secret():
+    return secrets.token_hex(32)
+
+
+class WebhookEndpoint(models.Model):
+    """
+    Адрес клиента для уведомлений о завершении анализов (вместо опроса статуса).
+    
+    Уведомления отправляет команда dispatch_webhooks (agent.webhooks): POST с
+    JSON-телом, подписанным HMAC-SHA256 ключом secret. Уведомления одному
+    адресу объединяются в пакеты.
+    
+    Входящие данные:
+    - url: Адрес, принимающий POST-запросы
+    - all_analyses: Уведомлять о каждом анализе; иначе — только об анализах,
+      созданных с этим вебхуком (Analysis.webhook). Только для сотрудников
+    - is_active: Отключенному адресу уведомления не отправляются
+    
+    Выходные данные:
+    - secret: Ключ подписи (генерируется при создании и показывается один раз)
+    - client: Владелец вебхука (agent.scheduler.owner_id); через
+      API вебхук видит и изменяет только он
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, verbose_name="Идентификатор")
+    client = models.CharField(max_length=100, blank=True, default='', editable=False, verbose_name="Клиент")
+    url = models.URLField(max_length=500, verbose_name="URL")
+    secret = models.CharField(max_length=64, default=_webhook_secret, editable=False, verbose_name="Ключ подписи")
+    all_analyses = models.BooleanField(default=False, verbose_name="Все анализы")
+    is_active = models.BooleanField(default=True, verbose_name="Активен")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    
+    class Meta:
+        verbose_name = "Вебхук"
+        verbose_name_plural = "Вебхуки"
+    
+    def __str__(self):
+        return self.url
+
+
+class WebhookDelivery(models.Model):
+    """
+    Уведомление об анализе для одного вебхука и состояние его доставки.
+    
+    Создается при переходе анализа в конечный статус; 'pending' — ждет
+    отправки (в том числе повторной после ошибки, не раньше next_attempt_at),
+    'delivered' — адрес ответил 2xx, 'failed' — исчерпаны попытки.
+    """
+    STATUSES = [
+        ('pending', 'Ожидает отправки'),
+        ('delivered', 'Доставлено'),
+        ('failed', 'Не доставлено'),
+    ]
+    endpoint = models.ForeignKey(WebhookEndpoint, on_delete=models.CASCADE, related_name='deliveries', verbose_name="Вебхук")
+    analysis = models.ForeignKey(Analysis, on_delete=models.CASCADE, related_name='webhook_deliveries', verbose_name="Анализ")
+    event = models.CharField(max_length=50, verbose_name="Событие")
+    status = models.CharField(max_length=20, choices=STATUSES, default='pending', verbose_name="Статус")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Попыток")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="Следующая попытка")
+    last_error = models.TextField(blank=True, null=True, verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    delivered_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата доставки")
+    
+    class Meta:
+        verbose_name = "Доставка вебхука"
+        verbose_name_plural = "Доставки вебхуков"
+        indexes = [models.Index(fields=['status', 'next_attempt_at'], name='agent_webhook_due_idx')]
+    
+    def __str__(self):
+        return f"{self.event} → {self.endpoint_id} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Ответ на POST-запрос API с заголовком Idempotency-Key (agent.idempotency).
+    
+    Запись создается до выполнения запроса — пока status_code пуст, запрос
+    выполняется, — и затем хранит ответ, который получит повтор запроса с тем
+    же ключом. fingerprint — SHA-256 метода, пути и тела запроса: тот же ключ
+    с другим запросом отклоняется. Ключ уникален в пределах владельца
+    (agent.scheduler.owner_id): одинаковые ключи разных пользователей не
+    пересекаются, и чужой ответ не возвращается.
+    """
+    client = models.CharField(max_length=100, blank=True, default='', verbose_name="Клиент")
+    key = models.CharField(max_length=255, verbose_name="Ключ")
+    path = models.CharField(max_length=255, verbose_name="Путь")
+    fingerprint = models.CharField(max_length=64, verbose_name="Отпечаток запроса")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Код ответа")
+    content_type = models.CharField(max_length=100, blank=True, verbose_name="Тип ответа")
+    response = models.BinaryField(null=True, blank=True, verbose_name="Тело ответа")
+    created_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name="Дата запроса")
+    
+    class Meta:
+        verbose_name = "Ключ идемпотентности"
+        verbose_name_plural = "Ключи идемпотентности"
+        constraints = [
+            models.UniqueConstraint(fields=['client', 'key'], name='unique_idempotency_key'),
+        ]
+    
+    def __str__(self):
+        return f"{self.key} → {self.path} ({self.status_code or 'выполняется'})"
+
+
+@retry_on_lock
+def _update_analysis(pk, fields, expected):
+    return Analysis.objects.filter(pk=pk, status__in=expected).update(**fields) > 0
@@ -0,0 +1,153 @@
+"""
+Профили отдельных запросов (ProfilingMiddleware).
+
+Каждый профиль — два файла в PROFILES_DIR с общим именем:
+
+- <имя>.prof — статистика cProfile (открывается snakeviz, pstats);
+- <имя>.json — метаданные: путь, статус, длительность, пользователь,
+  идентификатор анализа, самые медленные SQL-запросы и верхние функции
+  по суммарному времени.
+
+Хранятся последние PROFILES_KEEP профилей, более старые удаляются.
+"""
+import contextlib
+import io
+import json
+import os
+import pstats
+import re
+import time
+
+from django.conf import settings
+from django.db import connections
+
+# Имя профиля: время и идентификатор корреляции, без путей
+_NAME_RE = re.compile(r'^[0-9]{8}-[0-9]{6}-[A-Za-z0-9._-]{1,64}$')
+
+SQL_KEEP = 50
+TOP_FUNCTIONS = 40
+
+
+class QueryRecorder:
+    """
+    Записывает SQL-запросы и их длительность через execute_wrapper.
+
+    Использование:
+        >>> recorder = QueryRecorder()
+        >>> with recorder:
+        ...     Analysis.objects.count()
+        >>> recorder.queries[0]['ms']
+    """
+
+    def __init__(self):
+        self.queries = []
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'ms': round((time.perf_counter() - started) * 1000, 3),
+                'many': many,
+            })
+
+    def __enter__(self):
+        self._stack = contextlib.ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+
+def _top_functions(profiler):
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.strip_dirs().sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    return stream.getvalue()
+
+
+def save_profile(profiler, queries, meta):
+    """
+    Сохраняет профиль запроса и удаляет самые старые сверх PROFILES_KEEP.
+
+    Параметры:
+        profiler (cProfile.Profile): Остановленный профилировщик
+        queries (list): Записи QueryRecorder.queries
+        meta (dict): path, method, status, duration_ms, user, analysis_id, correlation_id
+
+    Возвращает:
+        str: Имя профиля (для заголовка X-Profile-Id и ссылки в админке)
+    """
+    os.makedirs(settings.PROFILES_DIR, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{meta['correlation_id']}"
+    base = os.path.join(settings.PROFILES_DIR, name)
+
+    profiler.dump_stats(f'{base}.prof')
+    data = {
+        **meta,
+        'name': name,
+        'created': time.time(),
+        'sql_count': len(queries),
+        'sql_ms': round(sum(query['ms'] for query in queries), 3),
+        'sql_slowest': sorted(queries, key=lambda query: query['ms'], reverse=True)[:SQL_KEEP],
+        'top_functions': _top_functions(profiler),
+    }
+    with open(f'{base}.json', 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, default=str)
+
+    _rotate()
+    return name
+
+
+def _rotate():
+    names = sorted(
+        entry[:-len('.json')] for entry in os.listdir(settings.PROFILES_DIR) if entry.endswith('.json')
+    )
+    for name in names[:max(len(names) - settings.PROFILES_KEEP, 0)]:
+        for suffix in ('.json', '.prof'):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(settings.PROFILES_DIR, name + suffix))
+
+
+def recent_profiles(limit=100):
+    """
+    Возвращает метаданные последних профилей, новые первыми (без списка функций).
+    """
+    if not os.path.isdir(settings.PROFILES_DIR):
+        return []
+    names = sorted(
+        (entry[:-len('.json')] for entry in os.listdir(settings.PROFILES_DIR) if entry.endswith('.json')),
+        reverse=True,
+    )[:limit]
+    profiles = []
+    for name in names:
+        data = load_profile(name)
+        if data is not None:
+            data.pop('top_functions', None)
+            data.pop('sql_slowest', None)
+            profiles.append(data)
+    return profiles
+
+
+def profile_path(name, suffix):
+    """Путь к файлу профиля или None, если имя некорректно."""
+    if not _NAME_RE.match(name):
+        return None
+    return os.path.join(settings.PROFILES_DIR, name + suffix)
+
+
+def load_profile(name):
+    """Метаданные профиля или None, если его нет."""
+    path = profile_path(name, '.json')
+    if path is None:
+        return None
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
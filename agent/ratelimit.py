@@ -0,0 +1,256 @@
+"""
+Межпроцессный ограничитель частоты запросов к API Claude.
+
+Воркеры gunicorn не знают друг о друге, поэтому без координации их суммарный
+поток запросов превышает лимиты организации, а отклоненные запросы тратят
+время в цикле резервных моделей. Ограничитель хранит корзины токенов в
+отдельном файле SQLite, общем для всех процессов на машине (Redis не нужен),
+и для каждой модели отдельно учитывает:
+
+- rpm  — запросы в минуту;
+- itpm — входные токены в минуту;
+- otpm — выходные токены в минуту.
+
+Перед запросом вызывающий резервирует оценку токенов и, если корзины пусты,
+ждет их пополнения не дольше RATE_LIMIT_MAX_WAIT секунд. После ответа
+резерв уточняется по фактическому usage из ответа API.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+from .db import is_lock_error
+
+DIMENSIONS = ('rpm', 'itpm', 'otpm')
+
+
+class RateLimitTimeout(Exception):
+    """Лимит не освободился за допустимое время ожидания."""
+
+    def __init__(self, model, wait):
+        self.model = model
+        self.wait = wait
+        super().__init__(
+            f"Превышен лимит запросов к модели {model}: ожидание {wait:.1f} с больше допустимого"
+        )
+
+
+class RateLimiter:
+    """
+    Корзины токенов в общей базе SQLite.
+
+    Параметры:
+        path (str): Путь к файлу базы ограничителя
+        limits (dict): Лимиты по моделям: {'default': {'rpm': 50, 'itpm': 40000, 'otpm': 8000}, ...}
+        period (float): Период, к которому относятся лимиты, в секундах (60 для "в минуту")
+        max_wait (float): Максимальное время ожидания свободного лимита, с
+
+    Использование:
+        ```python
+        limiter = get_rate_limiter()
+        reservation = limiter.acquire(model, input_tokens=1200, output_tokens=4000)
+        response = client.messages.create(...)
+        limiter.settle(reservation, response.usage.input_tokens, response.usage.output_tokens)
+        ```
+    """
+
+    def __init__(self, path, limits, period=60.0, max_wait=30.0):
+        self.path = path
+        self.limits = limits
+        self.period = period
+        self.max_wait = max_wait
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        # Соединение SQLite нельзя использовать после fork (gunicorn --preload)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS rate_limit_bucket ('
+                'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)'
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def limits_for(self, model):
+        """Возвращает лимиты модели (или лимиты по умолчанию), только заданные измерения."""
+        limits = self.limits.get(model) or self.limits.get('default') or {}
+        return {dimension: limits[dimension] for dimension in DIMENSIONS if limits.get(dimension)}
+
+    def _try_take(self, model, amounts):
+        """
+        Атомарно пополняет корзины модели и списывает amounts, если токенов хватает.
+
+        Возвращает:
+            float: 0, если списание выполнено, иначе время до пополнения в секундах
+        """
+        limits = self.limits_for(model)
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            buckets = {}
+            wait = 0.0
+            for dimension, limit in limits.items():
+                key = f'{model}:{dimension}'
+                row = conn.execute(
+                    'SELECT tokens, updated_at FROM rate_limit_bucket WHERE key = ?', (key,)
+                ).fetchone()
+                tokens = limit if row is None else min(limit, row[0] + (now - row[1]) * limit / self.period)
+                # Запрос больше емкости корзины пропускаем, когда корзина полна, иначе он ждал бы вечно
+                needed = min(amounts.get(dimension, 0), limit)
+                if tokens < needed:
+                    wait = max(wait, (needed - tokens) * self.period / limit)
+                buckets[key] = (tokens, amounts.get(dimension, 0))
+            if wait == 0:
+                for key, (tokens, amount) in buckets.items():
+                    conn.execute(
+                        'INSERT OR REPLACE INTO rate_limit_bucket (key, tokens, updated_at) VALUES (?, ?, ?)',
+                        (key, tokens - amount, now)
+                    )
+            conn.execute('COMMIT')
+            return wait
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def acquire(self, model, input_tokens=0, output_tokens=0, max_wait=None):
+        """
+        Резервирует запрос и токены, при необходимости ожидая пополнения корзин.
+
+        Параметры:
+            model (str): Модель Claude
+            input_tokens (int): Оценка входных токенов
+            output_tokens (int): Оценка выходных токенов (обычно max_tokens)
+            max_wait (float, optional): Предел ожидания вместо self.max_wait
+
+        Возвращает:
+            dict: Резерв, который нужно передать в settle()
+
+        Вызывает RateLimitTimeout, если лимит не освободится за допустимое время.
+        """
+        amounts = {'rpm': 1, 'itpm': input_tokens, 'otpm': output_tokens}
+        reservation = {'model': model, 'itpm': input_tokens, 'otpm': output_tokens, 'waited': 0.0}
+        if not self.limits_for(model):
+            return reservation
+
+        max_wait = self.max_wait if max_wait is None else max_wait
+        deadline = time.monotonic() + max_wait
+        started = time.monotonic()
+        while True:
+            try:
+                wait = self._try_take(model, amounts)
+            except sqlite3.OperationalError as e:
+                if not is_lock_error(e):
+                    raise
+                wait = 0.01
+            else:
+                if wait == 0:
+                    reservation['waited'] = time.monotonic() - started
+                    return reservation
+            if time.monotonic() + wait > deadline:
+                raise RateLimitTimeout(model, wait)
+            time.sleep(wait)
+
+    async def aacquire(self, model, input_tokens=0, output_tokens=0, max_wait=None):
+        """
+        Асинхронный вариант acquire() для кода под ASGI.
+
+        Обращения к базе ограничителя выполняются в потоке, а ожидание
+        пополнения корзин — через asyncio.sleep, поэтому цикл событий не
+        блокируется и остальные запросы процесса продолжают работать.
+        """
+        amounts = {'rpm': 1, 'itpm': input_tokens, 'otpm': output_tokens}
+        reservation = {'model': model, 'itpm': input_tokens, 'otpm': output_tokens, 'waited': 0.0}
+        if not self.limits_for(model):
+            return reservation
+
+        max_wait = self.max_wait if max_wait is None else max_wait
+        deadline = time.monotonic() + max_wait
+        started = time.monotonic()
+        while True:
+            try:
+                wait = await asyncio.to_thread(self._try_take, model, amounts)
+            except sqlite3.OperationalError as e:
+                if not is_lock_error(e):
+                    raise
+                wait = 0.01
+            else:
+                if wait == 0:
+                    reservation['waited'] = time.monotonic() - started
+                    return reservation
+            if time.monotonic() + wait > deadline:
+                raise RateLimitTimeout(model, wait)
+            await asyncio.sleep(wait)
+
+    async def asettle(self, reservation, input_tokens=None, output_tokens=None):
+        """Асинхронный вариант settle()."""
+        await asyncio.to_thread(self.settle, reservation, input_tokens, output_tokens)
+
+    def settle(self, reservation, input_tokens=None, output_tokens=None):
+        """
+        Уточняет резерв по фактическому расходу токенов.
+
+        Неизрасходованная часть резерва возвращается в корзины, перерасход
+        списывается (корзина может уйти в минус и восстановится со временем).
+        """
+        adjustments = {}
+        if input_tokens is not None:
+            adjustments['itpm'] = reservation['itpm'] - input_tokens
+        if output_tokens is not None:
+            adjustments['otpm'] = reservation['otpm'] - output_tokens
+        limits = self.limits_for(reservation['model'])
+        adjustments = {dimension: delta for dimension, delta in adjustments.items() if delta and dimension in limits}
+        if not adjustments:
+            return
+        conn = self._connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for dimension, delta in adjustments.items():
+                conn.execute(
+                    'UPDATE rate_limit_bucket SET tokens = MIN(?, tokens + ?) WHERE key = ?',
+                    (limits[dimension], delta, f"{reservation['model']}:{dimension}")
+                )
+            conn.execute('COMMIT')
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            # Уточнение резерва не критично: при блокировке корзины восстановятся сами
+            if not is_lock_error(e):
+                raise
+
+
+def estimate_tokens(text):
+    """Оценивает число токенов текста по RATE_LIMIT_CHARS_PER_TOKEN символов на токен."""
+    chars_per_token = getattr(settings, 'RATE_LIMIT_CHARS_PER_TOKEN', 3.0)
+    return int(len(text or '') / chars_per_token) + 1
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Возвращает общий ограничитель процесса или None, если ограничение выключено.
+    """
+    global _limiter
+    if not getattr(settings, 'RATE_LIMIT_ENABLED', False):
+        return None
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter(
+                path=settings.RATE_LIMIT_DB_PATH,
+                limits=settings.CLAUDE_RATE_LIMITS,
+                max_wait=getattr(settings, 'RATE_LIMIT_MAX_WAIT', 30.0),
+            )
+    return _limiter
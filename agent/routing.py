@@ -0,0 +1,219 @@
+"""
+Выбор модели Claude по размеру запроса, типу задачи и статистике моделей.
+
+Правила маршрутизации задаются в settings.MODEL_ROUTING_RULES и проверяются
+по порядку; первое подходящее правило дает список моделей-кандидатов.
+Например, короткий пользовательский запрос по JSON-файлу незачем отправлять
+в ту же модель, что и сравнение отчетов на 40 тысяч токенов.
+
+Кандидаты правила упорядочиваются по скользящей статистике (задержка и доля
+ошибок за MODEL_ROUTING_STATS_WINDOW секунд), которая строится по журналу
+решений ModelRouteDecision, поэтому общая для всех воркеров. Модели с долей
+ошибок выше MODEL_ROUTING_MAX_ERROR_RATE уходят в конец списка. После
+кандидатов идут обычные резервные модели сервиса.
+"""
+import statistics
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .db import retry_on_lock
+from .models import ModelRouteDecision
+
+TASK_COMPARISON = 'comparison'
+TASK_CUSTOM = 'custom'
+
+
+class RouteDecision:
+    """
+    Решение маршрутизатора для одного запроса.
+
+    Атрибуты:
+        rule (str): Имя сработавшего правила ('default', если ни одно не подошло)
+        task_type (str): 'comparison' или 'custom'
+        prompt_tokens (int): Оценка входных токенов запроса
+        models (list): Модели в порядке попыток
+        attempts (list): Результаты попыток: {'model', 'latency_ms', 'error'}
+    """
+
+    def __init__(self, rule, task_type, prompt_tokens, models):
+        self.rule = rule
+        self.task_type = task_type
+        self.prompt_tokens = prompt_tokens
+        self.models = models
+        self.attempts = []
+
+    def add_attempt(self, model, latency, error=None):
+        """Запоминает попытку запроса к модели (latency — в секундах)."""
+        self.attempts.append({
+            'model': model,
+            'latency_ms': round(latency * 1000),
+            'error': str(error)[:500] if error else None,
+        })
+
+
+class ModelRouter:
+    """
+    Маршрутизатор моделей.
+
+    Параметры:
+        default_model (str): Основная модель (settings.MODEL_NAME)
+        fallback_models (list): Резервные модели, которые пробуются после кандидатов
+        rules (list, optional): Правила вместо settings.MODEL_ROUTING_RULES
+
+    Формат правила:
+        ```python
+        {
+            'name': 'small',               # имя в журнале решений
+            'task': 'custom',              # 'comparison', 'custom' или None — любая задача
+            'min_prompt_tokens': 0,        # границы размера запроса (необязательные)
+            'max_prompt_tokens': 3000,
+            'models': ['claude-3-5-haiku-20241022', 'claude-3-7-sonnet-20250219'],
+            'prefer': 'latency',           # 'latency' — сначала самая быстрая модель,
+        }                                  # 'order' — в порядке списка
+        ```
+    """
+
+    def __init__(self, default_model, fallback_models, rules=None):
+        self.default_model = default_model
+        self.fallback_models = fallback_models
+        self.rules = getattr(settings, 'MODEL_ROUTING_RULES', []) if rules is None else rules
+        self.enabled = getattr(settings, 'MODEL_ROUTING_ENABLED', True)
+
+    def match_rule(self, prompt_tokens, task_type):
+        """Возвращает первое правило, подходящее под размер и тип задачи, или None."""
+        if not self.enabled:
+            return None
+        for rule in self.rules:
+            if rule.get('task') and rule['task'] != task_type:
+                continue
+            if prompt_tokens < rule.get('min_prompt_tokens', 0):
+                continue
+            if rule.get('max_prompt_tokens') is not None and prompt_tokens > rule['max_prompt_tokens']:
+                continue
+            return rule
+        return None
+
+    def route(self, prompt_tokens, task_type):
+        """
+        Выбирает порядок моделей для запроса.
+
+        Параметры:
+            prompt_tokens (int): Оценка входных токенов
+            task_type (str): 'comparison' или 'custom'
+
+        Возвращает:
+            RouteDecision: Решение со списком моделей в порядке попыток
+        """
+        rule = self.match_rule(prompt_tokens, task_type)
+        if rule is None:
+            candidates, name = [self.default_model], 'default'
+        else:
+            candidates, name = self.rank(rule['models'], rule.get('prefer', 'latency')), rule.get('name', 'rule')
+        models = list(dict.fromkeys(candidates + [self.default_model] + self.fallback_models))
+        return RouteDecision(name, task_type, prompt_tokens, models)
+
+    @staticmethod
+    def rank(models, prefer='latency'):
+        """
+        Упорядочивает кандидатов по статистике: сначала исправные модели, затем
+        (при prefer='latency') по медианной задержке. Модели, по которым мало
+        наблюдений, считаются быстрыми, чтобы статистика по ним набиралась.
+        """
+        stats = model_stats()
+        min_samples = getattr(settings, 'MODEL_ROUTING_MIN_SAMPLES', 5)
+        max_error_rate = getattr(settings, 'MODEL_ROUTING_MAX_ERROR_RATE', 0.5)
+
+        def key(model):
+            model_stat = stats.get(model)
+            if not model_stat or model_stat['requests'] < min_samples:
+                return (False, 0)
+            unhealthy = model_stat['error_rate'] > max_error_rate
+            latency = (model_stat['p50_ms'] or 0) if prefer == 'latency' else 0
+            return (unhealthy, latency)
+
+        # sorted устойчива: при равенстве сохраняется порядок из правила
+        return sorted(models, key=key)
+
+
+_stats_cache = {'expires': 0.0, 'stats': {}}
+_stats_lock = threading.Lock()
+
+
+def model_stats(refresh=False):
+    """
+    Скользящая статистика моделей по журналу решений.
+
+    Результат кэшируется в процессе на MODEL_ROUTING_STATS_TTL секунд, чтобы
+    маршрутизация не добавляла запрос к базе на каждый анализ.
+
+    Возвращает:
+        dict: {модель: {'requests', 'errors', 'error_rate', 'p50_ms'}}
+    """
+    with _stats_lock:
+        if not refresh and time.monotonic() < _stats_cache['expires']:
+            return _stats_cache['stats']
+
+    window = getattr(settings, 'MODEL_ROUTING_STATS_WINDOW', 900)
+    since = timezone.now() - timedelta(seconds=window)
+    attempts = ModelRouteDecision.objects.filter(created_at__gte=since).order_by('-created_at').values_list(
+        'attempts', flat=True
+    )[:getattr(settings, 'MODEL_ROUTING_STATS_SAMPLE', 500)]
+
+    collected = {}
+    for decision_attempts in attempts:
+        for attempt in decision_attempts or []:
+            model_stat = collected.setdefault(attempt['model'], {'requests': 0, 'errors': 0, 'latencies': []})
+            model_stat['requests'] += 1
+            if attempt.get('error'):
+                model_stat['errors'] += 1
+            else:
+                model_stat['latencies'].append(attempt['latency_ms'])
+    stats = {
+        model: {
+            'requests': model_stat['requests'],
+            'errors': model_stat['errors'],
+            'error_rate': model_stat['errors'] / model_stat['requests'],
+            'p50_ms': statistics.median(model_stat['latencies']) if model_stat['latencies'] else None,
+        }
+        for model, model_stat in collected.items()
+    }
+    with _stats_lock:
+        _stats_cache['stats'] = stats
+        _stats_cache['expires'] = time.monotonic() + getattr(settings, 'MODEL_ROUTING_STATS_TTL', 30)
+    return stats
+
+
+@retry_on_lock
+def record_decision(decision, analysis=None):
+    """
+    Сохраняет решение маршрутизатора и наблюдаемую задержку в журнал.
+
+    Параметры:
+        decision (RouteDecision): Решение с заполненными попытками
+        analysis (Analysis, optional): Анализ, для которого выполнялся запрос
+
+    Решение без попыток (лимит запросов не освободился, анализ отменен до
+    запроса) не записывается: о моделях оно ничего не говорит и исказило бы
+    долю успешных ответов в routing_report.
+
+    Возвращает:
+        ModelRouteDecision | None: Запись журнала
+    """
+    if not decision.attempts:
+        return None
+    succeeded = [attempt for attempt in decision.attempts if not attempt['error']]
+    return ModelRouteDecision.objects.create(
+        analysis=analysis,
+        rule=decision.rule,
+        task_type=decision.task_type,
+        prompt_tokens=decision.prompt_tokens,
+        chosen_model=decision.models[0],
+        model_used=succeeded[-1]['model'] if succeeded else None,
+        success=bool(succeeded),
+        latency_ms=sum(attempt['latency_ms'] for attempt in decision.attempts),
+        attempts=decision.attempts,
+    )
@@ -0,0 +1,273 @@
+"""
+Извлечение текста в отдельных процессах с ограничениями.
+
+Поврежденный PDF может заставить PyPDF2 работать минутами, а XLSX-бомба —
+исчерпать память в load_workbook. Чтобы это не занимало и не роняло воркер
+сервера, FileProcessor.get_document_text передает файл в пул процессов
+(ExtractionPool) со следующими ограничениями:
+
+- время процессора на задание — RLIMIT_CPU (EXTRACTION_CPU_LIMIT): при
+  превышении ядро завершает процесс сигналом SIGXCPU;
+- время ожидания результата (EXTRACTION_TIMEOUT): процесс, не ответивший
+  вовремя (например, завис на вводе-выводе), принудительно завершается;
+- память — RLIMIT_AS (EXTRACTION_MEMORY_LIMIT_MB): выделение сверх лимита
+  вызывает MemoryError, после чего процесс завершается.
+
+Вместо завершенного процесса запускается новый; процессы также
+перезапускаются после EXTRACTION_WORKER_MAX_JOBS заданий, чтобы не
+накапливать память. Нарушение лимита или ошибка разбора выбрасываются как
+ExtractionError. Если задание передано с CancelToken (agent.cancellation),
+ожидание результата прерывается при отмене анализа, а процесс завершается.
+Размер пула — EXTRACTION_WORKERS (по умолчанию 2): одновременно выполняется
+не больше заданий, остальные ждут. Пул есть в каждом воркере сервера, а
+каждый процесс пула выполняет django.setup(), поэтому процессы запускаются
+при первом задании, которому не хватило свободного процесса, а не заранее.
+"""
+import math
+import multiprocessing
+import os
+import queue
+import resource
+import signal
+import threading
+import time
+
+from django.conf import settings
+
+from . import log, metrics
+from .cancellation import AnalysisCancelled
+
+logger = log.get_logger(__name__)
+
+
+class ExtractionError(Exception):
+    """Текст не извлечен: превышен лимит ресурсов, процесс аварийно завершился или файл не разобран."""
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+
+def _worker_main(conn, cpu_limit, memory_limit):
+    """Цикл процесса извлечения: получает путь к файлу, возвращает ('ok', текст) или ошибку."""
+    import django
+    django.setup()
+    from .services import FileProcessor
+
+    # Процесс завершается только по команде родителя, Ctrl+C в терминале его не касается
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    while True:
+        try:
+            file_path = conn.recv()
+        except EOFError:
+            return
+        if file_path is None:
+            return
+        # RLIMIT_CPU считает время процесса целиком, поэтому лимит сдвигается на уже израсходованное
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        used = math.ceil(usage.ru_utime + usage.ru_stime)
+        resource.setrlimit(resource.RLIMIT_CPU, (used + cpu_limit, resource.RLIM_INFINITY))
+        try:
+            conn.send(('ok', FileProcessor.extract_text_from_file(file_path)))
+        except MemoryError:
+            conn.send(('memory', None))
+            return
+        except Exception as e:
+            conn.send(('error', f'{type(e).__name__}: {e}'))
+
+
+class _Worker:
+    def __init__(self, context, cpu_limit, memory_limit):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, cpu_limit, memory_limit), name='extraction-worker', daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class ExtractionPool:
+    """
+    Пул процессов извлечения текста с ограничениями времени и памяти.
+
+    Параметры:
+        size (int): Число процессов (одновременных заданий)
+        timeout (float): Предельное время ожидания результата, с
+        cpu_limit (int): Время процессора на задание, с
+        memory_limit_mb (int): Лимит адресного пространства процесса, МБ (0 — без лимита)
+        max_jobs (int): Заданий до перезапуска процесса
+
+    Использование:
+        ```python
+        text = get_extraction_pool().extract('/tmp/report.pdf')
+        ```
+    """
+
+    def __init__(self, size, timeout, cpu_limit, memory_limit_mb, max_jobs):
+        self.size = size
+        self.timeout = timeout
+        self.cpu_limit = cpu_limit
+        self.memory_limit = memory_limit_mb * 1024 * 1024
+        self.max_jobs = max_jobs
+        # spawn, а не fork: воркер сервера многопоточный, копировать его состояние небезопасно
+        self._context = multiprocessing.get_context('spawn')
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+        self._workers = set()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _start(self):
+        worker = _Worker(self._context, self.cpu_limit, self.memory_limit)
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def _discard(self, worker, kill=True):
+        with self._lock:
+            self._workers.discard(worker)
+        if kill:
+            worker.kill()
+        else:
+            worker.stop()
+
+    def extract(self, file_path, cancel=None):
+        """
+        Извлекает текст из файла в процессе пула.
+
+        Параметры:
+            file_path (str): Путь к файлу, доступный процессам пула
+            cancel (CancelToken, optional): Признак отмены анализа
+
+        Возвращает:
+            str: Результат FileProcessor.extract_text_from_file
+
+        Исключения:
+            ExtractionError: Превышен лимит времени или памяти, процесс
+                аварийно завершился или при разборе возникла ошибка
+            AnalysisCancelled: Анализ отменен во время извлечения
+        """
+        with self._slots:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                worker = self._start()
+            try:
+                content = self._run(worker, file_path, cancel)
+            except ExtractionError as e:
+                metrics.observe_extraction_failure(e.reason)
+                logger.warning("Извлечение текста из %s прервано: %s", file_path, e, extra={'reason': e.reason})
+                raise
+            finally:
+                self._release(worker)
+            return content
+
+    def _wait(self, worker, cancel):
+        """Ждет результата не дольше self.timeout, проверяя отмену анализа."""
+        if cancel is None:
+            return worker.conn.poll(self.timeout)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if worker.conn.poll(max(min(remaining, settings.CANCEL_CHECK_INTERVAL), 0)):
+                return True
+            if remaining <= 0:
+                return False
+            try:
+                cancel.check()
+            except AnalysisCancelled:
+                # Результат больше не нужен: процесс завершается, чтобы не тратить процессор
+                worker.kill()
+                raise
+
+    def _run(self, worker, file_path, cancel=None):
+        worker.jobs += 1
+        try:
+            worker.conn.send(file_path)
+            if not self._wait(worker, cancel):
+                worker.kill()
+                raise ExtractionError(f'превышено время извлечения ({self.timeout:g} с)', 'timeout')
+            status, payload = worker.conn.recv()
+        except (EOFError, OSError):
+            worker.process.join()
+            exitcode = worker.process.exitcode
+            if exitcode == -signal.SIGXCPU:
+                raise ExtractionError(f'превышен лимит процессорного времени ({self.cpu_limit} с)', 'cpu')
+            if exitcode == -signal.SIGKILL:
+                # Так процесс завершает системный OOM killer
+                raise ExtractionError('процесс извлечения завершен системой (нехватка памяти)', 'memory')
+            raise ExtractionError(f'процесс извлечения аварийно завершился (код {exitcode})', 'crashed')
+
+        if status == 'memory':
+            worker.process.join()
+            raise ExtractionError(f'превышен лимит памяти ({self.memory_limit // 1024 // 1024} МБ)', 'memory')
+        if status == 'error':
+            raise ExtractionError(payload, 'error')
+        return payload
+
+    def _release(self, worker):
+        if not worker.process.is_alive():
+            self._discard(worker)
+        elif worker.jobs >= self.max_jobs or self._closed:
+            self._discard(worker, kill=False)
+        else:
+            self._idle.put(worker)
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            workers = list(self._workers)
+        for worker in workers:
+            self._discard(worker, kill=False)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_extraction_pool():
+    """
+    Возвращает пул извлечения текста процесса (создается при первом вызове) или None, если песочница выключена.
+    """
+    global _pool
+    if not getattr(settings, 'EXTRACTION_SANDBOX_ENABLED', False):
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExtractionPool(
+                size=settings.EXTRACTION_WORKERS,
+                timeout=settings.EXTRACTION_TIMEOUT,
+                cpu_limit=settings.EXTRACTION_CPU_LIMIT,
+                memory_limit_mb=settings.EXTRACTION_MEMORY_LIMIT_MB,
+                max_jobs=settings.EXTRACTION_WORKER_MAX_JOBS,
+            )
+    return _pool
+
+
+def _reset_after_fork():
+    # Процессы пула принадлежат родителю; дочерний процесс (gunicorn --preload) создаст свой пул
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,302 @@
+"""
+Планировщик выполнения анализов: классы приоритета и справедливая очередь.
+
+Без планировщика анализ выполняется сразу на том воркере, который принял
+запрос, и массовая отправка одного клиента занимает весь запас запросов к
+Claude, а интерактивные анализы из веб-интерфейса ждут за ней. Теперь
+анализ (run_analysis, arun_analysis, потоковая выдача SSE, пакеты) перед
+выполнением получает один из ANALYSIS_CONCURRENCY слотов — общих для всех
+процессов, их число считается по анализам в статусе 'processing' в базе.
+Если слотов нет, воркер ждет в очереди, порядок которой такой:
+
+1. класс приоритета: 'interactive' (веб-интерфейс), затем 'normal' (API),
+   затем 'bulk' (пакеты, массовые задачи);
+2. внутри класса — по очереди между клиентами (Analysis.client): k-й
+   ожидающий анализ клиента идет после первых анализов остальных клиентов,
+   а уже выполняющиеся анализы клиента сдвигают его назад;
+3. затем по времени постановки в очередь.
+
+Чтобы массовые задачи не ждали бесконечно, за каждые SCHEDULER_AGING секунд
+ожидания анализ поднимается на один класс. Ожидание в очереди (started_at -
+queued_at) по классам видно в админке и в метрике agent_queue_wait_seconds.
+
+Ожидающий синхронный запрос занимает поток воркера gunicorn, поэтому
+массовые задачи лучше отправлять пакетом (/api/batches/) или через
+асинхронные эндпоинты: их ожидание не занимает воркер.
+"""
+import asyncio
+import re
+import time
+from collections import Counter
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from . import log, metrics
+from .accounting import percentile
+from .models import PRIORITIES, Analysis
+
+logger = log.get_logger(__name__)
+
+RANKS = {priority: rank for rank, (priority, _) in enumerate(PRIORITIES)}
+# Как часто ожидающий воркер подтверждает, что он жив; ожидание без
+# подтверждения дольше STALE_AFTER не учитывается в очереди
+HEARTBEAT_INTERVAL = 5.0
+STALE_AFTER = HEARTBEAT_INTERVAL * 3
+# Идентификатор клиента из заголовка принимается, только если он не ломает журнал и админку
+_CLIENT_RE = re.compile(r'^[A-Za-z0-9._:@-]{1,64}$')
+
+
+def _user(request):
+    """
+    Пользователь запроса или None.
+
+    Middleware выполняется до аутентификации DRF и видит только пользователя
+    сессии, поэтому остальные способы аутентификации API (Basic) проверяются
+    здесь; в представлении DRF request.user уже определен.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user
+    if isinstance(request, Request):
+        return None
+    drf_request = Request(request)
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        if issubclass(authentication_class, SessionAuthentication):
+            continue
+        try:
+            result = authentication_class().authenticate(drf_request)
+        except APIException:
+            # Неверные учетные данные отклонит представление
+            return None
+        if result is not None:
+            return result[0]
+    return None
+
+
+def owner_id(request):
+    """
+    Владелец ресурсов запроса: ключей Idempotency-Key и вебхуков.
+
+    Определяется только по учетным данным: пользователь (сессия или
+    аутентификация API), для анонимного запроса — IP-адрес. Заголовку
+    X-Client-ID здесь не доверяют: его может прислать любой.
+
+    Параметры:
+        request (HttpRequest | rest_framework.request.Request): Запрос
+
+    Возвращает:
+        str: Идентификатор владельца, например 'user:admin' или 'ip:10.0.0.5'
+    """
+    user = _user(request)
+    if user is not None:
+        return f'user:{user.get_username()}'[:100]
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def client_id(request):
+    """
+    Клиент, от имени которого создается анализ (для справедливой очереди).
+
+    Пользователь, если он вошел; иначе заголовок X-Client-ID (например, имя
+    интеграции); иначе IP-адрес. Заголовок — только подсказка для очереди и
+    не дает доступа к чужим ресурсам: для этого служит owner_id().
+
+    Параметры:
+        request (HttpRequest): Запрос
+
+    Возвращает:
+        str: Идентификатор клиента, например 'user:admin', 'key:crm' или 'ip:10.0.0.5'
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.get_username()}'[:100]
+    header = request.headers.get('X-Client-ID', '')
+    if _CLIENT_RE.match(header):
+        return f'key:{header}'
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def _rank(priority, queued_at, now):
+    waited = (now - queued_at).total_seconds()
+    return max(RANKS.get(priority, RANKS['normal']) - int(waited // settings.SCHEDULER_AGING), 0)
+
+
+def queue_order(waiting, running, now):
+    """
+    Порядок ожидающих анализов.
+
+    Параметры:
+        waiting (list): Ожидающие анализы: [(pk, priority, client, queued_at)]
+        running (Counter): Выполняющиеся анализы по клиентам
+        now (datetime): Текущее время (для повышения класса за ожидание)
+
+    Возвращает:
+        list: pk анализов в порядке обслуживания
+
+    Примеры:
+        >>> queue_order([(1, 'bulk', 'a', t0), (2, 'bulk', 'a', t0), (3, 'bulk', 'b', t1)], Counter(), t1)
+        [1, 3, 2]
+    """
+    position = Counter()
+    keyed = []
+    for pk, priority, client, queued_at in sorted(waiting, key=lambda row: row[3]):
+        keyed.append(((_rank(priority, queued_at, now), running[client] + position[client], queued_at), pk))
+        position[client] += 1
+    keyed.sort(key=lambda item: item[0])
+    return [pk for _, pk in keyed]
+
+
+def _running(now):
+    # Анализ, начатый дольше SCHEDULER_RUN_TIMEOUT назад, считается брошенным
+    # (процесс воркера завершился) и слот не занимает
+    return Analysis.objects.filter(
+        status='processing', execution_mode='sync',
+        started_at__gte=now - timedelta(seconds=settings.SCHEDULER_RUN_TIMEOUT),
+    )
+
+
+def _waiting(now):
+    return Analysis.objects.filter(
+        status='pending', execution_mode='sync', heartbeat_at__gte=now - timedelta(seconds=STALE_AFTER),
+    )
+
+
+def _start(analysis, now):
+    if not analysis.set_status('processing', started_at=now, heartbeat_at=None):
+        return False
+    metrics.observe_queue_wait(analysis.priority, max((now - analysis.queued_at).total_seconds(), 0))
+    return True
+
+
+class _Waiter:
+    """Место анализа в очереди: проверяет, подошла ли его очередь, и подтверждает ожидание."""
+
+    def __init__(self, analysis):
+        self.analysis = analysis
+        self.heartbeat = 0.0
+
+    def _beat(self, now):
+        if time.monotonic() - self.heartbeat < HEARTBEAT_INTERVAL:
+            return True
+        self.heartbeat = time.monotonic()
+        return Analysis.objects.filter(pk=self.analysis.pk, status='pending').update(heartbeat_at=now) > 0
+
+    def poll(self):
+        """
+        Возвращает:
+            bool | None: True — анализ взят в работу; False — анализ уже не в
+                очереди (отменен или взят другим воркером); None — ждать дальше
+        """
+        now = timezone.now()
+        if not self._beat(now):
+            return False
+        running = _running(now)
+        taken = Counter(running.values_list('client', flat=True))
+        free = settings.ANALYSIS_CONCURRENCY - sum(taken.values())
+        if free <= 0:
+            return None
+        order = queue_order(list(_waiting(now).values_list('pk', 'priority', 'client', 'queued_at')), taken, now)
+        if self.analysis.pk not in order[:free]:
+            return None
+        # Решение принято по снимку очереди; под блокировкой записи (IMMEDIATE)
+        # перепроверяется только число занятых слотов
+        with transaction.atomic():
+            if running.count() >= settings.ANALYSIS_CONCURRENCY:
+                return None
+            return _start(self.analysis, now)
+
+
+def acquire(analysis, cancel):
+    """
+    Ждет свободного слота и берет анализ в работу ('pending' → 'processing').
+
+    Параметры:
+        analysis (Analysis): Анализ в статусе 'pending'
+        cancel (CancelToken): Отмена и deadline прерывают ожидание
+
+    Возвращает:
+        bool: False, если анализ уже не в очереди (отменен или взят другим воркером)
+
+    Исключения:
+        AnalysisCancelled: Анализ отменен или истек его deadline во время ожидания
+
+    Примеры:
+        >>> if not scheduler.acquire(analysis, cancel):
+        ...     return
+    """
+    if not settings.ANALYSIS_CONCURRENCY:
+        return _start(analysis, timezone.now())
+    waiter = _Waiter(analysis)
+    while True:
+        started = waiter.poll()
+        if started is not None:
+            return started
+        cancel.check()
+        time.sleep(settings.SCHEDULER_POLL_INTERVAL)
+
+
+async def aacquire(analysis, cancel):
+    """Асинхронный вариант acquire(): ожидание не занимает поток."""
+    if not settings.ANALYSIS_CONCURRENCY:
+        return await sync_to_async(_start)(analysis, timezone.now())
+    waiter = _Waiter(analysis)
+    while True:
+        started = await sync_to_async(waiter.poll)()
+        if started is not None:
+            return started
+        cancel.check()
+        await asyncio.sleep(settings.SCHEDULER_POLL_INTERVAL)
+
+
+def queue_wait_report(days=7):
+    """
+    Ожидание в очереди по классам приоритета.
+
+    Параметры:
+        days (int): За сколько последних дней учитывать начатые анализы
+
+    Возвращает:
+        list: Строки {'priority', 'label', 'count', 'wait_p50_s', 'wait_p95_s', 'wait_max_s',
+              'waiting', 'oldest_wait_s'} в порядке классов; waiting и oldest_wait_s —
+              анализы, ожидающие сейчас
+
+    Примеры:
+        >>> queue_wait_report(days=1)
+        [{'priority': 'interactive', 'label': 'Интерактивный', 'count': 12, 'wait_p50_s': 0.4, ...}, ...]
+    """
+    now = timezone.now()
+    waits = {priority: [] for priority, _ in PRIORITIES}
+    rows = (
+        Analysis.objects.filter(execution_mode='sync', started_at__gte=now - timedelta(days=days))
+        .values_list('priority', 'queued_at', 'started_at')
+    )
+    for priority, queued_at, started_at in rows.iterator():
+        waits.setdefault(priority, []).append(max((started_at - queued_at).total_seconds(), 0))
+    waiting = {priority: [] for priority in waits}
+    for priority, queued_at in _waiting(now).values_list('priority', 'queued_at'):
+        waiting.setdefault(priority, []).append((now - queued_at).total_seconds())
+
+    def seconds(value):
+        return round(value, 1) if value is not None else None
+
+    return [
+        {
+            'priority': priority,
+            'label': label,
+            'count': len(waits[priority]),
+            'wait_p50_s': seconds(percentile(waits[priority], 0.5)),
+            'wait_p95_s': seconds(percentile(waits[priority], 0.95)),
+            'wait_max_s': seconds(max(waits[priority], default=None)),
+            'waiting': len(waiting[priority]),
+            'oldest_wait_s': seconds(max(waiting[priority], default=None)),
+        }
+        for priority, label in PRIORITIES
+    ]
@@ -0,0 +1,223 @@
+"""
+Полнотекстовый поиск по документам и результатам анализов.
+
+Индекс хранится в виртуальной таблице SQLite FTS5. Строкам индекса
+соответствуют записи служебной таблицы agent_search_entry, которая связывает
+целочисленный rowid FTS5 с UUID документа или анализа: так обновление и
+удаление записи выполняются по ключу, без полного просмотра индекса.
+
+Индекс обновляется при извлечении текста документа, при изменении названия
+документа и при завершении анализа (см. agent/signals.py и Analysis.set_status).
+"""
+import html
+import re
+import uuid
+
+from django.db import connection, transaction
+
+from .db import retry_on_lock
+
+INDEX_TABLE = 'agent_search_index'
+ENTRY_TABLE = 'agent_search_entry'
+
+SCHEMA_SQL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {ENTRY_TABLE} (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        object_id TEXT NOT NULL,
+        UNIQUE (kind, object_id)
+    )
+    """,
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {INDEX_TABLE} USING fts5(
+        title, body, prompt,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+]
+
+# Веса столбцов для bm25: совпадение в названии важнее совпадения в тексте
+COLUMN_WEIGHTS = (5.0, 1.0, 2.0)
+
+# Границы совпадений в сниппете: управляющие символы вместо <mark>, потому что
+# индексированный текст не экранирован — сниппет экранируется, и лишь затем
+# границы заменяются тегами (см. _highlight)
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+SEARCH_SQL = f"""
+    SELECT e.kind, e.object_id, i.title,
+           snippet({INDEX_TABLE}, -1, '{MARK_START}', '{MARK_END}', '…', 16),
+           bm25({INDEX_TABLE}, {', '.join(str(w) for w in COLUMN_WEIGHTS)}) AS score
+    FROM {INDEX_TABLE} AS i
+    JOIN {ENTRY_TABLE} AS e ON e.id = i.rowid
+    WHERE {INDEX_TABLE} MATCH %s {{kind_filter}}
+    ORDER BY score
+    LIMIT %s OFFSET %s
+"""
+
+KIND_DOCUMENT = 'document'
+KIND_ANALYSIS = 'analysis'
+
+
+def is_available():
+    """Полнотекстовый поиск доступен только при работе с SQLite."""
+    return connection.vendor == 'sqlite'
+
+
+def build_match_query(query):
+    """
+    Преобразует пользовательскую строку в безопасный запрос FTS5.
+
+    Каждое слово берется в кавычки (операторы FTS5 в пользовательском вводе
+    не интерпретируются), слова объединяются через AND, а последнее слово
+    ищется по префиксу, чтобы поиск работал по мере набора.
+
+    Параметры:
+        query (str): Строка поиска от пользователя
+
+    Возвращает:
+        str | None: Выражение для MATCH или None, если в строке нет слов
+
+    Примеры:
+        >>> build_match_query('выручка 2024 кварт')
+        '"выручка" "2024" "кварт"*'
+    """
+    terms = re.findall(r'\w+', query or '')
+    if not terms:
+        return None
+    parts = [f'"{term}"' for term in terms]
+    parts[-1] += '*'
+    return ' '.join(parts)
+
+
+def _highlight(snippet):
+    """Экранирует сниппет для HTML и выделяет совпадения тегом <mark>."""
+    return html.escape(snippet or '').replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+def _entry_id(cursor, kind, object_id):
+    cursor.execute(
+        f"INSERT OR IGNORE INTO {ENTRY_TABLE} (kind, object_id) VALUES (%s, %s)",
+        [kind, object_id.hex]
+    )
+    cursor.execute(
+        f"SELECT id FROM {ENTRY_TABLE} WHERE kind = %s AND object_id = %s",
+        [kind, object_id.hex]
+    )
+    return cursor.fetchone()[0]
+
+
+@retry_on_lock
+def _index(kind, object_id, title, body, prompt):
+    if not is_available():
+        return
+    with transaction.atomic(), connection.cursor() as cursor:
+        rowid = _entry_id(cursor, kind, object_id)
+        cursor.execute(f"DELETE FROM {INDEX_TABLE} WHERE rowid = %s", [rowid])
+        cursor.execute(
+            f"INSERT INTO {INDEX_TABLE} (rowid, title, body, prompt) VALUES (%s, %s, %s, %s)",
+            [rowid, title or '', body or '', prompt or '']
+        )
+
+
+def index_document(document):
+    """Добавляет или обновляет документ в индексе (название и извлеченный текст)."""
+    _index(KIND_DOCUMENT, document.pk, document.name, document.extracted_text, '')
+
+
+def index_analysis(analysis):
+    """Добавляет или обновляет анализ в индексе (результат и пользовательский запрос)."""
+    _index(KIND_ANALYSIS, analysis.pk, '', analysis.result, analysis.custom_prompt)
+
+
+@retry_on_lock
+def remove(kind, object_id):
+    """Удаляет объект из индекса."""
+    if not is_available():
+        return
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT id FROM {ENTRY_TABLE} WHERE kind = %s AND object_id = %s",
+            [kind, object_id.hex]
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return
+        cursor.execute(f"DELETE FROM {INDEX_TABLE} WHERE rowid = %s", [row[0]])
+        cursor.execute(f"DELETE FROM {ENTRY_TABLE} WHERE id = %s", [row[0]])
+
+
+def search(query, kind=None, limit=20, offset=0):
+    """
+    Ищет документы и анализы по содержимому с ранжированием bm25.
+
+    Параметры:
+        query (str): Строка поиска
+        kind (str, optional): 'document' или 'analysis' для фильтрации по типу
+        limit (int): Максимальное количество результатов
+        offset (int): Смещение для постраничного вывода
+
+    Возвращает:
+        list: Список словарей с ключами type, id, title, snippet и score
+              (чем больше score, тем релевантнее результат); snippet — HTML:
+              текст экранирован, совпадения выделены тегом <mark>
+
+    Примеры:
+        >>> for hit in search('выручка'):
+        ...     print(hit['type'], hit['id'], hit['snippet'])
+    """
+    match = build_match_query(query)
+    if match is None or not is_available():
+        return []
+    params = [match]
+    kind_filter = ''
+    if kind:
+        kind_filter = 'AND e.kind = %s'
+        params.append(kind)
+    params += [limit, offset]
+    with connection.cursor() as cursor:
+        cursor.execute(SEARCH_SQL.format(kind_filter=kind_filter), params)
+        rows = cursor.fetchall()
+    return [
+        {
+            'type': row_kind,
+            'id': str(uuid.UUID(object_id)),
+            'title': title,
+            'snippet': _highlight(snippet),
+            'score': -score,
+        }
+        for row_kind, object_id, title, snippet, score in rows
+    ]
+
+
+def matching_ids(kind, query, limit=1000):
+    """Возвращает UUID объектов заданного типа, подходящих под запрос (для админки)."""
+    return [hit['id'] for hit in search(query, kind=kind, limit=limit)]
+
+
+def rebuild():
+    """
+    Полностью перестраивает индекс по текущему содержимому базы.
+
+    Возвращает:
+        tuple: (количество проиндексированных документов, количество анализов)
+    """
+    from .models import Analysis, Document
+
+    if not is_available():
+        return 0, 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {INDEX_TABLE}")
+        cursor.execute(f"DELETE FROM {ENTRY_TABLE}")
+    documents = 0
+    for document in Document.objects.only('id', 'name', 'extracted_text').iterator():
+        index_document(document)
+        documents += 1
+    analyses = 0
+    for analysis in Analysis.objects.filter(status='completed').only('id', 'result', 'custom_prompt').iterator():
+        index_analysis(analysis)
+        analyses += 1
+    return documents, analyses
@@ -1,5 +1,12 @@
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Document, Analysis
+from django.urls import reverse
+from .models import Document, Analysis, AnalysisBatch, WebhookEndpoint
+from .batches import create_batch, missing_document_ids
+from . import scheduler, webhooks
+from .accounting import METRIC_FIELDS
 
 class DocumentSerializer(serializers.ModelSerializer):
     """
@@ -13,13 +20,21 @@ class DocumentSerializer(serializers.ModelSerializer):
     - name: Название документа (опциональное, если не указано, используется имя файла)
     - file_type: Тип файла (только для чтения, определяется автоматически)
     - uploaded_at: Дата и время загрузки (только для чтения)
+    - extraction_error: Причина, по которой не удалось извлечь текст (только для чтения)
+    - download_url: Адрес для скачивания файла (только для чтения; работает и без DEBUG)
     """
     name = serializers.CharField(max_length=255, required=False)
+    download_url = serializers.SerializerMethodField()
     
     class Meta:
         model = Document
-        fields = ['id', 'file', 'name', 'file_type', 'uploaded_at']
-        read_only_fields = ['id', 'uploaded_at', 'file_type']
+        fields = ['id', 'file', 'name', 'file_type', 'uploaded_at', 'extraction_error', 'download_url']
+        read_only_fields = ['id', 'uploaded_at', 'file_type', 'extraction_error']
+    
+    def get_download_url(self, obj):
+        url = reverse('document-download', args=[obj.pk])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
 
 class AnalysisSerializer(serializers.ModelSerializer):
     """
@@ -35,19 +50,70 @@ class AnalysisSerializer(serializers.ModelSerializer):
     - result: Результат анализа (только для чтения)
     - created_at: Дата и время создания (только для чтения)
     - completed_at: Дата и время завершения (только для чтения)
-    - status: Статус анализа (только для чтения)
+    - status: Статус анализа (только для чтения); 'cancelled' — отменен или истек deadline
+    - deadline: Момент, после которого незавершенный анализ прерывается (опционально)
+    - timeout: То же в секундах от создания анализа (только для записи, вместо deadline)
+    - execution_mode: 'sync' (по умолчанию) — выполнить сразу, 'message_batch' — поставить
+      в очередь для Message Batches API (для несрочных массовых задач)
+    - metrics: Учет выполнения (только для чтения): ответившая модель, число попыток,
+      время извлечения текста, задержка API, токены, причина остановки и разбивка по этапам
+    - webhook: UUID вебхука, на который придет уведомление о завершении (опционально;
+      только вебхук того же владельца, см. agent.scheduler.owner_id)
+    - priority: 'normal' (по умолчанию) или 'bulk' — для массовых задач, которые могут
+      подождать; 'interactive' назначается только анализам из веб-интерфейса
+    - client: Клиент, создавший анализ (только для чтения; пользователь, заголовок
+      X-Client-ID или IP-адрес, см. agent.scheduler)
+    - queued_at, started_at: Постановка в очередь и начало выполнения (только для чтения)
     """
     documents = DocumentSerializer(many=True, read_only=True)
+    priority = serializers.ChoiceField(
+        choices=[('normal', 'Обычный'), ('bulk', 'Массовый')],
+        default='normal',
+        help_text="Класс приоритета: normal или bulk (массовые задачи обслуживаются после остальных)."
+    )
     document_ids = serializers.ListField(
         child=serializers.UUIDField(),
         write_only=True,
         help_text="Список UUID документов для анализа. Требуется минимум один документ."
     )
+    timeout = serializers.IntegerField(
+        min_value=1,
+        write_only=True,
+        required=False,
+        help_text="Предельное время выполнения в секундах; по истечении анализ получает статус cancelled."
+    )
+    metrics = serializers.SerializerMethodField()
     
     class Meta:
         model = Analysis
-        fields = ['id', 'documents', 'document_ids', 'custom_prompt', 'result', 'created_at', 'completed_at', 'status']
-        read_only_fields = ['id', 'result', 'created_at', 'completed_at', 'status']
+        fields = ['id', 'documents', 'document_ids', 'custom_prompt', 'execution_mode', 'webhook', 'deadline', 'timeout', 'priority', 'client', 'result', 'created_at', 'queued_at', 'started_at', 'completed_at', 'status', 'metrics']
+        read_only_fields = ['id', 'client', 'result', 'created_at', 'queued_at', 'started_at', 'completed_at', 'status']
+    
+    def get_metrics(self, obj):
+        return {field: getattr(obj, field) for field in METRIC_FIELDS}
+    
+    def validate_document_ids(self, value):
+        missing = missing_document_ids([value])
+        if missing:
+            raise serializers.ValidationError(f"Документы не найдены: {', '.join(missing)}")
+        return value
+    
+    def validate_webhook(self, value):
+        # Уведомления уходят с результатами анализа, поэтому чужой вебхук указать нельзя
+        request = self.context.get('request')
+        if value is not None and not (request and value.client == scheduler.owner_id(request)):
+            raise serializers.ValidationError("Вебхук не найден")
+        return value
+    
+    def validate(self, attrs):
+        timeout = attrs.pop('timeout', None)
+        if timeout is not None:
+            if attrs.get('deadline'):
+                raise serializers.ValidationError("Укажите deadline или timeout, но не оба")
+            attrs['deadline'] = timezone.now() + timedelta(seconds=timeout)
+        elif attrs.get('deadline') and attrs['deadline'] <= timezone.now():
+            raise serializers.ValidationError({'deadline': "Момент deadline уже прошел"})
+        return attrs
     
     def create(self, validated_data):
         """
@@ -62,4 +128,102 @@ class AnalysisSerializer(serializers.ModelSerializer):
         document_ids = validated_data.pop('document_ids')
         analysis = Analysis.objects.create(**validated_data)
         analysis.documents.set(Document.objects.filter(id__in=document_ids))
-        return analysis 
\ No newline at end of file
+        return analysis 
+
+
+class WebhookEndpointSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор для модели WebhookEndpoint.
+    
+    Поля:
+    - id: UUID вебхука (только для чтения)
+    - url: Адрес, на который отправляются уведомления (POST); только http/https
+      и публичный хост (см. agent.webhooks.check_url)
+    - all_analyses: Уведомлять о завершении всех анализов, а не только указавших
+      этот вебхук (только для сотрудников: в уведомлениях чужие результаты)
+    - is_active: Отправлять ли уведомления
+    - created_at: Дата и время создания (только для чтения)
+    
+    Ключ подписи secret возвращает только WebhookEndpointCreateSerializer.
+    """
+    class Meta:
+        model = WebhookEndpoint
+        fields = ['id', 'url', 'all_analyses', 'is_active', 'created_at']
+        read_only_fields = ['id', 'created_at']
+    
+    def validate_url(self, value):
+        try:
+            webhooks.check_url(value, resolve=False)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+    
+    def validate_all_analyses(self, value):
+        request = self.context.get('request')
+        if value and not (request and request.user.is_staff):
+            raise serializers.ValidationError("Уведомления обо всех анализах доступны только сотрудникам")
+        return value
+
+
+class WebhookEndpointCreateSerializer(WebhookEndpointSerializer):
+    """
+    Регистрация вебхука: ответ на нее — единственный, в котором есть secret
+    (ключ подписи X-Webhook-Signature, генерируется при создании).
+    """
+    class Meta(WebhookEndpointSerializer.Meta):
+        fields = ['id', 'url', 'secret', 'all_analyses', 'is_active', 'created_at']
+        read_only_fields = ['id', 'secret', 'created_at']
+
+
+class AnalysisBatchSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор для модели AnalysisBatch.
+    
+    Поля:
+    - id: UUID пакета (только для чтения)
+    - document_groups: Список групп UUID документов; для каждой группы создается
+      отдельный анализ (только для записи при создании)
+    - custom_prompt: Общий запрос для всех анализов пакета (опционально)
+    - execution_mode: 'sync' (по умолчанию) или 'message_batch' для Message Batches API
+    - analysis_ids: UUID созданных анализов (только для чтения)
+    - Анализы пакета выполняются с приоритетом 'bulk' (см. agent.scheduler)
+    - progress: Сводный прогресс по статусам анализов (только для чтения)
+    - created_at: Дата и время создания (только для чтения)
+    - completed_at: Дата и время завершения пакета (только для чтения)
+    """
+    document_groups = serializers.ListField(
+        child=serializers.ListField(child=serializers.UUIDField(), min_length=1),
+        write_only=True,
+        min_length=1,
+        help_text="Список групп UUID документов. Для каждой группы создается отдельный анализ."
+    )
+    analysis_ids = serializers.SerializerMethodField()
+    progress = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = AnalysisBatch
+        fields = ['id', 'document_groups', 'custom_prompt', 'execution_mode', 'analysis_ids', 'progress', 'created_at', 'completed_at']
+        read_only_fields = ['id', 'created_at', 'completed_at']
+    
+    def validate_document_groups(self, value):
+        max_size = getattr(settings, 'BATCH_ANALYSIS_MAX_SIZE', 1000)
+        if len(value) > max_size:
+            raise serializers.ValidationError(f"Слишком много групп в одном пакете (максимум {max_size})")
+        missing = missing_document_ids(value)
+        if missing:
+            raise serializers.ValidationError(f"Документы не найдены: {', '.join(missing)}")
+        return value
+    
+    def get_analysis_ids(self, obj):
+        return [str(pk) for pk in obj.analyses.values_list('id', flat=True)]
+    
+    def get_progress(self, obj):
+        return obj.progress()
+    
+    def create(self, validated_data):
+        return create_batch(
+            validated_data['document_groups'],
+            validated_data.get('custom_prompt'),
+            execution_mode=validated_data.get('execution_mode', 'sync'),
+            client=validated_data.get('client', '')
+        )
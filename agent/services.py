@@ -1,13 +1,60 @@
 import os
-import anthropic
+import asyncio
+import contextvars
+import weakref
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
+from django.utils import timezone
+from .ratelimit import estimate_tokens, get_rate_limiter
+from . import cancellation, log, metrics, routing, scheduler
+from .accounting import AnalysisAccounting
+from .models import Document
+from .sandbox import ExtractionError, get_extraction_pool
+from .text_encoding import open_text
 import tempfile
+import time
 import mimetypes
-import docx
-import PyPDF2
 import csv
 import json
-from openpyxl import load_workbook
+
+logger = log.get_logger(__name__)
+
+# MIME-типы поддерживаемых форматов по расширению файла (mimetypes знает не все из них)
+EXTENSION_MIME_TYPES = {
+    '.txt': 'text/plain',
+    '.pdf': 'application/pdf',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.csv': 'text/csv',
+    '.json': 'application/json',
+}
+
+
+def detect_file_type(file_name, default=None):
+    """
+    Определяет MIME-тип файла по имени.
+    
+    Сначала используется стандартный модуль mimetypes, затем таблица
+    EXTENSION_MIME_TYPES для форматов, которые mimetypes может не знать.
+    
+    Параметры:
+        file_name (str): Имя или путь к файлу
+        default (str, optional): Значение, если тип определить не удалось
+        
+    Возвращает:
+        str | None: MIME-тип файла
+        
+    Примеры:
+        >>> detect_file_type('report.xlsx')
+        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    """
+    mime_type, _ = mimetypes.guess_type(file_name)
+    if mime_type is None:
+        file_extension = os.path.splitext(file_name)[1].lower()
+        mime_type = EXTENSION_MIME_TYPES.get(file_extension, default)
+    return mime_type
+
 
 class FileProcessor:
     """
@@ -19,7 +66,7 @@ class FileProcessor:
     Поддерживаемые форматы:
     - Текстовые файлы (.txt)
     - PDF документы (.pdf)
-    - Word документы (.docx)
+    - Word документы (.docx), включая таблицы, колонтитулы и сноски
     - Excel таблицы (.xlsx)
     - CSV файлы (.csv)
     - JSON файлы (.json)
@@ -39,38 +86,21 @@ class FileProcessor:
             >>> text = FileProcessor.extract_text_from_file('/path/to/document.pdf')
             >>> print(f"Извлечено {len(text)} символов")
         """
-        mime_type, _ = mimetypes.guess_type(file_path)
+        mime_type = detect_file_type(file_path)
         file_extension = os.path.splitext(file_path)[1].lower()
         
-        # Обработка по расширению файла, если mime_type не определен
-        if mime_type is None and file_extension:
-            if file_extension == '.txt':
-                mime_type = 'text/plain'
-            elif file_extension == '.pdf':
-                mime_type = 'application/pdf'
-            elif file_extension == '.docx':
-                mime_type = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-            elif file_extension == '.xlsx':
-                mime_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            elif file_extension == '.csv':
-                mime_type = 'text/csv'
-            elif file_extension == '.json':
-                mime_type = 'application/json'
-        
         # Попытка прочитать как текст, если mime_type не определен или это текстовый файл
         if mime_type is None or mime_type == 'text/plain' or file_extension == '.txt':
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
+                with open_text(file_path) as f:
                     return f.read()
-            except UnicodeDecodeError:
-                # Если не удалось прочитать как UTF-8, попробуем другие кодировки
-                try:
-                    with open(file_path, 'r', encoding='latin-1') as f:
-                        return f.read()
-                except Exception as e:
-                    return f"Ошибка при чтении текстового файла: {str(e)}"
+            except OSError as e:
+                return f"Ошибка при чтении текстового файла: {str(e)}"
                   
+        # Библиотеки форматов импортируются при первом файле своего типа:
+        # импорт при загрузке модуля замедлял запуск каждого воркера и команды
         elif mime_type == 'application/pdf':
+            import PyPDF2
             text = ""
             with open(file_path, 'rb') as f:
                 reader = PyPDF2.PdfReader(f)
@@ -79,10 +109,12 @@ class FileProcessor:
             return text
             
         elif mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
-            doc = docx.Document(file_path)
-            return "\n".join([para.text for para in doc.paragraphs])
+            # Потоковый разбор XML вместо python-docx: быстрее, с таблицами и колонтитулами
+            from .docx_text import iter_docx_text
+            return "\n".join(iter_docx_text(file_path))
             
         elif mime_type == 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet':
+            from openpyxl import load_workbook
             wb = load_workbook(file_path)
             text = ""
             for sheet_name in wb.sheetnames:
@@ -94,7 +126,7 @@ class FileProcessor:
             
         elif mime_type == 'text/csv':
             text = ""
-            with open(file_path, 'r', encoding='utf-8') as f:
+            with open_text(file_path, newline='') as f:
                 reader = csv.reader(f)
                 for row in reader:
                     text += " | ".join(row) + "\n"
@@ -107,6 +139,85 @@ class FileProcessor:
             
         else:
             return f"Unsupported file format: {mime_type}"
+    
+    @staticmethod
+    def is_extraction_error(content):
+        """
+        Проверяет, вернул ли extract_text_from_file сообщение об ошибке вместо текста.
+        
+        Параметры:
+            content (str): Результат extract_text_from_file
+            
+        Возвращает:
+            bool: True, если текст извлечь не удалось
+        """
+        return not content or content.startswith("Unsupported file format") or content.startswith("Ошибка при чтении")
+    
+    @staticmethod
+    def get_document_text(document, cancel=None):
+        """
+        Возвращает текст документа, извлекая его из файла только при первом обращении.
+        
+        Успешно извлеченный текст сохраняется в Document.extracted_text, поэтому
+        повторные анализы того же документа не читают и не разбирают файл заново,
+        а сам текст попадает в полнотекстовый поисковый индекс. Если то же
+        содержимое (Blob) уже загружалось другим документом, берется его текст.
+        
+        Параметры:
+            document (Document): Документ для извлечения текста
+            cancel (CancelToken, optional): Признак отмены анализа; извлечение в
+                пуле прерывается при отмене (AnalysisCancelled)
+            
+        Возвращает:
+            str: Извлеченный текст или сообщение об ошибке извлечения (оно же
+                 записывается в Document.extraction_error)
+        """
+        if document.extracted_text is not None:
+            metrics.observe_extraction_cache(hit=True)
+            return document.extracted_text
+        if document.blob_id:
+            content = Document.objects.filter(
+                blob_id=document.blob_id, extracted_text__isnull=False
+            ).exclude(pk=document.pk).values_list('extracted_text', flat=True).first()
+            if content is not None:
+                metrics.observe_extraction_cache(hit=True)
+                # Текст копируется в сжатом виде, без повторного сжатия
+                document.extracted_text = content
+                document.extracted_at = timezone.now()
+                document.save(update_fields=['extracted_text', 'extracted_at'])
+                return document.extracted_text
+        metrics.observe_extraction_cache(hit=False)
+        
+        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(document.file.name)[1]) as temp:
+            document.file.open('rb')
+            try:
+                for chunk in document.file.chunks():
+                    temp.write(chunk)
+            finally:
+                document.file.close()
+            temp_path = temp.name
+        
+        # В пуле процессов (agent.sandbox) зависший или слишком тяжелый файл
+        # прерывается по лимиту и не занимает воркер сервера
+        pool = get_extraction_pool()
+        started = time.perf_counter()
+        try:
+            content = pool.extract(temp_path, cancel) if pool else FileProcessor.extract_text_from_file(temp_path)
+        except ExtractionError as e:
+            content = f"Ошибка при чтении файла: {e}"
+        finally:
+            os.unlink(temp_path)
+            metrics.observe_extraction(document.file_type, time.perf_counter() - started)
+        
+        if not FileProcessor.is_extraction_error(content):
+            document.extracted_text = content
+            document.extracted_at = timezone.now()
+            document.extraction_error = None
+            document.save(update_fields=['extracted_text', 'extracted_at', 'extraction_error'])
+        else:
+            document.extraction_error = content
+            document.save(update_fields=['extraction_error'])
+        return content
 
 class ClaudeService:
     """
@@ -125,6 +236,12 @@ class ClaudeService:
         result = claude.compare_documents(documents=[doc1, doc2], custom_prompt="Сравни два отчета")
         ```
     """
+    # Класс клиента Anthropic; асинхронный вариант сервиса подменяет его на AsyncAnthropic.
+    # Пакет anthropic (около секунды на импорт) загружается при создании первого сервиса
+    client_class_name = 'Anthropic'
+    # Таймаут запроса к API, с; для анализа с deadline — не дольше оставшегося времени
+    request_timeout = 60.0
+    
     def __init__(self):
         """
         Инициализация сервиса с проверкой наличия API-ключа.
@@ -139,12 +256,18 @@ class ClaudeService:
         if not api_key:
             raise ValueError("CLAUDE_API_KEY не найден в настройках. Проверьте файл .env")
         
-        self.client = anthropic.Anthropic(
+        import anthropic
+        self.client = getattr(anthropic, self.client_class_name)(
             api_key=api_key,
+            # Локальная имитация API для тестов, если задана в настройках
+            base_url=getattr(settings, 'CLAUDE_API_BASE_URL', None) or None,
             # Увеличиваем timeout для больших запросов
-            timeout=60.0
+            timeout=self.request_timeout
         )
         
+        # Общий для всех процессов ограничитель частоты запросов (None, если выключен)
+        self.rate_limiter = get_rate_limiter()
+        
         # Проверяем модель из настроек или используем стандартную
         self.default_model = getattr(settings, 'MODEL_NAME', 'claude-3-sonnet-20240229')
         # Альтернативные модели для автоматического переключения
@@ -155,9 +278,48 @@ class ClaudeService:
             'claude-instant-1.2',
             'claude-2.0',
         ]
-        print(f"Используется модель: {self.default_model}")
+        # Выбор модели по размеру запроса, типу задачи и статистике моделей
+        self.router = routing.ModelRouter(self.default_model, self.fallback_models)
+        logger.debug("Модель по умолчанию: %s", self.default_model)
+    
+    @staticmethod
+    def request_params(model, system_message, prompt):
+        """
+        Формирует параметры запроса к Messages API.
+        
+        Одни и те же параметры используются для синхронного вызова
+        messages.create и для элементов Message Batch.
+        
+        Параметры:
+            model (str): Название модели Claude
+            system_message (str): Системное сообщение
+            prompt (str): Основной запрос к модели
+            
+        Возвращает:
+            dict: Параметры для messages.create
+        """
+        return {
+            "model": model,
+            "max_tokens": 4000,
+            "temperature": 0,
+            "system": system_message,
+            "messages": [
+                {"role": "user", "content": prompt}
+            ],
+        }
     
-    def _send_api_request(self, model, system_message, prompt):
+    def _reserve(self, model, system_message, prompt, max_tokens, cancel=None):
+        if not self.rate_limiter:
+            return None
+        # Ждем свободного лимита вместо запроса, который API отклонит с ошибкой 429
+        return self.rate_limiter.acquire(
+            model,
+            input_tokens=estimate_tokens(system_message) + estimate_tokens(prompt),
+            output_tokens=max_tokens,
+            max_wait=cancel.timeout(self.rate_limiter.max_wait) if cancel else None
+        )
+    
+    def _send_api_request(self, model, system_message, prompt, accounting=None, cancel=None):
         """
         Отправляет запрос к API с указанной моделью и обрабатывает ошибки.
         
@@ -165,73 +327,175 @@ class ClaudeService:
             model (str): Название модели Claude для использования
             system_message (str): Системное сообщение для задания контекста
             prompt (str): Основной запрос к модели
+            accounting (AnalysisAccounting, optional): Учет токенов и причины остановки
+            cancel (CancelToken, optional): Признак отмены анализа
             
         Возвращает:
             tuple: (ответ от модели или None, ошибка или None)
+            
+        Исключения:
+            AnalysisCancelled: Анализ отменен во время запроса (соединение закрыто)
+            RateLimitTimeout: Лимит запросов не освободился вовремя; это не ошибка
+                модели, поэтому резервные модели не пробуются, а анализ завершается
+                с понятной причиной
         """
+        params = self.request_params(model, system_message, prompt)
+        reservation = self._reserve(model, system_message, prompt, params["max_tokens"], cancel)
         try:
-            print(f"Отправка запроса к Claude API с моделью {model}...")
-            response = self.client.messages.create(
-                model=model,
-                max_tokens=4000,
-                temperature=0,
-                system=system_message,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            print("Ответ успешно получен!")
+            logger.debug("Отправка запроса к Claude API с моделью %s", model, extra={'model': model})
+            if cancel is None:
+                response = self.client.messages.create(**params)
+            else:
+                # Потоковый ответ: между событиями проверяется отмена, а закрытие
+                # соединения при выходе из with останавливает генерацию на стороне API
+                with self.client.messages.stream(**params, timeout=cancel.timeout(self.request_timeout)) as stream:
+                    for _ in stream:
+                        cancel.check()
+                    response = stream.get_final_message()
+            logger.debug("Ответ модели %s получен", model, extra={'model': model})
+            if accounting:
+                accounting.response(response)
+            if reservation:
+                self.rate_limiter.settle(reservation, response.usage.input_tokens, response.usage.output_tokens)
             return response.content[0].text, None
         except Exception as e:
+            if reservation:
+                # Запрос не выполнен: возвращаем зарезервированные выходные токены
+                self.rate_limiter.settle(reservation, output_tokens=0)
+            if isinstance(e, cancellation.AnalysisCancelled):
+                raise
             return None, e
     
-    def compare_documents(self, documents, custom_prompt=None):
+    def compare_documents(self, documents, custom_prompt=None, analysis=None, accounting=None, cancel=None):
         """
         Анализирует список документов и отправляет их содержимое в Claude для анализа.
         
         Функция извлекает текст из каждого документа, формирует запрос к API
-        Claude и возвращает результат анализа. В случае ошибок с основной моделью,
-        автоматически пробует использовать резервные модели.
+        Claude и возвращает результат анализа. Порядок моделей выбирает
+        маршрутизатор (agent.routing): небольшие простые запросы уходят в самую
+        быструю модель, остальные — в основную. Если модель не ответила,
+        автоматически пробуются следующие. Решение и задержка каждой попытки
+        записываются в журнал ModelRouteDecision.
         
         Параметры:
             documents (QuerySet): QuerySet с объектами Document для анализа
             custom_prompt (str, optional): Пользовательский запрос для анализа
+            analysis (Analysis, optional): Анализ для привязки записи журнала
+            accounting (AnalysisAccounting, optional): Учет времени этапов и токенов
+            cancel (CancelToken, optional): Признак отмены анализа; проверяется при
+                извлечении текста, перед каждой моделью и во время ответа
             
         Возвращает:
             str: Текстовый результат анализа от Claude
             
+        Исключения:
+            AnalysisCancelled: Анализ отменен или истек его deadline
+            RateLimitTimeout: Лимит запросов к Claude не освободился за RATE_LIMIT_MAX_WAIT
+            
         Примеры:
             >>> result = claude_service.compare_documents(
             ...     documents=Document.objects.filter(id__in=['uuid1', 'uuid2']),
             ...     custom_prompt="Сравните эти документы и выделите основные различия"
             ... )
         """
+        accounting = accounting or AnalysisAccounting()
+        system_message, prompt = self.build_request(documents, custom_prompt, accounting, cancel)
+        decision = self.route(system_message, prompt, custom_prompt)
+        
+        try:
+            error = None
+            for i, model in enumerate(decision.models):
+                if cancel:
+                    cancel.check()
+                if i:
+                    logger.warning(
+                        "Модель %s не ответила: %s; пробуем %s", decision.models[i - 1], error, model,
+                        extra={'model': decision.models[i - 1]}
+                    )
+                started = time.perf_counter()
+                result, error = self._send_api_request(model, system_message, prompt, accounting, cancel)
+                elapsed = time.perf_counter() - started
+                decision.add_attempt(model, elapsed, error)
+                accounting.attempt(model, elapsed, error)
+                if result:
+                    if i:
+                        logger.info("Получен ответ резервной модели %s", model, extra={'model': model})
+                    return result
+        finally:
+            metrics.observe_attempts(len(decision.attempts))
+            try:
+                routing.record_decision(decision, analysis)
+            except Exception as e:
+                # Журнал маршрутизации не должен ломать сам анализ
+                logger.warning("Не удалось записать решение маршрутизатора: %s", e, exc_info=True)
+        
+        # Если все модели не сработали, возвращаем сообщение об ошибке
+        return self.all_models_failed_message(error)
+    
+    def route(self, system_message, prompt, custom_prompt=None):
+        """
+        Выбирает порядок моделей для запроса через маршрутизатор.
+        
+        Возвращает:
+            routing.RouteDecision: Решение со списком моделей в порядке попыток
+        """
+        decision = self.router.route(
+            prompt_tokens=estimate_tokens(system_message) + estimate_tokens(prompt),
+            task_type=routing.TASK_CUSTOM if custom_prompt else routing.TASK_COMPARISON
+        )
+        logger.info(
+            "Маршрут %s (%d токенов): модель %s", decision.rule, decision.prompt_tokens, decision.models[0],
+            extra={'rule': decision.rule, 'prompt_tokens': decision.prompt_tokens, 'model': decision.models[0]}
+        )
+        return decision
+    
+    @staticmethod
+    def all_models_failed_message(error):
+        return f"Не удалось получить ответ ни от одной доступной модели Claude. Проверьте ваш API-ключ и доступ к моделям Claude. Последняя ошибка: {str(error)}"
+    
+    def build_request(self, documents, custom_prompt=None, accounting=None, cancel=None):
+        """
+        Извлекает текст документов и формирует системное сообщение и запрос к Claude.
+        
+        Параметры:
+            documents (QuerySet): Документы для анализа
+            custom_prompt (str, optional): Пользовательский запрос для анализа
+            accounting (AnalysisAccounting, optional): Учет времени извлечения и размера запроса
+            cancel (CancelToken, optional): Признак отмены анализа (проверяется перед каждым документом)
+            
+        Возвращает:
+            tuple: (системное сообщение, текст запроса)
+        """
+        build_started = time.perf_counter()
         document_contents = []
         
         for doc in documents:
-            print(f"Обработка документа: {doc.name} (тип: {doc.file_type})")
-            with tempfile.NamedTemporaryFile(delete=False) as temp:
-                temp.write(doc.file.read())
-                temp_path = temp.name
+            if cancel:
+                cancel.check()
+            cached = doc.extracted_text is not None
+            started = time.perf_counter()
+            content = FileProcessor.get_document_text(doc, cancel)
+            if accounting:
+                accounting.document_extracted(doc, time.perf_counter() - started, cached, len(content or ''))
+            file_extension = os.path.splitext(doc.name)[1].lower()
             
-            try:
-                content = FileProcessor.extract_text_from_file(temp_path)
-                file_extension = os.path.splitext(doc.name)[1].lower()
-                print(f"Расширение файла: {file_extension}, определенный тип: {doc.file_type}")
-                
-                # Проверяем, получен ли текст
-                if content and not content.startswith("Unsupported file format") and not content.startswith("Ошибка при чтении"):
-                    print(f"Успешно извлечен текст из {doc.name}. Размер: {len(content)} символов")
-                else:
-                    print(f"Проблема с извлечением текста из {doc.name}: {content}")
-                
-                document_contents.append({
-                    "name": doc.name,
-                    "type": doc.file_type or f"Файл{file_extension}",
-                    "content": content
-                })
-            finally:
-                os.unlink(temp_path)
+            # Проверяем, получен ли текст
+            if not FileProcessor.is_extraction_error(content):
+                logger.debug(
+                    "Документ %s (%s): %d символов%s", doc.name, doc.file_type, len(content), " из кэша" if cached else "",
+                    extra={'document_id': str(doc.id), 'file_type': doc.file_type, 'chars': len(content), 'cached': cached}
+                )
+            else:
+                logger.warning(
+                    "Проблема с извлечением текста из %s: %s", doc.name, content,
+                    extra={'document_id': str(doc.id), 'file_type': doc.file_type}
+                )
+            
+            document_contents.append({
+                "name": doc.name,
+                "type": doc.file_type or f"Файл{file_extension}",
+                "content": content
+            })
         
         # Prepare prompt for Claude
         if custom_prompt:
@@ -241,25 +505,13 @@ class ClaudeService:
             prompt = self._build_comparison_prompt(document_contents)
             system_message = "You are an expert analyst who performs thorough comparative analysis of documents."
         
-        # Сначала пробуем основную модель
-        result, error = self._send_api_request(self.default_model, system_message, prompt)
-        if result:
-            return result
-            
-        # Если основная модель не сработала, пробуем резервные модели
-        print(f"Ошибка при использовании основной модели: {error}")
-        print("Пробую альтернативные модели...")
-        
-        for fallback_model in self.fallback_models:
-            print(f"Попытка использовать модель: {fallback_model}")
-            result, error = self._send_api_request(fallback_model, system_message, prompt)
-            if result:
-                print(f"Удалось получить ответ от модели {fallback_model}")
-                return result
-            print(f"Модель {fallback_model} тоже не работает: {error}")
-        
-        # Если все модели не сработали, возвращаем сообщение об ошибке
-        return f"Не удалось получить ответ ни от одной доступной модели Claude. Проверьте ваш API-ключ и доступ к моделям Claude. Последняя ошибка: {str(error)}"
+        if accounting:
+            accounting.prompt_built(
+                system_message, prompt,
+                tokens=estimate_tokens(system_message) + estimate_tokens(prompt),
+                seconds=time.perf_counter() - build_started
+            )
+        return system_message, prompt
     
     def _build_comparison_prompt(self, document_contents):
         """
@@ -320,4 +572,325 @@ class ClaudeService:
 Пожалуйста, ответьте на мой запрос, основываясь на этих документах. 
 Сформулируйте свой ответ структурированным и понятным образом, используя markdown.
 """
-        return prompt 
\ No newline at end of file
+        return prompt 
+
+
+def run_analysis(analysis, documents=None, claude_service=None):
+    """
+    Выполняет анализ: извлекает текст документов, отправляет запрос в Claude
+    и сохраняет результат и итоговый статус анализа.
+    
+    Параметры:
+        analysis (Analysis): Анализ для выполнения
+        documents (list, optional): Уже загруженные документы анализа; позволяет
+            пакетному запуску передать документы с извлеченным текстом, не читая
+            их из базы заново
+        claude_service (ClaudeService, optional): Общий экземпляр сервиса для
+            нескольких анализов
+    
+    Анализ прерывается со статусом 'cancelled' при отмене (Analysis.cancel)
+    или по истечении analysis.deadline (см. agent.cancellation). До начала
+    выполнения анализ ждет слота в очереди agent.scheduler.
+    """
+    # Время этапов и расход токенов сохраняются в полях анализа
+    accounting = AnalysisAccounting()
+    cancel = cancellation.CancelToken(analysis.id, analysis.deadline)
+    # Все записи журнала во время анализа помечаются его идентификатором
+    with log.bind(analysis.id), cancellation.register(cancel):
+        try:
+            # Ждем слота планировщика и берем анализ в работу; отмененный до
+            # запуска или уже взятый другим воркером анализ не выполняется
+            if not scheduler.acquire(analysis, cancel):
+                return
+            cancel.check()
+            
+            # Get documents
+            if documents is None:
+                documents = analysis.documents.all()
+            
+            if not documents:
+                analysis.set_status('failed', result="No documents provided for analysis")
+                return
+            
+            # Process documents with Claude
+            claude_service = claude_service or ClaudeService()
+            result = claude_service.compare_documents(
+                documents=documents,
+                custom_prompt=analysis.custom_prompt,
+                analysis=analysis,
+                accounting=accounting,
+                cancel=cancel
+            )
+            
+            # Update analysis with results
+            analysis.set_status('completed', result=result, completed_at=timezone.now(), **accounting.fields())
+            logger.info("Анализ %s выполнен", analysis.id, extra={'analysis_id': str(analysis.id), 'model': accounting.model_used})
+            
+        except cancellation.AnalysisCancelled as e:
+            cancellation.finish(analysis, e, accounting.fields())
+        except Exception as e:
+            logger.warning("Анализ %s завершился ошибкой: %s", analysis.id, e, exc_info=True, extra={'analysis_id': str(analysis.id)})
+            analysis.set_status('failed', result=f"Analysis failed: {str(e)}", **accounting.fields())
+
+
+# Пул потоков для извлечения текста в асинхронном режиме: разбор PDF или XLSX
+# занимает процессор и не должен блокировать цикл событий ASGI-сервера
+_extraction_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'ASYNC_EXTRACTION_WORKERS', os.cpu_count() or 1),
+    thread_name_prefix='extraction'
+)
+
+
+class AsyncClaudeService(ClaudeService):
+    """
+    Асинхронный вариант сервиса для выполнения под ASGI.
+    
+    Использует anthropic.AsyncAnthropic, поэтому ожидание ответа Claude не
+    занимает поток: один процесс uvicorn держит сотни запросов к API
+    одновременно, тогда как синхронный воркер gunicorn — ровно один.
+    Извлечение текста выполняется в пуле потоков, обращения к базе — через
+    асинхронный ORM Django или sync_to_async.
+    
+    Синхронные методы базового класса (compare_documents) с этим клиентом
+    не работают; используйте acompare_documents и astream_documents.
+    
+    Использование:
+        ```python
+        claude = get_async_claude_service()
+        result = await claude.acompare_documents(documents, custom_prompt="Сравни два отчета")
+        ```
+    """
+    client_class_name = 'AsyncAnthropic'
+    
+    async def abuild_request(self, documents, custom_prompt=None, accounting=None, cancel=None):
+        """Асинхронный вариант build_request(): извлечение текста выполняется в пуле потоков."""
+        loop = asyncio.get_running_loop()
+        # Контекст передается в поток, чтобы записи журнала сохранили correlation_id анализа
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            _extraction_executor, context.run, self.build_request, documents, custom_prompt, accounting, cancel
+        )
+    
+    async def _areserve(self, model, system_message, prompt, max_tokens, cancel=None):
+        if not self.rate_limiter:
+            return None
+        return await self.rate_limiter.aacquire(
+            model,
+            input_tokens=estimate_tokens(system_message) + estimate_tokens(prompt),
+            output_tokens=max_tokens,
+            max_wait=cancel.timeout(self.rate_limiter.max_wait) if cancel else None
+        )
+    
+    async def _asend_api_request(self, model, system_message, prompt, accounting=None, cancel=None):
+        """
+        Асинхронный вариант _send_api_request().
+        
+        Отмена анализа прерывает ожидание ответа через отмену задачи
+        (CancelToken.watch), поэтому здесь токен ограничивает только таймаут.
+        
+        Возвращает:
+            tuple: (ответ от модели или None, ошибка или None)
+        
+        Исключения:
+            RateLimitTimeout: Лимит запросов не освободился вовремя (не ошибка модели)
+        """
+        params = self.request_params(model, system_message, prompt)
+        reservation = await self._areserve(model, system_message, prompt, params["max_tokens"], cancel)
+        try:
+            logger.debug("Отправка запроса к Claude API с моделью %s", model, extra={'model': model})
+            timeout = cancel.timeout(self.request_timeout) if cancel else self.request_timeout
+            response = await self.client.messages.create(**params, timeout=timeout)
+            logger.debug("Ответ модели %s получен", model, extra={'model': model})
+            if accounting:
+                accounting.response(response)
+            if reservation:
+                await self.rate_limiter.asettle(reservation, response.usage.input_tokens, response.usage.output_tokens)
+            return response.content[0].text, None
+        except Exception as e:
+            if reservation:
+                await self.rate_limiter.asettle(reservation, output_tokens=0)
+            return None, e
+    
+    async def acompare_documents(self, documents, custom_prompt=None, analysis=None, accounting=None, cancel=None):
+        """
+        Асинхронный вариант compare_documents() с тем же порядком моделей и журналом маршрутизации.
+        
+        Параметры:
+            documents (list): Документы для анализа (уже загруженные из базы)
+            custom_prompt (str, optional): Пользовательский запрос для анализа
+            analysis (Analysis, optional): Анализ для привязки записи журнала
+            accounting (AnalysisAccounting, optional): Учет времени этапов и токенов
+            cancel (CancelToken, optional): Признак отмены анализа (без analysis_id:
+                базу опрашивает CancelToken.watch)
+            
+        Возвращает:
+            str: Текстовый результат анализа от Claude
+        """
+        accounting = accounting or AnalysisAccounting()
+        system_message, prompt = await self.abuild_request(documents, custom_prompt, accounting, cancel)
+        decision = await sync_to_async(self.route)(system_message, prompt, custom_prompt)
+        
+        try:
+            error = None
+            for i, model in enumerate(decision.models):
+                if cancel:
+                    cancel.check()
+                if i:
+                    logger.warning(
+                        "Модель %s не ответила: %s; пробуем %s", decision.models[i - 1], error, model,
+                        extra={'model': decision.models[i - 1]}
+                    )
+                started = time.perf_counter()
+                result, error = await self._asend_api_request(model, system_message, prompt, accounting, cancel)
+                elapsed = time.perf_counter() - started
+                decision.add_attempt(model, elapsed, error)
+                accounting.attempt(model, elapsed, error)
+                if result:
+                    return result
+        finally:
+            metrics.observe_attempts(len(decision.attempts))
+            try:
+                await sync_to_async(routing.record_decision)(decision, analysis)
+            except Exception as e:
+                logger.warning("Не удалось записать решение маршрутизатора: %s", e, exc_info=True)
+        
+        return self.all_models_failed_message(error)
+    
+    async def astream_documents(self, documents, custom_prompt=None, analysis=None, accounting=None, cancel=None):
+        """
+        Выполняет анализ с потоковой выдачей ответа Claude.
+        
+        Асинхронный генератор возвращает фрагменты текста по мере генерации.
+        Следующая модель из маршрута пробуется, только если текущая не
+        выдала ни одного фрагмента; ошибка посреди ответа пробрасывается.
+        
+        Параметры:
+            documents (list): Документы для анализа (уже загруженные из базы)
+            custom_prompt (str, optional): Пользовательский запрос для анализа
+            analysis (Analysis, optional): Анализ для привязки записи журнала
+            accounting (AnalysisAccounting, optional): Учет времени этапов и токенов
+            cancel (CancelToken, optional): Признак отмены анализа; проверяется
+                перед каждой моделью и между фрагментами ответа (без analysis_id:
+                базу опрашивает CancelToken.watch)
+        
+        Исключения:
+            AnalysisCancelled: Анализ отменен или истек его deadline; выход из
+                потока закрывает соединение, и API прекращает генерацию
+            RateLimitTimeout: Лимит запросов к Claude не освободился вовремя
+        
+        Примеры:
+            >>> async for chunk in claude.astream_documents(documents):
+            ...     print(chunk, end='')
+        """
+        accounting = accounting or AnalysisAccounting()
+        system_message, prompt = await self.abuild_request(documents, custom_prompt, accounting, cancel)
+        decision = await sync_to_async(self.route)(system_message, prompt, custom_prompt)
+        
+        try:
+            error = None
+            for model in decision.models:
+                if cancel:
+                    cancel.check()
+                params = self.request_params(model, system_message, prompt)
+                timeout = cancel.timeout(self.request_timeout) if cancel else self.request_timeout
+                # RateLimitTimeout — не ошибка модели: пробрасывается без перехода к следующей
+                reservation = await self._areserve(model, system_message, prompt, params["max_tokens"], cancel)
+                started = time.perf_counter()
+                streamed = False
+                try:
+                    async with self.client.messages.stream(**params, timeout=timeout) as stream:
+                        async for text in stream.text_stream:
+                            if cancel:
+                                cancel.check()
+                            streamed = True
+                            yield text
+                        message = await stream.get_final_message()
+                    elapsed = time.perf_counter() - started
+                    decision.add_attempt(model, elapsed)
+                    accounting.attempt(model, elapsed)
+                    accounting.response(message)
+                    if reservation:
+                        await self.rate_limiter.asettle(reservation, message.usage.input_tokens, message.usage.output_tokens)
+                    return
+                except Exception as e:
+                    error = e
+                    elapsed = time.perf_counter() - started
+                    decision.add_attempt(model, elapsed, e)
+                    accounting.attempt(model, elapsed, e)
+                    if reservation:
+                        await self.rate_limiter.asettle(reservation, output_tokens=0)
+                    if streamed or isinstance(e, cancellation.AnalysisCancelled):
+                        raise
+                    logger.warning("Модель %s не ответила: %s", model, e, extra={'model': model})
+            raise RuntimeError(self.all_models_failed_message(error))
+        finally:
+            metrics.observe_attempts(len(decision.attempts))
+            try:
+                await sync_to_async(routing.record_decision)(decision, analysis)
+            except Exception as e:
+                logger.warning("Не удалось записать решение маршрутизатора: %s", e, exc_info=True)
+
+
+# Клиент AsyncAnthropic привязан к циклу событий, в котором создан, поэтому
+# сервис создается один раз на цикл (под uvicorn — один раз на процесс)
+_async_services = weakref.WeakKeyDictionary()
+
+
+def get_async_claude_service():
+    """Возвращает общий асинхронный сервис для текущего цикла событий."""
+    loop = asyncio.get_running_loop()
+    service = _async_services.get(loop)
+    if service is None:
+        service = _async_services[loop] = AsyncClaudeService()
+    return service
+
+
+async def arun_analysis(analysis, claude_service=None):
+    """
+    Асинхронный вариант run_analysis() для представлений под ASGI.
+    
+    Параметры:
+        analysis (Analysis): Анализ для выполнения
+        claude_service (AsyncClaudeService, optional): Сервис вместо общего для цикла событий
+    """
+    accounting = AnalysisAccounting()
+    # Отмену и deadline отслеживает отдельная задача: она отменяет эту задачу,
+    # и ожидание ответа Claude прерывается сразу
+    cancel = cancellation.CancelToken(deadline=analysis.deadline)
+    task = asyncio.current_task()
+    watcher = asyncio.create_task(cancel.watch(analysis.pk, task))
+    with log.bind(analysis.id):
+        try:
+            if not await scheduler.aacquire(analysis, cancel):
+                return
+            cancel.check()
+            
+            documents = [document async for document in analysis.documents.all()]
+            if not documents:
+                await analysis.aset_status('failed', result="No documents provided for analysis")
+                return
+            
+            claude_service = claude_service or get_async_claude_service()
+            result = await claude_service.acompare_documents(
+                documents=documents,
+                custom_prompt=analysis.custom_prompt,
+                analysis=analysis,
+                accounting=accounting,
+                cancel=cancel
+            )
+            watcher.cancel()
+            await analysis.aset_status('completed', result=result, completed_at=timezone.now(), **accounting.fields())
+            logger.info("Анализ %s выполнен", analysis.id, extra={'analysis_id': str(analysis.id), 'model': accounting.model_used})
+            
+        except (cancellation.AnalysisCancelled, asyncio.CancelledError):
+            if cancel.reason is None:
+                # Задачу отменил не наблюдатель (например, остановка сервера)
+                raise
+            if task.cancelling():
+                task.uncancel()
+            await sync_to_async(cancellation.finish)(analysis, cancellation.AnalysisCancelled(cancel.reason), accounting.fields())
+        except Exception as e:
+            logger.warning("Анализ %s завершился ошибкой: %s", analysis.id, e, exc_info=True, extra={'analysis_id': str(analysis.id)})
+            await analysis.aset_status('failed', result=f"Analysis failed: {str(e)}", **accounting.fields())
+        finally:
+            watcher.cancel()
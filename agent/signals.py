@@ -0,0 +1,35 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import blobs, search
+from .models import Analysis, Document
+
+
+@receiver(post_save, sender=Document)
+def index_document_on_save(sender, instance, **kwargs):
+    """Обновляет поисковый индекс при загрузке документа, смене названия или извлечении текста."""
+    search.index_document(instance)
+
+
+@receiver(post_save, sender=Analysis)
+def index_analysis_on_save(sender, instance, **kwargs):
+    """Обновляет поисковый индекс при сохранении завершенного анализа (например, из админки)."""
+    if instance.status == 'completed':
+        search.index_analysis(instance)
+
+
+@receiver(post_delete, sender=Document)
+def remove_document_from_index(sender, instance, **kwargs):
+    search.remove(search.KIND_DOCUMENT, instance.pk)
+
+
+@receiver(post_delete, sender=Document)
+def release_document_blob(sender, instance, **kwargs):
+    """Освобождает ссылку на содержимое файла; файл удаляется вместе с последней ссылкой."""
+    if instance.blob_id:
+        blobs.release(instance.blob_id)
+
+
+@receiver(post_delete, sender=Analysis)
+def remove_analysis_from_index(sender, instance, **kwargs):
+    search.remove(search.KIND_ANALYSIS, instance.pk)
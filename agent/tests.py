@@ -1,3 +1,1600 @@
-from django.test import TestCase
+import base64
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import logging
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from collections import Counter
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.client import encode_multipart
+from django.utils import timezone
+from drf_yasg.generators import OpenAPISchemaGenerator
+from prometheus_client import REGISTRY
+
+from . import (
+    blobs, cancellation, fields, idempotency, log, message_batches, profiling, routing, scheduler, search,
+    text_encoding, webhooks,
+)
+from .accounting import latency_report, percentile
+from .async_views import _event, _stream_analysis
+from .db import retry_on_lock
+from . import batches
+from .batches import BatchRunner, create_batch
+from .docx_text import iter_docx_text
+from .downloads import RangeNotSatisfiable, parse_range
+from .ingest import BulkDocumentUpload, BulkUploadError
+from .middleware import CompressionMiddleware, CorrelationIdMiddleware
+from .models import (
+    Analysis, Blob, Document, IdempotencyKey, MessageBatchJob, ModelRouteDecision, WebhookDelivery, WebhookEndpoint,
+)
+from .ratelimit import RateLimiter, RateLimitTimeout, estimate_tokens
+from .sandbox import ExtractionError, ExtractionPool
+from .services import ClaudeService, run_analysis
+
+
+def _document(name='report.txt'):
+    # Строка вместо файла: документ сохраняется без записи в хранилище
+    return Document.objects.create(name=name, file=f'documents/{name}', file_type='txt')
+
+
+def _basic(username):
+    # Basic-аутентификация DRF: пользователь определяется уже в middleware
+    token = base64.b64encode(f'{username}:secret'.encode()).decode()
+    return {'Authorization': f'Basic {token}'}
+
+
+_FAST_HASHER = override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+
+
+async def _events(stream):
+    events = []
+    async for chunk in stream:
+        name, data = chunk.strip().split('\n')
+        events.append((name.removeprefix('event: '), json.loads(data.removeprefix('data: '))))
+    return events
+
+
+class StreamCancellationTests(TestCase):
+    """Потоковая выдача (SSE) учитывает отмену анализа и сообщает настоящий итоговый статус."""
+
+    def setUp(self):
+        self.analysis = Analysis.objects.create(custom_prompt='Сравни')
+        self.analysis.documents.add(_document())
+
+    def _service(self, stream):
+        service = mock.Mock()
+        service.astream_documents = stream
+        return mock.patch('agent.async_views.get_async_claude_service', return_value=service)
+
+    async def test_deadline_between_chunks(self):
+        async def stream(documents, custom_prompt, analysis=None, accounting=None, cancel=None):
+            yield 'Первый фрагмент'
+            cancel.cancel('deadline')
+            cancel.check()
+            yield 'Не должен попасть в ответ'
+
+        with self._service(stream):
+            events = await _events(_stream_analysis(self.analysis))
+
+        self.assertEqual([name for name, _ in events], ['analysis', 'analysis', 'text', 'done'])
+        self.assertEqual(events[-1][1]['status'], 'cancelled')
+        await self.analysis.arefresh_from_db()
+        self.assertEqual(self.analysis.status, 'cancelled')
+        self.assertEqual(self.analysis.result, cancellation.DEADLINE_MESSAGE)
+
+    async def test_done_reports_status_set_elsewhere(self):
+        # Анализ отменили через API, а токен отмену еще не заметил: результат
+        # не перезаписывает 'cancelled', и done сообщает статус из базы
+        async def stream(documents, custom_prompt, analysis=None, accounting=None, cancel=None):
+            yield 'Ответ'
+            await Analysis.objects.filter(pk=analysis.pk).aupdate(status='cancelled')
+
+        with self._service(stream):
+            events = await _events(_stream_analysis(self.analysis))
+
+        self.assertEqual(events[-1], ('done', {'id': str(self.analysis.id), 'status': 'cancelled'}))
+
+    async def test_deadline_is_passed_to_stream(self):
+        received = {}
+
+        async def stream(documents, custom_prompt, analysis=None, accounting=None, cancel=None):
+            received['cancel'] = cancel
+            yield 'Ответ'
+
+        self.analysis.deadline = self.analysis.created_at.replace(year=2100)
+        with self._service(stream):
+            events = await _events(_stream_analysis(self.analysis))
+
+        self.assertEqual(received['cancel'].deadline, self.analysis.deadline)
+        self.assertEqual(events[-1][1]['status'], 'completed')
+
+
+@override_settings(ANALYSIS_CONCURRENCY=1, SCHEDULER_POLL_INTERVAL=0.01, CANCEL_CHECK_INTERVAL=0.01)
+class StreamSchedulingTests(TestCase):
+    """Потоковая выдача ждет слота планировщика, как и остальные способы выполнения."""
+
+    def setUp(self):
+        self.analysis = Analysis.objects.create(custom_prompt='Сравни')
+        self.analysis.documents.add(_document())
+
+    async def test_waits_for_free_slot(self):
+        await Analysis.objects.acreate(status='processing', started_at=timezone.now(), client='key:other')
+        stream = _stream_analysis(self.analysis)
+        self.assertEqual(await anext(stream), _event('analysis', {'id': self.analysis.id, 'status': 'pending'}))
+
+        # Слот занят: анализ остается в очереди, пока его не отменят
+        await sync_to_async(Analysis.cancel)(await Analysis.objects.aget(pk=self.analysis.pk))
+        events = await _events(stream)
+
+        self.assertEqual(events, [('done', {'id': str(self.analysis.id), 'status': 'cancelled'})])
+        await self.analysis.arefresh_from_db()
+        self.assertIsNone(self.analysis.started_at)
+
+    async def test_claims_slot_and_records_start(self):
+        async def stream(documents, custom_prompt, analysis=None, accounting=None, cancel=None):
+            yield 'Ответ'
+
+        self.analysis.status = 'failed'
+        await self.analysis.asave()
+        service = mock.Mock(astream_documents=stream)
+        with mock.patch('agent.async_views.get_async_claude_service', return_value=service):
+            events = await _events(_stream_analysis(self.analysis))
+
+        self.assertEqual(
+            [(name, data.get('status')) for name, data in events],
+            [('analysis', 'pending'), ('analysis', 'processing'), ('text', None), ('done', 'completed')],
+        )
+        await self.analysis.arefresh_from_db()
+        self.assertIsNotNone(self.analysis.started_at)
+        self.assertGreaterEqual(self.analysis.started_at, self.analysis.queued_at)
+
+    async def test_disconnect_releases_slot(self):
+        async def stream(documents, custom_prompt, analysis=None, accounting=None, cancel=None):
+            yield 'Ответ'
+
+        service = mock.Mock(astream_documents=stream)
+        with mock.patch('agent.async_views.get_async_claude_service', return_value=service):
+            events = _stream_analysis(self.analysis)
+            async for chunk in events:
+                if chunk.startswith('event: text'):
+                    break
+            await events.aclose()
+
+        await self.analysis.arefresh_from_db()
+        self.assertEqual(self.analysis.status, 'failed')
+
+
+@_FAST_HASHER
+class IdempotencyTests(TestCase):
+    """Повтор POST-запроса с тем же Idempotency-Key получает сохраненный ответ."""
+
+    def setUp(self):
+        for username in ('crm', 'erp'):
+            User.objects.create_user(username, password='secret')
+
+    def _upload(self, key, content='Выручка выросла'.encode(), boundary='first-boundary', user='crm', headers=None):
+        body = encode_multipart(boundary, {'file': SimpleUploadedFile('report.txt', content, 'text/plain')})
+        return self.client.post(
+            '/api/documents/', body, content_type=f'multipart/form-data; boundary={boundary}',
+            headers={'Idempotency-Key': key, **(_basic(user) if user else {}), **(headers or {})},
+        )
+
+    def test_multipart_retry_with_new_boundary_is_replayed(self):
+        first = self._upload('upload-1')
+        retry = self._upload('upload-1', boundary='second-boundary')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json()['id'], first.json()['id'])
+        self.assertEqual(Document.objects.count(), 1)
+
+    def test_multipart_with_other_file_is_rejected(self):
+        self._upload('upload-2')
+        retry = self._upload('upload-2', content='Другой файл'.encode(), boundary='second-boundary')
+
+        self.assertEqual(retry.status_code, 422)
+        self.assertEqual(Document.objects.count(), 1)
+
+    def _post(self, key, url='https://example.com/hook'):
+        return self.client.post(
+            '/api/webhooks/', {'url': url}, content_type='application/json',
+            headers={'Idempotency-Key': key, **_basic('crm')},
+        )
+
+    def _request(self):
+        return RequestFactory().post('/api/webhooks/', {'url': 'https://example.com/hook'}, content_type='application/json')
+
+    def test_json_retry_is_replayed(self):
+        first = self._post('hook-1')
+        retry = self._post('hook-1')
+
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(WebhookEndpoint.objects.count(), 1)
+
+    def test_same_key_with_other_body_is_rejected(self):
+        self._post('hook-2')
+        self.assertEqual(self._post('hook-2', url='https://example.com/other').status_code, 422)
+
+    def test_retry_while_first_request_runs(self):
+        IdempotencyKey.objects.create(
+            client='user:crm', key='hook-3', path='/api/webhooks/',
+            fingerprint=idempotency.fingerprint(self._request()),
+        )
+        response = self._post('hook-3')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(WebhookEndpoint.objects.count(), 0)
+
+    def test_invalid_key(self):
+        self.assertEqual(self._post('ключ с пробелами').status_code, 400)
+
+    def test_server_error_releases_key(self):
+        IdempotencyKey.objects.create(client='user:crm', key='hook-4', path='/api/webhooks/', fingerprint='x')
+        idempotency.finish('user:crm', 'hook-4', HttpResponse(status=503))
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_keys_are_scoped_to_user(self):
+        first = self._upload('upload-3', user='crm')
+        other = self._upload('upload-3', content='Другой файл'.encode(), user='erp')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(other.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', other)
+        self.assertNotEqual(other.json()['id'], first.json()['id'])
+        self.assertEqual(IdempotencyKey.objects.get(key='upload-3', client='user:crm').status_code, 201)
+        self.assertTrue(IdempotencyKey.objects.filter(key='upload-3', client='user:erp').exists())
+
+    def test_client_header_does_not_grant_access(self):
+        first = self._upload('upload-4', user='crm')
+        # X-Client-ID — подсказка для очереди: с ним нельзя получить чужой ответ
+        spoofed = self._upload('upload-4', user=None, headers={'X-Client-ID': 'crm'})
+
+        self.assertEqual(spoofed.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', spoofed)
+        self.assertNotEqual(spoofed.json()['id'], first.json()['id'])
+
+
+@_FAST_HASHER
+class WebhookEndpointApiTests(TestCase):
+    """Вебхуки видны только зарегистрировавшему их владельцу, а secret показывается один раз."""
+
+    def setUp(self):
+        for username in ('crm', 'erp'):
+            User.objects.create_user(username, password='secret')
+
+    def _create(self, user='crm', **data):
+        return self.client.post(
+            '/api/webhooks/', {'url': 'https://example.com/hook', **data},
+            content_type='application/json', headers=_basic(user),
+        )
+
+    def test_secret_only_in_create_response(self):
+        created = self._create()
+        self.assertEqual(created.status_code, 201)
+        self.assertEqual(created.json()['secret'], WebhookEndpoint.objects.get().secret)
+
+        listed = self.client.get('/api/webhooks/', headers=_basic('crm')).json()['results']
+        detail = self.client.get(f"/api/webhooks/{created.json()['id']}/", headers=_basic('crm')).json()
+        self.assertEqual(len(listed), 1)
+        self.assertNotIn('secret', listed[0])
+        self.assertNotIn('secret', detail)
+
+    def test_other_owners_endpoints_are_hidden(self):
+        created = self._create(user='crm')
+        self.assertEqual(WebhookEndpoint.objects.get().client, 'user:crm')
+
+        for headers in (_basic('erp'), {'X-Client-ID': 'crm'}):
+            with self.subTest(headers=headers):
+                listed = self.client.get('/api/webhooks/', headers=headers).json()['results']
+                detail = self.client.get(f"/api/webhooks/{created.json()['id']}/", headers=headers)
+                self.assertEqual(listed, [])
+                self.assertEqual(detail.status_code, 404)
+
+    def test_all_analyses_requires_staff(self):
+        self.assertEqual(self._create(all_analyses=True).status_code, 400)
+
+        User.objects.create_user('operator', password='secret', is_staff=True)
+        self.assertEqual(self._create(user='operator', all_analyses=True).status_code, 201)
+
+
+class BatchRunnerFailureTests(TestCase):
+    """Ошибка пакета завершает оставшиеся анализы через set_status, не трогая завершенные."""
+
+    def test_remaining_analyses_fail_through_status_transition(self):
+        document = _document()
+        batch = create_batch([[document.id], [document.id]], custom_prompt='Сравни')
+        done, remaining = batch.analyses.order_by('created_at', 'id')
+        done.set_status('completed', result='Готово')
+        webhook = WebhookEndpoint.objects.create(url='https://example.com/hook')
+        Analysis.objects.filter(pk=remaining.pk).update(webhook=webhook)
+
+        with mock.patch('agent.batches.FileProcessor'), \
+                mock.patch('agent.batches.ClaudeService', side_effect=RuntimeError('CLAUDE_API_KEY не задан')):
+            BatchRunner(batch).run()
+
+        done.refresh_from_db()
+        remaining.refresh_from_db()
+        self.assertEqual((done.status, done.result), ('completed', 'Готово'))
+        self.assertEqual(remaining.status, 'failed')
+        self.assertEqual(remaining.result, 'Analysis failed: CLAUDE_API_KEY не задан')
+        self.assertIsNotNone(remaining.completed_at)
+        self.assertTrue(WebhookDelivery.objects.filter(analysis=remaining, event='analysis.failed').exists())
+
+
+class _InlineExecutor:
+    """Пул, выполняющий задания в текущем потоке: база тестов в памяти не терпит записи из нескольких потоков."""
+
+    def __init__(self, max_workers=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def map(self, fn, *iterables):
+        return map(fn, *iterables)
+
+
+class BatchWorkerTests(TestCase):
+    """Пакеты выполняет process_analysis_batches; брошенные анализы не держат пакет открытым."""
+
+    def setUp(self):
+        self.document = _document()
+        self.batch = create_batch([[self.document.id], [self.document.id]], custom_prompt='Сравни')
+
+    def _run(self):
+        def run_analysis(analysis, documents=None, claude_service=None):
+            analysis.set_status('completed', result='Готово')
+
+        with mock.patch('agent.batches.FileProcessor'), mock.patch('agent.batches.ClaudeService'), \
+                mock.patch('agent.batches.ThreadPoolExecutor', _InlineExecutor), \
+                mock.patch('agent.batches.run_analysis', side_effect=run_analysis) as run:
+            processed = batches.run_pending()
+        return processed, run
+
+    def test_api_only_queues_batch(self):
+        with mock.patch('agent.batches.BatchRunner.run') as run:
+            response = self.client.post(
+                '/api/batches/', {'document_groups': [[str(self.document.pk)]]}, content_type='application/json',
+            )
+
+        self.assertEqual(response.status_code, 202)
+        run.assert_not_called()
+        self.assertEqual(Analysis.objects.get(batch_id=response.json()['id']).status, 'pending')
+
+    def test_run_pending(self):
+        processed, run = self._run()
+
+        self.assertEqual(processed, 1)
+        self.assertEqual(run.call_count, 2)
+        self.batch.refresh_from_db()
+        self.assertIsNotNone(self.batch.completed_at)
+        self.assertEqual(self._run()[0], 0)
+
+    @override_settings(SCHEDULER_RUN_TIMEOUT=900)
+    def test_abandoned_analysis(self):
+        crashed, pending = self.batch.analyses.order_by('created_at', 'id')
+        crashed.set_status('processing', started_at=timezone.now() - timedelta(seconds=60))
+
+        processed, run = self._run()
+        # Анализ мог еще выполняться в другом процессе: пакет остается открытым
+        self.assertEqual(run.call_count, 1)
+        self.batch.refresh_from_db()
+        self.assertIsNone(self.batch.completed_at)
+
+        Analysis.objects.filter(pk=crashed.pk).update(started_at=timezone.now() - timedelta(seconds=901))
+        processed, run = self._run()
+
+        crashed.refresh_from_db()
+        self.assertEqual((crashed.status, crashed.result), ('failed', batches.ABANDONED_MESSAGE))
+        run.assert_not_called()
+        self.batch.refresh_from_db()
+        self.assertIsNotNone(self.batch.completed_at)
+
+
+class SearchSnippetTests(TestCase):
+    """Сниппет поиска — безопасный HTML: текст документа экранирован, совпадения выделены."""
+
+    def test_document_text_is_escaped(self):
+        document = _document()
+        document.extracted_text = '<script>alert(1)</script> Выручка за квартал <b>выросла</b>'
+        search.index_document(document)
+
+        [hit] = search.search('выручка')
+
+        self.assertEqual(hit['id'], str(document.id))
+        self.assertIn('&lt;script&gt;alert(1)&lt;/script&gt;', hit['snippet'])
+        self.assertIn('<mark>Выручка</mark>', hit['snippet'])
+        self.assertIn('&lt;b&gt;выросла&lt;/b&gt;', hit['snippet'])
+        self.assertNotIn('<script>', hit['snippet'])
+
+    def test_match_query_ignores_fts_operators(self):
+        self.assertEqual(search.build_match_query('выручка OR "2024" кварт'), '"выручка" "OR" "2024" "кварт"*')
+        self.assertIsNone(search.build_match_query(' -*" '))
+
+
+def _zip(entries):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, content in entries.items():
+            archive.writestr(name, content)
+    return SimpleUploadedFile('reports.zip', buffer.getvalue(), 'application/zip')
+
+
+@override_settings(BULK_UPLOAD_MAX_FILES=2)
+class BulkUploadLimitTests(TestCase):
+    """Лимит BULK_UPLOAD_MAX_FILES считает только сохраненные файлы."""
+
+    def test_skipped_entries_do_not_count(self):
+        archive = _zip({
+            'a.exe': b'MZ', 'b.bin': b'\x00', 'c.dll': b'MZ', 'd.so': b'\x7fELF',
+            'report.txt': 'Выручка'.encode(), 'notes.txt': 'Расходы'.encode(),
+        })
+
+        results = BulkDocumentUpload([archive]).run()
+
+        statuses = {result['file']: result['status'] for result in results}
+        self.assertEqual(statuses['reports.zip/report.txt'], 'created')
+        self.assertEqual(statuses['reports.zip/notes.txt'], 'created')
+        self.assertEqual(list(statuses.values()).count('skipped'), 4)
+        self.assertEqual(Document.objects.count(), 2)
+
+    def test_limit_applies_to_stored_files(self):
+        archive = _zip({f'report-{number}.txt': f'Отчет {number}'.encode() for number in range(3)})
+
+        with self.assertRaises(BulkUploadError):
+            BulkDocumentUpload([archive]).run()
+        self.assertEqual(Document.objects.count(), 0)
+        # Ссылки на уже записанное содержимое освобождены
+        self.assertEqual(Blob.objects.count(), 0)
+
+
+class StatusTransitionTests(TestCase):
+    """Analysis.set_status меняет статус атомарно и только по STATUS_TRANSITIONS."""
+
+    def setUp(self):
+        self.analysis = Analysis.objects.create()
+
+    def test_only_one_worker_claims_analysis(self):
+        first = Analysis.objects.get(pk=self.analysis.pk)
+        second = Analysis.objects.get(pk=self.analysis.pk)
+
+        self.assertTrue(first.set_status('processing'))
+        self.assertFalse(second.set_status('processing'))
+        self.assertEqual(second.status, 'pending')
+
+    def test_result_does_not_overwrite_cancellation(self):
+        self.assertTrue(self.analysis.cancel())
+        self.assertFalse(self.analysis.set_status('completed', result='Поздний ответ'))
+
+        self.analysis.refresh_from_db()
+        self.assertEqual(self.analysis.status, 'cancelled')
+        self.assertEqual(self.analysis.result, cancellation.CANCELLED_MESSAGE)
+
+    def test_explicit_expected_statuses(self):
+        self.analysis.set_status('failed', result='Ошибка')
+        self.assertFalse(self.analysis.set_status('processing'))
+        self.assertTrue(self.analysis.set_status('processing', ('failed',)))
+
+    def test_retry_of_running_analysis_is_conflict(self):
+        self.analysis.set_status('processing')
+        response = self.client.post(f'/api/analyses/{self.analysis.pk}/retry/')
+
+        self.assertEqual(response.status_code, 409)
+        self.analysis.refresh_from_db()
+        self.assertEqual(self.analysis.status, 'processing')
+
+
+class ParseRangeTests(SimpleTestCase):
+    """Разбор заголовка Range (RFC 9110): один диапазон байтов или весь файл."""
+
+    def test_ranges(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+        # Конец за пределами файла обрезается, суффикс длиннее файла — весь файл
+        self.assertEqual(parse_range('bytes=500-5000', 1000), (500, 999))
+        self.assertEqual(parse_range('bytes=-5000', 1000), (0, 999))
+
+    def test_unsupported_ranges_return_whole_file(self):
+        for header in ('bytes=0-1,5-9', 'items=0-9', 'bytes=-', 'bytes=9-1', 'garbage'):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range(header, 1000))
+
+    def test_unsatisfiable(self):
+        for header in ('bytes=1000-', 'bytes=2000-3000', 'bytes=-0'):
+            with self.subTest(header=header):
+                with self.assertRaises(RangeNotSatisfiable):
+                    parse_range(header, 1000)
+
+
+class DocumentDownloadTests(TestCase):
+    """Скачивание документа с Range и ETag."""
+
+    def setUp(self):
+        response = self.client.post('/api/documents/', {
+            'file': SimpleUploadedFile('report.txt', b'0123456789', 'text/plain'),
+        })
+        self.url = response.json()['download_url']
+
+    def test_partial_content(self):
+        response = self.client.get(self.url, headers={'Range': 'bytes=2-5'})
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+
+    def test_not_satisfiable(self):
+        response = self.client.get(self.url, headers={'Range': 'bytes=10-'})
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_etag_revalidation(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': etag}).status_code, 304)
+
+
+class WebhookSignatureTests(TestCase):
+    """Подпись уведомлений HMAC-SHA256 и ее проверка получателем."""
+
+    secret = 'whsec_test'
+    body = b'{"events":[]}'
+
+    def test_sign(self):
+        expected = hmac.new(self.secret.encode(), b'1700000000.' + self.body, hashlib.sha256).hexdigest()
+        self.assertEqual(webhooks.sign(self.secret, 1700000000, self.body), f'sha256={expected}')
+
+    def test_verify(self):
+        timestamp = str(int(time.time()))
+        signature = webhooks.sign(self.secret, timestamp, self.body)
+
+        self.assertTrue(webhooks.verify_signature(self.secret, timestamp, self.body, signature))
+        self.assertFalse(webhooks.verify_signature(self.secret, timestamp, self.body + b' ', signature))
+        self.assertFalse(webhooks.verify_signature('whsec_other', timestamp, self.body, signature))
+        self.assertFalse(webhooks.verify_signature(self.secret, timestamp, self.body, None))
+
+    def test_reject_stale_or_invalid_timestamp(self):
+        stale = str(int(time.time()) - 301)
+        signature = webhooks.sign(self.secret, stale, self.body)
+
+        self.assertFalse(webhooks.verify_signature(self.secret, stale, self.body, signature))
+        self.assertTrue(webhooks.verify_signature(self.secret, stale, self.body, signature, tolerance=600))
+        self.assertFalse(webhooks.verify_signature(self.secret, 'now', self.body, webhooks.sign(self.secret, 'now', self.body)))
+
+    def test_dispatch_signs_request(self):
+        endpoint = WebhookEndpoint.objects.create(url='https://93.184.215.14/hook')
+        analysis = Analysis.objects.create(webhook=endpoint)
+        analysis.set_status('processing')
+        analysis.set_status('completed', result='Готово', completed_at=timezone.now())
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(204)
+
+        with httpx.Client(transport=httpx.MockTransport(handler)) as client:
+            self.assertEqual(webhooks.dispatch(client), 1)
+
+        request, = requests
+        self.assertTrue(webhooks.verify_signature(
+            endpoint.secret,
+            request.headers[webhooks.TIMESTAMP_HEADER],
+            request.content,
+            request.headers[webhooks.SIGNATURE_HEADER],
+        ))
+        event, = json.loads(request.content)['events']
+        self.assertEqual(event['type'], 'analysis.completed')
+        self.assertEqual(event['analysis']['id'], str(analysis.pk))
+        self.assertEqual(WebhookDelivery.objects.get().status, 'delivered')
+
+
+class _Clock:
+    """Часы для ограничителя: sleep() переводит время вперед без ожидания."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    monotonic = time
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RateLimiterTests(SimpleTestCase):
+    """Корзины токенов: списание, пополнение, ожидание и уточнение резерва."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.limiter = RateLimiter(
+            f'{directory.name}/ratelimit.sqlite3',
+            {'default': {'rpm': 2, 'itpm': 1000}, 'claude-opus': {'rpm': 0}},
+            period=60,
+            max_wait=30,
+        )
+        self.clock = _Clock()
+        patcher = mock.patch('agent.ratelimit.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _tokens(self, dimension, model='claude-sonnet'):
+        row = self.limiter._connection().execute(
+            'SELECT tokens FROM rate_limit_bucket WHERE key = ?', (f'{model}:{dimension}',)
+        ).fetchone()
+        return row[0]
+
+    def test_limits_for(self):
+        self.assertEqual(self.limiter.limits_for('claude-sonnet'), {'rpm': 2, 'itpm': 1000})
+        # Модель без заданных лимитов не ограничивается и не трогает базу
+        self.assertEqual(self.limiter.limits_for('claude-opus'), {})
+        self.assertEqual(self.limiter.acquire('claude-opus', input_tokens=10 ** 6)['waited'], 0)
+
+    def test_take_and_refill(self):
+        self.assertEqual(self.limiter._try_take('claude-sonnet', {'rpm': 1, 'itpm': 600}), 0)
+        self.assertEqual(self._tokens('itpm'), 400)
+        # Не хватает 200 токенов: при 1000 токенах в минуту это 12 секунд, списания нет
+        self.assertAlmostEqual(self.limiter._try_take('claude-sonnet', {'rpm': 1, 'itpm': 600}), 12)
+        self.assertEqual(self._tokens('itpm'), 400)
+
+        self.clock.now += 12
+        self.assertEqual(self.limiter._try_take('claude-sonnet', {'rpm': 1, 'itpm': 600}), 0)
+        self.assertAlmostEqual(self._tokens('itpm'), 0)
+        # Пополнение не превышает емкость корзины
+        self.clock.now += 600
+        self.assertEqual(self.limiter._try_take('claude-sonnet', {'rpm': 1}), 0)
+        self.assertEqual(self._tokens('itpm'), 1000)
+
+    def test_oversized_request_waits_for_full_bucket(self):
+        self.assertEqual(self.limiter._try_take('claude-sonnet', {'rpm': 1, 'itpm': 5000}), 0)
+        self.assertEqual(self._tokens('itpm'), -4000)
+        self.assertAlmostEqual(self.limiter._try_take('claude-sonnet', {'rpm': 1, 'itpm': 5000}), 300)
+
+    def test_acquire_waits_or_times_out(self):
+        self.limiter.acquire('claude-sonnet')
+        self.limiter.acquire('claude-sonnet')
+        reservation = self.limiter.acquire('claude-sonnet')
+        self.assertAlmostEqual(reservation['waited'], 30)
+
+        with self.assertRaises(RateLimitTimeout) as cm:
+            self.limiter.acquire('claude-sonnet', max_wait=10)
+        self.assertAlmostEqual(cm.exception.wait, 30)
+
+    def test_settle(self):
+        reservation = self.limiter.acquire('claude-sonnet', input_tokens=800)
+        self.limiter.settle(reservation, input_tokens=300)
+        self.assertEqual(self._tokens('itpm'), 700)
+        # Перерасход списывается, возврат не превышает емкость
+        self.limiter.settle(reservation, input_tokens=1500)
+        self.assertEqual(self._tokens('itpm'), 0)
+        self.limiter.settle({'model': 'claude-sonnet', 'itpm': 5000, 'otpm': 0}, input_tokens=0)
+        self.assertEqual(self._tokens('itpm'), 1000)
+
+    @override_settings(RATE_LIMIT_CHARS_PER_TOKEN=4)
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens(None), 1)
+        self.assertEqual(estimate_tokens('x' * 400), 101)
+
+
+class TextEncodingTests(SimpleTestCase):
+    """Определение кодировки TXT/CSV и декодирование за один проход."""
+
+    text = 'Выручка за квартал выросла на 12%, расходы остались прежними.\n'
+
+    def _file(self, data):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = f'{directory.name}/data.txt'
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_detect_encoding(self):
+        cases = [
+            ('utf-8-sig', self.text.encode('utf-8-sig')),
+            ('utf-16', self.text.encode('utf-16')),
+            ('utf-32', self.text.encode('utf-32')),
+            ('utf-8', self.text.encode('utf-8')),
+            ('utf-8', b'plain ascii'),
+            # Образец обрезан посреди двухбайтового символа
+            ('utf-8', self.text.encode('utf-8')[:3]),
+            ('cp1251', self.text.encode('cp1251')),
+            ('koi8_r', self.text.encode('koi8-r')),
+            ('cp1252', 'Café crème brûlée, naïve façade'.encode('cp1252')),
+        ]
+        for expected, sample in cases:
+            with self.subTest(expected=expected, sample=sample[:10]):
+                self.assertEqual(text_encoding.detect_encoding(sample), expected)
+
+    def test_open_text_reads_past_sample(self):
+        data = (self.text * 100).encode('cp1251')
+        with text_encoding.open_text(self._file(data), sample_size=256) as f:
+            self.assertEqual(f.encoding, 'cp1251')
+            self.assertEqual(f.read(), self.text * 100)
+
+    def test_open_text_replaces_invalid_bytes(self):
+        data = self.text.encode('utf-8') * 10 + b'\xff\xfe\xfd' + 'конец'.encode('utf-8')
+        with text_encoding.open_text(self._file(data), sample_size=len(self.text.encode('utf-8'))) as f:
+            text = f.read()
+
+        self.assertEqual(f.encoding, 'utf-8')
+        self.assertTrue(text.startswith(self.text * 10))
+        self.assertTrue(text.endswith('\ufffd' * 3 + 'конец'))
+
+
+class CompressedTextFieldTests(TestCase):
+    """Сжатие результатов анализов и извлеченного текста."""
+
+    long_text = '## Итоги\n\n' + 'Выручка выросла на 12%, расходы остались прежними. ' * 200
+
+    def test_round_trip(self):
+        for text in ('', 'Коротко', self.long_text):
+            with self.subTest(size=len(text)):
+                self.assertEqual(fields.decompress_text(fields.compress_text(text)), text)
+
+        self.assertEqual(fields.compress_text('Коротко')[:1], fields.FORMAT_PLAIN)
+        packed = fields.compress_text(self.long_text)
+        self.assertEqual(packed[:1], fields.FORMAT_ZLIB)
+        self.assertLess(len(packed), len(self.long_text.encode('utf-8')) // 10)
+
+    def test_decompress_legacy_and_invalid(self):
+        self.assertIsNone(fields.decompress_text(None))
+        # Строки, записанные до перехода на сжатие, читаются как есть
+        self.assertEqual(fields.decompress_text('Старый текст'), 'Старый текст')
+        self.assertEqual(fields.decompress_text(memoryview(b'\x00abc')), 'abc')
+        with self.assertRaises(ValueError):
+            fields.decompress_text(b'\x07abc')
+
+    def test_model_round_trip(self):
+        document = Document.objects.create(name='report', file='documents/report.txt', file_type='txt',
+                                           extracted_text=self.long_text)
+        analysis = Analysis.objects.create(result=self.long_text)
+        empty = Analysis.objects.create()
+
+        self.assertEqual(Document.objects.get(pk=document.pk).extracted_text, self.long_text)
+        self.assertEqual(Analysis.objects.get(pk=analysis.pk).result, self.long_text)
+        self.assertIsNone(Analysis.objects.get(pk=empty.pk).result)
+
+        stored = Analysis.objects.filter(pk=analysis.pk).values_list('result', flat=True).get()
+        self.assertIsInstance(stored, fields.CompressedText)
+        self.assertEqual(fields.decompress_text(stored), self.long_text)
+
+    def test_unread_value_is_saved_unchanged(self):
+        analysis = Analysis.objects.create(result=self.long_text)
+
+        loaded = Analysis.objects.get(pk=analysis.pk)
+        loaded.save()
+        self.assertEqual(Analysis.objects.get(pk=analysis.pk).result, self.long_text)
+
+        Analysis.objects.filter(pk=analysis.pk).update(result='Новый результат')
+        self.assertEqual(Analysis.objects.get(pk=analysis.pk).result, 'Новый результат')
+
+
+class BlobStorageTests(TestCase):
+    """Хранение файлов по содержимому и счетчик ссылок."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def test_store_deduplicates(self):
+        first = blobs.store(io.BytesIO(b'%PDF-1.4 report'), 'report.PDF')
+        second = blobs.store(io.BytesIO(b'%PDF-1.4 report'), 'copy.pdf')
+        other = blobs.store(io.BytesIO(b'%PDF-1.4 report'), 'report.txt')
+
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(Blob.objects.get(pk=first.pk).ref_count, 2)
+        self.assertEqual(first.sha256, hashlib.sha256(b'%PDF-1.4 report').hexdigest())
+        self.assertEqual(first.file.name, blobs.blob_path(first.sha256, '.pdf'))
+        self.assertEqual(first.size, 15)
+        # Расширение входит в ключ: от него зависит извлечение текста
+        self.assertNotEqual(other.pk, first.pk)
+
+    def test_last_release_deletes_file(self):
+        blob = blobs.store(io.BytesIO(b'data'), 'data.csv')
+        blobs.store(io.BytesIO(b'data'), 'data.csv')
+
+        blobs.release(blob.pk)
+        self.assertEqual(Blob.objects.get(pk=blob.pk).ref_count, 1)
+        self.assertTrue(default_storage.exists(blob.file.name))
+
+        blobs.release(blob.pk)
+        self.assertFalse(Blob.objects.filter(pk=blob.pk).exists())
+        self.assertFalse(default_storage.exists(blob.file.name))
+        # Повторное освобождение ничего не ломает
+        blobs.release(blob.pk)
+
+    def test_documents_share_blob(self):
+        first = Document.objects.create(name='a', file=SimpleUploadedFile('a.txt', b'same'), file_type='txt')
+        second = Document.objects.create(name='b', file=SimpleUploadedFile('b.txt', b'same'), file_type='txt')
+        blob = first.blob
+
+        self.assertEqual(second.blob_id, blob.pk)
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(Blob.objects.get(pk=blob.pk).ref_count, 2)
+
+        first.delete()
+        self.assertEqual(Blob.objects.get(pk=blob.pk).ref_count, 1)
+        second.delete()
+        self.assertFalse(Blob.objects.filter(pk=blob.pk).exists())
+        self.assertFalse(default_storage.exists(blob.file.name))
+
+    def test_replacing_file_releases_previous_blob(self):
+        document = Document.objects.create(name='a', file=SimpleUploadedFile('a.txt', b'old'), file_type='txt')
+        old_blob = document.blob
+
+        document.file = SimpleUploadedFile('a.txt', b'new')
+        document.save()
+
+        self.assertNotEqual(document.blob_id, old_blob.pk)
+        self.assertFalse(Blob.objects.filter(pk=old_blob.pk).exists())
+        with default_storage.open(document.file.name) as f:
+            self.assertEqual(f.read(), b'new')
+
+
+@override_settings(SCHEDULER_AGING=60)
+class SchedulerOrderTests(SimpleTestCase):
+    """Порядок очереди: классы приоритета, очередность клиентов и повышение класса за ожидание."""
+
+    def setUp(self):
+        self.now = timezone.now()
+
+    def _ago(self, seconds):
+        return self.now - timedelta(seconds=seconds)
+
+    def test_priority_classes(self):
+        waiting = [
+            (1, 'bulk', 'a', self._ago(30)),
+            (2, 'normal', 'a', self._ago(20)),
+            (3, 'interactive', 'a', self._ago(10)),
+        ]
+        self.assertEqual(scheduler.queue_order(waiting, Counter(), self.now), [3, 2, 1])
+
+    def test_clients_take_turns(self):
+        waiting = [(pk, 'bulk', 'a', self._ago(50 - pk)) for pk in range(1, 4)]
+        waiting.append((4, 'bulk', 'b', self._ago(1)))
+        # Единственный анализ клиента b не ждет всю очередь клиента a
+        self.assertEqual(scheduler.queue_order(waiting, Counter(), self.now), [1, 4, 2, 3])
+        # Уже выполняющиеся анализы клиента считаются его очередью
+        self.assertEqual(scheduler.queue_order(waiting, Counter(b=1), self.now), [1, 2, 4, 3])
+
+    def test_aging(self):
+        self.assertEqual(scheduler._rank('bulk', self._ago(59), self.now), 2)
+        self.assertEqual(scheduler._rank('bulk', self._ago(60), self.now), 1)
+        self.assertEqual(scheduler._rank('bulk', self._ago(600), self.now), 0)
+        self.assertEqual(scheduler._rank('unknown', self.now, self.now), 1)
+
+        waiting = [(1, 'bulk', 'a', self._ago(130)), (2, 'interactive', 'b', self._ago(1))]
+        # Массовый анализ, прождавший два интервала, догоняет интерактивный и идет первым как более ранний
+        self.assertEqual(scheduler.queue_order(waiting, Counter(), self.now), [1, 2])
+
+
+class SchedulerClientIdTests(TestCase):
+    """Определение клиента для справедливой очереди."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_client_id(self):
+        request = self.factory.post('/', headers={'X-Client-ID': 'crm'}, REMOTE_ADDR='10.0.0.5')
+        request.user = User.objects.create_user('alice')
+        self.assertEqual(scheduler.client_id(request), 'user:alice')
+
+        request = self.factory.post('/', headers={'X-Client-ID': 'crm'}, REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(scheduler.client_id(request), 'key:crm')
+
+        for header in ('', 'bad value', 'x' * 65):
+            with self.subTest(header=header):
+                request = self.factory.post('/', headers={'X-Client-ID': header}, REMOTE_ADDR='10.0.0.5')
+                self.assertEqual(scheduler.client_id(request), 'ip:10.0.0.5')
+
+    @_FAST_HASHER
+    def test_owner_id_ignores_client_header(self):
+        User.objects.create_user('alice', password='secret')
+
+        request = self.factory.post('/', headers={'X-Client-ID': 'crm'}, REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(scheduler.owner_id(request), 'ip:10.0.0.5')
+        # Basic-аутентификация распознается до DRF (в middleware)
+        request = self.factory.post('/', headers={'X-Client-ID': 'crm', **_basic('alice')}, REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(scheduler.owner_id(request), 'user:alice')
+        request = self.factory.post('/', headers={'Authorization': 'Basic bm90OnZhbGlk'}, REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(scheduler.owner_id(request), 'ip:10.0.0.5')
+
+
+class AsyncAnalysisApiTests(TestCase):
+    """Создание и повтор анализа через асинхронные эндпоинты."""
+
+    def setUp(self):
+        self.document = _document()
+
+    async def _post(self, path, data=None):
+        return await self.async_client.post(path, data or {}, content_type='application/json')
+
+    async def test_create(self):
+        with mock.patch('agent.async_views.arun_analysis') as run:
+            response = await self._post('/api/async/analyses/', {
+                'document_ids': [str(self.document.pk)], 'custom_prompt': 'Сравни',
+            })
+
+        self.assertEqual(response.status_code, 201)
+        analysis = await Analysis.objects.aget(pk=response.json()['id'])
+        self.assertEqual(analysis.status, 'pending')
+        self.assertEqual([document.pk async for document in analysis.documents.all()], [self.document.pk])
+        run.assert_awaited_once()
+
+    async def test_unknown_document(self):
+        missing = '00000000-0000-0000-0000-000000000000'
+        with mock.patch('agent.async_views.arun_analysis') as run:
+            response = await self._post('/api/async/analyses/', {'document_ids': [str(self.document.pk), missing]})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(missing, response.json()['document_ids'][0])
+        self.assertFalse(await Analysis.objects.aexists())
+        run.assert_not_called()
+
+    async def test_invalid_body(self):
+        response = await self.async_client.post('/api/async/analyses/', 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_retry(self):
+        analysis = await Analysis.objects.acreate(status='failed', result='Analysis failed: сбой')
+        with mock.patch('agent.async_views.arun_analysis') as run:
+            response = await self._post(f'/api/async/analyses/{analysis.pk}/retry/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'pending')
+        self.assertIsNone(response.json()['result'])
+        run.assert_awaited_once()
+
+        await analysis.aset_status('processing')
+        response = await self._post(f'/api/async/analyses/{analysis.pk}/retry/')
+        self.assertEqual(response.status_code, 409)
+
+
+class AnalysisWebhookOwnershipTests(TestCase):
+    """Анализ можно связать только с собственным вебхуком владельца."""
+
+    def setUp(self):
+        self.document = _document()
+        self.endpoint = WebhookEndpoint.objects.create(client='user:crm', url='https://example.com/hook')
+
+    def _create(self, headers):
+        with mock.patch('agent.views.run_analysis'):
+            return self.client.post(
+                '/api/analyses/', {'document_ids': [str(self.document.pk)], 'webhook': str(self.endpoint.pk)},
+                content_type='application/json', headers=headers,
+            )
+
+    def test_own_webhook(self):
+        self.client.force_login(User.objects.create_user('crm'))
+        response = self._create({})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Analysis.objects.get().webhook_id, self.endpoint.pk)
+
+    def test_other_clients_webhook_is_rejected(self):
+        response = self._create({'X-Client-ID': 'crm'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('webhook', response.json())
+        self.assertFalse(Analysis.objects.exists())
+
+
+class WebhookUrlTests(TestCase):
+    """Вебхук не должен давать доступ к внутренним адресам (SSRF)."""
+
+    def test_check_url(self):
+        webhooks.check_url('https://93.184.215.14/hook')
+        webhooks.check_url('http://[2606:2800:21f:cb07:6820:80da:af6b:8b2c]/hook')
+        for url in (
+            'ftp://93.184.215.14/hook', 'https:///hook', 'http://127.0.0.1:8000/', 'http://localhost/',
+            'http://169.254.169.254/latest/meta-data/', 'http://10.0.0.5/', 'http://192.168.1.1/',
+            'http://[::1]/', 'http://[::ffff:127.0.0.1]/', 'http://0.0.0.0/',
+        ):
+            with self.subTest(url=url):
+                with self.assertRaises(ValueError):
+                    webhooks.check_url(url)
+
+    def test_unresolved_host(self):
+        with mock.patch('agent.webhooks.socket.getaddrinfo', side_effect=socket.gaierror):
+            webhooks.check_url('https://hooks.example.com/', resolve=False)
+            with self.assertRaises(ValueError):
+                webhooks.check_url('https://hooks.example.com/')
+
+    @override_settings(WEBHOOK_ALLOW_PRIVATE_URLS=True)
+    def test_private_urls_allowed_for_development(self):
+        webhooks.check_url('http://127.0.0.1:8000/')
+        with self.assertRaises(ValueError):
+            webhooks.check_url('file:///etc/passwd')
+
+    def test_registration_rejects_internal_address(self):
+        response = self.client.post(
+            '/api/webhooks/', {'url': 'http://169.254.169.254/latest/meta-data/'}, content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('url', response.json())
+        self.assertFalse(WebhookEndpoint.objects.exists())
+
+    def test_dispatch_skips_internal_address(self):
+        # Адрес мог быть сохранен до проверки или сменить IP в DNS после регистрации
+        endpoint = WebhookEndpoint.objects.create(url='http://127.0.0.1:8000/hook')
+        analysis = Analysis.objects.create(webhook=endpoint)
+        analysis.set_status('cancelled')
+        handler = mock.Mock(return_value=httpx.Response(204))
+
+        with httpx.Client(transport=httpx.MockTransport(handler)) as client:
+            webhooks.dispatch(client)
+
+        handler.assert_not_called()
+        delivery = WebhookDelivery.objects.get()
+        self.assertEqual(delivery.status, 'pending')
+        self.assertIn('внутренний адрес', delivery.last_error)
+
+
+@override_settings(RESPONSE_COMPRESSION_MIN_SIZE=100)
+class CompressionMiddlewareTests(SimpleTestCase):
+    """Выбор сжатия ответа; HTML не сжимается brotli (BREACH)."""
+
+    body = ('<p>Выручка за квартал выросла на 12%</p>' * 50).encode('utf-8')
+
+    def _get(self, content_type, accept='br, gzip'):
+        response = HttpResponse(self.body, content_type=content_type)
+        middleware = CompressionMiddleware(lambda request: response)
+        return middleware(RequestFactory().get('/', headers={'Accept-Encoding': accept}))
+
+    def test_json_prefers_brotli(self):
+        response = self._get('application/json')
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_html_uses_gzip_with_random_bytes(self):
+        with mock.patch('django.utils.text.secrets.randbelow', side_effect=[3, 7]):
+            first = self._get('text/html; charset=utf-8')
+            second = self._get('text/html; charset=utf-8')
+
+        self.assertEqual(first['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(first.content), self.body)
+        # Случайной длины имя файла в заголовке gzip (защита от BREACH, как в GZipMiddleware)
+        self.assertTrue(first.content[3] & gzip.FNAME)
+        self.assertEqual(len(second.content) - len(first.content), 4)
+
+    def test_html_without_gzip_is_not_compressed(self):
+        response = self._get('text/html; charset=utf-8', accept='br')
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, self.body)
+
+
+@override_settings(CLAUDE_API_KEY='test-key', ANALYSIS_CONCURRENCY=0)
+class RateLimitTimeoutTests(TestCase):
+    """Ожидание лимита запросов — не ошибка модели: резервные модели не пробуются."""
+
+    def setUp(self):
+        self.service = ClaudeService()
+        self.service.client = mock.Mock()
+        self.service.rate_limiter = mock.Mock()
+        self.service.rate_limiter.acquire.side_effect = RateLimitTimeout(self.service.default_model, 45)
+        self.analysis = Analysis.objects.create(custom_prompt='Сравни')
+        self.analysis.documents.add(_document())
+
+    def test_analysis_fails_with_rate_limit_reason(self):
+        with mock.patch.object(self.service, 'build_request', return_value=('system', 'prompt')):
+            run_analysis(self.analysis, claude_service=self.service)
+
+        self.analysis.refresh_from_db()
+        self.assertEqual(self.analysis.status, 'failed')
+        self.assertIn('Превышен лимит запросов', self.analysis.result)
+        self.assertEqual(self.service.rate_limiter.acquire.call_count, 1)
+        self.service.client.messages.create.assert_not_called()
+        self.assertFalse(ModelRouteDecision.objects.exists())
+
+
+class ExtractionPoolTests(SimpleTestCase):
+    """Процессы пула запускаются по мере надобности, зависший или упавший процесс заменяется."""
+
+    def setUp(self):
+        self.pool = ExtractionPool(size=2, timeout=60, cpu_limit=60, memory_limit_mb=0, max_jobs=10)
+        self.addCleanup(self.pool.close)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f'{directory.name}/report.txt'
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('Выручка выросла')
+
+    def test_workers_start_on_first_job(self):
+        self.assertEqual(self.pool._workers, set())
+
+        self.assertEqual(self.pool.extract(self.path), 'Выручка выросла')
+        self.assertEqual(len(self.pool._workers), 1)
+
+    def test_timed_out_worker_is_killed(self):
+        # Процесс не успевает даже выполнить django.setup()
+        self.pool.timeout = 0.01
+        with self.assertRaises(ExtractionError) as raised:
+            self.pool.extract(self.path)
+
+        self.assertEqual(raised.exception.reason, 'timeout')
+        self.assertEqual(self.pool._workers, set())
+        self.pool.timeout = 60
+        self.assertEqual(self.pool.extract(self.path), 'Выручка выросла')
+
+    def test_crashed_worker_is_replaced(self):
+        worker = self.pool._start()
+        worker.process.terminate()
+        worker.process.join()
+        self.pool._idle.put(worker)
+
+        with self.assertRaises(ExtractionError) as raised:
+            self.pool.extract(self.path)
+
+        self.assertEqual(raised.exception.reason, 'crashed')
+        self.assertNotIn(worker, self.pool._workers)
+        self.assertEqual(self.pool.extract(self.path), 'Выручка выросла')
+
+
+def _docx_part(body):
+    return (
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f'<w:body>{body}</w:body></w:document>'
+    )
+
+
+def _p(*runs):
+    return '<w:p>' + ''.join(f'<w:r><w:t>{run}</w:t></w:r>' for run in runs) + '</w:p>'
+
+
+class DocxTextTests(SimpleTestCase):
+    """Потоковый разбор DOCX: таблицы, колонтитулы и сноски в порядке документа."""
+
+    def _extract(self, parts):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = f'{directory.name}/contract.docx'
+        with zipfile.ZipFile(path, 'w') as archive:
+            for name, body in parts.items():
+                archive.writestr(name, _docx_part(body))
+        return list(iter_docx_text(path))
+
+    def test_parts_and_tables_in_document_order(self):
+        table = (
+            '<w:tbl>'
+            f'<w:tr><w:tc>{_p("Товар")}</w:tc><w:tc>{_p("Сумма")}</w:tc></w:tr>'
+            f'<w:tr><w:tc>{_p("Сталь")}</w:tc><w:tc>{_p("1 200 ", "000")}</w:tc></w:tr>'
+            '</w:tbl>'
+        )
+        lines = self._extract({
+            'word/footer1.xml': _p('Конфиденциально'),
+            'word/footnotes.xml': _p('Без НДС'),
+            'word/document.xml': _p('Договор') + table + _p('Подписи'),
+            'word/header1.xml': _p('Договор поставки № 17'),
+        })
+
+        self.assertEqual(lines, [
+            'Договор поставки № 17',
+            'Договор',
+            'Товар | Сумма',
+            'Сталь | 1 200 000',
+            'Подписи',
+            'Без НДС',
+            'Конфиденциально',
+        ])
+
+    def test_nested_table_stays_in_outer_cell(self):
+        nested = f'<w:tbl><w:tr><w:tc>{_p("a")}</w:tc><w:tc>{_p("b")}</w:tc></w:tr></w:tbl>'
+        lines = self._extract({
+            'word/document.xml': f'<w:tbl><w:tr><w:tc>{_p("Итого")}</w:tc><w:tc>{nested}</w:tc></w:tr></w:tbl>',
+        })
+
+        self.assertEqual(lines, ['Итого | a | b'])
+
+
+class ProfilingMiddlewareTests(TestCase):
+    """?profile=1 профилирует только запросы сотрудников."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(PROFILES_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_non_staff_request_is_not_profiled(self):
+        self.client.force_login(User.objects.create_user('analyst'))
+
+        response = self.client.get('/api/analyses/?profile=1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('X-Profile-Id'))
+        self.assertEqual(profiling.recent_profiles(), [])
+
+    def test_staff_request_is_profiled(self):
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+
+        response = self.client.get('/api/analyses/?profile=1')
+
+        profile = profiling.load_profile(response['X-Profile-Id'])
+        self.assertEqual(profile['user'], 'admin')
+        self.assertEqual(profile['path'], '/api/analyses/?profile=1')
+        self.assertEqual(profile['status'], 200)
+
+
+class RetryOnLockTests(SimpleTestCase):
+    """Запись повторяется только при конкурентной блокировке SQLite."""
+
+    def setUp(self):
+        patcher = mock.patch('agent.db.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retries_until_lock_is_released(self):
+        write = mock.Mock(side_effect=[OperationalError('database is locked'), 'ok'])
+
+        self.assertEqual(retry_on_lock(retries=3, delay=0.01)(write)(), 'ok')
+        self.assertEqual(write.call_count, 2)
+        self.assertEqual(self.sleep.call_count, 1)
+
+    def test_gives_up_after_retries(self):
+        write = mock.Mock(side_effect=OperationalError('database is locked'))
+
+        with self.assertRaises(OperationalError):
+            retry_on_lock(retries=2, delay=0.01)(write)()
+        self.assertEqual(write.call_count, 3)
+
+    def test_other_errors_are_not_retried(self):
+        write = mock.Mock(side_effect=OperationalError('no such table: agent_analysis'))
+
+        with self.assertRaises(OperationalError):
+            retry_on_lock(write)()
+        write.assert_called_once()
+        self.sleep.assert_not_called()
+
+
+class SqlitePragmaTests(TestCase):
+    """PRAGMA из SQLITE_PRAGMAS выполняются при открытии соединения."""
+
+    def _pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_busy_timeout_and_synchronous(self):
+        self.assertEqual(self._pragma('busy_timeout'), int(settings.SQLITE_BUSY_TIMEOUT * 1000))
+        # 1 — NORMAL: в режиме WAL fsync только при контрольной точке
+        self.assertEqual(self._pragma('synchronous'), 1)
+
+
+@override_settings(MODEL_ROUTING_ENABLED=True, MODEL_ROUTING_MIN_SAMPLES=2, MODEL_ROUTING_MAX_ERROR_RATE=0.5)
+class ModelRouterTests(TestCase):
+    """Правило выбирается по размеру и типу задачи, кандидаты — по статистике журнала."""
+
+    rules = [
+        {'name': 'small', 'task': 'custom', 'max_prompt_tokens': 3000, 'models': ['haiku', 'sonnet']},
+        {'name': 'large', 'min_prompt_tokens': 3001, 'models': ['opus'], 'prefer': 'order'},
+    ]
+
+    def setUp(self):
+        # Кэш статистики общий для процесса: каждый тест строит ее по своему журналу
+        routing._stats_cache['expires'] = 0.0
+        self.addCleanup(routing._stats_cache.update, expires=0.0)
+        self.router = routing.ModelRouter('sonnet', ['opus'], rules=self.rules)
+
+    def _record(self, model, latency, error=None, times=2):
+        for _ in range(times):
+            decision = routing.RouteDecision('small', 'custom', 100, [model])
+            decision.add_attempt(model, latency, error)
+            routing.record_decision(decision)
+
+    def test_rule_by_size_and_task(self):
+        self.assertEqual(self.router.route(100, routing.TASK_CUSTOM).rule, 'small')
+        self.assertEqual(self.router.route(100, routing.TASK_COMPARISON).rule, 'default')
+        self.assertEqual(self.router.route(40000, routing.TASK_COMPARISON).rule, 'large')
+
+    def test_default_and_fallback_models_follow_candidates(self):
+        self.assertEqual(self.router.route(100, routing.TASK_CUSTOM).models, ['haiku', 'sonnet', 'opus'])
+        self.assertEqual(self.router.route(100, routing.TASK_COMPARISON).models, ['sonnet', 'opus'])
+
+    def test_faster_model_goes_first(self):
+        self._record('haiku', 2.0)
+        self._record('sonnet', 0.5)
+
+        self.assertEqual(self.router.route(100, routing.TASK_CUSTOM).models[:2], ['sonnet', 'haiku'])
+
+    def test_unhealthy_model_goes_last(self):
+        self._record('haiku', 0.1, error='overloaded')
+        self._record('sonnet', 3.0)
+
+        self.assertEqual(self.router.route(100, routing.TASK_CUSTOM).models[:2], ['sonnet', 'haiku'])
+
+    def test_decision_records_model_that_answered(self):
+        decision = routing.RouteDecision('small', 'custom', 100, ['haiku', 'sonnet'])
+        decision.add_attempt('haiku', 0.2, error='overloaded')
+        decision.add_attempt('sonnet', 1.0)
+
+        record = routing.record_decision(decision)
+
+        self.assertEqual((record.chosen_model, record.model_used, record.success), ('haiku', 'sonnet', True))
+        self.assertEqual(record.latency_ms, 1200)
+
+
+@override_settings(CLAUDE_API_KEY='test-key', ANALYSIS_CONCURRENCY=0, MODEL_ROUTING_ENABLED=False)
+class AnalysisAccountingTests(TestCase):
+    """Время этапов и расход токенов сохраняются в полях анализа."""
+
+    def test_completed_analysis_records_usage(self):
+        service = ClaudeService()
+        service.client = mock.MagicMock()
+        service.rate_limiter = None
+        usage = mock.Mock(
+            input_tokens=1200, output_tokens=300, cache_creation_input_tokens=0, cache_read_input_tokens=800,
+        )
+        message = mock.Mock(model=service.default_model, stop_reason='end_turn', usage=usage)
+        message.content = [mock.Mock(text='Выручка выросла')]
+        stream = service.client.messages.stream.return_value.__enter__.return_value
+        stream.__iter__.return_value = iter([])
+        stream.get_final_message.return_value = message
+        analysis = Analysis.objects.create(custom_prompt='Сравни')
+        analysis.documents.add(_document())
+
+        with mock.patch.object(service, 'build_request', return_value=('system', 'prompt')):
+            run_analysis(analysis, claude_service=service)
+
+        analysis.refresh_from_db()
+        self.assertEqual(analysis.status, 'completed')
+        self.assertEqual(analysis.model_used, service.default_model)
+        self.assertEqual(
+            (analysis.input_tokens, analysis.output_tokens, analysis.cache_read_input_tokens), (1200, 300, 800),
+        )
+        self.assertEqual((analysis.attempts, analysis.stop_reason), (1, 'end_turn'))
+        self.assertIsNotNone(analysis.api_latency_ms)
+        self.assertEqual(analysis.timings['attempts'][0]['model'], service.default_model)
+
+    def test_latency_report_groups_by_model(self):
+        for latency in (100, 200, 300, 400):
+            Analysis.objects.create(
+                status='completed', completed_at=timezone.now(), model_used='haiku',
+                api_latency_ms=latency, duration_ms=latency + 50, input_tokens=10, output_tokens=5,
+            )
+        Analysis.objects.create(status='failed', completed_at=timezone.now(), model_used='haiku', api_latency_ms=9000)
+
+        [row] = latency_report(days=1)
+
+        self.assertEqual((row['model'], row['count']), ('haiku', 4))
+        self.assertEqual((row['api_p50_ms'], row['api_p95_ms'], row['duration_p50_ms']), (300, 400, 350))
+        self.assertEqual((row['input_tokens'], row['output_tokens']), (40, 20))
+
+    def test_percentile_skips_missing_values(self):
+        self.assertEqual(percentile([120, 80, None, 300], 0.5), 120)
+        self.assertEqual(percentile(range(1, 101), 0.95), 96)
+        self.assertIsNone(percentile([None], 0.5))
+
+
+class MetricsTests(TestCase):
+    """/metrics: счетчики конвейера и глубина очередей из базы."""
+
+    def _finished(self, status):
+        return REGISTRY.get_sample_value('agent_analyses_finished_total', {'status': status}) or 0
+
+    @override_settings(METRICS_TOKEN='scrape-token')
+    def test_token_is_required(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code, 401)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer scrape-token'}).status_code, 200)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_queue_depth_is_counted_from_database(self):
+        Analysis.objects.create()
+        Analysis.objects.create()
+        Analysis.objects.create(status='processing')
+
+        body = self.client.get('/metrics').content.decode()
+
+        self.assertIn('agent_queue_depth{execution_mode="sync",status="pending"} 2.0', body)
+        self.assertIn('agent_queue_depth{execution_mode="sync",status="processing"} 1.0', body)
+        # Пустые ряды тоже отдаются, чтобы правила оповещений их не теряли
+        self.assertIn('agent_queue_depth{execution_mode="message_batch",status="pending"} 0.0', body)
+
+    def test_terminal_status_is_counted(self):
+        before = self._finished('failed')
+
+        Analysis.objects.create().set_status('failed', result='Ошибка')
+        Analysis.objects.create().set_status('processing')
+
+        self.assertEqual(self._finished('failed') - before, 1)
+
+
+class StructuredLogTests(SimpleTestCase):
+    """Записи журнала несут correlation_id, DEBUG пишется выборочно, очередь не блокирует."""
+
+    def _record(self, message='Анализ выполнен', **extra):
+        record = logging.LogRecord('agent.services', logging.INFO, __file__, 1, message, None, None)
+        record.__dict__.update(extra)
+        log.CorrelationFilter().filter(record)
+        return record
+
+    def test_json_line_has_correlation_id_and_extra_fields(self):
+        with log.bind('req-1'):
+            record = self._record(model='haiku')
+
+        data = json.loads(log.JsonFormatter().format(record))
+
+        self.assertEqual(data['correlation_id'], 'req-1')
+        self.assertEqual((data['level'], data['model']), ('INFO', 'haiku'))
+        self.assertIsNone(log.get_correlation_id())
+
+    def test_debug_is_sampled_per_request(self):
+        logger = log.get_logger('agent.services')
+        with mock.patch.object(logger.logger, 'isEnabledFor', return_value=True):
+            with override_settings(LOG_DEBUG_SAMPLE_RATE=0.0), log.bind('skipped'):
+                self.assertFalse(logger.isEnabledFor(logging.DEBUG))
+                self.assertTrue(logger.isEnabledFor(logging.INFO))
+            with override_settings(LOG_DEBUG_SAMPLE_RATE=1.0), log.bind('sampled'):
+                self.assertTrue(logger.isEnabledFor(logging.DEBUG))
+
+    def test_full_queue_drops_records(self):
+        handler = log.QueueLogHandler(maxsize=1)
+        self.addCleanup(handler.close)
+        # Без потока вывода очередь не разбирается
+        handler.listener.stop()
+
+        handler.emit(self._record('первая'))
+        handler.emit(self._record('вторая'))
+
+        self.assertEqual(handler.dropped, 1)
+        self.assertEqual(handler.queue.get_nowait().getMessage(), 'первая')
+
+
+class CorrelationIdMiddlewareTests(SimpleTestCase):
+    def _get(self, request_id):
+        seen = []
+
+        def view(request):
+            seen.append(log.get_correlation_id())
+            return HttpResponse()
+
+        request = RequestFactory().get('/api/analyses/', headers={'X-Request-ID': request_id})
+        response = CorrelationIdMiddleware(view)(request)
+        self.assertEqual(seen, [response['X-Request-ID']])
+        return response['X-Request-ID']
+
+    def test_request_id_is_kept_or_generated(self):
+        self.assertEqual(self._get('nginx-42'), 'nginx-42')
+        self.assertRegex(self._get('bad id\n'), r'^[0-9a-f]{32}$')
+
+
+class StartupTests(SimpleTestCase):
+    """Воркер запускается без тяжелых библиотек, схема OpenAPI строится один раз."""
+
+    def test_heavy_libraries_are_not_imported_at_startup(self):
+        code = (
+            'import sys, django; django.setup(); import claude_agent.wsgi, claude_agent.urls; '
+            "print(' '.join(m for m in ('anthropic', 'PyPDF2', 'docx', 'openpyxl') if m in sys.modules))"
+        )
+        completed = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+
+        self.assertEqual(completed.stdout.strip(), '')
+
+    def test_schema_is_cached(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        with mock.patch.object(
+            OpenAPISchemaGenerator, 'get_schema', autospec=True, side_effect=OpenAPISchemaGenerator.get_schema,
+        ) as get_schema:
+            first = self.client.get('/swagger.json')
+            second = self.client.get('/swagger.json')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.content, first.content)
+        get_schema.assert_called_once()
+
+
+def _batch_item(analysis, result_type, text=None):
+    result = mock.Mock(type=result_type)
+    if result_type == 'succeeded':
+        usage = mock.Mock(input_tokens=900, output_tokens=100, cache_creation_input_tokens=0, cache_read_input_tokens=0)
+        result.message = mock.Mock(model='claude-batch', stop_reason='end_turn', usage=usage)
+        result.message.content = [mock.Mock(type='text', text=text)]
+    elif result_type == 'errored':
+        result.error.error.message = 'overloaded'
+    return mock.Mock(custom_id=analysis.id.hex, result=result)
+
+
+@override_settings(CLAUDE_API_KEY='test-key')
+class MessageBatchTests(TestCase):
+    """Несрочные анализы уходят одним пакетом, результаты сопоставляются по custom_id."""
+
+    def setUp(self):
+        self.service = ClaudeService()
+        self.service.client = mock.MagicMock()
+        self.service.client.messages.batches.create.return_value = mock.Mock(
+            id='msgbatch_1', processing_status='in_progress',
+        )
+        patcher = mock.patch.object(self.service, 'build_request', return_value=('system', 'prompt'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.analyses = []
+        for _ in range(3):
+            analysis = Analysis.objects.create(execution_mode='message_batch')
+            analysis.documents.add(_document())
+            self.analyses.append(analysis)
+
+    def test_submit_sends_one_batch(self):
+        job = message_batches.submit_pending(self.service)
+
+        self.service.client.messages.batches.create.assert_called_once()
+        requests = self.service.client.messages.batches.create.call_args.kwargs['requests']
+        self.assertEqual([request['custom_id'] for request in requests], [a.id.hex for a in self.analyses])
+        self.assertEqual(job.request_count, 3)
+        self.assertEqual(set(job.analyses.values_list('status', flat=True)), {'processing'})
+        self.assertIsNone(message_batches.submit_pending(self.service))
+
+    def test_results_are_applied_by_custom_id(self):
+        job = message_batches.submit_pending(self.service)
+        batches_api = self.service.client.messages.batches
+        batches_api.retrieve.return_value = mock.Mock(processing_status='ended', ended_at=timezone.now())
+        # Результаты приходят не в порядке отправки, третьего анализа в них нет
+        batches_api.results.return_value = [
+            _batch_item(self.analyses[1], 'errored'),
+            _batch_item(self.analyses[0], 'succeeded', 'Выручка выросла'),
+        ]
+
+        self.assertEqual(message_batches.poll_jobs(self.service), 1)
+
+        for analysis in self.analyses:
+            analysis.refresh_from_db()
+        self.assertEqual(
+            (self.analyses[0].status, self.analyses[0].result, self.analyses[0].input_tokens),
+            ('completed', 'Выручка выросла', 900),
+        )
+        self.assertEqual(self.analyses[1].status, 'failed')
+        self.assertIn('overloaded', self.analyses[1].result)
+        self.assertEqual(self.analyses[2].status, 'failed')
+        job.refresh_from_db()
+        self.assertIsNotNone(job.ended_at)
+        self.assertEqual(message_batches.poll_jobs(self.service), 0)
+
+    def test_batch_ended_before_first_poll_is_applied(self):
+        self.service.client.messages.batches.create.return_value = mock.Mock(id='msgbatch_2', processing_status='ended')
+        job = message_batches.submit_pending(self.service)
+        self.service.client.messages.batches.retrieve.return_value = mock.Mock(processing_status='ended', ended_at=None)
+        self.service.client.messages.batches.results.return_value = [
+            _batch_item(analysis, 'succeeded', 'Готово') for analysis in self.analyses
+        ]
+
+        self.assertEqual(message_batches.poll_jobs(self.service), 1)
+
+        self.assertEqual(set(job.analyses.values_list('status', flat=True)), {'completed'})
+        self.assertFalse(MessageBatchJob.objects.filter(ended_at__isnull=True).exists())
@@ -0,0 +1,137 @@
+"""
+Определение кодировки и потоковое декодирование текстовых файлов (TXT, CSV).
+
+Кодировка определяется по началу файла (SAMPLE_SIZE байт):
+
+1. BOM — UTF-8, UTF-16 или UTF-32;
+2. корректный UTF-8 (в том числе чистый ASCII);
+3. кириллица в однобайтовой кодировке: если среди букв много байтов
+   0xC0–0xFF, текст считается русским, а между cp1251 и koi8-r выбирается
+   та, в которой чаще встречаются частые строчные русские буквы (в koi8-r
+   строчные и прописные буквы расположены наоборот, поэтому неверный выбор
+   дает текст из прописных);
+4. иначе cp1252 (западноевропейские файлы из Excel и Блокнота).
+
+Затем файл декодируется за один проход: прочитанное начало не читается
+повторно, а передается декодеру вместе с остальным потоком. Некорректные
+байты заменяются на U+FFFD, поэтому ошибка в середине большого файла не
+прерывает извлечение.
+
+Использование:
+    >>> with open_text('/path/to/report.csv', newline='') as f:
+    ...     rows = list(csv.reader(f))
+"""
+import codecs
+import io
+
+from . import log
+
+logger = log.get_logger(__name__)
+
+SAMPLE_SIZE = 64 * 1024
+
+_BOMS = (
+    # UTF-32 раньше UTF-16: BOM UTF-32 LE начинается с BOM UTF-16 LE
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+# Самые частые строчные буквы русского текста
+_FREQUENT_CYRILLIC = 'оеаинтсрвлкмдпу'
+# Доля байтов 0xC0–0xFF среди букв, начиная с которой текст считается кириллическим
+_CYRILLIC_SHARE = 0.3
+# Таблицы для bytes.translate: удаляются все байты, кроме считаемых
+_NOT_HIGH_LETTERS = bytes(range(0xC0))
+_NOT_ASCII_LETTERS = bytes(byte for byte in range(256) if not (0x41 <= byte <= 0x5A or 0x61 <= byte <= 0x7A))
+
+
+def _is_utf8(sample):
+    try:
+        # final=False: последний символ мог быть обрезан границей образца
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def detect_encoding(sample):
+    """
+    Определяет кодировку текста по его началу.
+
+    Параметры:
+        sample (bytes): Начало файла (достаточно нескольких килобайт)
+
+    Возвращает:
+        str: Имя кодировки для open()/codecs
+
+    Примеры:
+        >>> detect_encoding('Выручка за квартал'.encode('cp1251'))
+        'cp1251'
+        >>> detect_encoding('Выручка за квартал'.encode('koi8-r'))
+        'koi8_r'
+    """
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+    if _is_utf8(sample):
+        return 'utf-8'
+
+    high_letters = len(sample.translate(None, _NOT_HIGH_LETTERS))
+    ascii_letters = len(sample.translate(None, _NOT_ASCII_LETTERS))
+    if high_letters and high_letters / (high_letters + ascii_letters) >= _CYRILLIC_SHARE:
+        scores = {}
+        for encoding in ('cp1251', 'koi8_r'):
+            text = sample.decode(encoding, errors='replace')
+            scores[encoding] = sum(text.count(char) for char in _FREQUENT_CYRILLIC)
+        return max(scores, key=scores.get)
+    return 'cp1252'
+
+
+class _PrefixedReader(io.RawIOBase):
+    """Поток, который сначала отдает уже прочитанное начало, затем остаток файла."""
+
+    def __init__(self, prefix, stream):
+        self._prefix = memoryview(prefix)
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._prefix:
+            size = min(len(buffer), len(self._prefix))
+            buffer[:size] = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+            return size
+        return self._stream.readinto(buffer)
+
+    def close(self):
+        self._stream.close()
+        super().close()
+
+
+def open_text(file_path, newline=None, sample_size=SAMPLE_SIZE):
+    """
+    Открывает текстовый файл на чтение с определением кодировки.
+
+    Параметры:
+        file_path (str): Путь к файлу
+        newline (str | None): Как в open(); для csv.reader — ''
+        sample_size (int): Сколько байт начала файла использовать для определения кодировки
+
+    Возвращает:
+        io.TextIOWrapper: Текстовый поток; определенная кодировка — в атрибуте encoding
+    """
+    stream = open(file_path, 'rb')
+    try:
+        sample = stream.read(sample_size)
+        encoding = detect_encoding(sample)
+    except BaseException:
+        stream.close()
+        raise
+    logger.debug("Кодировка %s: %s", file_path, encoding)
+    return io.TextIOWrapper(
+        io.BufferedReader(_PrefixedReader(sample, stream)), encoding=encoding, errors='replace', newline=newline
+    )
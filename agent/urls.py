@@ -1,11 +1,19 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import DocumentViewSet, AnalysisViewSet
+from .views import DocumentViewSet, AnalysisViewSet, AnalysisBatchViewSet, WebhookEndpointViewSet, SearchView
+from .async_views import AsyncAnalysisCreateView, AsyncAnalysisRetryView, AsyncAnalysisStreamView
 
 router = DefaultRouter()
 router.register(r'documents', DocumentViewSet)
 router.register(r'analyses', AnalysisViewSet)
+router.register(r'batches', AnalysisBatchViewSet)
+router.register(r'webhooks', WebhookEndpointViewSet)
 
 urlpatterns = [
+    path('search/', SearchView.as_view(), name='search'),
+    # Асинхронные варианты эндпоинтов анализа (для запуска под ASGI)
+    path('async/analyses/', AsyncAnalysisCreateView.as_view(), name='async-analysis-create'),
+    path('async/analyses/<uuid:pk>/retry/', AsyncAnalysisRetryView.as_view(), name='async-analysis-retry'),
+    path('async/analyses/<uuid:pk>/stream/', AsyncAnalysisStreamView.as_view(), name='async-analysis-stream'),
     path('', include(router.urls)),
 ] 
\ No newline at end of file
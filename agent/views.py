@@ -1,16 +1,34 @@
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import render
-from rest_framework import viewsets, status
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from rest_framework import mixins, viewsets, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from datetime import datetime
-import mimetypes
+from rest_framework.views import APIView
+from rest_framework.parsers import MultiPartParser
 import os
-from .models import Document, Analysis
-from .serializers import DocumentSerializer, AnalysisSerializer
-from .services import ClaudeService
-from drf_yasg.utils import swagger_auto_schema
+from .models import Document, Analysis, AnalysisBatch, WebhookEndpoint
+from .serializers import DocumentSerializer, AnalysisSerializer, AnalysisBatchSerializer, WebhookEndpointSerializer, WebhookEndpointCreateSerializer
+from .services import detect_file_type, run_analysis
+from .ingest import BulkDocumentUpload, BulkUploadError
+from . import scheduler, search
+from .downloads import serve_document
+from .accounting import latency_report
+from . import log, metrics
+from drf_yasg.utils import no_body, swagger_auto_schema
 from drf_yasg import openapi
 
+logger = log.get_logger(__name__)
+
+# Заголовок обрабатывает IdempotencyMiddleware (agent.idempotency); здесь — только описание для Swagger
+IDEMPOTENCY_KEY_HEADER = openapi.Parameter(
+    'Idempotency-Key', openapi.IN_HEADER, type=openapi.TYPE_STRING, required=False,
+    description='Уникальный ключ запроса (например, UUID). Повтор с тем же ключом вернет ответ первого '
+                'запроса с заголовком Idempotent-Replayed: true, не выполняя его снова'
+)
+
 # Create your views here.
 
 class DocumentViewSet(viewsets.ModelViewSet):
@@ -20,7 +38,7 @@ class DocumentViewSet(viewsets.ModelViewSet):
     Позволяет загружать, просматривать, обновлять и удалять документы
     для последующего анализа с использованием Claude API.
     """
-    queryset = Document.objects.all()
+    queryset = Document.objects.select_related('blob')
     serializer_class = DocumentSerializer
     
     @swagger_auto_schema(
@@ -69,6 +87,75 @@ class DocumentViewSet(viewsets.ModelViewSet):
         """Удалить документ из системы."""
         return super().destroy(request, *args, **kwargs)
     
+    @swagger_auto_schema(
+        operation_summary='Пакетная загрузка документов',
+        operation_description="""
+        Загружает несколько документов за один запрос.
+        
+        Файлы передаются в поле files (можно повторять поле несколько раз).
+        ZIP-архивы распаковываются: каждый файл поддерживаемого формата внутри
+        архива становится отдельным документом. Параметр extract=true сразу
+        извлекает текст из загруженных документов.
+        
+        Ответ содержит результат по каждому файлу: created, skipped или error.
+        """,
+        manual_parameters=[
+            openapi.Parameter('files', openapi.IN_FORM, description='Файлы или ZIP-архивы', type=openapi.TYPE_FILE, required=True),
+            openapi.Parameter('extract', openapi.IN_FORM, description='Сразу извлечь текст (true/false)', type=openapi.TYPE_BOOLEAN),
+        ],
+        responses={
+            201: 'Результаты загрузки по каждому файлу',
+            400: 'Файлы не переданы или превышены лимиты пакета'
+        }
+    )
+    @action(detail=False, methods=['post'], parser_classes=[MultiPartParser])
+    def bulk(self, request):
+        """Загрузить несколько документов или ZIP-архив за один запрос."""
+        files = request.FILES.getlist('files') + request.FILES.getlist('file')
+        if not files:
+            return Response({'error': 'Не переданы файлы для загрузки'}, status=status.HTTP_400_BAD_REQUEST)
+        extract = str(request.data.get('extract', '')).lower() in ('1', 'true', 'yes')
+        
+        try:
+            results = BulkDocumentUpload(files, extract=extract).run()
+        except BulkUploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        created = sum(1 for result in results if result['status'] == 'created')
+        logger.info("Пакетная загрузка: создано документов %d из %d", created, len(results))
+        return Response({
+            'created': created,
+            'failed': len(results) - created,
+            'results': results,
+        }, status=status.HTTP_201_CREATED)
+    
+    @swagger_auto_schema(
+        operation_summary='Скачать файл документа',
+        operation_description="""
+        Отдает исходный файл документа. Поддерживаются условные запросы
+        (If-None-Match, ETag — SHA-256 содержимого) и запросы диапазона (Range).
+        Параметр download=1 отдает файл как вложение.
+        
+        В зависимости от MEDIA_SERVE_MODE файл отправляет приложение или
+        фронтовой сервер (X-Accel-Redirect для nginx, X-Sendfile).
+        """,
+        manual_parameters=[
+            openapi.Parameter('download', openapi.IN_QUERY, description='1 — отдать как вложение', type=openapi.TYPE_INTEGER),
+        ],
+        responses={
+            200: 'Файл документа',
+            206: 'Запрошенный диапазон файла',
+            304: 'Файл не изменился',
+            404: 'Документ или файл не найден',
+            416: 'Диапазон за пределами файла'
+        }
+    )
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Скачать исходный файл документа."""
+        document = self.get_object()
+        return serve_document(request, document)
+    
     def perform_create(self, serializer):
         file = self.request.FILES.get('file')
         file_name = file.name
@@ -80,30 +167,13 @@ class DocumentViewSet(viewsets.ModelViewSet):
             name = os.path.splitext(file_name)[0]
         
         # Определяем тип файла из расширения и MIME-типа
-        mime_type, _ = mimetypes.guess_type(file_name)
-        file_extension = os.path.splitext(file_name)[1].lower()
-        
-        # Определение типа файла по расширению, если mime_type не определен
-        if not mime_type:
-            if file_extension == '.txt':
-                mime_type = 'text/plain'
-            elif file_extension == '.pdf':
-                mime_type = 'application/pdf'
-            elif file_extension == '.docx':
-                mime_type = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-            elif file_extension == '.xlsx':
-                mime_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            elif file_extension == '.csv':
-                mime_type = 'text/csv'
-            elif file_extension == '.json':
-                mime_type = 'application/json'
-            else:
-                mime_type = 'application/octet-stream'
-        
-        # Записываем тип в консоль для диагностики
-        print(f"Загружен файл: {file_name}, тип: {mime_type}, имя документа: {name}")
-        
-        serializer.save(file_type=mime_type, name=name)
+        mime_type = detect_file_type(file_name, default='application/octet-stream')
+        
+        document = serializer.save(file_type=mime_type, name=name)
+        logger.info(
+            "Загружен файл %s, тип %s, имя документа %s", file_name, mime_type, name,
+            extra={'document_id': str(document.id), 'file_type': mime_type}
+        )
 
 class AnalysisViewSet(viewsets.ModelViewSet):
     """
@@ -144,13 +214,20 @@ class AnalysisViewSet(viewsets.ModelViewSet):
         Для создания анализа необходимо указать:
         - document_ids: список UUID документов для анализа (минимум 1 документ)
         - custom_prompt: (опционально) пользовательский запрос для анализа
+        - deadline или timeout: (опционально) предельное время выполнения; по его
+          истечении анализ прерывается со статусом cancelled
         
         Система автоматически запустит обработку документов с использованием API Claude.
+        Повтор запроса после таймаута сети передайте с тем же заголовком Idempotency-Key,
+        чтобы не создать второй анализ.
         """,
+        manual_parameters=[IDEMPOTENCY_KEY_HEADER],
         request_body=AnalysisSerializer,
         responses={
             201: AnalysisSerializer(),
-            400: 'Ошибка валидации'
+            400: 'Ошибка валидации',
+            409: 'Запрос с этим Idempotency-Key еще выполняется',
+            422: 'Idempotency-Key уже использован для другого запроса'
         }
     )
     def create(self, request, *args, **kwargs):
@@ -171,10 +248,14 @@ class AnalysisViewSet(viewsets.ModelViewSet):
     
     @swagger_auto_schema(
         operation_summary='Повторить анализ',
-        operation_description='Сбрасывает статус анализа и запускает его повторно с теми же параметрами.',
+        operation_description='Сбрасывает статус анализа и запускает его повторно с теми же параметрами. '
+                              'Анализ в очереди или в работе повторить нельзя (409).',
+        manual_parameters=[IDEMPOTENCY_KEY_HEADER],
+        request_body=no_body,
         responses={
             200: AnalysisSerializer(),
-            404: 'Анализ не найден'
+            404: 'Анализ не найден',
+            409: 'Анализ уже выполняется'
         }
     )
     @action(detail=True, methods=['post'])
@@ -187,47 +268,222 @@ class AnalysisViewSet(viewsets.ModelViewSet):
         Полезно в случае ошибок при первоначальном анализе.
         """
         analysis = self.get_object()
-        analysis.status = 'pending'
-        analysis.result = None
-        analysis.completed_at = None
-        analysis.save()
+        if not analysis.set_status(
+            'pending', result=None, completed_at=None, message_batch=None, queued_at=timezone.now(), started_at=None
+        ):
+            analysis.refresh_from_db(fields=['status'])
+            return Response(
+                {'error': f'Анализ в статусе {analysis.status} уже выполняется'}, status=status.HTTP_409_CONFLICT
+            )
         
         self.run_analysis(analysis)
         return Response(self.get_serializer(analysis).data)
     
+    @swagger_auto_schema(
+        operation_summary='Отменить анализ',
+        operation_description="""
+        Отменяет анализ в очереди или в работе: извлечение текста и запросы к Claude
+        прекращаются в течение CANCEL_CHECK_INTERVAL, воркер освобождается, анализ
+        получает статус cancelled. Завершенный анализ отменить нельзя (409).
+        """,
+        request_body=no_body,
+        responses={
+            200: AnalysisSerializer(),
+            404: 'Анализ не найден',
+            409: 'Анализ уже завершен'
+        }
+    )
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        """Отменить выполнение анализа."""
+        analysis = self.get_object()
+        if not analysis.cancel():
+            analysis.refresh_from_db(fields=['status'])
+            return Response(
+                {'error': f'Анализ в статусе {analysis.status} отменить нельзя'}, status=status.HTTP_409_CONFLICT
+            )
+        return Response(self.get_serializer(analysis).data)
+    
+    @swagger_auto_schema(
+        operation_summary='Статистика задержек по моделям',
+        operation_description="""
+        Возвращает p50/p95 задержки API и общей длительности завершенных анализов,
+        а также расход токенов по каждой модели за каждый день.
+        """,
+        manual_parameters=[
+            openapi.Parameter('days', openapi.IN_QUERY, description='Период в днях (1-90, по умолчанию 7)', type=openapi.TYPE_INTEGER),
+        ],
+        responses={200: 'Список строк: day, model, count, api_p50_ms, api_p95_ms, duration_p50_ms, duration_p95_ms, input_tokens, output_tokens'}
+    )
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """Получить перцентили задержек по моделям и дням."""
+        try:
+            days = min(max(int(request.query_params.get('days', 7)), 1), 90)
+        except ValueError:
+            return Response({'error': 'Параметр days должен быть целым числом'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'days': days, 'results': latency_report(days)})
+    
     def perform_create(self, serializer):
-        analysis = serializer.save(status='pending')
+        analysis = serializer.save(status='pending', client=scheduler.client_id(self.request))
         self.run_analysis(analysis)
         
     def run_analysis(self, analysis):
+        # Анализы в режиме message_batch остаются в очереди до команды process_message_batches
+        if analysis.execution_mode == 'sync':
+            run_analysis(analysis)
+
+class AnalysisBatchViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    API для пакетного запуска анализов.
+    
+    Позволяет применить один пользовательский запрос к множеству групп
+    документов одним запросом и отслеживать общий прогресс пакета.
+    """
+    queryset = AnalysisBatch.objects.all().order_by('-created_at')
+    serializer_class = AnalysisBatchSerializer
+    
+    @swagger_auto_schema(
+        operation_summary='Создать пакет анализов',
+        operation_description="""
+        Создает по одному анализу на каждую группу документов с общим запросом custom_prompt.
+        Анализы выполняет процесс process_analysis_batches с ограниченным параллелизмом
+        (BATCH_ANALYSIS_CONCURRENCY).
+        
+        Текст документа, входящего в несколько групп, извлекается один раз.
+        Прогресс пакета доступен через GET /api/batches/{id}/.
+        
+        При execution_mode=message_batch анализы ставятся в очередь и выполняются
+        через Message Batches API командой process_message_batches.
+        """,
+        manual_parameters=[IDEMPOTENCY_KEY_HEADER],
+        request_body=AnalysisBatchSerializer,
+        responses={
+            202: AnalysisBatchSerializer(),
+            400: 'Ошибка валидации'
+        }
+    )
+    def create(self, request, *args, **kwargs):
+        """Создать пакет анализов и поставить его в очередь на выполнение."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        batch = serializer.save(client=scheduler.client_id(request))
+        return Response(self.get_serializer(batch).data, status=status.HTTP_202_ACCEPTED)
+    
+    @swagger_auto_schema(
+        operation_summary='Получить прогресс пакета',
+        operation_description='Возвращает пакет анализов со сводным прогрессом по статусам.',
+        responses={
+            200: AnalysisBatchSerializer(),
+            404: 'Пакет не найден'
+        }
+    )
+    def retrieve(self, request, *args, **kwargs):
+        """Получить пакет анализов и его прогресс."""
+        return super().retrieve(request, *args, **kwargs)
+
+class WebhookEndpointViewSet(viewsets.ModelViewSet):
+    """
+    API для регистрации вебхуков.
+    
+    Вместо периодических запросов GET /api/analyses/{id}/ клиент регистрирует
+    адрес и получает POST-уведомление, когда анализ завершится (completed, failed или cancelled).
+    
+    Владелец (agent.scheduler.owner_id) видит и изменяет только свои вебхуки;
+    сотрудник — все.
+    """
+    queryset = WebhookEndpoint.objects.all().order_by('-created_at')
+    serializer_class = WebhookEndpointSerializer
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.user.is_staff:
+            return queryset
+        return queryset.filter(client=scheduler.owner_id(self.request))
+    
+    def get_serializer_class(self):
+        # secret показывается один раз — в ответе на регистрацию
+        if self.action == 'create':
+            return WebhookEndpointCreateSerializer
+        return super().get_serializer_class()
+    
+    def perform_create(self, serializer):
+        serializer.save(client=scheduler.owner_id(self.request))
+    
+    @swagger_auto_schema(
+        operation_summary='Зарегистрировать вебхук',
+        operation_description="""
+        Регистрирует адрес для уведомлений о завершении анализов.
+        
+        - url: адрес, на который придет POST с событиями analysis.completed / analysis.failed / analysis.cancelled
+        - all_analyses: true — уведомлять обо всех анализах (только для сотрудников);
+          false — только об анализах, созданных с полем webhook, равным id этого вебхука
+        
+        В ответе возвращается secret — только здесь, сохраните его: им подписывается тело каждого уведомления
+        (заголовки X-Webhook-Timestamp и X-Webhook-Signature: sha256=HMAC от
+        "<timestamp>.<тело>"). Неудачная доставка повторяется с экспоненциальной задержкой,
+        события одного адреса объединяются в один запрос.
+        """,
+        request_body=WebhookEndpointSerializer,
+        responses={
+            201: WebhookEndpointCreateSerializer(),
+            400: 'Ошибка валидации'
+        }
+    )
+    def create(self, request, *args, **kwargs):
+        """Зарегистрировать адрес для уведомлений."""
+        return super().create(request, *args, **kwargs)
+
+class SearchView(APIView):
+    """
+    API полнотекстового поиска.
+    
+    Ищет по названиям и извлеченному тексту документов, а также по результатам
+    и пользовательским запросам завершенных анализов. Результаты упорядочены
+    по релевантности (bm25) и содержат фрагмент текста с подсветкой совпадений.
+    """
+    
+    @swagger_auto_schema(
+        operation_summary='Полнотекстовый поиск',
+        operation_description='Ищет документы и анализы по содержимому. Сниппет — HTML: текст экранирован, совпадения выделены тегом <mark>.',
+        manual_parameters=[
+            openapi.Parameter('q', openapi.IN_QUERY, description='Строка поиска', type=openapi.TYPE_STRING, required=True),
+            openapi.Parameter('type', openapi.IN_QUERY, description='Тип объектов: document или analysis', type=openapi.TYPE_STRING, enum=[search.KIND_DOCUMENT, search.KIND_ANALYSIS]),
+            openapi.Parameter('limit', openapi.IN_QUERY, description='Количество результатов (1-100, по умолчанию 20)', type=openapi.TYPE_INTEGER),
+            openapi.Parameter('offset', openapi.IN_QUERY, description='Смещение для постраничного вывода', type=openapi.TYPE_INTEGER),
+        ],
+        responses={
+            200: 'Список результатов: type, id, title, snippet, score',
+            400: 'Ошибка в параметрах запроса'
+        }
+    )
+    def get(self, request):
+        """Найти документы и анализы по содержимому."""
+        query = request.query_params.get('q', '').strip()
+        kind = request.query_params.get('type') or None
+        if not query:
+            return Response({'error': 'Параметр q обязателен'}, status=status.HTTP_400_BAD_REQUEST)
+        if kind not in (None, search.KIND_DOCUMENT, search.KIND_ANALYSIS):
+            return Response({'error': 'Параметр type должен быть document или analysis'}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            # Update status to processing
-            analysis.status = 'processing'
-            analysis.save()
-            
-            # Get documents
-            documents = analysis.documents.all()
-            
-            if not documents:
-                analysis.status = 'failed'
-                analysis.result = "No documents provided for analysis"
-                analysis.save()
-                return
-            
-            # Process documents with Claude
-            claude_service = ClaudeService()
-            result = claude_service.compare_documents(
-                documents=documents,
-                custom_prompt=analysis.custom_prompt
-            )
-            
-            # Update analysis with results
-            analysis.result = result
-            analysis.status = 'completed'
-            analysis.completed_at = datetime.now()
-            analysis.save()
-            
-        except Exception as e:
-            analysis.status = 'failed'
-            analysis.result = f"Analysis failed: {str(e)}"
-            analysis.save()
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+        except ValueError:
+            return Response({'error': 'Параметры limit и offset должны быть целыми числами'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        results = search.search(query, kind=kind, limit=limit, offset=offset)
+        return Response({'query': query, 'results': results})
+
+
+def metrics_view(request):
+    """
+    Метрики конвейера анализа в текстовом формате Prometheus.
+    
+    Если задан METRICS_TOKEN, запрос должен содержать заголовок
+    Authorization: Bearer <METRICS_TOKEN>.
+    """
+    token = settings.METRICS_TOKEN
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    body, content_type = metrics.render_metrics()
+    return HttpResponse(body, content_type=content_type)
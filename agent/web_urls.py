@@ -3,16 +3,20 @@ from .web_views import (
     HomeView, 
     DocumentListView, 
     DocumentUploadView, 
+    DocumentDownloadView,
     AnalysisCreateView,
     AnalysisDetailView,
-    RetryAnalysisView
+    RetryAnalysisView,
+    CancelAnalysisView
 )
 
 urlpatterns = [
     path('', HomeView.as_view(), name='home'),
     path('documents/', DocumentListView.as_view(), name='document_list'),
     path('documents/upload/', DocumentUploadView.as_view(), name='document_upload'),
+    path('documents/<uuid:pk>/download/', DocumentDownloadView.as_view(), name='document_download'),
     path('analyses/create/', AnalysisCreateView.as_view(), name='analysis_create'),
     path('analyses/<uuid:pk>/', AnalysisDetailView.as_view(), name='analysis_detail'),
     path('analyses/<uuid:pk>/retry/', RetryAnalysisView.as_view(), name='retry'),
+    path('analyses/<uuid:pk>/cancel/', CancelAnalysisView.as_view(), name='cancel'),
 ] 
\ No newline at end of file
@@ -3,13 +3,18 @@ from django.urls import reverse_lazy
 from django.shortcuts import redirect
 from .models import Document, Analysis
 from .forms import DocumentUploadForm, AnalysisCreateForm
-from .services import ClaudeService
-from datetime import datetime
+from .services import run_analysis
+from .scheduler import client_id
+from . import log
+from .downloads import serve_document
+from django.utils import timezone
 from django.views import View
 from django.shortcuts import get_object_or_404
 import os
 from django.contrib import messages
 
+logger = log.get_logger(__name__)
+
 class HomeView(TemplateView):
     template_name = 'agent/home.html'
     
@@ -39,12 +44,19 @@ class DocumentUploadView(CreateView):
             file_name = uploaded_file.name
             # Удаляем расширение из имени файла для более красивого отображения
             form.instance.name = os.path.splitext(file_name)[0]
-            print(f"Имя документа не указано, используем имя файла: {form.instance.name}")
+            logger.debug("Имя документа не указано, используем имя файла: %s", form.instance.name)
         
         response = super().form_valid(form)
         messages.success(self.request, f'Документ "{self.object.name}" успешно загружен.')
         return response
 
+class DocumentDownloadView(View):
+    """Представление для скачивания файла документа (см. agent.downloads)"""
+    
+    def get(self, request, pk):
+        document = get_object_or_404(Document.objects.select_related('blob'), pk=pk)
+        return serve_document(request, document)
+
 class AnalysisCreateView(CreateView):
     model = Analysis
     form_class = AnalysisCreateForm
@@ -57,41 +69,17 @@ class AnalysisCreateView(CreateView):
     
     def form_valid(self, form):
         analysis = form.save(commit=False)
-        analysis.status = 'processing'
+        # Анализ из веб-интерфейса ждет пользователь: он обслуживается раньше API и пакетов
+        analysis.priority = 'interactive'
+        analysis.client = client_id(self.request)
         analysis.save()
         
         # Добавляем выбранные документы
         document_ids = self.request.POST.getlist('documents')
         analysis.documents.set(Document.objects.filter(id__in=document_ids))
         
-        # Запускаем анализ
-        try:
-            documents = analysis.documents.all()
-            
-            if not documents:
-                analysis.status = 'failed'
-                analysis.result = "Документы для анализа не выбраны"
-                analysis.save()
-                return redirect('analysis_detail', pk=analysis.id)
-            
-            # Обрабатываем документы с помощью Claude
-            claude_service = ClaudeService()
-            result = claude_service.compare_documents(
-                documents=documents,
-                custom_prompt=form.cleaned_data.get('custom_prompt')
-            )
-            
-            # Обновляем результаты анализа
-            analysis.result = result
-            analysis.status = 'completed'
-            analysis.completed_at = datetime.now()
-            analysis.save()
-            
-        except Exception as e:
-            analysis.status = 'failed'
-            analysis.result = f"Ошибка анализа: {str(e)}"
-            analysis.save()
-        
+        # Запускаем анализ (в очереди планировщика, см. agent.scheduler)
+        run_analysis(analysis)
         return redirect('analysis_detail', pk=analysis.id)
 
 class AnalysisDetailView(DetailView):
@@ -109,37 +97,23 @@ class RetryAnalysisView(View):
     
     def post(self, request, pk):
         analysis = get_object_or_404(Analysis, pk=pk)
-        analysis.status = 'processing'
-        analysis.result = None
-        analysis.completed_at = None
-        analysis.save()
-        
-        # Запускаем анализ заново
-        try:
-            documents = analysis.documents.all()
-            
-            if not documents:
-                analysis.status = 'failed'
-                analysis.result = "Документы для анализа не выбраны"
-                analysis.save()
-                return redirect('analysis_detail', pk=analysis.id)
-            
-            # Обрабатываем документы с помощью Claude
-            claude_service = ClaudeService()
-            result = claude_service.compare_documents(
-                documents=documents,
-                custom_prompt=analysis.custom_prompt
-            )
-            
-            # Обновляем результаты анализа
-            analysis.result = result
-            analysis.status = 'completed'
-            analysis.completed_at = datetime.now()
-            analysis.save()
-            
-        except Exception as e:
-            analysis.status = 'failed'
-            analysis.result = f"Ошибка анализа: {str(e)}"
-            analysis.save()
+        # Повтор — атомарный переход статуса: при двойном нажатии кнопки
+        # второй запрос анализ не запускает
+        if not analysis.set_status(
+            'pending', result=None, completed_at=None, message_batch=None,
+            priority='interactive', queued_at=timezone.now(), started_at=None
+        ):
+            messages.warning(request, "Анализ уже выполняется")
+            return redirect('analysis_detail', pk=analysis.id)
         
-        return redirect('analysis_detail', pk=analysis.id) 
\ No newline at end of file
+        run_analysis(analysis)
+        return redirect('analysis_detail', pk=analysis.id) 
+
+class CancelAnalysisView(View):
+    """Представление для отмены анализа в очереди или в работе"""
+    
+    def post(self, request, pk):
+        analysis = get_object_or_404(Analysis, pk=pk)
+        if not analysis.cancel():
+            messages.warning(request, "Анализ уже завершен, отменить его нельзя")
+        return redirect('analysis_detail', pk=analysis.id)
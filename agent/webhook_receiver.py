@@ -0,0 +1,129 @@
+"""
+Локальный получатель вебхуков для проверки уведомлений без внешнего сервиса.
+
+Принимает POST с пакетом событий (формат — agent.webhooks), проверяет подпись
+ключом вебхука и отвечает 204. Доля запросов fail_rate получает 503, чтобы
+проверить повторную доставку. Повторно пришедшие события (тот же id) не
+передаются в on_event повторно, а учитываются в stats['duplicates'].
+
+Использование:
+    ```
+    python manage.py webhook_receiver --port 8766 --secret <secret вебхука>
+    curl -X POST http://127.0.0.1:8000/api/webhooks/ -H 'Content-Type: application/json' \\
+         -d '{"url": "http://127.0.0.1:8766/"}'
+    # id вебхука из ответа — в поле webhook при создании анализа
+    python manage.py dispatch_webhooks
+    ```
+"""
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .webhooks import SIGNATURE_HEADER, TIMESTAMP_HEADER, verify_signature
+
+
+class WebhookReceiverState:
+    """
+    Настройки и счетчики получателя.
+
+    Параметры:
+        secret (str, optional): Ключ вебхука; без него подпись не проверяется
+        fail_rate (float): Доля запросов, на которые отвечать 503 (0..1)
+        seed (int, optional): Начальное значение генератора случайных чисел
+        on_event (callable, optional): Вызывается из потока сервера для каждого нового события
+    """
+
+    def __init__(self, secret=None, fail_rate=0.0, seed=None, on_event=None):
+        self.secret = secret
+        self.fail_rate = fail_rate
+        self.on_event = on_event
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.seen = set()
+        self.stats = {'requests': 0, 'events': 0, 'duplicates': 0, 'rejected': 0, 'bad_signature': 0}
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+
+class WebhookReceiverHandler(BaseHTTPRequestHandler):
+    """Обработчик уведомлений. Состояние берется из self.server.state."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        if status == 503:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+
+    def do_POST(self):
+        state = self.server.state
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        state._count('requests')
+        if state.secret and not verify_signature(
+            state.secret, self.headers.get(TIMESTAMP_HEADER), body, self.headers.get(SIGNATURE_HEADER)
+        ):
+            state._count('bad_signature')
+            self._reply(401)
+            return
+        with state.lock:
+            fail = state.random.random() < state.fail_rate
+        if fail:
+            state._count('rejected')
+            self._reply(503)
+            return
+
+        try:
+            events = json.loads(body)['events']
+        except (ValueError, KeyError, TypeError):
+            self._reply(400)
+            return
+        fresh = []
+        with state.lock:
+            for event in events:
+                if event['id'] in state.seen:
+                    state.stats['duplicates'] += 1
+                else:
+                    state.seen.add(event['id'])
+                    state.stats['events'] += 1
+                    fresh.append(event)
+        self._reply(204)
+        if state.on_event:
+            for event in fresh:
+                state.on_event(event)
+
+
+class WebhookReceiverServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def make_receiver(host='127.0.0.1', port=8766, state=None, verbose=False):
+    """
+    Создает HTTP-сервер получателя вебхуков.
+
+    Параметры:
+        host (str): Адрес для прослушивания
+        port (int): Порт (0 — выбрать свободный)
+        state (WebhookReceiverState, optional): Настройки и счетчики
+        verbose (bool): Печатать журнал запросов
+
+    Возвращает:
+        WebhookReceiverServer: Сервер; адрес доступен в server.server_address
+
+    Примеры:
+        >>> server = make_receiver(port=0, state=WebhookReceiverState(on_event=print))
+        >>> threading.Thread(target=server.serve_forever, daemon=True).start()
+    """
+    server = WebhookReceiverServer((host, port), WebhookReceiverHandler)
+    server.state = state or WebhookReceiverState()
+    server.verbose = verbose
+    return server
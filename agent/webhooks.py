@@ -0,0 +1,315 @@
+"""
+Уведомления о завершении анализов через вебхуки.
+
+Клиент регистрирует адрес (WebhookEndpoint, POST /api/webhooks/) и указывает
+его при создании анализа (поле webhook); сотрудник может подписать адрес на
+все анализы (all_analyses). Когда
+анализ переходит в completed, failed или cancelled, Analysis.set_status вызывает
+enqueue(), и для каждого подходящего адреса создается WebhookDelivery.
+
+Команда dispatch_webhooks периодически вызывает dispatch(): забирает
+доставки, срок которых наступил, группирует их по адресу и отправляет одним
+POST-запросом до WEBHOOK_BATCH_SIZE событий (разные адреса — параллельно).
+Тело запроса:
+
+    {"id": "<идентификатор пакета>", "created_at": "...",
+     "events": [{"id": 17, "type": "analysis.completed",
+                 "analysis": {"id": "...", "status": "completed",
+                              "completed_at": "...", "url": "/api/analyses/<id>/"}}]}
+
+Подпись — заголовок X-Webhook-Signature: sha256=<HMAC-SHA256 ключом
+secret от строки "<X-Webhook-Timestamp>.<тело>">; проверить ее можно
+verify_signature(). Ответ 2xx — доставлено; иначе попытка повторяется с
+экспоненциальной задержкой (WEBHOOK_RETRY_BASE · 2^n, не больше
+WEBHOOK_RETRY_MAX, с учетом Retry-After) до WEBHOOK_MAX_ATTEMPTS попыток.
+Одно событие может прийти повторно (например, если ответ не дошел до
+сервиса), поэтому получателю следует учитывать id события.
+
+Запросы уходят из сети сервиса, поэтому адрес вебхука проверяется check_url()
+при регистрации и перед каждой отправкой: только http/https и только
+публичные IP-адреса (не 127.0.0.1, не частные сети и не 169.254.169.254),
+переадресации не выполняются. WEBHOOK_ALLOW_PRIVATE_URLS=True снимает
+ограничение для разработки и load_test.
+"""
+import hashlib
+import hmac
+import ipaddress
+import json
+import random
+import socket
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import httpx
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import log, metrics
+from .db import retry_on_lock
+from .models import WebhookDelivery, WebhookEndpoint
+
+logger = log.get_logger(__name__)
+
+SIGNATURE_HEADER = 'X-Webhook-Signature'
+TIMESTAMP_HEADER = 'X-Webhook-Timestamp'
+ID_HEADER = 'X-Webhook-Id'
+
+
+def sign(secret, timestamp, body):
+    """
+    Подпись тела уведомления.
+
+    Параметры:
+        secret (str): Ключ вебхука
+        timestamp (int | str): Значение заголовка X-Webhook-Timestamp
+        body (bytes): Тело запроса
+
+    Возвращает:
+        str: Значение заголовка X-Webhook-Signature
+    """
+    digest = hmac.new(secret.encode(), f'{timestamp}.'.encode() + body, hashlib.sha256).hexdigest()
+    return f'sha256={digest}'
+
+
+def verify_signature(secret, timestamp, body, signature, tolerance=300):
+    """
+    Проверяет подпись полученного уведомления (для получателей и тестов).
+
+    Параметры:
+        secret (str): Ключ вебхука
+        timestamp (str): Заголовок X-Webhook-Timestamp
+        body (bytes): Тело запроса
+        signature (str): Заголовок X-Webhook-Signature
+        tolerance (int): Допустимое расхождение времени, с (защита от повтора старых запросов)
+
+    Возвращает:
+        bool: True, если подпись верна и запрос не устарел
+    """
+    try:
+        if abs(time.time() - int(timestamp)) > tolerance:
+            return False
+    except (TypeError, ValueError):
+        return False
+    return hmac.compare_digest(sign(secret, timestamp, body), signature or '')
+
+
+def _is_public(address):
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def check_url(url, resolve=True):
+    """
+    Проверяет, что на адрес можно отправлять уведомления.
+
+    Параметры:
+        url (str): Адрес вебхука
+        resolve (bool): Требовать, чтобы имя хоста разрешалось в DNS (при отправке);
+            при регистрации имя, которое пока не разрешается, допускается
+
+    Исключения:
+        ValueError: Схема не http/https или хост указывает на внутренний адрес
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError("Адрес вебхука должен начинаться с http:// или https://")
+    if settings.WEBHOOK_ALLOW_PRIVATE_URLS:
+        return
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, None, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError):
+        if resolve:
+            raise ValueError(f"Не удалось определить адрес хоста {parts.hostname}")
+        return
+    if not all(_is_public(address) for address in addresses):
+        raise ValueError(f"Хост {parts.hostname} указывает на внутренний адрес")
+
+
+@retry_on_lock
+def _create_deliveries(deliveries):
+    WebhookDelivery.objects.bulk_create(deliveries)
+
+
+def enqueue(analyses, status):
+    """
+    Ставит в очередь уведомления о переходе анализов в конечный статус.
+
+    Параметры:
+        analyses (iterable): Анализы (нужны pk и webhook_id)
+        status (str): 'completed', 'failed' или 'cancelled'
+    """
+    subscribers = list(WebhookEndpoint.objects.filter(is_active=True, all_analyses=True).values_list('pk', flat=True))
+    event = f'analysis.{status}'
+    deliveries = []
+    for analysis in analyses:
+        endpoints = set(subscribers)
+        if analysis.webhook_id:
+            endpoints.add(analysis.webhook_id)
+        deliveries += [
+            WebhookDelivery(endpoint_id=endpoint_id, analysis_id=analysis.pk, event=event)
+            for endpoint_id in endpoints
+        ]
+    if deliveries:
+        _create_deliveries(deliveries)
+
+
+def _backoff(attempts, retry_after=None):
+    delay = min(settings.WEBHOOK_RETRY_BASE * 2 ** (attempts - 1), settings.WEBHOOK_RETRY_MAX)
+    # Разброс, чтобы повторы к одному адресу после его сбоя не приходили одновременно
+    delay *= random.uniform(0.8, 1.2)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return timedelta(seconds=delay)
+
+
+@retry_on_lock
+def _claim(limit, now):
+    """Забирает доставки, срок которых наступил, и откладывает их на время отправки."""
+    with transaction.atomic():
+        ids = list(
+            WebhookDelivery.objects.filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at').values_list('pk', flat=True)[:limit]
+        )
+        if ids:
+            # Если диспетчер упадет посреди отправки, доставки вернутся в очередь после этого срока
+            lease = timedelta(seconds=settings.WEBHOOK_TIMEOUT * 2 + 5)
+            WebhookDelivery.objects.filter(pk__in=ids).update(next_attempt_at=now + lease)
+    return list(WebhookDelivery.objects.filter(pk__in=ids).select_related('endpoint', 'analysis'))
+
+
+def _payload(deliveries):
+    return {
+        'id': uuid.uuid4().hex,
+        'created_at': timezone.now().isoformat(),
+        'events': [
+            {
+                'id': delivery.pk,
+                'type': delivery.event,
+                'analysis': {
+                    'id': str(delivery.analysis_id),
+                    'status': delivery.analysis.status,
+                    'completed_at': delivery.analysis.completed_at.isoformat() if delivery.analysis.completed_at else None,
+                    'url': f'/api/analyses/{delivery.analysis_id}/',
+                },
+            }
+            for delivery in deliveries
+        ],
+    }
+
+
+def _post(client, endpoint, deliveries):
+    """Отправляет пакет событий. Возвращает (ошибка или None, Retry-After в секундах или None)."""
+    try:
+        # Повторная проверка: адрес в DNS мог смениться после регистрации
+        check_url(endpoint.url)
+    except ValueError as e:
+        return str(e), None
+    payload = _payload(deliveries)
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    timestamp = str(int(time.time()))
+    headers = {
+        'Content-Type': 'application/json',
+        ID_HEADER: payload['id'],
+        TIMESTAMP_HEADER: timestamp,
+        SIGNATURE_HEADER: sign(endpoint.secret, timestamp, body),
+    }
+    try:
+        response = client.post(endpoint.url, content=body, headers=headers)
+    except httpx.HTTPError as e:
+        return f'{type(e).__name__}: {e}', None
+    if response.is_success:
+        return None, None
+    retry_after = response.headers.get('Retry-After')
+    retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+    return f'HTTP {response.status_code}', retry_after
+
+
+@retry_on_lock
+def _record(endpoint, deliveries, error, retry_after):
+    now = timezone.now()
+    if error is None:
+        WebhookDelivery.objects.filter(pk__in=[d.pk for d in deliveries]).update(
+            status='delivered', delivered_at=now, last_error=None, attempts=F('attempts') + 1
+        )
+        metrics.observe_webhook_deliveries('delivered', len(deliveries))
+        return
+
+    logger.warning(
+        "Уведомление на %s не доставлено (%s), событий %d", endpoint.url, error, len(deliveries),
+        extra={'webhook_id': str(endpoint.pk)}
+    )
+    for delivery in deliveries:
+        delivery.attempts += 1
+        delivery.last_error = error
+        if delivery.attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+            delivery.status = 'failed'
+        else:
+            delivery.next_attempt_at = now + _backoff(delivery.attempts, retry_after)
+    WebhookDelivery.objects.bulk_update(deliveries, ['attempts', 'last_error', 'status', 'next_attempt_at'])
+    failed = sum(1 for delivery in deliveries if delivery.status == 'failed')
+    metrics.observe_webhook_deliveries('failed', failed)
+    metrics.observe_webhook_deliveries('retry', len(deliveries) - failed)
+
+
+@retry_on_lock
+def _cancel(deliveries):
+    WebhookDelivery.objects.filter(pk__in=[d.pk for d in deliveries]).update(status='failed', last_error='Вебхук отключен')
+
+
+def dispatch(client=None, limit=None):
+    """
+    Отправляет доставки, срок которых наступил.
+
+    Параметры:
+        client (httpx.Client, optional): HTTP-клиент (по умолчанию создается с WEBHOOK_TIMEOUT)
+        limit (int, optional): Максимум доставок за вызов (по умолчанию WEBHOOK_BATCH_SIZE · WEBHOOK_CONCURRENCY)
+
+    Возвращает:
+        int: Количество обработанных доставок
+
+    Примеры:
+        >>> while webhooks.dispatch():
+        ...     pass
+    """
+    limit = limit or settings.WEBHOOK_BATCH_SIZE * settings.WEBHOOK_CONCURRENCY
+    deliveries = _claim(limit, timezone.now())
+    if not deliveries:
+        return 0
+
+    by_endpoint = defaultdict(list)
+    for delivery in deliveries:
+        by_endpoint[delivery.endpoint_id].append(delivery)
+    batches = []
+    for endpoint_deliveries in by_endpoint.values():
+        endpoint = endpoint_deliveries[0].endpoint
+        if not endpoint.is_active:
+            _cancel(endpoint_deliveries)
+            continue
+        for start in range(0, len(endpoint_deliveries), settings.WEBHOOK_BATCH_SIZE):
+            batches.append((endpoint, endpoint_deliveries[start:start + settings.WEBHOOK_BATCH_SIZE]))
+
+    if not batches:
+        return len(deliveries)
+
+    own_client = client is None
+    if own_client:
+        client = httpx.Client(timeout=settings.WEBHOOK_TIMEOUT, headers={'User-Agent': 'claude-agent-webhooks/1'})
+    try:
+        # Запросы идут параллельно, чтобы медленный адрес не задерживал остальные;
+        # результаты записываются в базу из этого потока
+        with ThreadPoolExecutor(max_workers=min(settings.WEBHOOK_CONCURRENCY, len(batches))) as executor:
+            results = list(executor.map(lambda batch: _post(client, *batch), batches))
+    finally:
+        if own_client:
+            client.close()
+    for (endpoint, batch), (error, retry_after) in zip(batches, results):
+        _record(endpoint, batch, error, retry_after)
+    return len(deliveries)
@@ -28,6 +28,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "agent.middleware.CompressionMiddleware",
+    "agent.middleware.CorrelationIdMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -35,6 +37,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "agent.middleware.IdempotencyMiddleware",
+    "agent.middleware.ProfilingMiddleware",
 ]
 
 # CORS settings
@@ -57,8 +61,10 @@ CORS_ALLOW_HEADERS = [
     'authorization',
     'content-type',
     'dnt',
+    'idempotency-key',
     'origin',
     'user-agent',
+    'x-client-id',
     'x-csrftoken',
     'x-requested-with',
 ]
@@ -92,13 +98,39 @@ WSGI_APPLICATION = "claude_agent.wsgi.application"
 
 
 # Database
+# Несколько воркеров gunicorn одновременно пишут статусы анализов, поэтому
+# SQLite работает в режиме WAL (читатели не блокируют писателя), ждет снятия
+# блокировки вместо немедленной ошибки "database is locked" и сразу берет
+# блокировку на запись (IMMEDIATE), чтобы избежать взаимоблокировок при
+# повышении уровня блокировки внутри транзакции.
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', '20'))  # секунды
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    f'PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT * 1000)}',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-20000',
+]
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": os.getenv('SQLITE_PATH', BASE_DIR / "db.sqlite3"),
+        # Постоянные соединения: PRAGMA выполняются один раз на соединение
+        "CONN_MAX_AGE": int(os.getenv('DB_CONN_MAX_AGE', '600')),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            "timeout": SQLITE_BUSY_TIMEOUT,
+            "transaction_mode": "IMMEDIATE",
+            "init_command": "; ".join(SQLITE_PRAGMAS),
+        },
     }
 }
 
+# Повторы при "database is locked" для переходов статуса анализа
+SQLITE_LOCK_RETRIES = int(os.getenv('SQLITE_LOCK_RETRIES', '5'))
+SQLITE_LOCK_RETRY_DELAY = float(os.getenv('SQLITE_LOCK_RETRY_DELAY', '0.05'))  # секунды
+
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -130,7 +162,118 @@ STATICFILES_DIRS = []
 
 # Media files
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+# Отдача файлов документов (agent.downloads): 'django' — приложением, 'x-accel-redirect' —
+# nginx из internal-локации MEDIA_ACCEL_PREFIX (deploy/nginx.conf), 'x-sendfile' — Apache/lighttpd
+MEDIA_SERVE_MODE = os.getenv('MEDIA_SERVE_MODE', 'django')
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media/')
+
+# SHA-256 загружаемого файла считается по мере приема данных (agent.blobs):
+# по хешу дубликат находится до записи в хранилище
+FILE_UPLOAD_HANDLERS = [
+    'agent.blobs.HashingMemoryFileUploadHandler',
+    'agent.blobs.HashingTemporaryFileUploadHandler',
+]
+
+# Bulk document upload
+BULK_UPLOAD_MAX_FILES = int(os.getenv('BULK_UPLOAD_MAX_FILES', '1000'))
+BULK_UPLOAD_MAX_TOTAL_SIZE = int(os.getenv('BULK_UPLOAD_MAX_TOTAL_SIZE', str(1024 ** 3)))  # байты
+BULK_EXTRACTION_WORKERS = int(os.getenv('BULK_EXTRACTION_WORKERS', str(os.cpu_count() or 1)))
+DATA_UPLOAD_MAX_NUMBER_FILES = BULK_UPLOAD_MAX_FILES
+
+# Async analyses under ASGI: потоки для извлечения текста, чтобы не блокировать цикл событий
+ASYNC_EXTRACTION_WORKERS = int(os.getenv('ASYNC_EXTRACTION_WORKERS', str(os.cpu_count() or 1)))
+
+# Извлечение текста в пуле процессов с лимитами (agent.sandbox): процесс, превысивший
+# время ожидания, процессорное время или память, завершается и заменяется новым.
+# Пул создается в каждом воркере сервера, процессы запускаются по мере надобности
+EXTRACTION_SANDBOX_ENABLED = os.getenv('EXTRACTION_SANDBOX_ENABLED', 'True') == 'True'
+EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', '2'))
+EXTRACTION_TIMEOUT = float(os.getenv('EXTRACTION_TIMEOUT', '120'))  # секунды
+EXTRACTION_CPU_LIMIT = int(os.getenv('EXTRACTION_CPU_LIMIT', '60'))  # секунды процессорного времени
+EXTRACTION_MEMORY_LIMIT_MB = int(os.getenv('EXTRACTION_MEMORY_LIMIT_MB', '1024'))
+EXTRACTION_WORKER_MAX_JOBS = int(os.getenv('EXTRACTION_WORKER_MAX_JOBS', '200'))
+
+# Batch analyses
+BATCH_ANALYSIS_CONCURRENCY = int(os.getenv('BATCH_ANALYSIS_CONCURRENCY', '4'))
+BATCH_ANALYSIS_MAX_SIZE = int(os.getenv('BATCH_ANALYSIS_MAX_SIZE', '1000'))
+
+# Как часто выполняющийся анализ проверяет, не отменен ли он (agent.cancellation), с:
+# столько в худшем случае проходит от POST /api/analyses/{id}/cancel/ до остановки работы
+CANCEL_CHECK_INTERVAL = float(os.getenv('CANCEL_CHECK_INTERVAL', '0.5'))
+
+# Планировщик анализов (agent.scheduler): сколько анализов выполняется одновременно во всех
+# процессах (0 — без ограничения и очереди); как часто ожидающий анализ проверяет очередь, с;
+# через сколько секунд ожидания анализ поднимается на класс приоритета; через сколько секунд
+# выполняющийся анализ считается брошенным и не занимает слот
+ANALYSIS_CONCURRENCY = int(os.getenv('ANALYSIS_CONCURRENCY', '8'))
+SCHEDULER_POLL_INTERVAL = float(os.getenv('SCHEDULER_POLL_INTERVAL', '0.25'))
+SCHEDULER_AGING = float(os.getenv('SCHEDULER_AGING', '60'))
+SCHEDULER_RUN_TIMEOUT = int(os.getenv('SCHEDULER_RUN_TIMEOUT', '900'))
+
+# Заголовок Idempotency-Key (agent.idempotency): сколько хранится ответ для повторов, с;
+# через сколько секунд незавершенный запрос считается брошенным (больше самого долгого анализа)
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', str(24 * 3600)))
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT', '900'))
+
+# Уведомления о завершении анализов (agent.webhooks, команда dispatch_webhooks): таймаут запроса, с;
+# число попыток; задержка повтора WEBHOOK_RETRY_BASE · 2^n, с, но не больше WEBHOOK_RETRY_MAX;
+# событий в одном запросе; адресов, которым отправка идет одновременно; разрешены ли адреса
+# localhost и частных сетей (только для разработки: иначе вебхук дает доступ к внутренним сервисам)
+WEBHOOK_TIMEOUT = float(os.getenv('WEBHOOK_TIMEOUT', '10'))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '8'))
+WEBHOOK_RETRY_BASE = float(os.getenv('WEBHOOK_RETRY_BASE', '5'))
+WEBHOOK_RETRY_MAX = float(os.getenv('WEBHOOK_RETRY_MAX', '3600'))
+WEBHOOK_BATCH_SIZE = int(os.getenv('WEBHOOK_BATCH_SIZE', '50'))
+WEBHOOK_CONCURRENCY = int(os.getenv('WEBHOOK_CONCURRENCY', '8'))
+WEBHOOK_ALLOW_PRIVATE_URLS = os.getenv('WEBHOOK_ALLOW_PRIVATE_URLS', 'False') == 'True'
+
+# Журналирование (agent.log): записи уходят в stdout через очередь и фоновый поток.
+# LOG_FORMAT — json или text; LOG_DEBUG_SAMPLE_RATE — доля запросов и анализов, для которых
+# пишутся DEBUG-записи (0 — отключены, 1 — все)
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '0.01'))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'correlation': {'()': 'agent.log.CorrelationFilter'},
+    },
+    'handlers': {
+        'queue': {
+            'class': 'agent.log.QueueLogHandler',
+            'format': LOG_FORMAT,
+            'maxsize': LOG_QUEUE_SIZE,
+            'filters': ['correlation'],
+        },
+    },
+    'loggers': {
+        'agent': {
+            # Без выборки DEBUG-вызовы отсекаются по уровню, не создавая записей
+            'level': 'DEBUG' if LOG_DEBUG_SAMPLE_RATE > 0 else 'INFO',
+            'handlers': ['queue'],
+            'propagate': False,
+        },
+    },
+    'root': {'level': 'WARNING', 'handlers': ['queue']},
+}
+
+# Метрики Prometheus (/metrics). Под несколькими воркерами задайте переменную окружения
+# PROMETHEUS_MULTIPROC_DIR (пустой каталог), иначе каждый воркер отдает только свои значения
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Профилирование отдельных запросов сотрудников (X-Profile: 1 или ?profile=1), см. agent.profiling
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'True') == 'True'
+PROFILES_DIR = os.getenv('PROFILES_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILES_KEEP = int(os.getenv('PROFILES_KEEP', '200'))
+
+# Время кэширования схемы OpenAPI (/swagger/, /redoc/), с; 0 — строить при каждом запросе.
+# Схема меняется только с кодом, поэтому по умолчанию хранится сутки (до перезапуска воркера)
+SWAGGER_CACHE_TIMEOUT = int(os.getenv('SWAGGER_CACHE_TIMEOUT', str(24 * 60 * 60)))
+
+# Ответы API и HTML короче этого размера (байт) не сжимаются: выигрыш меньше затрат (agent.middleware.CompressionMiddleware)
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.getenv('RESPONSE_COMPRESSION_MIN_SIZE', '1024'))
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
@@ -138,6 +281,57 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # Claude API settings
 CLAUDE_API_KEY = os.getenv('CLAUDE_API_KEY')
 MODEL_NAME = os.getenv('MODEL_NAME', 'claude-3-sonnet-20240229')
+# Адрес API (например, локальной имитации из manage.py fake_claude_server); по умолчанию api.anthropic.com
+CLAUDE_API_BASE_URL = os.getenv('CLAUDE_API_BASE_URL')
+# Нагрузочные тесты без расходов на API: все запросы идут в имитацию FAKE_CLAUDE_URL
+USE_FAKE_CLAUDE = os.getenv('USE_FAKE_CLAUDE', 'False') == 'True'
+if USE_FAKE_CLAUDE:
+    CLAUDE_API_BASE_URL = os.getenv('FAKE_CLAUDE_URL', 'http://127.0.0.1:8765')
+    CLAUDE_API_KEY = CLAUDE_API_KEY or 'fake'
+# Межпроцессное ограничение частоты запросов к Claude (общие корзины токенов в SQLite)
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'True') == 'True'
+RATE_LIMIT_DB_PATH = os.getenv('RATE_LIMIT_DB_PATH', os.path.join(os.path.dirname(DATABASES['default']['NAME']), 'ratelimit.sqlite3'))
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', '30'))  # секунды
+RATE_LIMIT_CHARS_PER_TOKEN = float(os.getenv('RATE_LIMIT_CHARS_PER_TOKEN', '3'))
+# Лимиты по моделям в минуту: rpm — запросы, itpm/otpm — входные/выходные токены.
+# Значения по умолчанию соответствуют лимитам организации; модели без своей записи используют 'default'.
+CLAUDE_RATE_LIMITS = {
+    'default': {
+        'rpm': int(os.getenv('CLAUDE_RPM', '50')),
+        'itpm': int(os.getenv('CLAUDE_ITPM', '40000')),
+        'otpm': int(os.getenv('CLAUDE_OTPM', '8000')),
+    },
+}
+
+# Маршрутизация моделей (agent.routing): правила проверяются по порядку, первое подходящее
+# дает кандидатов, которые упорядочиваются по скользящей статистике задержек и ошибок
+FAST_MODEL_NAME = os.getenv('FAST_MODEL_NAME', 'claude-3-5-haiku-20241022')
+MODEL_ROUTING_ENABLED = os.getenv('MODEL_ROUTING_ENABLED', 'True') == 'True'
+MODEL_ROUTING_RULES = [
+    # Короткий пользовательский запрос (извлечь поле из JSON, ответить на вопрос по справке)
+    {
+        'name': 'small-custom',
+        'task': 'custom',
+        'max_prompt_tokens': int(os.getenv('MODEL_ROUTING_SMALL_CUSTOM_TOKENS', '4000')),
+        'models': [FAST_MODEL_NAME, MODEL_NAME],
+        'prefer': 'latency',
+    },
+    # Сравнение пары небольших документов
+    {
+        'name': 'small-comparison',
+        'task': 'comparison',
+        'max_prompt_tokens': int(os.getenv('MODEL_ROUTING_SMALL_COMPARISON_TOKENS', '2000')),
+        'models': [FAST_MODEL_NAME, MODEL_NAME],
+        'prefer': 'latency',
+    },
+]
+MODEL_ROUTING_STATS_WINDOW = int(os.getenv('MODEL_ROUTING_STATS_WINDOW', '900'))  # секунды
+MODEL_ROUTING_STATS_TTL = int(os.getenv('MODEL_ROUTING_STATS_TTL', '30'))  # секунды
+MODEL_ROUTING_MIN_SAMPLES = int(os.getenv('MODEL_ROUTING_MIN_SAMPLES', '5'))
+MODEL_ROUTING_MAX_ERROR_RATE = float(os.getenv('MODEL_ROUTING_MAX_ERROR_RATE', '0.5'))
+
+# Максимум запросов в одном Message Batch (ограничение Anthropic — 100 000)
+MESSAGE_BATCH_MAX_REQUESTS = int(os.getenv('MESSAGE_BATCH_MAX_REQUESTS', '10000'))
 
 # REST Framework settings
 REST_FRAMEWORK = {
@@ -182,6 +376,10 @@ UNFOLD = {
                         "title": "Анализы",
                         "link": "/admin/agent/analysis/",
                     },
+                    {
+                        "title": "Задержки по моделям",
+                        "link": "/admin/agent/analysis/latency/",
+                    },
                 ],
             },
         ],
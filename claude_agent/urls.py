@@ -22,6 +22,7 @@ from django.conf.urls.static import static
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from agent.views import metrics_view
 
 # Настройка Swagger
 schema_view = get_schema_view(
@@ -104,11 +105,13 @@ POST /api/analyses/[id]/retry/
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include("agent.urls")),
+    path("metrics", metrics_view, name='metrics'),
     
     # Swagger URLs
-    re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    # Схема строится при первом обращении к воркеру и кэшируется на SWAGGER_CACHE_TIMEOUT секунд
+    re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=settings.SWAGGER_CACHE_TIMEOUT), name='schema-json'),
+    path('swagger/', schema_view.with_ui('swagger', cache_timeout=settings.SWAGGER_CACHE_TIMEOUT), name='schema-swagger-ui'),
+    path('redoc/', schema_view.with_ui('redoc', cache_timeout=settings.SWAGGER_CACHE_TIMEOUT), name='schema-redoc'),
     
     # Главная страница
     path('', include('agent.web_urls')),